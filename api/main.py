@@ -7,23 +7,22 @@
 """
 
 import asyncio
-import audioop
 import base64
 import json
 import logging
 import os
-import threading
 import time
 import uuid
 from datetime import datetime, timedelta
 from pathlib import Path
 from collections import deque
-from typing import Deque, Dict, List, Optional
+from typing import Any, AsyncIterator, Deque, Dict, Optional
 
 import jwt
+import numpy as np
 import requests
 from fastapi import Depends, FastAPI, HTTPException, Request, Header, WebSocket, WebSocketDisconnect, status
-from fastapi.responses import StreamingResponse, JSONResponse, HTMLResponse, FileResponse
+from fastapi.responses import StreamingResponse, JSONResponse, HTMLResponse, FileResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
@@ -37,6 +36,7 @@ project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
 from modules.llm_emotion_router import llm_emotion_route
+from emotion_tag_engine import insert_emotion_tags
 from modules.speech_tag_mapper import extract_tags_from_text
 from modules.voice_cache_engine import (
     ensure_cache_dir,
@@ -49,22 +49,54 @@ from eleven_tts import generate_speech, API_KEY, VOICE_ID
 
 from .whisper_api import (
     router as whisper_router,
-    transcribe_media_chunks,
     summarize_energy_window,
     ENERGY_WINDOW_SECONDS,
     ENERGY_SAMPLE_RATE,
 )
-from modules.audio_decode import decode_to_wav16k
+from modules.audio_decode import PCM16_MIME_TYPE
+from modules.audio_input import AudioInput, CompressedInput, negotiate_input
 from modules.telemetry import get_telemetry_client
 from modules.emotion_ai import EmotionAIWorker, EmotionSnapshot
 from modules.role_registry import RoleRegistry, RoleChannelConfig
-
-try:
-    from faster_whisper import WhisperModel  # type: ignore
-    _WHISPER_AVAILABLE = True
-except Exception:
-    _WHISPER_AVAILABLE = False
-    WhisperModel = None  # type: ignore
+from modules.metrics import PROMETHEUS_CONTENT_TYPE, get_metrics_registry
+from modules.tracing import Span, TurnTrace, get_tracer
+from modules.session_buffers import ChunkArena
+from modules.quantile_sketch import DDSketch
+from modules.shared_state import close_shared_state, get_shared_state
+from modules.whisper_client import close_whisper_client
+from modules.stt_engines import RoutedSTTStream, STTEngine, get_stt_router
+from modules.rate_limit import (
+    ROUTE_DEFAULT,
+    ROUTE_GATEWAY,
+    ROUTE_LLM,
+    ROUTE_TTS,
+    RateLimiter,
+    RateLimitHeadersMiddleware,
+    client_identity,
+    rate_limit_headers,
+)
+from modules.admission import (
+    PRIORITY_BATCH,
+    PRIORITY_LIVE,
+    AdmissionRejected,
+    get_admission_controller,
+    is_overload_error,
+)
+from modules.resilience import CircuitOpen, get_circuit_breaker, hedge_policy_from_env, hedged_call
+from modules.audio_formats import (
+    FORMAT_MP3,
+    FORMATS,
+    AudioFormat,
+    TranscodeUnavailable,
+    eleven_output_format,
+    ensure_variant,
+    get_format,
+    negotiate_format,
+    variant_path,
+)
+from modules.audio_serving import audio_response
+from modules.phrase_bank import get_phrase_bank, phrase_key
+from modules.tts_prefetch import SentencePrefetcher, iterate_blocking, split_sentences
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("voice_agent")
@@ -93,7 +125,86 @@ ENABLE_EMOTION_AI_P1 = os.getenv("ENABLE_EMOTION_AI_P1", "false").lower() in {"1
 app.include_router(whisper_router)
 telemetry_client = get_telemetry_client()
 emotion_ai_worker = EmotionAIWorker() if ENABLE_EMOTION_AI_P1 else None
-role_registry = RoleRegistry()
+shared_state = get_shared_state()
+role_registry = RoleRegistry(shared_state=shared_state)
+rate_limiter = RateLimiter(shared_state)
+tts_admission = get_admission_controller(
+    "elevenlabs", overload_check=lambda exc: is_overload_error(exc) or isinstance(exc, requests.Timeout)
+)
+llm_admission = get_admission_controller("llm")
+elevenlabs_breaker = get_circuit_breaker("elevenlabs")
+elevenlabs_hedge = hedge_policy_from_env("elevenlabs")
+phrase_bank = get_phrase_bank()
+metrics_registry = get_metrics_registry()
+tracer = get_tracer()
+_active_gateway_sessions: "set[LingyaGatewayMultiRole]" = set()
+
+METRIC_DECODE_SECONDS = metrics_registry.histogram(
+    "gateway_audio_decode_seconds", "Time to decode one client audio chunk to 16k mono PCM"
+)
+METRIC_ANALYSIS_SECONDS = metrics_registry.histogram(
+    "gateway_audio_analysis_seconds", "Per-chunk audio analysis time", ["stage"]
+)
+METRIC_STT_SECONDS = metrics_registry.histogram(
+    "gateway_stt_latency_seconds", "Speech-to-text latency per transcription call", ["mode", "final"]
+)
+METRIC_LLM_SECONDS = metrics_registry.histogram(
+    "gateway_llm_latency_seconds", "LLM emotion routing latency per reply", ["provider"]
+)
+METRIC_TTS_FIRST_CHUNK_SECONDS = metrics_registry.histogram(
+    "gateway_tts_first_chunk_seconds", "Time from TTS request to first audio chunk", ["role_id"]
+)
+METRIC_TTS_TOTAL_SECONDS = metrics_registry.histogram(
+    "gateway_tts_total_seconds", "Time from TTS request to last audio chunk", ["role_id"]
+)
+METRIC_CACHE_REQUESTS = metrics_registry.counter(
+    "voice_cache_requests_total", "Audio cache lookups by result", ["result"]
+)
+METRIC_CACHE_HIT_RATIO = metrics_registry.gauge("voice_cache_hit_ratio", "Audio cache hit ratio since start")
+METRIC_TELEMETRY_QUEUE_DEPTH = metrics_registry.gauge(
+    "telemetry_queue_depth", "Telemetry events waiting to be flushed"
+)
+METRIC_ACTIVE_SESSIONS = metrics_registry.gauge(
+    "gateway_active_sessions", "Sessions currently holding a role", ["role_id"]
+)
+METRIC_WS_SEND_BACKLOG = metrics_registry.gauge(
+    "gateway_ws_send_backlog", "TTS events produced but not yet sent over WebSocket"
+)
+METRIC_ROLE_LATENCY_MS = metrics_registry.summary(
+    "gateway_role_latency_milliseconds",
+    "Per-role latency quantiles merged from per-session DDSketches at session close",
+    ["stage", "role_id"],
+)
+METRIC_SESSION_BUFFER_BYTES = metrics_registry.gauge(
+    "gateway_session_buffer_bytes", "Bytes held in per-session audio and sample buffers", ["stat"]
+)
+METRIC_AUDIO_OVERFLOW_BYTES = metrics_registry.counter(
+    "gateway_audio_overflow_bytes_total", "Audio bytes trimmed or rejected by the per-session budget", ["action"]
+)
+
+
+def _cache_hit_ratio() -> Dict[tuple, float]:
+    hits = METRIC_CACHE_REQUESTS.value("hit")
+    total = hits + METRIC_CACHE_REQUESTS.value("miss")
+    return {(): hits / total if total else 0.0}
+
+
+METRIC_CACHE_HIT_RATIO.set_function(_cache_hit_ratio)
+METRIC_TELEMETRY_QUEUE_DEPTH.set_function(lambda: {(): telemetry_client.queue.qsize()})
+METRIC_ACTIVE_SESSIONS.set_function(
+    lambda: {(role_id,): info["active_sessions"] for role_id, info in role_registry.list_roles().items()}
+)
+METRIC_WS_SEND_BACKLOG.set_function(
+    lambda: {(): sum(session.tts_backlog() for session in list(_active_gateway_sessions))}
+)
+
+
+def _session_buffer_bytes() -> Dict[tuple, float]:
+    held = [session.memory_bytes() for session in list(_active_gateway_sessions)]
+    return {("total",): sum(held), ("max",): max(held, default=0)}
+
+
+METRIC_SESSION_BUFFER_BYTES.set_function(_session_buffer_bytes)
 
 FRONTEND_DIST = project_root / "frontend" / "dist"
 if FRONTEND_DIST.exists():
@@ -114,6 +225,9 @@ async def startup_event() -> None:
 @app.on_event("shutdown")
 async def shutdown_event() -> None:
     await telemetry_client.stop()
+    await asyncio.to_thread(tracer.flush)
+    await close_shared_state()
+    await close_whisper_client()
 
 # Health and version endpoints
 @app.get("/healthz")
@@ -121,6 +235,12 @@ async def healthz():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint for gateway hot-path metrics."""
+    return PlainTextResponse(metrics_registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
 @app.get("/version")
 async def version():
     return {"version": "2.0.0"}
@@ -133,24 +253,32 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(RateLimitHeadersMiddleware)
 
 # 設定音訊儲存目錄
 AUDIO_DIR = Path("public/audio")
 AUDIO_DIR.mkdir(parents=True, exist_ok=True)
 BASE_URL = os.getenv("BASE_URL", "http://localhost:8000")
 SERVICE_API_KEY = os.getenv("SERVICE_API_KEY")
-RATE_LIMIT_PER_MIN = int(os.getenv("SERVICE_RATE_LIMIT_PER_MIN", "60"))
 ELEVEN_MAX_RETRIES = int(os.getenv("ELEVEN_MAX_RETRIES", "3"))
 ELEVEN_RETRY_BACKOFF = float(os.getenv("ELEVEN_RETRY_BACKOFF", "1.5"))
 CHATKIT_CLIENT_SECRET_SEED = os.getenv("CHATKIT_CLIENT_SECRET_SEED")
 CHATKIT_SESSION_TTL_MIN = int(os.getenv("CHATKIT_SESSION_TTL_MIN", "30"))
 CHATKIT_JWT_ALGORITHM = os.getenv("CHATKIT_JWT_ALGORITHM", "HS256")
-    THROTTLE_MS = int(os.getenv("STT_THROTTLE_MS", "700"))
-    SILENCE_MS = int(os.getenv("STT_SILENCE_MS", "1500"))
-    ENERGY_MS = int(os.getenv("STT_ENERGY_MS", "120"))
+THROTTLE_MS = int(os.getenv("STT_THROTTLE_MS", "700"))
+SILENCE_MS = int(os.getenv("STT_SILENCE_MS", "1500"))
+ENERGY_MS = int(os.getenv("STT_ENERGY_MS", "120"))
 REALTIME_PARTIAL_INTERVAL_MS = int(os.getenv("REALTIME_PARTIAL_INTERVAL_MS", str(THROTTLE_MS)))
 REALTIME_FINAL_SILENCE_MS = int(os.getenv("REALTIME_FINAL_SILENCE_MS", str(SILENCE_MS)))
 REALTIME_CHUNK_THRESHOLD = int(os.getenv("REALTIME_CHUNK_THRESHOLD", "3"))
+GATEWAY_AUDIO_MAX_BYTES = int(os.getenv("GATEWAY_AUDIO_MAX_BYTES", str(8 * 1024 * 1024)))
+GATEWAY_AUDIO_OVERFLOW = os.getenv("GATEWAY_AUDIO_OVERFLOW", "trim").strip().lower()
+TTS_CHUNK_BYTES = int(os.getenv("TTS_CHUNK_BYTES", "24576"))
+TTS_AGGREGATE = max(1, int(os.getenv("TTS_AGGREGATE", "2")))
+TTS_PREFETCH_SENTENCES = int(os.getenv("TTS_PREFETCH_SENTENCES", "2"))
+TTS_PREFETCH_CONCURRENCY = int(os.getenv("TTS_PREFETCH_CONCURRENCY", "2"))
+TTS_PREFETCH_MAX_CHARS = int(os.getenv("TTS_PREFETCH_MAX_CHARS", "400"))
+TTS_SPLIT_MIN_CHARS = int(os.getenv("TTS_SPLIT_MIN_CHARS", "12"))
 GATEWAY_JWT_SECRET = os.getenv("GATEWAY_JWT_SECRET", SERVICE_API_KEY or "")
 GATEWAY_JWT_ALGORITHM = os.getenv("GATEWAY_JWT_ALGORITHM", CHATKIT_JWT_ALGORITHM or "HS256")
 GATEWAY_JWT_AUDIENCE = os.getenv("GATEWAY_JWT_AUDIENCE")
@@ -176,6 +304,7 @@ async def _handle_voice_stream(ws: WebSocket):
         registry=role_registry,
         emotion_worker=emotion_ai_worker,
     )
+    _active_gateway_sessions.add(session)
     await session.notify_ready()
     try:
         while True:
@@ -193,6 +322,7 @@ async def _handle_voice_stream(ws: WebSocket):
         await session.handle_exception(exc)
     finally:
         await session.close()
+        _active_gateway_sessions.discard(session)
 
 
 @app.websocket("/api/voice/stream")
@@ -286,71 +416,6 @@ async def tts_stream_ws(ws: WebSocket):
         return
 
 
-# Agent route: STT text -> LLM reply -> TTS URL
-class AgentRequest(BaseModel):
-    text: str
-    provider: Optional[str] = "openai"
-    voice_id: Optional[str] = None
-
-
-class AgentResponse(BaseModel):
-    reply_text: str
-    audio_url: Optional[str] = None
-
-
-@app.post("/api/agent/reply", response_model=AgentResponse, dependencies=[Depends(verify_api_key), Depends(enforce_rate_limit)])
-async def agent_reply(body: AgentRequest, http_request: Request):
-    try:
-        # 1) LLM 產生回覆（沿用現有情感路由，可改 provider）
-        reply_text = llm_emotion_route(body.text, provider=body.provider, fallback_to_rule=True)
-
-        # 2) 生成語音（沿用現有 generate_speech 流程與快取機制）
-        vid = body.voice_id or VOICE_ID
-        if not vid:
-            raise HTTPException(status_code=500, detail="Missing default VOICE_ID")
-
-        # 直接用現有 API 的快取機制：寫入為一次性檔，回傳 URL
-        # 這裡重用 generate_speech 的包裝：為保持最小改動，直接呼叫並寫入臨時檔案
-        # 使用與 /api/voice/huangrong 相同的設定
-        from modules.speech_tag_mapper import extract_tags_from_text
-        from modules.voice_cache_engine import (
-            generate_audio_key,
-            get_cached_audio_path,
-            is_cache_valid,
-            clean_expired_cache,
-        )
-
-        tags = extract_tags_from_text(reply_text)
-        cache_key = generate_audio_key(reply_text, vid, tags)
-        cache_path = get_cached_audio_path(cache_key)
-        if not is_cache_valid(cache_path):
-            payload = {
-                "model_id": "eleven_turbo_v2_5",
-                "text": reply_text,
-                "voice_settings": {
-                    "stability": 0.4,
-                    "similarity_boost": 0.8,
-                    "style": 0.9,
-                    "use_speaker_boost": True,
-                },
-            }
-            resp = call_elevenlabs_generate(payload, vid)
-            with open(cache_path, "wb") as f:
-                f.write(resp.content)
-            clean_expired_cache()
-
-        audio_url = f"{BASE_URL}/audio/{cache_path.name}"
-        return AgentResponse(reply_text=reply_text, audio_url=audio_url)
-    except HTTPException:
-        raise
-    except Exception as e:  # noqa: BLE001
-        logger.exception("agent_reply failed")
-        raise HTTPException(status_code=500, detail=str(e))
-
-_rate_state: Dict[str, tuple[int, int]] = {}
-_rate_lock = asyncio.Lock()
-_gateway_rate_state: Dict[str, tuple[int, int]] = {}
-_gateway_rate_lock = asyncio.Lock()
 
 ensure_cache_dir()
 
@@ -361,6 +426,7 @@ class VoiceRequest(BaseModel):
     provider: Optional[str] = "openai"  # LLM provider: "openai" 或 "anthropic"
     emotion_auto: Optional[bool] = True  # 是否自動判斷語氣
     voice_id: Optional[str] = None  # 可選：指定不同的 voice_id
+    audio_format: Optional[str] = None  # 可選：mp3 / opus / pcm16（未指定時依 Accept 標頭）
 
 
 class VoiceResponse(BaseModel):
@@ -372,6 +438,7 @@ class VoiceResponse(BaseModel):
     voice_tags: Optional[list[str]] = None
     cache_hit: Optional[bool] = None
     message: Optional[str] = None
+    audio_format: Optional[str] = None
 
 
 class ChatKitSessionRequest(BaseModel):
@@ -454,24 +521,15 @@ def _verify_gateway_jwt(token: str) -> bool:
 
 
 async def _enforce_gateway_rate_limit(websocket: WebSocket) -> bool:
-    if RATE_LIMIT_PER_MIN <= 0:
-        return True
-    identifier = (
-        websocket.headers.get("Service-Api-Key")
-        or websocket.headers.get("x-service-api-key")
-        or _extract_gateway_token(websocket)
-        or (websocket.client.host if websocket.client else "anonymous")
+    identity = client_identity(
+        websocket.headers.get("Service-Api-Key") or websocket.headers.get("x-service-api-key"),
+        _extract_gateway_token(websocket),
+        websocket.client.host if websocket.client else None,
     )
-    current_bucket = int(time.time() // 60)
-    async with _gateway_rate_lock:
-        count, bucket = _gateway_rate_state.get(identifier, (0, current_bucket))
-        if bucket != current_bucket:
-            count = 0
-            bucket = current_bucket
-        if count >= RATE_LIMIT_PER_MIN:
-            logger.warning("Gateway rate limit exceeded", extra={"client": identifier})
-            return False
-        _gateway_rate_state[identifier] = (count + 1, bucket)
+    decision = await rate_limiter.check(identity, ROUTE_GATEWAY)
+    if decision is not None and not decision.allowed:
+        logger.warning("Gateway rate limit exceeded", extra={"client": identity})
+        return False
     return True
 
 
@@ -503,43 +561,125 @@ async def create_chatkit_session(payload: ChatKitSessionRequest):
     return {"client_secret": token}
 
 
-async def enforce_rate_limit(request: Request) -> None:
-    if RATE_LIMIT_PER_MIN <= 0:
-        return
+def rate_limited(route_class: str = ROUTE_DEFAULT):
+    """Dependency factory: one token bucket per (client, route class)."""
 
-    identifier = request.headers.get("x-service-api-key") or (request.client.host if request.client else "anonymous")
-    current_bucket = int(time.time() // 60)
+    async def dependency(request: Request) -> None:
+        identity = client_identity(
+            request.headers.get("x-service-api-key"), None, request.client.host if request.client else None
+        )
+        decision = await rate_limiter.check(identity, route_class)
+        request.state.rate_limit = decision
+        if decision is not None and not decision.allowed:
+            logger.warning(
+                "Rate limit exceeded",
+                extra={"client": identity, "path": request.url.path, "route_class": route_class},
+            )
+            raise HTTPException(status_code=429, detail="Rate limit exceeded", headers=rate_limit_headers(decision))
 
-    async with _rate_lock:
-        count, bucket = _rate_state.get(identifier, (0, current_bucket))
-        if bucket != current_bucket:
-            count = 0
-            bucket = current_bucket
+    return dependency
 
-        if count >= RATE_LIMIT_PER_MIN:
-            logger.warning("Rate limit exceeded", extra={"client": identifier, "path": request.url.path})
-            raise HTTPException(status_code=429, detail="Rate limit exceeded")
 
-        _rate_state[identifier] = (count + 1, bucket)
+enforce_rate_limit = rate_limited(ROUTE_DEFAULT)
 
 
-def call_elevenlabs_generate(payload: dict, voice_id: str):
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}/stream"
+def _elevenlabs_throttled(response) -> HTTPException:
+    """429s are not retried here: admission control shrinks its window and sheds load instead."""
+    logger.warning("ElevenLabs throttled", extra={"status": 429})
+    return HTTPException(
+        status_code=429,
+        detail="ElevenLabs rate limited",
+        headers={"Retry-After": response.headers.get("Retry-After", "1")},
+    )
+
+
+async def _route_emotion(text: str, provider: Optional[str], priority: int) -> str:
+    """LLM emotion tagging under admission control; rule-based tags when the LLM upstream is saturated."""
+    try:
+        async with llm_admission.admit(priority):
+            # Overloads are raised (not folded into the rule fallback) so admit() shrinks the window.
+            return await asyncio.to_thread(llm_emotion_route, text, provider or "openai", None, True, True)
+    except AdmissionRejected as exc:
+        logger.info("LLM admission rejected; using rule-based tags", extra={"reason": exc.reason})
+        return insert_emotion_tags(text)
+    except Exception as exc:
+        if not is_overload_error(exc):
+            raise
+        logger.info("LLM upstream overloaded; using rule-based tags", extra={"error": str(exc)})
+        return insert_emotion_tags(text)
+
+
+def _write_cache_file(path: Path, data: bytes) -> None:
+    """Atomic write into the audio cache, so a concurrent reader never serves a partial file."""
+    if not data:
+        return
+    ensure_cache_dir()
+    # Unique per write: two requests may render the same key concurrently.
+    tmp = path.with_suffix(path.suffix + f".{uuid.uuid4().hex}.tmp")
+    try:
+        tmp.write_bytes(data)
+        tmp.replace(path)
+    except OSError:
+        logger.warning("audio cache write failed", extra={"path": str(path)}, exc_info=True)
+        tmp.unlink(missing_ok=True)
+
+
+async def _generate_speech_admitted(payload: dict, voice_id: str, priority: int, output_format: Optional[str] = None):
+    """`call_elevenlabs_generate` off the event loop, inside the ElevenLabs admission window."""
+    async with tts_admission.admit(priority):
+        return await asyncio.to_thread(call_elevenlabs_generate, payload, voice_id, output_format)
+
+
+def _elevenlabs_attempt(url: str, payload: dict, stream: bool):
     headers = {
         "xi-api-key": API_KEY,
         "Content-Type": "application/json"
     }
+    response = requests.post(url, headers=headers, json=payload, timeout=30, stream=stream)
+    if response.status_code == 200:
+        return response
+    if response.status_code == 429:
+        raise _elevenlabs_throttled(response)
+    detail = response.text
+    response.close()
+    raise HTTPException(status_code=response.status_code, detail=f"ElevenLabs API 錯誤：{detail}")
+
+
+def _elevenlabs_request(payload: dict, voice_id: str, stream: bool, output_format: Optional[str] = None):
+    """
+    ElevenLabs call guarded by the circuit breaker (and the optional p95 hedge).
+
+    5xx and network errors are retried with backoff only while the breaker stays
+    closed; once it opens, `CircuitOpen` is raised without sleeping or calling out.
+    """
+    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}/stream"
+    if output_format:
+        url = f"{url}?output_format={output_format}"
     retry_wait = ELEVEN_RETRY_BACKOFF
     last_error: Optional[Exception] = None
 
     for attempt in range(1, ELEVEN_MAX_RETRIES + 1):
+        elevenlabs_breaker.before_call()
         try:
-            response = requests.post(url, headers=headers, json=payload, timeout=30)
-            if response.status_code == 200:
-                return response
-            last_error = HTTPException(status_code=response.status_code, detail=f"ElevenLabs API 錯誤：{response.text}")
-            logger.warning("ElevenLabs call failed", extra={"attempt": attempt, "status": response.status_code})
+            if elevenlabs_hedge is not None:
+                response = hedged_call(
+                    lambda: _elevenlabs_attempt(url, payload, stream), elevenlabs_hedge, discard=lambda r: r.close()
+                )
+            else:
+                response = _elevenlabs_attempt(url, payload, stream)
+            elevenlabs_breaker.record_success()
+            return response
+        except HTTPException as exc:
+            if exc.status_code < 500 and exc.status_code != 429:
+                elevenlabs_breaker.record_success()  # the upstream answered; the request itself was bad
+                raise
+            elevenlabs_breaker.record_failure()
+            if exc.status_code == 429:
+                raise
+            last_error = exc
+            logger.warning("ElevenLabs call failed", extra={"attempt": attempt, "status": exc.status_code})
         except requests.RequestException as exc:  # noqa: BLE001
+            elevenlabs_breaker.record_failure()
             last_error = exc
             logger.error("ElevenLabs request exception", exc_info=exc, extra={"attempt": attempt})
 
@@ -554,46 +694,128 @@ def call_elevenlabs_generate(payload: dict, voice_id: str):
     raise HTTPException(status_code=502, detail="ElevenLabs API 錯誤")
 
 
-def call_elevenlabs_stream(payload: dict, voice_id: str):
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}/stream"
-    headers = {
-        "xi-api-key": API_KEY,
-        "Content-Type": "application/json"
-    }
-    retry_wait = ELEVEN_RETRY_BACKOFF
-    last_exc: Optional[Exception] = None
+def call_elevenlabs_generate(payload: dict, voice_id: str, output_format: Optional[str] = None):
+    return _elevenlabs_request(payload, voice_id, stream=False, output_format=output_format)
 
-    for attempt in range(1, ELEVEN_MAX_RETRIES + 1):
-        try:
-            response = requests.post(url, headers=headers, json=payload, timeout=30, stream=True)
-            if response.status_code == 200:
-                return response
-            logger.warning("ElevenLabs stream failed", extra={"attempt": attempt, "status": response.status_code})
-        except requests.RequestException as exc:  # noqa: BLE001
-            last_exc = exc
-            logger.error("ElevenLabs stream exception", exc_info=exc, extra={"attempt": attempt})
 
-        if attempt < ELEVEN_MAX_RETRIES:
-            time.sleep(retry_wait)
-            retry_wait *= 2
+def call_elevenlabs_stream(payload: dict, voice_id: str, output_format: Optional[str] = None):
+    return _elevenlabs_request(payload, voice_id, stream=True, output_format=output_format)
 
-    if last_exc:
-        raise last_exc
-    raise HTTPException(status_code=502, detail="ElevenLabs stream 呼叫失敗")
 
+def _requested_format(requested: Optional[str], http_request: Request) -> AudioFormat:
+    """Body `audio_format` first, then the Accept header; 400 for unknown formats."""
+    try:
+        return negotiate_format(requested, http_request.headers.get("accept"))
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
 
-def _compute_energy_levels(wav_bytes: bytes) -> tuple[float, float]:
-    """Return (avg_energy, peak_energy) scaled 0-100 from 16-bit PCM wav bytes."""
-    if len(wav_bytes) <= 44:
-        return 0.0, 0.0
-    pcm = wav_bytes[44:]
-    if not pcm:
-        return 0.0, 0.0
+
+def _stream_format(audio_format: AudioFormat) -> AudioFormat:
+    """Live streams cannot be transcoded on the fly: formats ElevenLabs cannot emit fall back to MP3."""
+    return audio_format if eleven_output_format(audio_format) else FORMATS[FORMAT_MP3]
+
+
+async def _audio_variant(source: Path, audio_format: AudioFormat) -> tuple[Path, AudioFormat]:
+    """Cached MP3 -> requested format via the transcode cache; the MP3 itself if ffmpeg is unavailable."""
+    if audio_format.name == FORMAT_MP3:
+        return source, audio_format
+    try:
+        return await asyncio.to_thread(ensure_variant, source, audio_format), audio_format
+    except TranscodeUnavailable as exc:
+        logger.warning("audio transcode unavailable; serving mp3", extra={"format": audio_format.name, "reason": str(exc)})
+        return source, FORMATS[FORMAT_MP3]
+
+
+# Agent route: STT text -> LLM reply -> TTS URL
+class AgentRequest(BaseModel):
+    text: str
+    provider: Optional[str] = "openai"
+    voice_id: Optional[str] = None
+    audio_format: Optional[str] = None
+
+
+class AgentResponse(BaseModel):
+    reply_text: str
+    audio_url: Optional[str] = None
+    audio_format: Optional[str] = None
+
+
+@app.post(
+    "/api/agent/reply",
+    response_model=AgentResponse,
+    dependencies=[Depends(verify_api_key), Depends(rate_limited(ROUTE_LLM))],
+)
+async def agent_reply(body: AgentRequest, http_request: Request):
     try:
-        rms = audioop.rms(pcm, 2)
-        peak = audioop.max(pcm, 2)
-    except audioop.error:
+        # 1) LLM 產生回覆（沿用現有情感路由，可改 provider）
+        reply_text = await _route_emotion(body.text, body.provider, PRIORITY_BATCH)
+
+        # 2) 生成語音（沿用現有 generate_speech 流程與快取機制）
+        vid = body.voice_id or VOICE_ID
+        if not vid:
+            raise HTTPException(status_code=500, detail="Missing default VOICE_ID")
+        audio_format = _requested_format(body.audio_format, http_request)
+
+        # 直接用現有 API 的快取機制：寫入為一次性檔，回傳 URL
+        # 這裡重用 generate_speech 的包裝：為保持最小改動，直接呼叫並寫入臨時檔案
+        # 使用與 /api/voice/huangrong 相同的設定
+        from modules.speech_tag_mapper import extract_tags_from_text
+        from modules.voice_cache_engine import (
+            generate_audio_key,
+            get_cached_audio_path,
+            is_cache_valid,
+            clean_expired_cache,
+        )
+
+        tags = extract_tags_from_text(reply_text)
+        cache_key = generate_audio_key(reply_text, vid, tags)
+        cache_path = get_cached_audio_path(cache_key)
+        cache_valid = is_cache_valid(cache_path)
+        METRIC_CACHE_REQUESTS.labels("hit" if cache_valid else "miss").inc()
+        await telemetry_client.record_cache_event(
+            {
+                "timestamp": int(time.time() * 1000),
+                "route": http_request.url.path,
+                "cache_hit": cache_valid,
+                "voice_id": vid,
+                "text_length": len(reply_text),
+            }
+        )
+        if not cache_valid:
+            payload = {
+                "model_id": "eleven_turbo_v2_5",
+                "text": reply_text,
+                "voice_settings": {
+                    "stability": 0.4,
+                    "similarity_boost": 0.8,
+                    "style": 0.9,
+                    "use_speaker_boost": True,
+                },
+            }
+            try:
+                resp = await _generate_speech_admitted(payload, vid, PRIORITY_BATCH)
+            except (AdmissionRejected, CircuitOpen):
+                # Degrade to a text-only reply rather than queueing behind live sessions.
+                return AgentResponse(reply_text=reply_text, audio_url=None)
+            await asyncio.to_thread(_write_cache_file, cache_path, resp.content)
+            clean_expired_cache()
+
+        audio_path, audio_format = await _audio_variant(cache_path, audio_format)
+        audio_url = f"{BASE_URL}/audio/{audio_path.name}"
+        return AgentResponse(reply_text=reply_text, audio_url=audio_url, audio_format=audio_format.name)
+    except HTTPException:
+        raise
+    except Exception as e:  # noqa: BLE001
+        logger.exception("agent_reply failed")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _compute_energy_levels(pcm: np.ndarray) -> tuple[float, float]:
+    """Return (avg_energy, peak_energy) scaled 0-100 from 16-bit mono PCM samples."""
+    if not pcm.size:
         return 0.0, 0.0
+    samples = pcm.astype(np.float32)
+    rms = float(np.sqrt(np.dot(samples, samples) / samples.size))
+    peak = max(int(pcm.max()), -int(pcm.min()))
     avg = min(100.0, (rms / 32768.0) * 100.0)
     peak_level = min(100.0, (peak / 32768.0) * 100.0 if peak else 0.0)
     return avg, peak_level
@@ -602,6 +824,48 @@ def _compute_energy_levels(wav_bytes: bytes) -> tuple[float, float]:
 class LingyaGatewayMultiRole:
     """Gateway-managed session supporting multi-role orchestration."""
 
+    __slots__ = (
+        "session_id",
+        "ws",
+        "voice_id",
+        "provider",
+        "mime_type",
+        "audio_input",
+        "audio_format",
+        "created_at",
+        "started_at",
+        "closed_at",
+        "phase",
+        "role_id",
+        "role_config",
+        "registry",
+        "audio_chunks",
+        "audio_rejected_notified",
+        "energy_history",
+        "peak_energy",
+        "last_energy_ms",
+        "last_chunk_ms",
+        "last_partial_ms",
+        "partial_task",
+        "partial_lock",
+        "stt_stream",
+        "stt_last_text",
+        "finalized",
+        "loop",
+        "latency_sketches",
+        "tts_first_chunk_latency_ms",
+        "tts_prefetch",
+        "error_count",
+        "last_metrics_payload",
+        "emotion_worker",
+        "last_emotion_snapshot",
+        "turn",
+        "last_trace_id",
+        "seat_heartbeat_task",
+        "seat_lock",
+        "reply_task",
+    )
+
     def __init__(
         self,
         websocket: WebSocket,
@@ -614,6 +878,8 @@ class LingyaGatewayMultiRole:
         self.voice_id = default_voice_id or VOICE_ID
         self.provider = "openai"
         self.mime_type = "audio/webm"
+        self.audio_input: AudioInput = CompressedInput()
+        self.audio_format = _stream_format(get_format(None))
         self.created_at = time.time()
         self.started_at: Optional[float] = None
         self.closed_at: Optional[float] = None
@@ -623,7 +889,8 @@ class LingyaGatewayMultiRole:
         self.role_config: Optional[RoleChannelConfig] = None
         self.registry = registry
 
-        self.audio_chunks: List[bytes] = []
+        self.audio_chunks = ChunkArena(GATEWAY_AUDIO_MAX_BYTES, policy=GATEWAY_AUDIO_OVERFLOW)
+        self.audio_rejected_notified = False
         self.energy_history: Deque[float] = deque(maxlen=ENERGY_WINDOW_SECONDS * ENERGY_SAMPLE_RATE)
         self.peak_energy: float = 0.0
         self.last_energy_ms = 0
@@ -631,24 +898,64 @@ class LingyaGatewayMultiRole:
         self.last_partial_ms = 0
         self.partial_task: Optional[asyncio.Task] = None
         self.partial_lock = asyncio.Lock()
-        self.partial_transcript: List[str] = []
-        self.remote_cache_text: str = ""
-        self.using_local_whisper = _WHISPER_AVAILABLE
-        self.whisper_model: Optional[WhisperModel] = None
+        self.stt_stream: Optional[RoutedSTTStream] = None
+        self.stt_last_text: str = ""
         self.finalized = False
         self.loop: Optional[asyncio.AbstractEventLoop] = None
 
-        self.metrics_samples: List[dict] = []
-        self.stt_latency_samples: List[float] = []
+        self.latency_sketches: Dict[tuple, DDSketch] = {}
         self.tts_first_chunk_latency_ms: Optional[int] = None
+        self.tts_prefetch: Optional[SentencePrefetcher] = None
         self.error_count = 0
         self.last_metrics_payload: Optional[dict] = None
         self.emotion_worker = emotion_worker
         self.last_emotion_snapshot: Optional[EmotionSnapshot] = None
+        self.turn: Optional[TurnTrace] = None
+        self.last_trace_id: Optional[str] = None
+        self.seat_heartbeat_task: Optional[asyncio.Task] = None
+        self.seat_lock = asyncio.Lock()
+        self.reply_task: Optional[asyncio.Task] = None
+
+    async def _send_json(self, payload: dict, parent: Optional[Span] = None) -> None:
+        if self.turn is None or not self.turn.sampled:
+            await self.ws.send_json(payload)
+            return
+        with self.turn.span("ws_send", parent=parent, event_type=payload.get("type")):
+            await self.ws.send_json(payload)
+
+    def _start_turn(self) -> TurnTrace:
+        if self.turn is None:
+            self.turn = tracer.start_turn(
+                "gateway.turn",
+                session_id=self.session_id,
+                role_id=self.role_id,
+                mime_type=self.mime_type,
+                provider=self.provider,
+            )
+            if self.turn.sampled:
+                self.last_trace_id = self.turn.trace_id
+        return self.turn
+
+    def _finish_turn(self, **attributes: Any) -> None:
+        if self.turn is not None:
+            self.turn.finish(**attributes)
+            self.turn = None
+
+    async def _seat_heartbeat_loop(self) -> None:
+        interval = max(1.0, self.registry.seat_ttl / 3)
+        while True:
+            await asyncio.sleep(interval)
+            if self.role_id and not await self.registry.heartbeat_role(self.role_id, self.session_id):
+                logger.warning("gateway role seat lost", extra={"session": self.session_id, "role_id": self.role_id})
+
+    def _stop_seat_heartbeat(self) -> None:
+        if self.seat_heartbeat_task is not None:
+            self.seat_heartbeat_task.cancel()
+            self.seat_heartbeat_task = None
 
     async def notify_ready(self) -> None:
         self.loop = asyncio.get_running_loop()
-        await self.ws.send_json(
+        await self._send_json(
             {
                 "type": "gateway.ready",
                 "timestamp": int(time.time() * 1000),
@@ -666,13 +973,14 @@ class LingyaGatewayMultiRole:
             return
         message_type = payload.get("type")
         if message_type in ("ping", "voice.ping"):
-            await self.ws.send_json({"type": "gateway.pong", "timestamp": int(time.time() * 1000)})
+            await self._send_json({"type": "gateway.pong", "timestamp": int(time.time() * 1000)})
             return
         if message_type == "voice.start":
             await self._handle_voice_start(payload)
         elif message_type == "voice.data":
             await self._handle_voice_data(payload)
         elif message_type == "voice.end":
+            await self.cancel_tts()
             await self.finalize(reason="client_end")
         elif message_type == "voice.switch":
             await self._handle_role_switch(payload)
@@ -680,7 +988,7 @@ class LingyaGatewayMultiRole:
             await self._emit_role_catalog()
         elif message_type == "config":
             mime = payload.get("mime_type")
-            if isinstance(mime, str) and mime:
+            if isinstance(mime, str) and mime and not self.audio_input.buffers_pcm:
                 self.mime_type = mime
         else:
             logger.debug("gateway unknown message type %s", message_type)
@@ -713,54 +1021,76 @@ class LingyaGatewayMultiRole:
             finally:
                 self.partial_task = None
 
-        if previous_phase in {"listen", "respond"}:
-            if self.using_local_whisper:
-                final_text = " ".join(self.partial_transcript).strip()
-                if final_text:
-                    await self._emit_metrics({"transcript": final_text, "is_final": True})
-                    await self._handle_final_reply(final_text)
-            else:
-                await self._transcribe_remote(final=True)
+        transcript = None
+        if previous_phase in {"listen", "respond"} and self.stt_stream is not None:
+            transcript = await self._stt_transcribe(final=True)
+
+        if transcript and reason != "disconnect":
+            # The reply runs as a session task so the receive loop keeps handling
+            # voice.switch / voice.end while sentences are synthesized.
+            self.phase = "respond"
+            self.reply_task = asyncio.create_task(self._reply_then_close(transcript, reason, error))
+            return
+        await self._close_session(reason, error)
+
+    async def _reply_then_close(self, transcript: str, reason: str, error: Optional[str]) -> None:
+        await self._handle_final_reply(transcript)
+        await self._close_session(reason, error)
 
+    async def _close_session(self, reason: str, error: Optional[str] = None) -> None:
+        if self.closed_at is not None:
+            return
         self.closed_at = time.time()
-        if self.role_id:
-            self.registry.release_role(self.role_id, self.session_id)
+        self._finish_turn(reason=reason)
+        self._publish_latency_sketches()
+        self._stop_seat_heartbeat()
+        async with self.seat_lock:
+            if self.role_id:
+                await self.registry.release_role_async(self.role_id, self.session_id)
         await self._emit_session_closed(reason=reason, error=error)
         self._reset_buffers()
 
     async def close(self) -> None:
+        await self.cancel_tts(abandon=True)
         if not self.finalized:
             await self.finalize(reason="disconnect")
+        else:
+            # No-op unless a reply task was abandoned before it could close the session.
+            await self._close_session(reason="disconnect")
 
     async def handle_exception(self, exc: Exception) -> None:
         self.error_count += 1
         self.phase = "error"
         message = str(exc)
         logger.exception("gateway session error", extra={"session": self.session_id})
+        await self.cancel_tts(abandon=True)
         try:
-            await self.ws.send_json(
+            await self._send_json(
                 {"type": "error", "session_id": self.session_id, "message": message}
             )
         except Exception:
             pass
-        await self.finalize(reason="error", error=message)
+        if not self.finalized:
+            await self.finalize(reason="error", error=message)
+        else:
+            await self._close_session(reason="error", error=message)
 
     async def _handle_voice_start(self, payload: dict) -> None:
         if self.phase in {"listen", "respond"}:
-            await self.ws.send_json(
+            await self._send_json(
                 {"type": "voice.ack", "session_id": self.session_id, "voice_id": self.voice_id, "role_id": self.role_id}
             )
             return
         self.started_at = time.time()
         requested_role = payload.get("role_id")
         try:
-            role_config = self.registry.acquire_role(requested_role, self.session_id)
+            role_config = await self.registry.acquire_role_async(requested_role, self.session_id)
             self.role_config = role_config
             self.role_id = role_config.role_id
             self.voice_id = role_config.voice_id or self.voice_id
         except Exception as exc:
             self.phase = "error"
-            await self.ws.send_json(
+            await self._send_json(
                 {
                     "type": "voice.role_status",
                     "session_id": self.session_id,
@@ -775,33 +1105,66 @@ class LingyaGatewayMultiRole:
             self.provider = payload["provider"]
         if isinstance(payload.get("mime_type"), str):
             self.mime_type = payload["mime_type"]
+        if isinstance(payload.get("input_format"), str):
+            self._negotiate_input(payload["input_format"])
+        if isinstance(payload.get("output_format"), str):
+            try:
+                self.audio_format = _stream_format(get_format(payload["output_format"]))
+            except ValueError:
+                await self._send_json(
+                    {"type": "error", "session_id": self.session_id, "message": "invalid_output_format"}
+                )
 
         self.phase = "listen"
-        await self.ws.send_json(
+        await self._send_json(
             {
                 "type": "voice.ack",
                 "session_id": self.session_id,
                 "voice_id": self.voice_id,
                 "role_id": self.role_id,
                 "phase": self.phase,
+                "output_format": self.audio_format.name,
+                "mime": self.audio_format.media_type,
+                "input_format": self.audio_input.name,
                 "timestamp": int(self.started_at * 1000),
             }
         )
         await self._emit_role_status(status="active", message="role_initialized", latency_ms=0)
+        if self.registry.shared_state is not None and self.seat_heartbeat_task is None:
+            self.seat_heartbeat_task = asyncio.create_task(self._seat_heartbeat_loop())
+
+    def _negotiate_input(self, requested: str) -> None:
+        """Switch the client input format; unknown or unavailable formats keep the current one."""
+        try:
+            audio_input = negotiate_input(requested)
+        except (ValueError, RuntimeError) as exc:
+            logger.info("input format not accepted", extra={"requested": requested, "reason": str(exc)})
+            return
+        self.audio_input.close()
+        self.audio_input = audio_input
+        if audio_input.buffers_pcm:
+            self.mime_type = PCM16_MIME_TYPE
+
+    def _decode_input(self, turn: TurnTrace, chunk: bytes) -> np.ndarray:
+        decode_start = time.perf_counter()
+        with turn.span("decode", bytes=len(chunk), input_format=self.audio_input.name):
+            pcm = self.audio_input.decode(chunk)
+        METRIC_DECODE_SECONDS.observe(time.perf_counter() - decode_start)
+        return pcm
 
     async def _handle_voice_data(self, payload: dict) -> None:
         if not await self._ensure_active_or_error():
             return
         chunk_b64 = payload.get("chunk")
         if not isinstance(chunk_b64, str):
-            await self.ws.send_json(
+            await self._send_json(
                 {"type": "error", "session_id": self.session_id, "message": "invalid_chunk"}
             )
             return
         try:
             chunk = base64.b64decode(chunk_b64)
         except Exception:
-            await self.ws.send_json(
+            await self._send_json(
                 {"type": "error", "session_id": self.session_id, "message": "chunk_decode_failed"}
             )
             return
@@ -810,7 +1173,20 @@ class LingyaGatewayMultiRole:
 
     async def _process_audio_chunk(self, chunk: bytes, timestamp_ms: int) -> None:
         now_ms = timestamp_ms or int(time.time() * 1000)
-        self.audio_chunks.append(chunk)
+        turn = self._start_turn()
+        pcm: Optional[np.ndarray] = None
+        if self.audio_input.buffers_pcm:
+            # PCM/Opus clients: STT buffers the decoded PCM, so decode before buffering.
+            try:
+                pcm = self._decode_input(turn, chunk)
+            except Exception as exc:  # noqa: BLE001
+                logger.debug("input frame decode failed", exc_info=exc)
+                return
+            if not pcm.size:
+                return
+            chunk = memoryview(pcm).cast("B")
+        if not await self._buffer_audio(chunk):
+            return
         self.last_chunk_ms = now_ms
         if self.phase == "idle":
             self.phase = "listen"
@@ -820,8 +1196,12 @@ class LingyaGatewayMultiRole:
         peak_energy_value: Optional[float] = None
 
         try:
-            wav = decode_to_wav16k(chunk)
-            avg, peak = _compute_energy_levels(wav)
+            if pcm is None:
+                pcm = self._decode_input(turn, chunk)
+            analysis_start = time.perf_counter()
+            analyze_span = turn.start_span("analyze")
+            avg, peak = _compute_energy_levels(pcm)
+            METRIC_ANALYSIS_SECONDS.labels("energy").observe(time.perf_counter() - analysis_start)
             if avg:
                 self.energy_history.append(avg)
                 self.peak_energy = max(peak, self.peak_energy * 0.92)
@@ -841,112 +1221,127 @@ class LingyaGatewayMultiRole:
                             self.registry.update_emotion_state(self.role_id, metrics["emotionEstimate"])
 
                         if self.emotion_worker:
-                            snapshot = self.emotion_worker.analyze(
-                                wav,
+                            pitch_start = time.perf_counter()
+                            snapshot = self.emotion_worker.analyze_pcm(
+                                pcm,
                                 avg_energy_value,
                                 peak_energy_value,
                             )
+                            METRIC_ANALYSIS_SECONDS.labels("pitch").observe(time.perf_counter() - pitch_start)
                             self.last_emotion_snapshot = snapshot
                             metrics_payload.update(self.emotion_worker.to_payload(snapshot))
                             if snapshot.emotion_estimate:
                                 metrics_payload["emotion_estimate"] = snapshot.emotion_estimate
 
+                        analyze_span.end(avg_energy=avg_energy_value)
                         await self._emit_metrics(metrics_payload.copy())
                     self.last_energy_ms = now_ms
+            analyze_span.end()
         except Exception as exc:  # noqa: BLE001
             logger.debug("energy feedback failed", exc_info=exc)
 
-        if self.using_local_whisper:
-            await self._transcribe_local_chunk(chunk, is_final=False)
+        stream = self._stt()
+        if stream.incremental:
+            await self._stt_feed(chunk)
         else:
+            # Batch engines re-transcribe the whole utterance, so partials are paced to
+            # the engine's expected latency rather than fired on every chunk.
+            interval_ms = REALTIME_PARTIAL_INTERVAL_MS
+            if stream.engine is not None:
+                interval_ms = max(interval_ms, stream.engine.profile.partial_latency_ms)
             if (
                 not self.partial_task
-                and now_ms - self.last_partial_ms >= REALTIME_PARTIAL_INTERVAL_MS
+                and now_ms - self.last_partial_ms >= interval_ms
                 and len(self.audio_chunks) >= REALTIME_CHUNK_THRESHOLD
             ):
-                self.partial_task = asyncio.create_task(self._transcribe_remote(final=False))
+                self.partial_task = asyncio.create_task(self._stt_transcribe(final=False))
                 self.last_partial_ms = now_ms
 
-    async def _transcribe_local_chunk(self, chunk: bytes, is_final: bool) -> None:
+    def _stt(self) -> RoutedSTTStream:
+        """STT stream for the current utterance, opened on the role's preferred engine."""
+        if self.stt_stream is None:
+            preferred = self.role_config.stt_model if self.role_config else None
+            self.stt_stream = get_stt_router().open(self.audio_chunks, self.mime_type, preferred=preferred)
+        return self.stt_stream
+
+    def _observe_stt(self, engine: Optional[STTEngine], final: bool, start_ts: float) -> int:
+        latency_ms = int((time.time() - start_ts) * 1000)
+        self._observe_latency("stt", latency_ms)
+        mode = "local" if engine is not None and engine.capabilities.local else "remote"
+        METRIC_STT_SECONDS.labels(mode, str(final).lower()).observe(latency_ms / 1000.0)
+        return latency_ms
+
+    async def _stt_failed(self, exc: Exception) -> None:
+        logger.warning("stt failed on every engine", exc_info=exc)
+        await self._send_json({"type": "error", "session_id": self.session_id, "message": f"stt_failed: {exc}"})
+
+    async def _stt_feed(self, chunk: bytes) -> None:
+        stream = self._stt()
+        engine = stream.engine
+        start_ts = time.time()
         try:
-            if self.whisper_model is None:
-                model_size = os.getenv("REALTIME_WHISPER_MODEL", "tiny")
-                whisper_device = os.getenv("REALTIME_WHISPER_DEVICE", "cpu")
-                compute_type = os.getenv("REALTIME_WHISPER_COMPUTE", "int8")
-                self.whisper_model = WhisperModel(model_size, device=whisper_device, compute_type=compute_type)
-            start_ts = time.time()
-            wav = decode_to_wav16k(chunk)
-            segments, _ = await asyncio.to_thread(
-                self.whisper_model.transcribe,
-                wav,
-                vad_filter=True,
-            )
-            latency_ms = int((time.time() - start_ts) * 1000)
-            self.stt_latency_samples.append(latency_ms)
-            text_parts = [s.text.strip() for s in segments if getattr(s, "text", "").strip()]
-            if text_parts:
-                self.partial_transcript.extend(text_parts)
-                combined = " ".join(self.partial_transcript).strip()
-                if combined:
-                    await self._emit_metrics(
-                        {"transcript": combined, "is_final": is_final, "latency_ms": latency_ms, "role_id": self.role_id}
-                    )
+            with self._start_turn().span("transcribe", engine=engine.name if engine else None, final=False, bytes=len(chunk)):
+                text = await stream.feed(chunk)
         except Exception as exc:  # noqa: BLE001
-            logger.warning("local whisper transcribe failed", exc_info=exc)
-            await self.ws.send_json({"type": "error", "session_id": self.session_id, "message": f"stt_failed: {exc}"})
-            self.using_local_whisper = False
+            await self._stt_failed(exc)
+            return
+        latency_ms = self._observe_stt(engine, False, start_ts)
+        text = (text or "").strip()
+        if text and text != self.stt_last_text:
+            self.stt_last_text = text
+            await self._emit_metrics({"transcript": text, "is_final": False, "latency_ms": latency_ms, "role_id": self.role_id})
 
-    async def _transcribe_remote(self, final: bool) -> None:
+    async def _stt_transcribe(self, final: bool) -> Optional[str]:
         async with self.partial_lock:
+            stream = self._stt()
+            engine = stream.engine
             try:
                 start_ts = time.time()
-                text = await transcribe_media_chunks(list(self.audio_chunks), self.mime_type)
-                latency_ms = int((time.time() - start_ts) * 1000)
-                self.stt_latency_samples.append(latency_ms)
+                with self._start_turn().span(
+                    "transcribe", engine=engine.name if engine else None, final=final, chunks=len(self.audio_chunks)
+                ):
+                    text = await (stream.final() if final else stream.partial())
+                # Failover may have moved the utterance; report against the engine that answered.
+                engine = stream.engine or engine
+                latency_ms = self._observe_stt(engine, final, start_ts)
             except Exception as exc:  # noqa: BLE001
-                logger.warning("remote whisper transcribe failed", exc_info=exc)
-                await self.ws.send_json(
-                    {"type": "error", "session_id": self.session_id, "message": f"stt_failed: {exc}"}
-                )
-                return
+                await self._stt_failed(exc)
+                return None
 
             text = (text or "").strip()
             if not text:
-                return
+                return None
 
-            if not final and text == self.remote_cache_text:
-                return
+            if not final and text == self.stt_last_text:
+                return None
 
-            self.remote_cache_text = text
+            self.stt_last_text = text
             await self._emit_metrics({"transcript": text, "is_final": final, "latency_ms": latency_ms, "role_id": self.role_id})
-
-            if final:
-                await self._handle_final_reply(text)
+            return text
 
     async def _handle_final_reply(self, user_text: str) -> None:
         text = user_text.strip()
         if not text:
             return
         self.phase = "respond"
-        loop = asyncio.get_running_loop()
+        turn = self._start_turn()
         try:
-            reply_text = await loop.run_in_executor(
-                None,
-                llm_emotion_route,
-                text,
-                self.provider,
-                None,
-                True,
-            )
+            llm_start = time.perf_counter()
+            with turn.span("llm_route", provider=self.provider):
+                reply_text = await _route_emotion(text, self.provider, PRIORITY_LIVE)
+            METRIC_LLM_SECONDS.labels(self.provider).observe(time.perf_counter() - llm_start)
         except Exception as exc:  # noqa: BLE001
             self.phase = "error"
             logger.exception("llm_emotion_route failed")
-            await self.ws.send_json({"type": "error", "session_id": self.session_id, "message": f"llm_failed: {exc}"})
+            await self._send_json({"type": "error", "session_id": self.session_id, "message": f"llm_failed: {exc}"})
+            self._finish_turn(outcome="llm_failed")
             return
 
         reply_text = reply_text.strip()
-        tags = extract_tags_from_text(reply_text)
-        await self.ws.send_json(
+        with turn.span("tag_map") as tag_span:
+            tags = extract_tags_from_text(reply_text)
+            tag_span.set_attribute("tags", ",".join(tags))
+        await self._send_json(
             {
                 "type": "assistant.reply",
                 "session_id": self.session_id,
@@ -957,16 +1352,105 @@ class LingyaGatewayMultiRole:
         )
         await self._stream_tts(reply_text)
         self.phase = "listen"
+        self._finish_turn(outcome="replied")
 
     async def _stream_tts(self, reply_text: str) -> None:
         voice_id = self.voice_id or VOICE_ID
         if not voice_id:
-            await self.ws.send_json({"type": "error", "session_id": self.session_id, "message": "no_voice_id"})
+            await self._send_json({"type": "error", "session_id": self.session_id, "message": "no_voice_id"})
             return
 
-        payload = {
+        banked = phrase_bank.lookup(reply_text, voice_id)
+        if banked is not None and self.audio_format.name != FORMAT_MP3:
+            try:
+                banked = await asyncio.to_thread(ensure_variant, banked, self.audio_format)
+            except TranscodeUnavailable:
+                banked = None  # synthesize live in the session's format instead
+        if banked is not None:
+            await self._stream_banked_audio(banked)
+            return
+
+        sentences = split_sentences(reply_text, min_chars=TTS_SPLIT_MIN_CHARS) if TTS_PREFETCH_SENTENCES > 0 else []
+        role_label = self.role_id or "none"
+        turn = self._start_turn()
+        tts_span = turn.start_span("tts_request", voice_id=voice_id, chars=len(reply_text), sentences=len(sentences))
+        first_byte_span = turn.start_span("first_byte", parent=tts_span)
+        prefetcher = SentencePrefetcher(
+            sentences or [reply_text],
+            stream=lambda text: self._tts_sentence_stream(text, voice_id),
+            fetch=lambda text: self._tts_sentence_audio(text, voice_id),
+            lookahead=TTS_PREFETCH_SENTENCES,
+            concurrency=TTS_PREFETCH_CONCURRENCY,
+            max_ahead_chars=TTS_PREFETCH_MAX_CHARS,
+            chunk_bytes=TTS_CHUNK_BYTES * TTS_AGGREGATE,
+        )
+        self.tts_prefetch = prefetcher
+        request_start = time.perf_counter()
+        sequence = 0
+        try:
+            async for chunk in prefetcher:
+                event = self._encode_tts_chunk(chunk, sequence=sequence)
+                if event is None:
+                    continue
+                if sequence == 0:
+                    first_byte_span.end()
+                    METRIC_TTS_FIRST_CHUNK_SECONDS.labels(role_label).observe(time.perf_counter() - request_start)
+                    self.tts_first_chunk_latency_ms = int((time.perf_counter() - request_start) * 1000)
+                    self._observe_latency("tts_first_chunk", self.tts_first_chunk_latency_ms)
+                await self._send_json(event, parent=tts_span)
+                sequence += 1
+            if prefetcher.cancelled:
+                return
+            METRIC_TTS_TOTAL_SECONDS.labels(role_label).observe(time.perf_counter() - request_start)
+            await self._send_json({"type": "tts.stream.completed", "session_id": self.session_id, "role_id": self.role_id})
+        except (AdmissionRejected, CircuitOpen) as exc:
+            # The text reply is already on screen; finish the turn without (the rest of the) audio.
+            tts_span.record_error(exc)
+            await self._send_json(
+                {
+                    "type": "tts.stream.completed",
+                    "session_id": self.session_id,
+                    "role_id": self.role_id,
+                    "degraded": "text_only" if sequence == 0 else "partial",
+                    "retry_after": round(getattr(exc, "retry_after", 0.0), 1),
+                }
+            )
+        except HTTPException as exc:
+            tts_span.record_error(exc)
+            await self._send_json({"type": "error", "session_id": self.session_id, "message": str(exc.detail)})
+        except Exception as exc:  # noqa: BLE001
+            tts_span.record_error(exc)
+            await self._send_json({"type": "error", "session_id": self.session_id, "message": f"tts_failed: {exc}"})
+        finally:
+            await prefetcher.aclose()
+            if self.tts_prefetch is prefetcher:
+                self.tts_prefetch = None
+            first_byte_span.end()
+            tts_span.end(prefetched=prefetcher.prefetched, chunks=sequence)
+
+    async def cancel_tts(self, abandon: bool = False) -> None:
+        """
+        Drop outstanding sentence synthesis (voice.end, role switch); the reply task
+        stops after the chunk in flight and wraps the turn up. With ``abandon``
+        (disconnect, error) the reply task itself is cancelled and awaited.
+        """
+        if self.tts_prefetch is not None:
+            self.tts_prefetch.cancel()
+            self.tts_prefetch = None
+        task = self.reply_task
+        if not abandon or task is None or task is asyncio.current_task():
+            return
+        self.reply_task = None
+        task.cancel()
+        await asyncio.wait({task})
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("gateway reply task failed", exc_info=task.exception(), extra={"session": self.session_id})
+
+    @staticmethod
+    def _tts_payload(text: str) -> dict:
+        return {
             "model_id": "eleven_turbo_v2_5",
-            "text": reply_text,
+            "text": text,
             "voice_settings": {
                 "stability": 0.4,
                 "similarity_boost": 0.8,
@@ -975,66 +1459,107 @@ class LingyaGatewayMultiRole:
             },
         }
 
-        queue: asyncio.Queue[Optional[dict]] = asyncio.Queue()
+    async def _tts_sentence_stream(self, text: str, voice_id: str) -> AsyncIterator[bytes]:
+        """First sentence: stream ElevenLabs chunks as they arrive, then keep the result in the audio cache."""
+        cache_path = variant_path(phrase_key(text, voice_id), self.audio_format)
+        if is_cache_valid(cache_path):
+            yield await asyncio.to_thread(cache_path.read_bytes)
+            return
+        async with tts_admission.admit(PRIORITY_LIVE):
+            response = await asyncio.to_thread(
+                call_elevenlabs_stream, self._tts_payload(text), voice_id, eleven_output_format(self.audio_format)
+            )
+            audio = bytearray()
+            pending = bytearray()
+            count = 0
+            async for chunk in iterate_blocking(response.iter_content(chunk_size=TTS_CHUNK_BYTES), response.close):
+                audio.extend(chunk)
+                pending.extend(chunk)
+                count += 1
+                if count >= TTS_AGGREGATE:
+                    yield bytes(pending)
+                    pending.clear()
+                    count = 0
+            if pending:
+                yield bytes(pending)
+        await asyncio.to_thread(_write_cache_file, cache_path, bytes(audio))
+
+    async def _tts_sentence_audio(self, text: str, voice_id: str) -> bytes:
+        """Later sentences: whole-file synthesis (prefetched in parallel), served from the cache when present."""
+        cache_path = variant_path(phrase_key(text, voice_id), self.audio_format)
+        if is_cache_valid(cache_path):
+            return await asyncio.to_thread(cache_path.read_bytes)
+        response = await _generate_speech_admitted(
+            self._tts_payload(text), voice_id, PRIORITY_LIVE, eleven_output_format(self.audio_format)
+        )
+        await asyncio.to_thread(_write_cache_file, cache_path, response.content)
+        return response.content
+
+    async def _stream_banked_audio(self, path: Path) -> None:
+        """Replay a pre-rendered phrase-bank file as tts.stream events (no upstream call)."""
+        started = time.perf_counter()
+        turn = self._start_turn()
+        with turn.span("tts_phrase_bank", file=path.name):
+            data = await asyncio.to_thread(path.read_bytes)
+            step = TTS_CHUNK_BYTES * TTS_AGGREGATE
+            for sequence, offset in enumerate(range(0, len(data), step)):
+                event = self._encode_tts_chunk(data[offset:offset + step], sequence=sequence)
+                if sequence == 0:
+                    self.tts_first_chunk_latency_ms = int((time.perf_counter() - started) * 1000)
+                    self._observe_latency("tts_first_chunk", self.tts_first_chunk_latency_ms)
+                await self._send_json(event)
+        await self._send_json(
+            {
+                "type": "tts.stream.completed",
+                "session_id": self.session_id,
+                "role_id": self.role_id,
+                "source": "phrase_bank",
+            }
+        )
 
-        def worker():
-            try:
-                response = call_elevenlabs_stream(payload, voice_id)
-                agg = bytearray()
-                chunk_limit = int(os.getenv("TTS_CHUNK_BYTES", "24576"))
-                aggregate_every = int(os.getenv("TTS_AGGREGATE", "2"))
-                count = 0
-                sequence = 0
-                start_ts = time.time()
-                first_chunk_emitted = False
-                for chunk in response.iter_content(chunk_size=chunk_limit):
-                    if not chunk:
-                        continue
-                    agg.extend(chunk)
-                    count += 1
-                    if count >= aggregate_every:
-                        event = self._encode_tts_chunk(bytes(agg), sequence=sequence)
-                        agg.clear()
-                        count = 0
-                        if event:
-                            if not first_chunk_emitted:
-                                first_chunk_emitted = True
-                                queue.put_nowait({"__first_chunk_latency__": int((time.time() - start_ts) * 1000)})
-                            queue.put_nowait(event)
-                            sequence += 1
-                if agg:
-                    event = self._encode_tts_chunk(bytes(agg), sequence=sequence)
-                    if event:
-                        if sequence == 0:
-                            queue.put_nowait({"__first_chunk_latency__": int((time.time() - start_ts) * 1000)})
-                        queue.put_nowait(event)
-                queue.put_nowait({"type": "tts.stream.completed", "session_id": self.session_id, "role_id": self.role_id})
-            except HTTPException as exc:
-                queue.put_nowait({"type": "error", "session_id": self.session_id, "message": str(exc.detail)})
-            except Exception as exc:  # noqa: BLE001
-                queue.put_nowait({"type": "error", "session_id": self.session_id, "message": f"tts_failed: {exc}"})
-            finally:
-                queue.put_nowait(None)
+    def memory_bytes(self) -> int:
+        """Approximate bytes held by this session's growable buffers."""
+        return (
+            self.audio_chunks.footprint
+            + sum(len(sketch.bins) for sketch in self.latency_sketches.values()) * 16
+            + sys.getsizeof(self.stt_last_text)
+        )
 
-        threading.Thread(target=worker, daemon=True).start()
+    async def _buffer_audio(self, chunk: bytes) -> bool:
+        """Store a chunk within the session budget; False means it was rejected."""
+        trimmed_before = self.audio_chunks.trimmed_bytes
+        if not self.audio_chunks.append(chunk):
+            METRIC_AUDIO_OVERFLOW_BYTES.labels("rejected").inc(len(chunk))
+            if not self.audio_rejected_notified:
+                self.audio_rejected_notified = True
+                logger.warning(
+                    "gateway audio budget exceeded",
+                    extra={"session": self.session_id, "held_bytes": self.audio_chunks.nbytes},
+                )
+                try:
+                    await self._send_json(
+                        {"type": "error", "session_id": self.session_id, "message": "audio_buffer_full"}
+                    )
+                except Exception:
+                    pass
+            return False
+        trimmed = self.audio_chunks.trimmed_bytes - trimmed_before
+        if trimmed:
+            METRIC_AUDIO_OVERFLOW_BYTES.labels("trimmed").inc(trimmed)
+        return True
 
-        while True:
-            event = await queue.get()
-            if event is None:
-                break
-            if "__first_chunk_latency__" in event:
-                self.tts_first_chunk_latency_ms = event["__first_chunk_latency__"]
-                continue
-            await self.ws.send_json(event)
+    def tts_backlog(self) -> int:
+        prefetcher = self.tts_prefetch
+        return prefetcher.pending if prefetcher is not None else 0
 
     def _encode_tts_chunk(self, data: bytes, sequence: int) -> Optional[dict]:
         if not data:
             return None
         b64 = base64.b64encode(data).decode("ascii")
-    return {
+        return {
             "type": "tts.stream",
             "session_id": self.session_id,
-            "mime": "audio/mpeg",
+            "mime": self.audio_format.media_type,
             "chunk": b64,
             "sequence": sequence,
             "timestamp": int(time.time() * 1000),
@@ -1050,11 +1575,10 @@ class LingyaGatewayMultiRole:
         }
         base_payload.update(payload)
         try:
-            await self.ws.send_json(base_payload)
+            await self._send_json(base_payload)
         except Exception:
             pass
         metric_record = {k: v for k, v in base_payload.items() if k not in {"type"}}
-        self.metrics_samples.append(metric_record)
         self.last_metrics_payload = metric_record
         await telemetry_client.record_metric(metric_record)
 
@@ -1068,6 +1592,7 @@ class LingyaGatewayMultiRole:
         if requested_role == self.role_id:
             await self._emit_role_status(status="active", message="role_unchanged", latency_ms=0)
             return
+        await self.cancel_tts()
         start = time.time()
         prev_role = self.role_id
         self.phase = "pause"
@@ -1081,10 +1606,16 @@ class LingyaGatewayMultiRole:
             )
             if not self.registry.can_switch(requested_role, self.session_id):
                 raise RuntimeError("role_capacity_exceeded")
-            config = self.registry.switch_role(prev_role or self.registry.default_role(), requested_role, self.session_id)
-            self.role_config = config
-            self.role_id = config.role_id
-            self.voice_id = config.voice_id or self.voice_id
+            # A reply task may be closing the session (and releasing the seat) concurrently.
+            async with self.seat_lock:
+                if self.closed_at is not None:
+                    raise RuntimeError("session_closed")
+                config = await self.registry.switch_role_async(
+                    prev_role or self.registry.default_role(), requested_role, self.session_id
+                )
+                self.role_config = config
+                self.role_id = config.role_id
+                self.voice_id = config.voice_id or self.voice_id
             latency_ms = int((time.time() - start) * 1000)
             await self._emit_role_status(
                 status="active",
@@ -1127,7 +1658,7 @@ class LingyaGatewayMultiRole:
 
     async def _emit_role_catalog(self) -> None:
         try:
-            await self.ws.send_json({"type": "voice.roles", "roles": role_registry.list_roles()})
+            await self._send_json({"type": "voice.roles", "roles": role_registry.list_roles()})
         except Exception:
             pass
 
@@ -1152,7 +1683,7 @@ class LingyaGatewayMultiRole:
         if previous_role:
             payload["previous_role"] = previous_role
         try:
-            await self.ws.send_json(payload)
+            await self._send_json(payload)
         except Exception:
             pass
 
@@ -1168,21 +1699,26 @@ class LingyaGatewayMultiRole:
             "voice_id": self.voice_id,
             "provider": self.provider,
             "role_id": self.role_id,
+            "trace_id": self.last_trace_id,
             "metrics": {
-                "stt_latency_ms": self._reduce_samples(self.stt_latency_samples),
+                "stt_latency_ms": self._latency_summary("stt"),
                 "tts_first_chunk_ms": self.tts_first_chunk_latency_ms,
+                "tts_first_chunk_quantiles_ms": self._latency_summary("tts_first_chunk"),
                 "avg_energy": self._last_metric_field("avg_energy"),
                 "peak_energy": self._last_metric_field("peak_energy"),
                 "emotion_estimate": self._last_metric_field("emotion_estimate"),
                 "pitch_hz": self._last_metric_field("pitch_hz"),
                 "emotion_confidence": self._last_metric_field("emotion_confidence"),
+                "buffer_bytes_peak": self.audio_chunks.peak_bytes,
+                "audio_trimmed_bytes": self.audio_chunks.trimmed_bytes,
+                "audio_rejected_bytes": self.audio_chunks.rejected_bytes,
             },
             "errors": self.error_count,
         }
         if error:
             summary["error_message"] = error
         try:
-            await self.ws.send_json(summary)
+            await self._send_json(summary)
         except Exception:
             pass
         logger.info("gateway.session.summary", extra={"summary": summary})
@@ -1193,19 +1729,28 @@ class LingyaGatewayMultiRole:
             return None
         return self.last_metrics_payload.get(field)
 
-    @staticmethod
-    def _reduce_samples(samples: List[float]) -> Optional[dict]:
-        if not samples:
-            return None
-        samples_sorted = sorted(samples)
-        n = len(samples_sorted)
-        p50 = samples_sorted[n // 2]
-        p95 = samples_sorted[int(n * 0.95) - 1 if n > 1 else 0]
-        return {"p50": p50, "p95": p95}
+    def _observe_latency(self, stage: str, value_ms: float) -> None:
+        key = (stage, self.role_id or "unknown")
+        sketch = self.latency_sketches.get(key)
+        if sketch is None:
+            sketch = self.latency_sketches[key] = DDSketch()
+        sketch.add(value_ms)
+
+    def _latency_summary(self, stage: str) -> Optional[dict]:
+        merged = DDSketch()
+        for (sketch_stage, _), sketch in self.latency_sketches.items():
+            if sketch_stage == stage:
+                merged.merge(sketch)
+        return merged.summary()
+
+    def _publish_latency_sketches(self) -> None:
+        """Fold this session's sketches into the process-wide per-role summaries."""
+        for (stage, role_id), sketch in self.latency_sketches.items():
+            METRIC_ROLE_LATENCY_MS.labels(stage, role_id).merge(sketch)
 
     async def _ensure_active_or_error(self) -> bool:
         if self.phase not in {"listen", "respond"} or not self.started_at:
-            await self.ws.send_json(
+            await self._send_json(
                 {
                     "type": "error",
                     "session_id": self.session_id,
@@ -1217,11 +1762,12 @@ class LingyaGatewayMultiRole:
 
     def _reset_buffers(self) -> None:
         self.audio_chunks.clear()
+        self.audio_rejected_notified = False
         self.energy_history.clear()
         self.peak_energy = 0.0
         self.last_energy_ms = 0
-        self.remote_cache_text = ""
-        self.partial_transcript.clear()
+        self.stt_stream = None
+        self.stt_last_text = ""
         self.phase = "closed"
 @app.get("/", response_class=HTMLResponse)
 async def root():
@@ -1256,7 +1802,7 @@ async def favicon():
 @app.post(
     "/api/voice/huangrong",
     response_model=VoiceResponse,
-    dependencies=[Depends(verify_api_key), Depends(enforce_rate_limit)],
+    dependencies=[Depends(verify_api_key), Depends(rate_limited(ROUTE_TTS))],
 )
 async def generate_voice_api(request: VoiceRequest, http_request: Request):
     """
@@ -1274,26 +1820,33 @@ async def generate_voice_api(request: VoiceRequest, http_request: Request):
     try:
         # 1. 判斷語氣（如果需要）
         if request.emotion_auto:
-            tagged_text = llm_emotion_route(
-                request.text,
-                provider=request.provider,
-                fallback_to_rule=True
-            )
+            tagged_text = await _route_emotion(request.text, request.provider, PRIORITY_BATCH)
         else:
             tagged_text = request.text
 
         voice_id = request.voice_id or VOICE_ID
         if not voice_id:
             raise HTTPException(status_code=500, detail="未設定 Voice ID")
+        audio_format = _requested_format(request.audio_format, http_request)
 
         tags = extract_tags_from_text(tagged_text)
         cache_key = generate_audio_key(request.text, voice_id, tags)
         cache_path = get_cached_audio_path(cache_key)
         cache_hit = is_cache_valid(cache_path)
+        METRIC_CACHE_REQUESTS.labels("hit" if cache_hit else "miss").inc()
+        await telemetry_client.record_cache_event(
+            {
+                "timestamp": int(time.time() * 1000),
+                "route": http_request.url.path,
+                "cache_hit": cache_hit,
+                "voice_id": voice_id,
+                "text_length": len(request.text),
+            }
+        )
 
         if cache_hit:
-            audio_filename = cache_path.name
-            audio_url = f"{BASE_URL}/audio/{audio_filename}"
+            audio_path, audio_format = await _audio_variant(cache_path, audio_format)
+            audio_url = f"{BASE_URL}/audio/{audio_path.name}"
             logger.info(
                 "voice cache hit",
                 extra={
@@ -1310,7 +1863,8 @@ async def generate_voice_api(request: VoiceRequest, http_request: Request):
                 tagged_text=tagged_text,
                 voice_tags=tags,
                 cache_hit=True,
-                message="語音產生成功（快取）"
+                message="語音產生成功（快取）",
+                audio_format=audio_format.name,
             )
 
         # 2. 呼叫 ElevenLabs API（含重試）
@@ -1326,12 +1880,12 @@ async def generate_voice_api(request: VoiceRequest, http_request: Request):
         }
         try:
             start_time = time.time()
-            response = call_elevenlabs_generate(payload, voice_id)
+            response = await _generate_speech_admitted(payload, voice_id, PRIORITY_BATCH)
             elapsed = time.time() - start_time
-            with open(cache_path, "wb") as f:
-                f.write(response.content)
+            await asyncio.to_thread(_write_cache_file, cache_path, response.content)
 
-            audio_url = f"{BASE_URL}/audio/{cache_path.name}"
+            audio_path, audio_format = await _audio_variant(cache_path, audio_format)
+            audio_url = f"{BASE_URL}/audio/{audio_path.name}"
             clean_expired_cache()
 
             logger.info(
@@ -1352,11 +1906,23 @@ async def generate_voice_api(request: VoiceRequest, http_request: Request):
                 tagged_text=tagged_text,
                 voice_tags=tags,
                 cache_hit=False,
-                message="語音產生成功"
+                message="語音產生成功",
+                audio_format=audio_format.name,
             )
 
         except HTTPException:
             raise
+        except (AdmissionRejected, CircuitOpen) as exc:
+            logger.info("ElevenLabs unavailable; text-only fallback", extra={"reason": str(exc)})
+            return VoiceResponse(
+                status="fallback",
+                audio_url=None,
+                text=request.text,
+                tagged_text=tagged_text,
+                voice_tags=tags,
+                cache_hit=False,
+                message="語音服務忙碌中，小軟先以文字回覆"
+            )
         except Exception as exc:  # noqa: BLE001
             logger.error("ElevenLabs 產生語音失敗，改用 fallback", exc_info=exc)
             return VoiceResponse(
@@ -1378,23 +1944,20 @@ async def generate_voice_api(request: VoiceRequest, http_request: Request):
 
 @app.post(
     "/api/voice/huangrong/stream",
-    dependencies=[Depends(verify_api_key), Depends(enforce_rate_limit)],
+    dependencies=[Depends(verify_api_key), Depends(rate_limited(ROUTE_TTS))],
 )
 async def generate_voice_stream(request: VoiceRequest, http_request: Request):
     """直接返回音訊流（Streaming Response）。"""
     try:
         if request.emotion_auto:
-            tagged_text = llm_emotion_route(
-                request.text,
-                provider=request.provider,
-                fallback_to_rule=True
-            )
+            tagged_text = await _route_emotion(request.text, request.provider, PRIORITY_BATCH)
         else:
             tagged_text = request.text
 
         voice_id = request.voice_id or VOICE_ID
         if not voice_id:
             raise HTTPException(status_code=500, detail="未設定 Voice ID")
+        audio_format = _stream_format(_requested_format(request.audio_format, http_request))
 
         payload = {
             "model_id": "eleven_turbo_v2_5",
@@ -1407,9 +1970,24 @@ async def generate_voice_stream(request: VoiceRequest, http_request: Request):
             }
         }
 
+        try:
+            admitted_at = await tts_admission.acquire(PRIORITY_BATCH)
+        except AdmissionRejected as exc:
+            raise HTTPException(
+                status_code=503,
+                detail="語音服務忙碌中，請稍後再試",
+                headers={"Retry-After": str(max(1, int(exc.retry_after + 0.999)))},
+            )
+
         try:
             start_time = time.time()
-            response = call_elevenlabs_stream(payload, voice_id)
+            try:
+                response = await asyncio.to_thread(
+                    call_elevenlabs_stream, payload, voice_id, eleven_output_format(audio_format)
+                )
+            except BaseException as exc:
+                tts_admission.release(admitted_at, tts_admission.outcome_for(exc))
+                raise
             elapsed = time.time() - start_time
             logger.info(
                 "voice stream generated",
@@ -1420,13 +1998,36 @@ async def generate_voice_stream(request: VoiceRequest, http_request: Request):
                 },
             )
 
+            async def stream_body():
+                # The admission slot is held until the body is fully relayed (or the client leaves).
+                chunks = response.iter_content(chunk_size=8192)
+                error: Optional[BaseException] = None
+                try:
+                    while True:
+                        chunk = await asyncio.to_thread(next, chunks, None)
+                        if chunk is None:
+                            break
+                        yield chunk
+                except BaseException as exc:
+                    error = exc
+                    raise
+                finally:
+                    response.close()
+                    tts_admission.release(admitted_at, tts_admission.outcome_for(error))
+
             return StreamingResponse(
-                response.iter_content(chunk_size=8192),
-                media_type="audio/mpeg",
+                stream_body(),
+                media_type=audio_format.media_type,
                 headers={
-                    "Content-Disposition": f'attachment; filename="huangrong_audio.mp3"'
+                    "Content-Disposition": f'attachment; filename="huangrong_audio.{audio_format.extension}"'
                 }
             )
+        except CircuitOpen as exc:
+            raise HTTPException(
+                status_code=503,
+                detail="語音服務暫時不可用",
+                headers={"Retry-After": str(max(1, int(exc.retry_after + 0.999)))},
+            )
         except Exception as exc:  # noqa: BLE001
             logger.error("ElevenLabs stream 生成失敗", exc_info=exc)
             raise HTTPException(status_code=502, detail="語音服務暫時不可用")
@@ -1439,14 +2040,9 @@ async def generate_voice_stream(request: VoiceRequest, http_request: Request):
 
 
 @app.get("/audio/{filename}")
-async def serve_audio(filename: str):
-    """提供音訊檔案下載"""
-    filepath = AUDIO_DIR / filename
-    if not filepath.exists():
-        raise HTTPException(status_code=404, detail="檔案不存在")
-    
-    from fastapi.responses import FileResponse
-    return FileResponse(filepath, media_type="audio/mpeg")
+async def serve_audio(filename: str, request: Request):
+    """提供音訊檔案下載（ETag / 304 / Range）"""
+    return audio_response(request, AUDIO_DIR, filename)
 
 
 @app.get("/health")
@@ -1455,7 +2051,8 @@ async def health_check():
     return {
         "status": "healthy",
         "api_key_set": bool(API_KEY),
-        "voice_id_set": bool(VOICE_ID)
+        "voice_id_set": bool(VOICE_ID),
+        "stt_engines": get_stt_router().stats(),
     }
 
 
@@ -3,41 +3,22 @@
 import json
 import logging
 import os
-import tempfile
 from collections import deque
-from pathlib import Path
 from typing import Deque, List, Optional
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
-from openai import OpenAI
+
+from modules.whisper_client import DEFAULT_MIME_TYPE, MIME_SUFFIX_MAP, get_whisper_client
 
 router = APIRouter()
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-WHISPER_MODEL = os.getenv("WHISPER_MODEL", "whisper-1")
 SERVICE_API_KEY = os.getenv("SERVICE_API_KEY")
 CHUNK_THRESHOLD = 4  # number of MediaRecorder chunks (~2-4 seconds)
 ENERGY_WINDOW_SECONDS = 4
 ENERGY_SAMPLE_RATE = 60  # expected client-side sampling per second
-DEFAULT_MIME_TYPE = "audio/webm"
-
-MIME_SUFFIX_MAP = {
-    "audio/webm": ".webm",
-    "audio/webm;codecs=opus": ".webm",
-    "audio/ogg": ".ogg",
-    "audio/ogg;codecs=opus": ".ogg",
-    "audio/mp4": ".m4a",
-    "audio/mp4;codecs=opus": ".m4a",
-    "audio/mpeg": ".mp3",
-    "audio/mp3": ".mp3",
-}
 
 logger = logging.getLogger("voice_agent")
 
-client: Optional[OpenAI] = None
-if OPENAI_API_KEY:
-    client = OpenAI(api_key=OPENAI_API_KEY)
-
 
 def _verify_service_key(websocket: WebSocket) -> bool:
     if not SERVICE_API_KEY:
@@ -79,38 +60,19 @@ def _summarize_energy(
     }
 
 
-async def _transcribe_chunks(chunks: List[bytes], file_suffix: str) -> str:
-    """Persist chunks to a temp file and call Whisper transcription."""
-    if not client:
-        raise RuntimeError("OPENAI_API_KEY is not configured")
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix=file_suffix) as tmp_file:
-        for chunk in chunks:
-            tmp_file.write(chunk)
-        temp_path = Path(tmp_file.name)
-
-    try:
-        with temp_path.open("rb") as audio_file:
-            response = client.audio.transcriptions.create(
-                model=WHISPER_MODEL,
-                file=audio_file,
-            )
-        return response.text or ""
-    finally:
-        try:
-            temp_path.unlink(missing_ok=True)
-        except OSError:
-            pass
-
-
 async def transcribe_media_chunks(chunks: List[bytes], mime_type: str) -> str:
     """
     Helper shared by realtime pipelines to transcribe MediaRecorder chunks with Whisper.
+
+    The chunks are uploaded from memory through the shared async client (see
+    modules/whisper_client.py); the caller must not mutate them until this returns.
     """
     if not chunks:
         return ""
-    file_suffix = MIME_SUFFIX_MAP.get(mime_type, ".webm")
-    return await _transcribe_chunks(chunks, file_suffix)
+    client = get_whisper_client()
+    if client is None:
+        raise RuntimeError("OPENAI_API_KEY is not configured")
+    return await client.transcribe(chunks, mime_type)
 
 
 def summarize_energy_window(
@@ -138,11 +100,12 @@ async def whisper_websocket(websocket: WebSocket):
         return
 
     mime_type = websocket.query_params.get("mime_type", DEFAULT_MIME_TYPE)
-    file_suffix = MIME_SUFFIX_MAP.get(mime_type, ".webm")
+    if mime_type not in MIME_SUFFIX_MAP:
+        mime_type = DEFAULT_MIME_TYPE
 
     await websocket.accept()
 
-    if not client:
+    if get_whisper_client() is None:
         await websocket.send_json(
             {
                 "type": "error",
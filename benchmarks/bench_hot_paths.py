@@ -0,0 +1,189 @@
+"""
+Micro-benchmarks for the per-chunk / per-reply hot paths.
+
+Run through `scripts/hot_path_benchmark.py` (record / compare), or directly:
+
+    python -m pytest benchmarks/bench_hot_paths.py --benchmark-only
+
+The file name intentionally does not match `test_*.py`, so the regular
+`pytest -q` run does not pick these up.
+"""
+
+import io
+import random
+import wave
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from api.main import LingyaGatewayMultiRole, _compute_energy_levels  # noqa: E402
+from emotion_tag_engine import insert_emotion_tags  # noqa: E402
+from modules.audio_decode import wav_to_pcm16  # noqa: E402
+from modules.autonomous_emotion import AutonomousEmotionAgent  # noqa: E402
+from modules.emotion_ai import EmotionAIWorker  # noqa: E402
+from modules.keyword_matcher import get_keyword_lexicon  # noqa: E402
+from modules.role_registry import RoleRegistry  # noqa: E402
+from modules.speech_tag_mapper import (  # noqa: E402
+    _voice_settings_for,
+    extract_tags_from_text,
+    map_tags_to_voice_settings,
+    process_text_with_voice_settings,
+)
+from modules.voice_cache_engine import generate_audio_key  # noqa: E402
+
+SAMPLE_RATE = 16000
+PCM_DURATIONS_MS = (250, 1000, 5000)
+
+TAGGED_TEXTS = [
+    "[crying][softly] 你知道嗎？我真的好感動。",
+    "[excited][happy] 太好了！我們成功了！",
+    "[whispers] 這是個秘密，不要告訴別人。",
+    "[speaks quickly][playful] 靖哥哥，快來看看我今天做的叫化雞，香不香？",
+    "[curious][sarcastic][sighs] 為什麼每次都是我在等你呢？唉，算了算了。",
+]
+PLAIN_TEXTS = [
+    "你好，我是黃蓉！",
+    "你知道嗎，我剛剛夢見你在月光下教我輕功",
+    "這是個秘密，不要告訴別人",
+    "嗚嗚，我好難過",
+    "今天天氣不錯，要不要一起去湖邊走走？",
+]
+
+
+def _synth_wav(duration_ms: int, seed: int = 7) -> bytes:
+    """Voiced-like 16k mono PCM: 180 Hz harmonics, syllable envelope, light noise."""
+    rng = np.random.default_rng(seed)
+    n = SAMPLE_RATE * duration_ms // 1000
+    t = np.arange(n, dtype=np.float64) / SAMPLE_RATE
+    signal = sum(np.sin(2 * np.pi * 180.0 * k * t) / k for k in range(1, 5))
+    envelope = 0.55 + 0.45 * np.sin(2 * np.pi * 4.0 * t)
+    samples = signal * envelope * 6000.0 + rng.normal(0.0, 300.0, n)
+    pcm = np.clip(samples, -32768, 32767).astype("<i2")
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(SAMPLE_RATE)
+        wf.writeframes(pcm.tobytes())
+    return buf.getvalue()
+
+
+@pytest.fixture(scope="module", params=PCM_DURATIONS_MS, ids=lambda ms: f"{ms}ms")
+def pcm_samples(request) -> np.ndarray:
+    return np.frombuffer(wav_to_pcm16(_synth_wav(request.param)), "<i2")
+
+
+@pytest.fixture(scope="module")
+def gateway_session() -> LingyaGatewayMultiRole:
+    session = LingyaGatewayMultiRole(
+        websocket=None,  # type: ignore[arg-type]
+        default_voice_id="bench-voice",
+        registry=RoleRegistry(),
+        emotion_worker=None,
+    )
+    session.role_id = "huangrong"
+    return session
+
+
+def test_compute_energy_levels(benchmark, pcm_samples: np.ndarray) -> None:
+    benchmark.group = "energy"
+    avg, peak = benchmark(_compute_energy_levels, pcm_samples)
+    assert 0.0 < avg <= peak <= 100.0
+
+
+def test_emotion_ai_analyze_pcm(benchmark, pcm_samples: np.ndarray) -> None:
+    benchmark.group = "emotion_ai"
+    worker = EmotionAIWorker()
+    snapshot = benchmark(worker.analyze_pcm, pcm_samples, 55.0, 70.0)
+    assert snapshot.confidence >= 0.0
+
+
+def test_map_tags_to_voice_settings(benchmark) -> None:
+    benchmark.group = "tag_mapper"
+    tag_lists = [extract_tags_from_text(text) for text in TAGGED_TEXTS]
+
+    def run() -> None:
+        for tags in tag_lists:
+            map_tags_to_voice_settings(tags)
+
+    benchmark(run)
+
+
+def test_map_tags_to_voice_settings_cold(benchmark) -> None:
+    """Memo cleared every round: the NumPy weighted-average path itself."""
+    benchmark.group = "tag_mapper"
+    tag_lists = [extract_tags_from_text(text) for text in TAGGED_TEXTS]
+
+    def run() -> None:
+        _voice_settings_for.cache_clear()
+        for tags in tag_lists:
+            map_tags_to_voice_settings(tags)
+
+    benchmark(run)
+
+
+def test_process_text_with_voice_settings(benchmark) -> None:
+    """Per-reply overhead: parse tags, strip them, map to voice settings."""
+    benchmark.group = "tag_mapper"
+
+    def run() -> None:
+        for text in TAGGED_TEXTS:
+            process_text_with_voice_settings(text)
+
+    benchmark(run)
+
+
+def test_extract_tags_from_text(benchmark) -> None:
+    benchmark.group = "tag_mapper"
+
+    def run() -> None:
+        for text in TAGGED_TEXTS:
+            extract_tags_from_text(text)
+
+    benchmark(run)
+
+
+def test_rule_based_emotion_tags(benchmark) -> None:
+    """Keyword rules over the shared automaton (memo cleared: one real scan per text)."""
+    benchmark.group = "tag_mapper"
+    lexicon = get_keyword_lexicon()
+
+    def run() -> None:
+        lexicon._cache.clear()
+        for text in PLAIN_TEXTS:
+            insert_emotion_tags(text)
+
+    benchmark(run)
+
+
+def test_generate_audio_key(benchmark) -> None:
+    benchmark.group = "cache"
+    cases = [(text, extract_tags_from_text(text)) for text in TAGGED_TEXTS]
+
+    def run() -> None:
+        for text, tags in cases:
+            generate_audio_key(text, "bench-voice", tags)
+
+    benchmark(run)
+
+
+@pytest.mark.parametrize("size", [4096, 24576 * 2], ids=["4KB", "48KB"])
+def test_encode_tts_chunk(benchmark, gateway_session: LingyaGatewayMultiRole, size: int) -> None:
+    benchmark.group = "tts_encode"
+    data = bytes(random.Random(size).getrandbits(8) for _ in range(size))
+    event = benchmark(gateway_session._encode_tts_chunk, data, 3)
+    assert event and event["sequence"] == 3
+
+
+def test_autonomous_process_text(benchmark) -> None:
+    benchmark.group = "autonomous"
+    random.seed(2024)
+    agent = AutonomousEmotionAgent(autonomy_level=0.7)
+
+    def run() -> None:
+        for text in PLAIN_TEXTS:
+            agent.process_text(text, use_llm=False)
+
+    benchmark(run)
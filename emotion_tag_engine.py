@@ -4,6 +4,27 @@
 根據文字內容自動插入語氣標籤，讓黃蓉能夠根據語境表達不同情緒。
 """
 
+from modules.keyword_matcher import register_keywords, scan_keywords
+
+# 依優先順序排列：第一個命中的規則決定標籤（關鍵字比對不分大小寫）
+TAG_RULES = [
+    # 興奮/開心情緒
+    ("excited", "[excited] ", ["你好", "哈囉", "嗨", "hello", "hi", "太好了", "真棒"]),
+    # 悄悄話/秘密
+    ("whispers", "[whispers] ", ["秘密", "悄悄話", "偷偷", "不要告訴", "小聲"]),
+    # 哭泣/難過
+    ("crying", "[crying][sighs] ", ["哭", "難過", "傷心", "悲傷", "眼淚", "嗚嗚"]),
+    # 生氣/憤怒
+    ("angry", "[angry] ", ["氣死我", "生氣", "憤怒", "討厭", "可惡"]),
+    # 好奇/疑問
+    ("curious", "[curious] ", ["你知道嗎", "你知道", "為什麼", "怎麼", "什麼"]),
+]
+# 預設：快速/調皮（黃蓉的典型風格）
+DEFAULT_TAGS = "[speaks quickly][playful] "
+
+register_keywords("tag_rules", {name: keywords for name, _, keywords in TAG_RULES})
+_RULE_CATEGORIES = [(f"tag_rules.{name}", prefix) for name, prefix, _ in TAG_RULES]
+
 
 def insert_emotion_tags(text: str) -> str:
     """
@@ -22,32 +43,12 @@ def insert_emotion_tags(text: str) -> str:
         >>> insert_emotion_tags("這是秘密")
         '[whispers] 這是秘密'
     """
-    # 轉換為小寫以便比對（保留原始大小寫）
-    text_lower = text.lower()
-    
-    # 興奮/開心情緒
-    if any(keyword in text_lower for keyword in ["你好", "哈囉", "嗨", "hello", "hi", "太好了", "真棒"]):
-        return "[excited] " + text
-    
-    # 悄悄話/秘密
-    elif any(keyword in text_lower for keyword in ["秘密", "悄悄話", "偷偷", "不要告訴", "小聲"]):
-        return "[whispers] " + text
-    
-    # 哭泣/難過
-    elif any(keyword in text_lower for keyword in ["哭", "難過", "傷心", "悲傷", "眼淚", "嗚嗚"]):
-        return "[crying][sighs] " + text
-    
-    # 生氣/憤怒
-    elif any(keyword in text_lower for keyword in ["氣死我", "生氣", "憤怒", "討厭", "可惡"]):
-        return "[angry] " + text
-    
-    # 好奇/疑問
-    elif any(keyword in text_lower for keyword in ["你知道嗎", "你知道", "你知道", "為什麼", "怎麼", "什麼"]):
-        return "[curious] " + text
-    
-    # 預設：快速/調皮（黃蓉的典型風格）
-    else:
-        return "[speaks quickly][playful] " + text
+    # 共用關鍵字自動機一次掃描全文，再依規則順序取第一個命中的類別
+    hits = scan_keywords(text)
+    for category, prefix in _RULE_CATEGORIES:
+        if hits.has(category):
+            return prefix + text
+    return DEFAULT_TAGS + text
 
 
 def insert_emotion_tags_advanced(text: str, emotion: str = None) -> str:
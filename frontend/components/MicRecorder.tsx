@@ -35,6 +35,24 @@ const getSupportedMimeType = (): string | undefined => {
   return undefined;
 };
 
+// 原始 PCM（16 kHz mono int16）不需要伺服器端解碼；瀏覽器不支援時退回 MediaRecorder WebM。
+const INPUT_FORMAT_PCM = "pcm16le@16k";
+const INPUT_FORMAT_WEBM = "webm";
+const PCM_SAMPLE_RATE = 16000;
+const PCM_FRAME_SAMPLES = 8192; // 約 0.5 秒一個 chunk
+
+const supportsPcmCapture = (): boolean =>
+  typeof window !== "undefined" && typeof AudioContext !== "undefined";
+
+const floatToPcm16 = (input: Float32Array): ArrayBuffer => {
+  const pcm = new Int16Array(input.length);
+  for (let i = 0; i < input.length; i += 1) {
+    const sample = Math.max(-1, Math.min(1, input[i]));
+    pcm[i] = sample < 0 ? sample * 0x8000 : sample * 0x7fff;
+  }
+  return pcm.buffer;
+};
+
 const resolveApiBase = () => {
   if (API_BASE_URL) {
     return stripTrailingSlash(API_BASE_URL);
@@ -126,6 +144,9 @@ const MicRecorder: React.FC<MicRecorderProps> = ({
   const wsRef = useRef<WebSocket | null>(null);
   const recorderRef = useRef<MediaRecorder | null>(null);
   const streamRef = useRef<MediaStream | null>(null);
+  const audioContextRef = useRef<AudioContext | null>(null);
+  const processorRef = useRef<ScriptProcessorNode | null>(null);
+  const startCaptureRef = useRef<((inputFormat: string) => void) | null>(null);
   const ttsChunksRef = useRef<Uint8Array[]>([]);
   const audioUrlRef = useRef<string | null>(null);
   const currentUserTranscriptIdRef = useRef<string | null>(null);
@@ -209,6 +230,12 @@ const MicRecorder: React.FC<MicRecorderProps> = ({
   const stopAll = useCallback(() => {
     recorderRef.current?.stop();
     recorderRef.current = null;
+    startCaptureRef.current = null;
+
+    processorRef.current?.disconnect();
+    processorRef.current = null;
+    audioContextRef.current?.close().catch(() => undefined);
+    audioContextRef.current = null;
 
     streamRef.current?.getTracks().forEach((track) => track.stop());
     streamRef.current = null;
@@ -266,6 +293,8 @@ const MicRecorder: React.FC<MicRecorderProps> = ({
               phase: typeof payload.phase === "string" ? payload.phase : "listen",
             });
           }
+          startCaptureRef.current?.(typeof payload.input_format === "string" ? payload.input_format : INPUT_FORMAT_WEBM);
+          startCaptureRef.current = null;
           setStatus("Session 已啟動，開始串流音訊");
           appendTranscript({
             id: crypto.randomUUID(),
@@ -443,9 +472,48 @@ const MicRecorder: React.FC<MicRecorderProps> = ({
         roleRef.current = null;
         pendingSwitchRef.current = roleId;
         setStatus("已連線 Gateway，準備啟動 session...");
-        const recorderOptions = mimeType ? { mimeType } : undefined;
-        const recorder = new MediaRecorder(stream, recorderOptions);
-        recorderRef.current = recorder;
+        const sendChunk = (buffer: ArrayBuffer) => {
+          if (ws.readyState !== WebSocket.OPEN) return;
+          ws.send(
+            JSON.stringify({
+              type: "voice.data",
+              session_id: sessionIdRef.current ?? undefined,
+              chunk: arrayBufferToBase64(buffer),
+              timestamp: Date.now(),
+            })
+          );
+        };
+
+        // 依 voice.ack 回傳的 input_format 開始擷取（伺服器可能退回 webm）。
+        startCaptureRef.current = (inputFormat: string) => {
+          if (inputFormat === INPUT_FORMAT_PCM && supportsPcmCapture()) {
+            const context = new AudioContext({ sampleRate: PCM_SAMPLE_RATE });
+            const source = context.createMediaStreamSource(stream);
+            const processor = context.createScriptProcessor(PCM_FRAME_SAMPLES, 1, 1);
+            processor.onaudioprocess = (event) => {
+              sendChunk(floatToPcm16(event.inputBuffer.getChannelData(0)));
+            };
+            source.connect(processor);
+            processor.connect(context.destination);
+            audioContextRef.current = context;
+            processorRef.current = processor;
+          } else {
+            const recorderOptions = mimeType ? { mimeType } : undefined;
+            const recorder = new MediaRecorder(stream, recorderOptions);
+            recorderRef.current = recorder;
+            recorder.addEventListener("dataavailable", async (event) => {
+              if (event.data.size === 0) return;
+              try {
+                sendChunk(await event.data.arrayBuffer());
+              } catch (error) {
+                console.error("傳送音訊片段失敗", error);
+              }
+            });
+            recorder.start(500); // 每 0.5 秒一個 chunk，降低延遲
+          }
+          setIsRecording(true);
+          setStatus("錄音中... 點擊停止以結束");
+        };
 
         ws.send(
           JSON.stringify({
@@ -454,32 +522,10 @@ const MicRecorder: React.FC<MicRecorderProps> = ({
             voice_id: undefined,
             provider: "openai",
             mime_type: mimeType,
+            input_format: supportsPcmCapture() ? INPUT_FORMAT_PCM : INPUT_FORMAT_WEBM,
             timestamp: Date.now(),
           })
         );
-
-        recorder.addEventListener("dataavailable", async (event) => {
-          if (event.data.size === 0 || ws.readyState !== WebSocket.OPEN) return;
-
-          try {
-            const buffer = await event.data.arrayBuffer();
-            const chunk = arrayBufferToBase64(buffer);
-            ws.send(
-              JSON.stringify({
-                type: "voice.data",
-                session_id: sessionIdRef.current ?? undefined,
-                chunk,
-                timestamp: Date.now(),
-              })
-            );
-          } catch (error) {
-            console.error("傳送音訊片段失敗", error);
-          }
-        });
-
-        recorder.start(500); // 每 0.5 秒一個 chunk，降低延遲
-        setIsRecording(true);
-        setStatus("錄音中... 點擊停止以結束");
       };
 
       ws.onerror = (event) => {
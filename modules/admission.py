@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from modules.metrics import get_metrics_registry
+
+logger = logging.getLogger("admission")
+
+# Lower value = served first. Live gateway turns always jump ahead of batch REST calls.
+PRIORITY_LIVE = 0
+PRIORITY_BATCH = 1
+PRIORITY_NAMES = {PRIORITY_LIVE: "live", PRIORITY_BATCH: "batch"}
+
+OUTCOME_OK = "ok"
+OUTCOME_OVERLOAD = "overload"
+OUTCOME_ERROR = "error"
+
+_OVERLOAD_STATUS = {429, 503}
+
+
+class AdmissionRejected(Exception):
+    """Raised when a call is shed instead of being sent upstream; callers degrade instead of failing."""
+
+    def __init__(self, upstream: str, priority: int, reason: str, retry_after: float) -> None:
+        super().__init__(f"{upstream} admission rejected ({reason})")
+        self.upstream = upstream
+        self.priority = priority
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def is_overload_error(exc: BaseException) -> bool:
+    """429/503 from the upstream (HTTPException or a requests response) or a timeout."""
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError)):
+        return True
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status in _OVERLOAD_STATUS
+
+
+class AdmissionController:
+    """
+    Adaptive concurrency limit for one upstream (ElevenLabs, LLM, ...).
+
+    - AIMD window: every successful call grows the limit by `increase / limit` (about +1
+      per window of calls); a 429/503/timeout, or a call slower than `latency_target_ms`,
+      multiplies it by `backoff`, at most once per `cooldown` seconds.
+    - Calls over the limit wait in a priority queue (live before batch, FIFO within a
+      class) for at most the class's queue timeout, then raise `AdmissionRejected`.
+    - A queue timeout of 0 sheds that class immediately whenever the window is full.
+    - All bookkeeping happens on the event loop; there are no locks.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial_limit: float = 8,
+        min_limit: float = 1,
+        max_limit: float = 64,
+        increase: float = 1.0,
+        backoff: float = 0.7,
+        latency_target_ms: Optional[float] = None,
+        queue_timeouts: Optional[Dict[int, float]] = None,
+        max_queue: int = 64,
+        cooldown: float = 1.0,
+        overload_check: Callable[[BaseException], bool] = is_overload_error,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.name = name
+        self.min_limit = max(1.0, float(min_limit))
+        self.max_limit = max(self.min_limit, float(max_limit))
+        self.limit = min(self.max_limit, max(self.min_limit, float(initial_limit)))
+        self.increase = increase
+        self.backoff = backoff
+        self.latency_target_ms = latency_target_ms
+        self.queue_timeouts = dict(queue_timeouts or {PRIORITY_LIVE: 3.0, PRIORITY_BATCH: 0.5})
+        self.max_queue = max_queue
+        self.cooldown = cooldown
+        self.overload_check = overload_check
+        self.clock = clock
+        self.in_flight = 0
+        self.rejected = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._last_decrease = -float("inf")
+        self._latency_ewma = 0.0
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    def _has_capacity(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    def retry_after(self) -> float:
+        """Rough wait estimate for clients that were shed: one average call per queued slot."""
+        per_slot = self._latency_ewma / max(1, int(self.limit))
+        return max(1.0, per_slot * (self.queued + 1))
+
+    async def acquire(self, priority: int = PRIORITY_BATCH) -> float:
+        """Wait for a slot; returns the admission timestamp to pass back to `release()`."""
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+        if self._has_capacity() and not self._waiters:
+            self.in_flight += 1
+            return self.clock()
+
+        timeout = self.queue_timeouts.get(priority, 0.0)
+        if timeout <= 0 or self.queued >= self.max_queue:
+            raise self._reject(priority, "shed" if timeout <= 0 else "queue_full")
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        self._wake()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                return self.clock()  # granted in the same tick the timeout fired
+            future.cancel()
+            raise self._reject(priority, "queue_timeout") from None
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(self.clock(), OUTCOME_ERROR)  # slot was handed over; give it back
+            else:
+                future.cancel()
+            raise
+        return self.clock()
+
+    def release(self, started: float, outcome: str = OUTCOME_OK) -> None:
+        self.in_flight = max(0, self.in_flight - 1)
+        latency_ms = (self.clock() - started) * 1000.0
+        self._latency_ewma = latency_ms / 1000.0 if not self._latency_ewma else (
+            0.8 * self._latency_ewma + 0.2 * latency_ms / 1000.0
+        )
+        if outcome == OUTCOME_OVERLOAD or (
+            outcome == OUTCOME_OK and self.latency_target_ms and latency_ms > self.latency_target_ms
+        ):
+            self._decrease()
+        elif outcome == OUTCOME_OK:
+            self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+        self._wake()
+
+    def outcome_for(self, exc: Optional[BaseException]) -> str:
+        if exc is None:
+            return OUTCOME_OK
+        return OUTCOME_OVERLOAD if self.overload_check(exc) else OUTCOME_ERROR
+
+    @asynccontextmanager
+    async def admit(self, priority: int = PRIORITY_BATCH) -> AsyncIterator[None]:
+        started = await self.acquire(priority)
+        error: Optional[BaseException] = None
+        try:
+            yield
+        except BaseException as exc:
+            error = exc
+            raise
+        finally:
+            self.release(started, self.outcome_for(error))
+
+    def stats(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "rejected": self.rejected,
+        }
+
+    def _decrease(self) -> None:
+        now = self.clock()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        previous = self.limit
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+        logger.info("admission limit decreased", extra={"upstream": self.name, "from": previous, "to": self.limit})
+
+    def _wake(self) -> None:
+        while self._waiters and self._has_capacity():
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _reject(self, priority: int, reason: str) -> AdmissionRejected:
+        self.rejected += 1
+        METRIC_ADMISSION_REJECTED.labels(self.name, PRIORITY_NAMES.get(priority, str(priority)), reason).inc()
+        return AdmissionRejected(self.name, priority, reason, self.retry_after())
+
+
+_controllers: Dict[str, AdmissionController] = {}
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, str(default)))
+
+
+def controller_from_env(upstream: str, **overrides) -> AdmissionController:
+    """
+    `ADMISSION_<UPSTREAM>_LIMIT` / `_MIN_LIMIT` / `_MAX_LIMIT` / `_LATENCY_TARGET_MS` per
+    upstream; `ADMISSION_LIVE_QUEUE_MS`, `ADMISSION_BATCH_QUEUE_MS`, `ADMISSION_MAX_QUEUE`
+    are shared.
+    """
+    prefix = f"ADMISSION_{upstream.upper()}"
+    latency_target = _env_float(f"{prefix}_LATENCY_TARGET_MS", 0)
+    options = dict(
+        initial_limit=_env_float(f"{prefix}_LIMIT", 8),
+        min_limit=_env_float(f"{prefix}_MIN_LIMIT", 1),
+        max_limit=_env_float(f"{prefix}_MAX_LIMIT", 64),
+        latency_target_ms=latency_target or None,
+        queue_timeouts={
+            PRIORITY_LIVE: _env_float("ADMISSION_LIVE_QUEUE_MS", 3000) / 1000.0,
+            PRIORITY_BATCH: _env_float("ADMISSION_BATCH_QUEUE_MS", 500) / 1000.0,
+        },
+        max_queue=int(_env_float("ADMISSION_MAX_QUEUE", 64)),
+    )
+    options.update(overrides)
+    return AdmissionController(upstream, **options)
+
+
+def get_admission_controller(upstream: str, **overrides) -> AdmissionController:
+    controller = _controllers.get(upstream)
+    if controller is None:
+        controller = _controllers[upstream] = controller_from_env(upstream, **overrides)
+    return controller
+
+
+def _controller_samples(field: str) -> Dict[tuple, float]:
+    return {(name,): float(controller.stats()[field]) for name, controller in _controllers.items()}
+
+
+_metrics = get_metrics_registry()
+METRIC_ADMISSION_REJECTED = _metrics.counter(
+    "admission_rejections_total", "Upstream calls shed by admission control", ["upstream", "priority", "reason"]
+)
+_metrics.gauge("admission_concurrency_limit", "Current adaptive concurrency limit", ["upstream"]).set_function(
+    lambda: _controller_samples("limit")
+)
+_metrics.gauge("admission_in_flight", "Upstream calls currently admitted", ["upstream"]).set_function(
+    lambda: _controller_samples("in_flight")
+)
+_metrics.gauge("admission_queue_depth", "Upstream calls waiting for a slot", ["upstream"]).set_function(
+    lambda: _controller_samples("queued")
+)
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional, Tuple, Type
+
+from modules.autonomous_emotion import AutonomousEmotionAgent
+from modules.metrics import get_metrics_registry
+from modules.soft_ling import SoftLingAgent
+
+logger = logging.getLogger("agent_store")
+
+AGENT_STORE_MAX_SESSIONS = int(os.getenv("AGENT_STORE_MAX_SESSIONS", "10000"))
+AGENT_STORE_TTL_SECONDS = float(os.getenv("AGENT_STORE_TTL_SECONDS", "3600"))
+AGENT_STORE_SNAPSHOT = os.getenv("AGENT_STORE_SNAPSHOT", "")
+DEFAULT_SESSION_ID = "default"
+
+AGENT_KINDS: Dict[str, Type[AutonomousEmotionAgent]] = {
+    "autonomous": AutonomousEmotionAgent,
+    "soft_ling": SoftLingAgent,
+}
+
+_metrics = get_metrics_registry()
+METRIC_AGENT_SESSIONS = _metrics.gauge("agent_store_sessions", "Emotion agents held in memory")
+METRIC_AGENT_EVICTIONS = _metrics.counter(
+    "agent_store_evictions_total", "Emotion agents dropped from the store", ["reason"]
+)
+
+StoreKey = Tuple[str, str]
+
+
+class _Entry:
+    __slots__ = ("agent", "touched", "lock")
+
+    def __init__(self, agent: AutonomousEmotionAgent, touched: float) -> None:
+        self.agent = agent
+        self.touched = touched
+        self.lock = asyncio.Lock()
+
+
+class AgentStore:
+    """
+    Per-session emotion agents, so one user's emotional momentum never leaks into another's.
+
+    - Keyed by (session id, agent kind); least recently used sessions are evicted beyond
+      `max_sessions`, idle ones after `ttl_seconds`.
+    - `use()` serializes the requests of one session: an agent reads its state, awaits
+      the LLM, then updates it, and two turns interleaved across that await would
+      clobber each other (double submit, client retry).
+    - `save()`/`load()` write and read a JSON snapshot so sessions survive a restart.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = AGENT_STORE_MAX_SESSIONS,
+        ttl_seconds: float = AGENT_STORE_TTL_SECONDS,
+        snapshot_path: Optional[Path] = None,
+    ) -> None:
+        self.max_sessions = max(1, max_sessions)
+        self.ttl_seconds = ttl_seconds
+        self.snapshot_path = snapshot_path
+        self._entries: "OrderedDict[StoreKey, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - entry.touched > self.ttl_seconds
+
+    def _entry(self, session_id: Optional[str], kind: str) -> _Entry:
+        if kind not in AGENT_KINDS:
+            raise ValueError(f"unknown agent kind: {kind}")
+        key = (session_id or DEFAULT_SESSION_ID, kind)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, now):
+                del self._entries[key]
+                METRIC_AGENT_EVICTIONS.labels("ttl").inc()
+                entry = None
+            if entry is None:
+                entry = self._entries[key] = _Entry(AGENT_KINDS[kind](), now)
+                self._evict(now)
+            else:
+                entry.touched = now
+                self._entries.move_to_end(key)
+        return entry
+
+    def _evict(self, now: float) -> None:
+        # Oldest first: stop at the first live entry once the store is within its cap.
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if self._expired(entry, now):
+                reason = "ttl"
+            elif len(self._entries) > self.max_sessions:
+                reason = "capacity"
+            else:
+                break
+            del self._entries[key]
+            METRIC_AGENT_EVICTIONS.labels(reason).inc()
+        METRIC_AGENT_SESSIONS.set(len(self._entries))
+
+    def get(self, session_id: Optional[str], kind: str = "autonomous", autonomy_level: Optional[float] = None) -> AutonomousEmotionAgent:
+        agent = self._entry(session_id, kind).agent
+        if autonomy_level is not None:
+            agent.autonomy_level = autonomy_level
+        return agent
+
+    @asynccontextmanager
+    async def use(
+        self, session_id: Optional[str], kind: str = "autonomous", autonomy_level: Optional[float] = None
+    ) -> AsyncIterator[AutonomousEmotionAgent]:
+        """The session's agent, held for the duration of the block (concurrent tabs, retries)."""
+        entry = self._entry(session_id, kind)
+        async with entry.lock:
+            if autonomy_level is not None:
+                entry.agent.autonomy_level = autonomy_level
+            yield entry.agent
+
+    def discard(self, session_id: str, kind: Optional[str] = None) -> int:
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == session_id and (kind is None or key[1] == kind)]
+            for key in keys:
+                del self._entries[key]
+            METRIC_AGENT_SESSIONS.set(len(self._entries))
+        return len(keys)
+
+    def evict_expired(self) -> int:
+        with self._lock:
+            before = len(self._entries)
+            self._evict(time.monotonic())
+            return before - len(self._entries)
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            items = list(self._entries.items())
+        sessions = []
+        for (session_id, kind), entry in items:
+            if self._expired(entry, now):
+                continue
+            # Agents are only mutated on the event loop, so a synchronous read is consistent.
+            state = entry.agent.to_state()
+            sessions.append({"session": session_id, "kind": kind, "idle": round(now - entry.touched, 3), "state": state})
+        return {"version": 1, "sessions": sessions}
+
+    def restore(self, snapshot: Dict[str, Any]) -> int:
+        """Load sessions from `snapshot()` output (oldest first); returns how many were restored."""
+        now = time.monotonic()
+        restored = 0
+        records = sorted(snapshot.get("sessions", []), key=lambda record: -float(record.get("idle", 0)))
+        with self._lock:
+            for record in records:
+                agent_class = AGENT_KINDS.get(record.get("kind"))
+                if agent_class is None:
+                    continue
+                try:
+                    agent = agent_class.from_state(record["state"])
+                except (KeyError, IndexError, TypeError, ValueError) as exc:
+                    logger.warning("skipping agent snapshot", extra={"session": record.get("session"), "error": str(exc)})
+                    continue
+                key = (str(record["session"]), record["kind"])
+                self._entries[key] = _Entry(agent, now - float(record.get("idle", 0)))
+                self._entries.move_to_end(key)
+                restored += 1
+            self._evict(now)
+        return restored
+
+    def save(self, path: Optional[Path] = None) -> Optional[Path]:
+        path = Path(path) if path else self.snapshot_path
+        if path is None:
+            return None
+        data = self.snapshot()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+        tmp.replace(path)
+        logger.info("agent store saved", extra={"path": str(path), "sessions": len(data["sessions"])})
+        return path
+
+    def load(self, path: Optional[Path] = None) -> int:
+        path = Path(path) if path else self.snapshot_path
+        if path is None or not path.exists():
+            return 0
+        try:
+            snapshot = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as exc:
+            logger.warning("agent store snapshot unreadable", extra={"path": str(path), "error": str(exc)})
+            return 0
+        restored = self.restore(snapshot)
+        logger.info("agent store loaded", extra={"path": str(path), "sessions": restored})
+        return restored
+
+
+_store: Optional[AgentStore] = None
+
+
+def get_agent_store() -> AgentStore:
+    global _store
+    if _store is None:
+        _store = AgentStore(snapshot_path=Path(AGENT_STORE_SNAPSHOT) if AGENT_STORE_SNAPSHOT else None)
+    return _store
@@ -1,31 +1,129 @@
+import io
 import shutil
+import struct
 import subprocess
 import tempfile
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+try:
+    import av  # type: ignore
+except ImportError:  # pragma: no cover - optional dependency
+    av = None  # type: ignore
+
+# Raw 16 kHz mono PCM16 (little endian), as buffered for clients that send PCM or Opus frames.
+PCM16_MIME_TYPE = "audio/pcm"
+PCM16_SAMPLE_RATE = 16000
+PCM16_DTYPE = np.dtype("<i2")
 
 
 def _has_ffmpeg() -> bool:
     return shutil.which("ffmpeg") is not None
 
 
-def decode_to_wav16k(input_bytes: bytes) -> bytes:
+def decode_to_pcm16(input_bytes: bytes, decoder: Optional["PCMStreamDecoder"] = None) -> np.ndarray:
     """
-    Decode arbitrary compressed audio (e.g., webm/opus) to 16kHz mono PCM WAV.
-    Prefer system ffmpeg; fall back to PyAV if available.
+    Decode arbitrary compressed audio (e.g., webm/opus) to 16kHz mono PCM16 samples.
+    Prefer system ffmpeg; fall back to PyAV if available (through `decoder` when the
+    caller keeps one per stream).
+
+    The result is a 1-D int16 array; for the ffmpeg path it is a read-only view over
+    ffmpeg's output (no copy).
     """
     if _has_ffmpeg():
         return _decode_with_ffmpeg(input_bytes)
     try:
-        return _decode_with_pyav(input_bytes)
+        return (decoder or PCMStreamDecoder()).decode(input_bytes)
     except Exception as e:  # noqa: BLE001
         raise RuntimeError("Audio decode failed (need ffmpeg or PyAV)") from e
 
 
-def _decode_with_ffmpeg(input_bytes: bytes) -> bytes:
+def decode_to_wav16k(input_bytes: bytes) -> bytes:
+    """Same as `decode_to_pcm16`, packaged as a WAV file (for consumers that want one)."""
+    pcm = decode_to_pcm16(input_bytes)
+    return wav_header(pcm.nbytes) + pcm.tobytes()
+
+
+def pcm16_to_float32(pcm: np.ndarray) -> np.ndarray:
+    """int16 samples as float32 in [-1, 1) (what faster-whisper takes as audio input)."""
+    return pcm.astype(np.float32) / 32768.0
+
+
+def is_pcm16_mime(mime_type: Optional[str]) -> bool:
+    return (mime_type or "").split(";")[0].strip().lower() in {PCM16_MIME_TYPE, "audio/l16"}
+
+
+def wav_header(pcm_bytes: int, sample_rate: int = PCM16_SAMPLE_RATE) -> bytes:
+    """44-byte header that turns `pcm_bytes` of mono PCM16 into a WAV file."""
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + pcm_bytes, b"WAVE",
+        b"fmt ", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b"data", pcm_bytes,
+    )
+
+
+def wav_to_pcm16(wav_bytes: bytes) -> bytes:
+    """PCM payload of a WAV file (the `data` chunk); assumes a plain 44-byte header if none is found."""
+    offset = 12
+    while offset + 8 <= len(wav_bytes):
+        chunk_id, size = struct.unpack_from("<4sI", wav_bytes, offset)
+        if chunk_id == b"data":
+            return wav_bytes[offset + 8:offset + 8 + size]
+        offset += 8 + size + (size & 1)
+    return wav_bytes[44:]
+
+
+class PCMStreamDecoder:
+    """
+    PyAV decoding to 16 kHz mono int16 with one resampler kept for the whole stream.
+
+    Keeping the resampler means its filter state (and any samples it still buffers)
+    carries over from one chunk to the next instead of being rebuilt per call.
+    `frames()` yields one array per decoded frame; `decode()` returns them joined.
+    """
+
+    def __init__(self, sample_rate: int = PCM16_SAMPLE_RATE) -> None:
+        if av is None:
+            raise RuntimeError("PyAV is not installed")
+        self.sample_rate = sample_rate
+        self._resampler = av.AudioResampler(format="s16", layout="mono", rate=sample_rate)
+
+    def resample(self, frame) -> Iterator[np.ndarray]:
+        """Samples for one decoded `av.AudioFrame` (empty while the resampler is priming)."""
+        for resampled in self._resampler.resample(frame):
+            yield resampled.to_ndarray().reshape(-1)
+
+    def frames(self, input_bytes: bytes) -> Iterator[np.ndarray]:
+        """Decode one container chunk (WebM/Ogg/MP4/...) frame by frame."""
+        with av.open(io.BytesIO(input_bytes)) as container:
+            for frame in container.decode(audio=0):
+                yield from self.resample(frame)
+
+    def flush(self) -> np.ndarray:
+        """Samples still held by the resampler at the end of the stream."""
+        return _join(resampled.to_ndarray().reshape(-1) for resampled in self._resampler.resample(None))
+
+    def decode(self, input_bytes: bytes) -> np.ndarray:
+        pcm = _join(self.frames(input_bytes))
+        if not pcm.size:
+            raise RuntimeError("No audio frames decoded")
+        return pcm
+
+
+def _join(arrays) -> np.ndarray:
+    parts: List[np.ndarray] = [a for a in arrays if a.size]
+    if not parts:
+        return np.empty(0, dtype=PCM16_DTYPE)
+    return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+
+def _decode_with_ffmpeg(input_bytes: bytes) -> np.ndarray:
     with tempfile.TemporaryDirectory() as td:
+        # Input stays a file: MP4 needs to seek to its index, which a pipe cannot.
         in_path = Path(td) / "in.bin"
-        out_path = Path(td) / "out.wav"
         in_path.write_bytes(input_bytes)
         cmd = [
             "ffmpeg",
@@ -37,37 +135,10 @@ def _decode_with_ffmpeg(input_bytes: bytes) -> bytes:
             "-ac",
             "1",
             "-ar",
-            "16000",
+            str(PCM16_SAMPLE_RATE),
             "-f",
-            "wav",
-            str(out_path),
+            "s16le",
+            "pipe:1",
         ]
-        subprocess.run(cmd, check=True)
-        return out_path.read_bytes()
-
-
-def _decode_with_pyav(input_bytes: bytes) -> bytes:
-    import av  # type: ignore
-    import numpy as np  # type: ignore
-    import soundfile as sf  # type: ignore
-    import io
-
-    with av.open(io.BytesIO(input_bytes)) as container:
-        resampler = None
-        pcm = []
-        for frame in container.decode(audio=0):
-            if resampler is None:
-                resampler = av.audio.resampler.AudioResampler(
-                    format="s16",
-                    layout="mono",
-                    rate=16000,
-                )
-            rf = resampler.resample(frame)
-            pcm.append(rf.to_ndarray())
-        if not pcm:
-            raise RuntimeError("No audio frames decoded")
-        data = np.concatenate(pcm, axis=1).T  # shape (n, channels=1)
-        buf = io.BytesIO()
-        sf.write(buf, data, 16000, format="WAV", subtype="PCM_16")
-        return buf.getvalue()
-
+        result = subprocess.run(cmd, check=True, stdout=subprocess.PIPE)
+    return np.frombuffer(result.stdout, dtype=PCM16_DTYPE)
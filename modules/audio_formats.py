@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import logging
+import os
+import shutil
+import subprocess
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional
+
+from modules import voice_cache_engine
+from modules.metrics import get_metrics_registry
+
+logger = logging.getLogger("audio_formats")
+
+FORMAT_MP3 = "mp3"
+FORMAT_OPUS = "opus"
+FORMAT_PCM16 = "pcm16"
+
+OPUS_BITRATE_KBPS = int(os.getenv("AUDIO_OPUS_BITRATE", "64"))
+PCM16_SAMPLE_RATE = 16000
+DEFAULT_AUDIO_FORMAT = os.getenv("AUDIO_DEFAULT_FORMAT", FORMAT_MP3).strip().lower()
+# Formats requested from ElevenLabs directly (`output_format`); the rest are transcoded.
+ELEVEN_NATIVE_FORMATS = {
+    name.strip().lower()
+    for name in os.getenv("ELEVEN_NATIVE_FORMATS", "mp3,opus,pcm16").split(",")
+    if name.strip()
+}
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+TRANSCODE_TIMEOUT = float(os.getenv("AUDIO_TRANSCODE_TIMEOUT", "20"))
+
+_metrics = get_metrics_registry()
+METRIC_TRANSCODES = _metrics.counter(
+    "audio_transcodes_total", "Cached audio transcodes by target format", ["format", "result"]
+)
+
+
+@dataclass(frozen=True)
+class AudioFormat:
+    name: str
+    extension: str
+    media_type: str
+    bitrate_kbps: int = 0
+
+    @property
+    def variant_suffix(self) -> str:
+        """Cache-name suffix: the transcode cache is keyed by (audio key, format, bitrate)."""
+        return "" if self.name == FORMAT_MP3 else f"_{self.name}{self.bitrate_kbps or ''}"
+
+
+FORMATS: Dict[str, AudioFormat] = {
+    FORMAT_MP3: AudioFormat(FORMAT_MP3, "mp3", "audio/mpeg", 128),
+    FORMAT_OPUS: AudioFormat(FORMAT_OPUS, "ogg", "audio/ogg; codecs=opus", OPUS_BITRATE_KBPS),
+    FORMAT_PCM16: AudioFormat(FORMAT_PCM16, "pcm", f"audio/L16; rate={PCM16_SAMPLE_RATE}; channels=1"),
+}
+_ALIASES = {"mpeg": FORMAT_MP3, "ogg": FORMAT_OPUS, "pcm": FORMAT_PCM16, "l16": FORMAT_PCM16}
+_ACCEPT_TYPES = {
+    "audio/mpeg": FORMAT_MP3,
+    "audio/mp3": FORMAT_MP3,
+    "audio/ogg": FORMAT_OPUS,
+    "audio/opus": FORMAT_OPUS,
+    "audio/l16": FORMAT_PCM16,
+}
+
+
+class TranscodeUnavailable(RuntimeError):
+    """ffmpeg is missing or failed; callers fall back to the MP3 original."""
+
+
+def get_format(name: Optional[str]) -> AudioFormat:
+    """Format by name (`mp3`, `opus`, `pcm16` or an alias); None means the configured default."""
+    key = (name or DEFAULT_AUDIO_FORMAT).strip().lower()
+    key = _ALIASES.get(key, key)
+    if key not in FORMATS:
+        raise ValueError(f"unsupported audio format: {name}")
+    return FORMATS[key]
+
+
+def negotiate_format(requested: Optional[str] = None, accept: Optional[str] = None) -> AudioFormat:
+    """
+    Pick the response format: an explicit request wins, then the best audio type in
+    `Accept` (q-values honoured), then `AUDIO_DEFAULT_FORMAT`. Raises ValueError for an
+    unknown explicit format.
+    """
+    if requested:
+        return get_format(requested)
+    candidates = []
+    for position, item in enumerate((accept or "").split(",")):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        name = _ACCEPT_TYPES.get(media_type.lower())
+        if name and quality > 0:
+            candidates.append((-quality, position, name))
+    if candidates:
+        return FORMATS[min(candidates)[2]]
+    return get_format(None)
+
+
+def eleven_output_format(audio_format: AudioFormat) -> Optional[str]:
+    """ElevenLabs `output_format` for this format, or None when it must be transcoded locally."""
+    if audio_format.name not in ELEVEN_NATIVE_FORMATS:
+        return None
+    if audio_format.name == FORMAT_OPUS:
+        return f"opus_48000_{audio_format.bitrate_kbps}"
+    if audio_format.name == FORMAT_PCM16:
+        return f"pcm_{PCM16_SAMPLE_RATE}"
+    return "mp3_44100_128"
+
+
+def variant_path(audio_key: str, audio_format: AudioFormat) -> Path:
+    """Cache file for `audio_key` in `audio_format`; the MP3 variant is the plain cache file."""
+    return voice_cache_engine.AUDIO_CACHE_DIR / f"{audio_key}{audio_format.variant_suffix}.{audio_format.extension}"
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which(FFMPEG_BIN) is not None
+
+
+def _ffmpeg_args(audio_format: AudioFormat) -> list:
+    if audio_format.name == FORMAT_OPUS:
+        return ["-c:a", "libopus", "-b:a", f"{audio_format.bitrate_kbps}k", "-f", "ogg"]
+    if audio_format.name == FORMAT_PCM16:
+        return ["-ac", "1", "-ar", str(PCM16_SAMPLE_RATE), "-f", "s16le", "-c:a", "pcm_s16le"]
+    return ["-c:a", "libmp3lame", "-b:a", f"{audio_format.bitrate_kbps}k", "-f", "mp3"]
+
+
+def transcode(data: bytes, audio_format: AudioFormat) -> bytes:
+    """Transcode encoded audio bytes with ffmpeg (stdin -> stdout)."""
+    if not ffmpeg_available():
+        raise TranscodeUnavailable("ffmpeg not found")
+    command = [FFMPEG_BIN, "-hide_banner", "-loglevel", "error", "-i", "pipe:0", "-vn", *_ffmpeg_args(audio_format), "pipe:1"]
+    try:
+        result = subprocess.run(command, input=data, capture_output=True, timeout=TRANSCODE_TIMEOUT, check=False)
+    except (OSError, subprocess.TimeoutExpired) as exc:
+        raise TranscodeUnavailable(str(exc)) from exc
+    if result.returncode != 0 or not result.stdout:
+        raise TranscodeUnavailable(result.stderr.decode("utf-8", "replace")[-300:] or "empty output")
+    return result.stdout
+
+
+_variant_locks: Dict[str, threading.Lock] = {}
+_variant_locks_guard = threading.Lock()
+
+
+def _variant_lock(path: Path) -> threading.Lock:
+    with _variant_locks_guard:
+        if len(_variant_locks) > 1024:
+            _variant_locks.clear()
+        return _variant_locks.setdefault(path.name, threading.Lock())
+
+
+def ensure_variant(source: Path, audio_format: AudioFormat) -> Path:
+    """
+    Path of `source` (a cached MP3 named by its audio key) in `audio_format`,
+    transcoding once and caching the result next to it. Blocking: run in a thread.
+    """
+    if audio_format.name == FORMAT_MP3 and source.suffix == ".mp3":
+        return source
+    target = variant_path(source.stem, audio_format)
+    if voice_cache_engine.is_cache_valid(target):
+        METRIC_TRANSCODES.labels(audio_format.name, "cached").inc()
+        return target
+    with _variant_lock(target):
+        if voice_cache_engine.is_cache_valid(target):
+            return target
+        try:
+            audio = transcode(source.read_bytes(), audio_format)
+        except TranscodeUnavailable:
+            METRIC_TRANSCODES.labels(audio_format.name, "failed").inc()
+            raise
+        tmp = target.with_suffix(target.suffix + f".{os.getpid()}.tmp")
+        tmp.write_bytes(audio)
+        tmp.replace(target)
+    METRIC_TRANSCODES.labels(audio_format.name, "transcoded").inc()
+    logger.info(
+        "audio variant cached",
+        extra={"file": target.name, "source_bytes": source.stat().st_size, "bytes": len(audio)},
+    )
+    return target
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import logging
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Type
+
+import numpy as np
+
+from modules.audio_decode import PCM16_DTYPE, PCMStreamDecoder, av, decode_to_pcm16
+
+logger = logging.getLogger("audio_input")
+
+INPUT_WEBM = "webm"
+INPUT_PCM16 = "pcm16le@16k"
+INPUT_OPUS_FRAMES = "opus-frames"
+
+
+class AudioInput(ABC):
+    """
+    Decoder for one client input format, negotiated on `voice.start`.
+
+    `decode()` turns one `voice.data` chunk into 16 kHz mono int16 samples for the
+    energy/pitch analysis. When `buffers_pcm` is set the gateway also buffers those
+    samples for STT (under `PCM16_MIME_TYPE`) instead of the chunk as received.
+    """
+
+    name = INPUT_WEBM
+    buffers_pcm = False
+
+    @abstractmethod
+    def decode(self, chunk: bytes) -> np.ndarray:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class CompressedInput(AudioInput):
+    """MediaRecorder chunks (WebM/Ogg/MP4): every chunk goes through ffmpeg (or PyAV)."""
+
+    name = INPUT_WEBM
+
+    def __init__(self) -> None:
+        # Used when ffmpeg is missing: one PyAV resampler for the whole session.
+        self._pcm = PCMStreamDecoder() if av is not None else None
+
+    def decode(self, chunk: bytes) -> np.ndarray:
+        return decode_to_pcm16(chunk, self._pcm)
+
+
+class PCM16Input(AudioInput):
+    """Raw little-endian PCM16 at 16 kHz mono: nothing to decode."""
+
+    name = INPUT_PCM16
+    buffers_pcm = True
+
+    def __init__(self) -> None:
+        self._carry = b""
+
+    def decode(self, chunk: bytes) -> np.ndarray:
+        # Keep frames sample-aligned even if a client splits a sample across messages.
+        if self._carry:
+            chunk = self._carry + chunk
+            self._carry = b""
+        if len(chunk) & 1:
+            self._carry = chunk[-1:]
+            chunk = chunk[:-1]
+        return np.frombuffer(chunk, dtype=PCM16_DTYPE)
+
+
+class OpusFramesInput(AudioInput):
+    """
+    Raw Opus packets (e.g. from WebCodecs `AudioEncoder`), one packet per `voice.data`.
+
+    One decoder and resampler live for the whole session, so packets decode in-process
+    without a container, a subprocess or per-chunk setup.
+    """
+
+    name = INPUT_OPUS_FRAMES
+    buffers_pcm = True
+
+    def __init__(self) -> None:
+        if av is None:
+            raise RuntimeError("opus-frames input needs PyAV (pip install av)")
+        self._decoder = av.CodecContext.create("opus", "r")
+        self._decoder.sample_rate = 48000
+        self._decoder.layout = "mono"
+        self._pcm = PCMStreamDecoder()
+
+    def decode(self, chunk: bytes) -> np.ndarray:
+        parts = [pcm for frame in self._decoder.decode(av.Packet(chunk)) for pcm in self._pcm.resample(frame)]
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=PCM16_DTYPE)
+
+    def close(self) -> None:
+        self._decoder = None
+        self._pcm = None
+
+
+INPUT_FORMATS: Dict[str, Type[AudioInput]] = {
+    INPUT_WEBM: CompressedInput,
+    INPUT_PCM16: PCM16Input,
+    INPUT_OPUS_FRAMES: OpusFramesInput,
+}
+
+
+def negotiate_input(name: Optional[str]) -> AudioInput:
+    """
+    Decoder for a requested input format (default: webm).
+
+    Raises ValueError for unknown formats and RuntimeError when the format needs a
+    decoder that is not installed; the caller answers with the format it fell back to.
+    """
+    input_class = INPUT_FORMATS.get((name or INPUT_WEBM).strip().lower())
+    if input_class is None:
+        raise ValueError(f"unknown input format: {name}")
+    return input_class()
+
@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import logging
+import os
+import re
+import stat as stat_module
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Mapping, Optional, Tuple
+
+import anyio
+from fastapi import HTTPException, Request
+from starlette.responses import FileResponse, Response
+from starlette.types import Receive, Scope, Send
+
+from modules.audio_formats import FORMAT_MP3, FORMAT_OPUS, FORMAT_PCM16, FORMATS
+from modules.metrics import get_metrics_registry
+
+logger = logging.getLogger("audio_serving")
+
+# Cache files are named by content key (`<md5>.mp3`, `chat_<uuid>.mp3`): no dots, no
+# separators, so a matching name can never leave the audio directory.
+AUDIO_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,127}\.(mp3|ogg|opus|wav|pcm)$")
+MEDIA_TYPES = {
+    "mp3": FORMATS[FORMAT_MP3].media_type,
+    "ogg": FORMATS[FORMAT_OPUS].media_type,
+    "opus": FORMATS[FORMAT_OPUS].media_type,
+    "wav": "audio/wav",
+    "pcm": FORMATS[FORMAT_PCM16].media_type,
+}
+# Names are content keys, so a URL always denotes the same bytes: let clients keep them.
+AUDIO_CACHE_CONTROL = os.getenv("AUDIO_CACHE_CONTROL", "public, max-age=31536000, immutable")
+RANGE_CHUNK_BYTES = 64 * 1024
+
+_metrics = get_metrics_registry()
+METRIC_AUDIO_RESPONSES = _metrics.counter(
+    "audio_responses_total", "Audio file responses by status code", ["status"]
+)
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+def safe_audio_path(directory: Path, filename: str) -> Path:
+    """Resolve `filename` inside `directory`; 404 for anything that is not a plain cache file name."""
+    if not AUDIO_NAME_PATTERN.match(filename):
+        raise HTTPException(status_code=404, detail="檔案不存在")
+    root = Path(directory).resolve()
+    path = (root / filename).resolve()
+    if path.parent != root:
+        raise HTTPException(status_code=404, detail="檔案不存在")
+    return path
+
+
+def audio_etag(path: Path, stat_result: os.stat_result) -> str:
+    """Strong validator: the cache key plus size/mtime (a forced re-render changes it)."""
+    return f'"{path.stem}-{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def _http_date_ts(value: str) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def etag_matches(header: str, etag: str, weak: bool = True) -> bool:
+    """If-None-Match uses weak comparison, If-Range strong comparison."""
+    header = header.strip()
+    if header == "*":
+        return True
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            if not weak:
+                continue
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def is_not_modified(headers: Mapping[str, str], etag: str, mtime: float) -> bool:
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    since = _http_date_ts(headers.get("if-modified-since") or "")
+    return since is not None and int(mtime) <= since
+
+
+def range_applies(headers: Mapping[str, str], etag: str, mtime: float) -> bool:
+    """A Range is honoured unless If-Range names a different version of the file."""
+    if_range = headers.get("if-range")
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith(('"', "W/")):
+        return etag_matches(if_range, etag, weak=False)
+    date = _http_date_ts(if_range)
+    return date is not None and int(mtime) <= date
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Single `bytes=` range as inclusive (start, end), or None to serve the whole file
+    (unknown unit, malformed or multi-range requests). Raises RangeNotSatisfiable.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = spec.strip().partition("-")
+    if not dash:
+        return None
+    try:
+        length = int(last) if not first else None
+        start = int(first) if first else 0
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if length is not None:  # suffix range: the last N bytes
+        if length <= 0 or size == 0:  # an empty file has no last byte to serve
+            raise RangeNotSatisfiable(header)
+        return max(0, size - length), size - 1
+    if start < 0 or (last and end < start):  # e.g. bytes=5-2: invalid, ignored
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    return start, min(end, size - 1)
+
+
+class FileRangeResponse(Response):
+    """206 response streaming one byte range of a file from a worker thread."""
+
+    def __init__(self, path: Path, start: int, end: int, size: int, headers: Mapping[str, str], media_type: str) -> None:
+        super().__init__(status_code=206, headers=dict(headers), media_type=media_type)
+        self.path = path
+        self.start = start
+        self.end = end
+        self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+        self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope.get("method", "GET").upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        remaining = self.end - self.start + 1
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            while remaining > 0:
+                chunk = await file.read(min(RANGE_CHUNK_BYTES, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:  # file shrank underneath us; close the body
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def audio_response(request: Request, directory: Path, filename: str) -> Response:
+    """
+    Serve a cached audio file with HTTP caching.
+
+    - Strong ETag + Last-Modified, `Cache-Control: immutable` (names are content keys).
+    - Conditional GET (If-None-Match / If-Modified-Since) answers 304 without reading the file.
+    - A single `Range` answers 206 (416 when unsatisfiable); If-Range is honoured.
+    - Full responses go through `FileResponse`, which hands the path to the server
+      (`http.response.pathsend`) when it supports zero-copy transfer.
+    """
+    path = safe_audio_path(directory, filename)
+    try:
+        stat_result = path.stat()
+    except FileNotFoundError:
+        METRIC_AUDIO_RESPONSES.labels("404").inc()
+        raise HTTPException(status_code=404, detail="檔案不存在")
+    if not stat_module.S_ISREG(stat_result.st_mode):
+        raise HTTPException(status_code=404, detail="檔案不存在")
+
+    size = stat_result.st_size
+    mtime = stat_result.st_mtime
+    etag = audio_etag(path, stat_result)
+    media_type = MEDIA_TYPES[path.suffix.lstrip(".").lower()]
+    headers = {
+        "etag": etag,
+        "last-modified": formatdate(mtime, usegmt=True),
+        "cache-control": AUDIO_CACHE_CONTROL,
+        "accept-ranges": "bytes",
+    }
+
+    if is_not_modified(request.headers, etag, mtime):
+        METRIC_AUDIO_RESPONSES.labels("304").inc()
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if range_header and range_applies(request.headers, etag, mtime):
+        try:
+            byte_range = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            METRIC_AUDIO_RESPONSES.labels("416").inc()
+            return Response(status_code=416, headers={**headers, "content-range": f"bytes */{size}"})
+        if byte_range is not None:
+            METRIC_AUDIO_RESPONSES.labels("206").inc()
+            return FileRangeResponse(path, byte_range[0], byte_range[1], size, headers, media_type)
+
+    METRIC_AUDIO_RESPONSES.labels("200").inc()
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat_result)
@@ -6,9 +6,11 @@
 
 import random
 import re
-from typing import Optional, List, Dict
-from datetime import datetime, timedelta
-from collections import deque
+import time
+from array import array
+from typing import Any, Optional, List, Dict
+
+from modules.keyword_matcher import register_keywords, scan_keywords
 
 # 可用的語氣標籤
 AVAILABLE_EMOTION_TAGS = [
@@ -17,6 +19,53 @@ AVAILABLE_EMOTION_TAGS = [
     "sighs", "happy", "sad", "surprised", "whispering", "echoes",
 ]
 
+# 明顯的情緒關鍵字：出現時一定使用語氣
+STRONG_EMOTION_KEYWORDS = [
+    "哭", "難過", "開心", "生氣", "驚訝", "秘密",
+    "感動", "氣死", "太好了", "你知道嗎"
+]
+
+# 自主選擇的關鍵字規則（標籤 → 關鍵字）
+EMOTION_RULES = {
+    "excited": ["你好", "哈囉", "太好了", "真棒", "成功"],
+    "whispers": ["秘密", "悄悄話", "偷偷", "不要告訴"],
+    "crying": ["哭", "難過", "傷心", "感動", "眼淚"],
+    "softly": ["溫柔", "輕柔", "輕輕"],
+    "angry": ["氣死", "生氣", "憤怒", "討厭"],
+    "curious": ["你知道嗎", "為什麼", "怎麼", "什麼"],
+    "playful": ["調皮", "好玩", "有趣"],
+    "happy": ["開心", "高興", "快樂"],
+    "sad": ["難過", "悲傷", "傷心"],
+    "surprised": ["驚訝", "驚奇", "沒想到"],
+    "sighs": ["嘆氣", "無奈"],
+}
+
+register_keywords("autonomy", {"strong": STRONG_EMOTION_KEYWORDS, **EMOTION_RULES})
+_RULE_CATEGORIES = [(tag, f"autonomy.{tag}") for tag in EMOTION_RULES]
+
+# 狀態以標籤 id 為索引的定長陣列保存（見 AutonomousEmotionAgent.__slots__）
+TAG_IDS = {tag: index for index, tag in enumerate(AVAILABLE_EMOTION_TAGS)}
+_TAG_COUNT = len(AVAILABLE_EMOTION_TAGS)
+HISTORY_SIZE = 20  # 保留最近20條對話
+# 對話紀錄每筆一個整數：低位元為標籤 id 的位元遮罩，最高位元表示有使用語氣
+_HAS_EMOTION = 1 << 31
+_NEVER = float("-inf")
+# 時間以相對於本模組載入時的 monotonic 秒數存成 float32（一年內誤差在秒級，遠小於 30 秒窗口）
+_EPOCH = time.monotonic()
+
+
+def _now() -> float:
+    return time.monotonic() - _EPOCH
+
+
+def _tag_mask(tags: List[str]) -> int:
+    mask = _HAS_EMOTION
+    for tag in tags:
+        tag_id = TAG_IDS.get(tag)
+        if tag_id is not None:
+            mask |= 1 << tag_id
+    return mask
+
 
 class AutonomousEmotionAgent:
     """
@@ -28,7 +77,12 @@ class AutonomousEmotionAgent:
     3. 有一定的隨機性和自主性
     4. 學習對話模式
     5. 保持情感持續性（情緒慣性曲線）
+
+    每個 session 一個代理（modules/agent_store.py），狀態精簡：以標籤 id 為索引的定長陣列、
+    monotonic 時間，閒置代理約數百 bytes，可用 to_state()/from_state() 快照還原。
     """
+
+    __slots__ = ("autonomy_level", "emotion_persistence", "_history", "_patterns", "_momentum", "_last_used", "_state")
     
     def __init__(self, autonomy_level: float = 0.7, emotion_persistence: float = 0.6):
         """
@@ -40,16 +94,29 @@ class AutonomousEmotionAgent:
         """
         self.autonomy_level = autonomy_level
         self.emotion_persistence = emotion_persistence  # 情感持續性參數
-        self.conversation_history = deque(maxlen=20)  # 保留最近20條對話
-        self.emotion_patterns = {}  # 學習的情緒模式
-        self.last_emotion_time = {}  # 記錄上次使用某種情緒的時間
-        self.current_emotion_state = None  # 當前情緒狀態
-        self.emotion_momentum = {}  # 情緒動量（慣性）
-        
-        # 自主決策參數
-        self.base_emotion_probability = 0.6  # 基礎使用語氣的概率
-        self.context_weight = 0.3  # 上下文權重
-        self.randomness_weight = 0.2  # 隨機性權重
+        self._history = array("L")  # 最近對話（位元遮罩，最多 HISTORY_SIZE 筆）
+        self._patterns = array("I", bytes(4 * _TAG_COUNT))  # 學習的情緒模式（使用次數）
+        self._momentum = array("f", bytes(4 * _TAG_COUNT))  # 情緒動量（慣性）
+        self._last_used = array("f", [_NEVER]) * _TAG_COUNT  # 上次使用時間（_now()）
+        self._state = -1  # 當前情緒狀態（標籤 id，-1 表示無）
+
+    # 自主決策參數（類別常數，不佔每個代理的記憶體）
+    base_emotion_probability = 0.6  # 基礎使用語氣的概率
+    context_weight = 0.3  # 上下文權重
+    randomness_weight = 0.2  # 隨機性權重
+
+    @property
+    def current_emotion_state(self) -> Optional[str]:
+        return AVAILABLE_EMOTION_TAGS[self._state] if self._state >= 0 else None
+
+    @current_emotion_state.setter
+    def current_emotion_state(self, tag: Optional[str]) -> None:
+        self._state = TAG_IDS.get(tag, -1) if tag else -1
+
+    def _append_history(self, mask: int) -> None:
+        self._history.append(mask)
+        if len(self._history) > HISTORY_SIZE:
+            del self._history[0]
         
     def should_use_emotion(self, text: str) -> bool:
         """
@@ -67,11 +134,7 @@ class AutonomousEmotionAgent:
             return False  # 太短的文字不需要語氣
         
         # 2. 檢查是否有明顯的情緒關鍵字
-        strong_emotion_keywords = [
-            "哭", "難過", "開心", "生氣", "驚訝", "秘密", 
-            "感動", "氣死", "太好了", "你知道嗎"
-        ]
-        has_strong_emotion = any(keyword in text for keyword in strong_emotion_keywords)
+        has_strong_emotion = scan_keywords(text).has("autonomy.strong")
         
         if has_strong_emotion:
             return True  # 有強烈情緒，應該使用語氣
@@ -114,21 +177,46 @@ class AutonomousEmotionAgent:
             return None  # 不需要語氣，返回原始文字
         
         # 2. 使用 LLM 判斷（如果可用）
+        llm_tags = None
         if use_llm:
             try:
                 from modules.llm_emotion_router import llm_emotion_route_openai
-                llm_result = llm_emotion_route_openai(text)
-                if llm_result and llm_result != text:
-                    # 從 LLM 結果中提取標籤
-                    tags = self._extract_tags_from_text(llm_result)
-                    if tags:
-                        self._record_emotion_usage(tags, text)
-                        return tags
+                llm_tags = self._llm_result_tags(llm_emotion_route_openai(text), text)
             except:
                 pass  # LLM 失敗，使用自主判斷
         
         # 3. 自主判斷（基於規則和上下文）
-        tags = self._autonomous_emotion_selection(text)
+        return self._finish_emotion_tags(text, llm_tags)
+    
+    async def choose_emotion_tags_async(
+        self, text: str, use_llm: bool = True, budget_ms: Optional[float] = None
+    ) -> Optional[List[str]]:
+        """
+        choose_emotion_tags 的非同步版本：LLM 判斷不阻塞 event loop，
+        超過 budget_ms（預設 EMOTION_LLM_BUDGET_MS）未回應則改用自主判斷。
+        代理狀態只在 await 前後的同步區段讀寫。
+        """
+        if not self.should_use_emotion(text):
+            return None
+        
+        llm_tags = None
+        if use_llm:
+            try:
+                from modules.llm_emotion_router import llm_emotion_route_openai_async, within_budget
+                llm_tags = self._llm_result_tags(await within_budget(llm_emotion_route_openai_async(text), budget_ms), text)
+            except Exception:
+                pass  # LLM 失敗，使用自主判斷
+        
+        return self._finish_emotion_tags(text, llm_tags)
+    
+    def _llm_result_tags(self, llm_result: Optional[str], text: str) -> Optional[List[str]]:
+        """從 LLM 結果中提取標籤（LLM 沒有加標籤時返回 None）"""
+        if llm_result and llm_result != text:
+            return self._extract_tags_from_text(llm_result) or None
+        return None
+    
+    def _finish_emotion_tags(self, text: str, llm_tags: Optional[List[str]]) -> Optional[List[str]]:
+        tags = llm_tags or self._autonomous_emotion_selection(text)
         
         if tags:
             self._record_emotion_usage(tags, text)
@@ -145,28 +233,9 @@ class AutonomousEmotionAgent:
         Returns:
             語氣標籤列表
         """
-        text_lower = text.lower()
-        selected_tags = []
-        
-        # 根據關鍵字判斷
-        emotion_rules = {
-            "excited": ["你好", "哈囉", "太好了", "真棒", "成功"],
-            "whispers": ["秘密", "悄悄話", "偷偷", "不要告訴"],
-            "crying": ["哭", "難過", "傷心", "感動", "眼淚"],
-            "softly": ["溫柔", "輕柔", "輕輕"],
-            "angry": ["氣死", "生氣", "憤怒", "討厭"],
-            "curious": ["你知道嗎", "為什麼", "怎麼", "什麼"],
-            "playful": ["調皮", "好玩", "有趣"],
-            "happy": ["開心", "高興", "快樂"],
-            "sad": ["難過", "悲傷", "傷心"],
-            "surprised": ["驚訝", "驚奇", "沒想到"],
-            "sighs": ["嘆氣", "無奈"],
-        }
-        
-        # 匹配關鍵字
-        for tag, keywords in emotion_rules.items():
-            if any(keyword in text_lower for keyword in keywords):
-                selected_tags.append(tag)
+        # 根據關鍵字判斷（與 should_use_emotion 共用同一次掃描結果）
+        hits = scan_keywords(text)
+        selected_tags = [tag for tag, category in _RULE_CATEGORIES if hits.has(category)]
         
         # 如果沒有匹配到，根據上下文和隨機性決定
         if not selected_tags:
@@ -245,11 +314,7 @@ class AutonomousEmotionAgent:
         Returns:
             使用語氣的次數
         """
-        count = 0
-        for entry in list(self.conversation_history)[-window:]:
-            if entry.get('has_emotion', False):
-                count += 1
-        return count
+        return sum(1 for mask in self._history[-window:] if mask & _HAS_EMOTION)
     
     def _get_recent_emotion_tags(self, window: int = 5) -> List[str]:
         """
@@ -262,9 +327,9 @@ class AutonomousEmotionAgent:
             標籤列表
         """
         tags = []
-        for entry in list(self.conversation_history)[-window:]:
-            if entry.get('emotion_tags'):
-                tags.extend(entry['emotion_tags'])
+        for mask in self._history[-window:]:
+            if mask & _HAS_EMOTION:
+                tags.extend(tag for tag_id, tag in enumerate(AVAILABLE_EMOTION_TAGS) if mask & (1 << tag_id))
         return tags
     
     def _get_emotion_momentum(self, tag: str) -> float:
@@ -277,22 +342,22 @@ class AutonomousEmotionAgent:
         Returns:
             動量值（0.0-1.0），越高表示越容易延續該情緒
         """
-        if tag not in self.emotion_momentum:
+        tag_id = TAG_IDS.get(tag)
+        if tag_id is None:
             return 0.0
         
         # 計算時間衰減（最近使用的情緒動量更高）
-        momentum = self.emotion_momentum[tag]
+        momentum = self._momentum[tag_id]
         
         # 如果最近使用過，增加動量
-        if tag in self.last_emotion_time:
-            time_since = (datetime.now() - self.last_emotion_time[tag]).total_seconds()
-            # 30秒內使用過，動量不衰減；超過30秒開始衰減
-            if time_since < 30:
-                momentum = min(1.0, momentum + 0.2)
-            else:
-                # 指數衰減
-                decay_factor = max(0.0, 1.0 - (time_since - 30) / 300)  # 5分鐘內完全衰減
-                momentum *= decay_factor
+        time_since = _now() - self._last_used[tag_id]
+        # 30秒內使用過，動量不衰減；超過30秒開始衰減
+        if time_since < 30:
+            momentum = min(1.0, momentum + 0.2)
+        else:
+            # 指數衰減
+            decay_factor = max(0.0, 1.0 - (time_since - 30) / 300)  # 5分鐘內完全衰減
+            momentum *= decay_factor
         
         return max(0.0, min(1.0, momentum))
     
@@ -303,25 +368,24 @@ class AutonomousEmotionAgent:
         Args:
             tags: 使用的情緒標籤列表
         """
+        momentum = self._momentum
         for tag in tags:
-            if tag not in self.emotion_momentum:
-                self.emotion_momentum[tag] = 0.0
-            
-            # 增加該情緒的動量
-            self.emotion_momentum[tag] = min(1.0, self.emotion_momentum[tag] + 0.3)
-            
-            # 其他情緒動量衰減
-            for other_tag in self.emotion_momentum:
-                if other_tag != tag:
-                    self.emotion_momentum[other_tag] *= 0.8  # 衰減20%
+            tag_id = TAG_IDS.get(tag)
+            if tag_id is None:
+                continue
+            # 增加該情緒的動量，其他情緒動量衰減20%
+            boosted = min(1.0, momentum[tag_id] + 0.3)
+            for other in range(_TAG_COUNT):
+                momentum[other] *= 0.8
+            momentum[tag_id] = boosted
         
         # 更新當前情緒狀態
         if tags:
             self.current_emotion_state = tags[0]  # 使用第一個標籤作為主要情緒
         else:
             # 如果沒有標籤，當前情緒狀態逐漸衰減
-            if self.current_emotion_state:
-                self.emotion_momentum[self.current_emotion_state] *= 0.9
+            if self._state >= 0:
+                momentum[self._state] *= 0.9
     
     def _record_emotion_usage(self, tags: List[str], text: str):
         """
@@ -331,19 +395,15 @@ class AutonomousEmotionAgent:
             tags: 使用的標籤
             text: 文字內容
         """
-        self.conversation_history.append({
-            'text': text,
-            'emotion_tags': tags,
-            'has_emotion': True,
-            'timestamp': datetime.now()
-        })
+        self._append_history(_tag_mask(tags))
         
         # 更新情緒模式
+        now = _now()
         for tag in tags:
-            if tag not in self.emotion_patterns:
-                self.emotion_patterns[tag] = 0
-            self.emotion_patterns[tag] += 1
-            self.last_emotion_time[tag] = datetime.now()
+            tag_id = TAG_IDS.get(tag)
+            if tag_id is not None:
+                self._patterns[tag_id] += 1
+                self._last_used[tag_id] = now
         
         # 更新情緒動量（情感持續性）
         self._update_emotion_momentum(tags)
@@ -360,20 +420,35 @@ class AutonomousEmotionAgent:
             處理後的文字（可能包含語氣標籤）
         """
         # 記錄對話（無論是否使用語氣）
-        self.conversation_history.append({
-            'text': text,
-            'emotion_tags': None,
-            'has_emotion': False,
-            'timestamp': datetime.now()
-        })
+        self._append_history(0)
         
         # 自主選擇語氣標籤
         tags = self.choose_emotion_tags(text, use_llm=use_llm)
         
+        return self._render(text, tags)
+    
+    async def process_text_async(self, text: str, use_llm: bool = True, budget_ms: Optional[float] = None) -> str:
+        """process_text 的非同步版本（不使用 LLM 時結果與同步版本相同）"""
+        self._append_history(0)
+        tags = await self.choose_emotion_tags_async(text, use_llm=use_llm, budget_ms=budget_ms)
+        return self._render(text, tags)
+    
+    def process_text_with_tags(self, text: str, tags: List[str]) -> str:
+        """
+        標籤已由外部決定（例如回應與語氣一次產生的 LLM 呼叫）：
+        照常記錄對話與情緒動量，再加上標籤
+        """
+        self._append_history(0)
+        tags = [tag for tag in tags if tag in TAG_IDS]
+        if tags:
+            self._record_emotion_usage(tags, text)
+        return self._render(text, tags)
+    
+    def _render(self, text: str, tags: Optional[List[str]]) -> str:
         # 如果沒有使用語氣，也更新動量（逐漸衰減）
         if not tags:
-            if self.current_emotion_state:
-                self.emotion_momentum[self.current_emotion_state] *= 0.95  # 輕微衰減
+            if self._state >= 0:
+                self._momentum[self._state] *= 0.95  # 輕微衰減
         
         if tags:
             # 添加標籤
@@ -390,8 +465,8 @@ class AutonomousEmotionAgent:
         Returns:
             統計資訊
         """
-        total_messages = len(self.conversation_history)
-        emotion_messages = sum(1 for e in self.conversation_history if e.get('has_emotion'))
+        total_messages = len(self._history)
+        emotion_messages = self._count_recent_emotions(window=HISTORY_SIZE)
         
         return {
             'total_messages': total_messages,
@@ -399,11 +474,55 @@ class AutonomousEmotionAgent:
             'emotion_usage_rate': emotion_messages / total_messages if total_messages > 0 else 0,
             'autonomy_level': self.autonomy_level,
             'emotion_persistence': self.emotion_persistence,
-            'emotion_patterns': dict(self.emotion_patterns),
+            'emotion_patterns': {tag: count for tag, count in zip(AVAILABLE_EMOTION_TAGS, self._patterns) if count},
             'current_emotion_state': self.current_emotion_state,
-            'emotion_momentum': dict(self.emotion_momentum)
+            'emotion_momentum': {
+                tag: value for tag, value in zip(AVAILABLE_EMOTION_TAGS, self._momentum) if value or self._patterns[TAG_IDS[tag]]
+            }
         }
 
+    def to_state(self) -> Dict[str, Any]:
+        """可 JSON 序列化的快照；時間存成距今秒數（monotonic 時鐘跨程序不可比較）。"""
+        now = _now()
+        return {
+            "autonomy_level": self.autonomy_level,
+            "emotion_persistence": self.emotion_persistence,
+            "history": list(self._history),
+            "patterns": list(self._patterns),
+            "momentum": list(self._momentum),
+            "idle": [None if last == _NEVER else round(now - last, 3) for last in self._last_used],
+            "state": self.current_emotion_state,
+            "tags": AVAILABLE_EMOTION_TAGS,
+        }
+
+    def load_state(self, state: Dict[str, Any]) -> None:
+        """還原 to_state() 的快照；標籤依名稱對應，快照中的未知標籤略過。"""
+        self.autonomy_level = state.get("autonomy_level", self.autonomy_level)
+        self.emotion_persistence = state.get("emotion_persistence", self.emotion_persistence)
+        order = [TAG_IDS.get(tag) for tag in state.get("tags", AVAILABLE_EMOTION_TAGS)]
+        now = _now()
+        for position, tag_id in enumerate(order):
+            if tag_id is None:
+                continue
+            self._patterns[tag_id] = int(state["patterns"][position])
+            self._momentum[tag_id] = float(state["momentum"][position])
+            idle = state["idle"][position]
+            self._last_used[tag_id] = _NEVER if idle is None else now - float(idle)
+        self._history = array("L")
+        for mask in state.get("history", [])[-HISTORY_SIZE:]:
+            remapped = mask & _HAS_EMOTION
+            for position, tag_id in enumerate(order):
+                if tag_id is not None and mask & (1 << position):
+                    remapped |= 1 << tag_id
+            self._history.append(remapped)
+        self.current_emotion_state = state.get("state")
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "AutonomousEmotionAgent":
+        agent = cls()
+        agent.load_state(state)
+        return agent
+
 
 def autonomous_emotion_route(
     text: str,
@@ -429,6 +548,20 @@ def autonomous_emotion_route(
     return agent.process_text(text, use_llm=use_llm)
 
 
+async def autonomous_emotion_route_async(
+    text: str,
+    autonomy_level: float = 0.7,
+    use_llm: bool = True,
+    agent: Optional[AutonomousEmotionAgent] = None,
+    budget_ms: Optional[float] = None
+) -> str:
+    """autonomous_emotion_route 的非同步版本"""
+    if agent is None:
+        agent = AutonomousEmotionAgent(autonomy_level=autonomy_level)
+    
+    return await agent.process_text_async(text, use_llm=use_llm, budget_ms=budget_ms)
+
+
 # 全域代理實例（用於保持對話上下文）
 _global_agent = None
 
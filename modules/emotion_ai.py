@@ -6,6 +6,8 @@ from typing import Dict, Optional
 
 import numpy as np
 
+from modules.audio_decode import wav_to_pcm16
+
 
 @dataclass
 class EmotionSnapshot:
@@ -18,7 +20,7 @@ class EmotionAIWorker:
     """
     Lightweight Emotion AI Phase 1 worker.
 
-    - Estimates pitch via zero-crossing on 16-bit PCM WAV.
+    - Estimates pitch via zero-crossing on 16-bit PCM samples (or a WAV file).
     - Generates simple confidence score.
     - Maps energy + pitch to coarse emotion tags (for debug/phase-1).
     """
@@ -26,20 +28,20 @@ class EmotionAIWorker:
     def __init__(self) -> None:
         self.pitch_floor_hz = int(os.getenv("EMOTION_PITCH_FLOOR", "80"))
         self.pitch_ceil_hz = int(os.getenv("EMOTION_PITCH_CEIL", "400"))
-        self.sample_rate = 16000  # decode_to_wav16k guarantees 16k mono
+        self.sample_rate = 16000  # decode_to_pcm16 guarantees 16k mono
 
     def analyze(self, wav_bytes: bytes, avg_energy: float, peak_energy: float) -> EmotionSnapshot:
-        pitch_hz, confidence = self._estimate_pitch(wav_bytes)
+        pcm = wav_to_pcm16(wav_bytes)
+        return self.analyze_pcm(np.frombuffer(pcm, dtype="<i2", count=len(pcm) // 2), avg_energy, peak_energy)
+
+    def analyze_pcm(self, pcm: np.ndarray, avg_energy: float, peak_energy: float) -> EmotionSnapshot:
+        """Same as `analyze` for 16 kHz mono int16 samples (no WAV round trip)."""
+        pitch_hz, confidence = self._estimate_pitch(pcm)
         emotion = self._estimate_emotion(avg_energy, peak_energy, pitch_hz, confidence)
         return EmotionSnapshot(pitch_hz=pitch_hz, confidence=confidence, emotion_estimate=emotion)
 
-    def _estimate_pitch(self, wav_bytes: bytes) -> tuple[Optional[float], float]:
-        if len(wav_bytes) <= 44:
-            return None, 0.0
-        try:
-            pcm = np.frombuffer(wav_bytes[44:], dtype="<i2").astype(np.float32)
-        except ValueError:
-            return None, 0.0
+    def _estimate_pitch(self, samples: np.ndarray) -> tuple[Optional[float], float]:
+        pcm = samples.astype(np.float32)
         if pcm.size < 256:
             return None, 0.0
         pcm -= pcm.mean()
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger("keyword_matcher")
+
+
+class KeywordMatch(NamedTuple):
+    category: str
+    keyword: str
+    start: int
+    end: int
+
+
+class AhoCorasick:
+    """
+    Multi-pattern substring matcher: one pass over the text finds every occurrence of
+    every keyword (overlaps included), in O(len(text) + matches) regardless of how many
+    keywords there are. Patterns are (keyword, category) pairs; a keyword may carry
+    several categories.
+    """
+
+    __slots__ = ("_delta", "_out", "size")
+
+    def __init__(self, patterns: Iterable[Tuple[str, str]]) -> None:
+        goto: List[Dict[str, int]] = [{}]
+        out: List[List[Tuple[str, str]]] = [[]]
+        seen = set()
+        for keyword, category in patterns:
+            if not keyword or (keyword, category) in seen:
+                continue
+            seen.add((keyword, category))
+            state = 0
+            for char in keyword:
+                nxt = goto[state].get(char)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][char] = nxt
+                    goto.append({})
+                    out.append([])
+                state = nxt
+            out[state].append((keyword, category))
+
+        # Breadth-first failure links, folded into a full transition table (a DFA), so
+        # matching is one dict lookup per character; outputs of the fallback state are merged in.
+        fail = [0] * len(goto)
+        delta: List[Dict[str, int]] = [dict(goto[0])] + [{} for _ in range(len(goto) - 1)]
+        queue = list(goto[0].values())
+        for state in queue:
+            if state:
+                delta[state] = {**delta[fail[state]], **goto[state]}
+            for char, nxt in goto[state].items():
+                queue.append(nxt)
+                fail[nxt] = delta[fail[state]].get(char, 0) if state else 0
+                out[nxt].extend(out[fail[nxt]])
+
+        self._delta = delta
+        self._out: List[Tuple[Tuple[str, str], ...]] = [tuple(items) for items in out]
+        self.size = len(seen)
+
+    def iter_matches(self, text: str) -> Iterator[KeywordMatch]:
+        return iter(self.find_all(text))
+
+    def find_all(self, text: str) -> List[KeywordMatch]:
+        delta, out = self._delta, self._out
+        matches: List[KeywordMatch] = []
+        state = 0
+        end = 0
+        for char in text:
+            end += 1
+            state = delta[state].get(char, 0)
+            if out[state]:
+                for keyword, category in out[state]:
+                    matches.append(KeywordMatch(category, keyword, end - len(keyword), end))
+        return matches
+
+
+class KeywordHits:
+    """One scan of a text: every keyword hit grouped by category (positions in the lower-cased text)."""
+
+    __slots__ = ("matches", "_by_category")
+
+    def __init__(self, matches: Iterable[KeywordMatch]) -> None:
+        self.matches: Tuple[KeywordMatch, ...] = tuple(matches)
+        by_category: Dict[str, List[KeywordMatch]] = {}
+        for match in self.matches:
+            by_category.setdefault(match.category, []).append(match)
+        self._by_category = by_category
+
+    def __bool__(self) -> bool:
+        return bool(self.matches)
+
+    def has(self, *categories: str) -> bool:
+        return any(category in self._by_category for category in categories)
+
+    def get(self, category: str) -> Tuple[KeywordMatch, ...]:
+        return tuple(self._by_category.get(category, ()))
+
+    def keywords(self, category: str) -> FrozenSet[str]:
+        """Distinct keywords of `category` present in the text."""
+        return frozenset(match.keyword for match in self.get(category))
+
+    def categories(self, namespace: Optional[str] = None) -> List[str]:
+        prefix = f"{namespace}." if namespace else ""
+        return [category for category in self._by_category if category.startswith(prefix)]
+
+
+class KeywordLexicon:
+    """
+    Unified keyword lexicon for the rule-based detectors.
+
+    Modules register their keyword lists under a namespace at import time
+    (`register("tag_rules", {"excited": [...]})` -> category `tag_rules.excited`); the
+    automaton is compiled once on the first scan after a registration. Matching is
+    case-insensitive (text and keywords are lower-cased), i.e. `keyword.lower() in
+    text.lower()` for every keyword at once. Recent scans are memoized, so detectors
+    looking at the same reply share one result.
+    """
+
+    def __init__(self, cache_size: int = 256) -> None:
+        self._lexicon: Dict[str, Tuple[str, ...]] = {}
+        self._automaton: Optional[AhoCorasick] = None
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, KeywordHits]" = OrderedDict()
+        self._cache_size = cache_size
+
+    def register(self, namespace: str, categories: Mapping[str, Iterable[str]]) -> None:
+        with self._lock:
+            for name, keywords in categories.items():
+                self._lexicon[f"{namespace}.{name}"] = tuple(dict.fromkeys(k.lower() for k in keywords if k))
+            self._automaton = None
+            self._cache.clear()
+
+    def lexicon(self) -> Dict[str, Tuple[str, ...]]:
+        return dict(self._lexicon)
+
+    def _compiled(self) -> AhoCorasick:
+        automaton = self._automaton
+        if automaton is None:
+            with self._lock:
+                if self._automaton is None:
+                    self._automaton = AhoCorasick(
+                        (keyword, category) for category, keywords in self._lexicon.items() for keyword in keywords
+                    )
+                    logger.debug("keyword automaton compiled", extra={"patterns": self._automaton.size})
+                automaton = self._automaton
+        return automaton
+
+    def scan(self, text: str) -> KeywordHits:
+        hits = self._cache.get(text)
+        if hits is not None:
+            return hits
+        hits = KeywordHits(self._compiled().find_all(text.lower()))
+        with self._lock:
+            self._cache[text] = hits
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return hits
+
+
+_lexicon: Optional[KeywordLexicon] = None
+
+
+def get_keyword_lexicon() -> KeywordLexicon:
+    global _lexicon
+    if _lexicon is None:
+        _lexicon = KeywordLexicon()
+    return _lexicon
+
+
+def register_keywords(namespace: str, categories: Mapping[str, Iterable[str]]) -> None:
+    get_keyword_lexicon().register(namespace, categories)
+
+
+def scan_keywords(text: str) -> KeywordHits:
+    return get_keyword_lexicon().scan(text)
@@ -4,16 +4,29 @@
 使用 GPT/Claude 等 LLM 根據輸入文字語意，自動加上適合的 ElevenLabs v3 語氣標籤。
 """
 
+import asyncio
 import os
-from typing import Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
 from dotenv import load_dotenv
 
+from modules.admission import is_overload_error
+from modules.resilience import CircuitOpen, get_circuit_breaker
+
 load_dotenv()
 
 # 支援多種 LLM Provider
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")  # 預設使用 gpt-4o-mini
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
+ANTHROPIC_MODEL = os.getenv("ANTHROPIC_MODEL", "claude-3-haiku-20240307")
+# 主要 provider 失敗或熔斷時，自動改用其他已設定金鑰的 provider
+LLM_FAILOVER = os.getenv("LLM_FAILOVER", "1").lower() in {"1", "true", "on", "yes"}
+# 非同步路徑的語氣判斷延遲預算：LLM 逾時未回應就改用規則式判斷（0 表示不限）
+EMOTION_LLM_BUDGET_MS = float(os.getenv("EMOTION_LLM_BUDGET_MS", "1500"))
+# 非同步 LLM client 的請求逾時（秒）
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+
+T = TypeVar("T")
 
 
 # ElevenLabs v3 支援的語氣標籤
@@ -113,6 +126,8 @@ def llm_emotion_route_openai(text: str, model: str = "gpt-4o-mini") -> Optional[
         print("⚠️  未安裝 openai 套件，請執行：pip install openai")
         return None
     except Exception as e:
+        if is_overload_error(e):
+            raise  # 429/503/逾時交給呼叫端：熔斷器與准入控制要看到上游過載
         print(f"❌ OpenAI API 錯誤：{str(e)}")
         return None
 
@@ -154,15 +169,131 @@ def llm_emotion_route_anthropic(text: str, model: str = "claude-3-haiku-20240307
         print("⚠️  未安裝 anthropic 套件，請執行：pip install anthropic")
         return None
     except Exception as e:
+        if is_overload_error(e):
+            raise  # 429/503/逾時交給呼叫端：熔斷器與准入控制要看到上游過載
         print(f"❌ Anthropic API 錯誤：{str(e)}")
         return None
 
 
+_PROVIDERS: Dict[str, Callable[[str, str], Optional[str]]] = {
+    "openai": llm_emotion_route_openai,
+    "anthropic": llm_emotion_route_anthropic,
+}
+
+
+# === 非同步版本（不阻塞 event loop） ===
+
+_async_clients: Dict[str, Any] = {}
+
+
+def get_async_llm_client(provider: str) -> Optional[Any]:
+    """
+    共用的 AsyncOpenAI / AsyncAnthropic client（連線池跨請求重用）；
+    未設定金鑰或未安裝套件時返回 None。
+    """
+    provider = provider.lower()
+    client = _async_clients.get(provider)
+    if client is not None:
+        return client
+    try:
+        if provider == "openai" and OPENAI_API_KEY:
+            import openai
+            client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY, timeout=LLM_TIMEOUT_SECONDS)
+        elif provider == "anthropic" and ANTHROPIC_API_KEY:
+            import anthropic
+            client = anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY, timeout=LLM_TIMEOUT_SECONDS)
+    except ImportError as error:
+        print(f"⚠️  LLM 模組未安裝：{error}")
+        return None
+    if client is not None:
+        _async_clients[provider] = client
+    return client
+
+
+async def within_budget(awaitable: Awaitable[Optional[T]], budget_ms: Optional[float] = None) -> Optional[T]:
+    """在延遲預算內等待結果；逾時則取消並返回 None（由呼叫端改走規則式判斷）。"""
+    budget_ms = EMOTION_LLM_BUDGET_MS if budget_ms is None else budget_ms
+    if budget_ms <= 0:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, timeout=budget_ms / 1000)
+    except asyncio.TimeoutError:
+        print(f"⏱️  LLM 語氣判斷超過 {budget_ms:.0f}ms，改用規則式判斷")
+        return None
+
+
+async def llm_emotion_route_openai_async(text: str, model: str = "gpt-4o-mini") -> Optional[str]:
+    """llm_emotion_route_openai 的非同步版本"""
+    client = get_async_llm_client("openai")
+    if client is None:
+        return None
+    try:
+        response = await client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": "你是一個語氣判斷專家，專門為文字添加 ElevenLabs 語氣標籤。"},
+                {"role": "user", "content": create_emotion_prompt(text)}
+            ],
+            temperature=0.7,
+            max_tokens=200
+        )
+        return response.choices[0].message.content.strip()
+    except Exception as e:
+        if is_overload_error(e):
+            raise  # 429/503/逾時交給呼叫端：熔斷器與准入控制要看到上游過載
+        print(f"❌ OpenAI API 錯誤：{str(e)}")
+        return None
+
+
+async def llm_emotion_route_anthropic_async(text: str, model: str = "claude-3-haiku-20240307") -> Optional[str]:
+    """llm_emotion_route_anthropic 的非同步版本"""
+    client = get_async_llm_client("anthropic")
+    if client is None:
+        return None
+    try:
+        message = await client.messages.create(
+            model=model,
+            max_tokens=200,
+            messages=[
+                {"role": "user", "content": create_emotion_prompt(text)}
+            ]
+        )
+        return message.content[0].text.strip()
+    except Exception as e:
+        if is_overload_error(e):
+            raise  # 429/503/逾時交給呼叫端：熔斷器與准入控制要看到上游過載
+        print(f"❌ Anthropic API 錯誤：{str(e)}")
+        return None
+
+
+_ASYNC_PROVIDERS: Dict[str, Callable[[str, str], Awaitable[Optional[str]]]] = {
+    "openai": llm_emotion_route_openai_async,
+    "anthropic": llm_emotion_route_anthropic_async,
+}
+
+
+def _default_model(provider: str) -> str:
+    return OPENAI_MODEL if provider == "openai" else ANTHROPIC_MODEL
+
+
+def _provider_configured(provider: str) -> bool:
+    return bool(OPENAI_API_KEY if provider == "openai" else ANTHROPIC_API_KEY)
+
+
+def _provider_order(provider: str) -> List[str]:
+    """指定的 provider 優先，其餘已設定金鑰的 provider 依序作為備援。"""
+    order = [provider] if provider in _PROVIDERS else []
+    if LLM_FAILOVER or not order:
+        order += [name for name in _PROVIDERS if name != provider and _provider_configured(name)]
+    return order
+
+
 def llm_emotion_route(
     text: str,
     provider: str = "openai",
     model: Optional[str] = None,
-    fallback_to_rule: bool = True
+    fallback_to_rule: bool = True,
+    raise_on_overload: bool = False
 ) -> str:
     """
     主要接口：使用 LLM 判斷語氣並插入標籤
@@ -170,23 +301,43 @@ def llm_emotion_route(
     Args:
         text: 輸入文字
         provider: LLM 提供者（"openai" 或 "anthropic"）
-        model: 模型名稱（可選，使用環境變數或預設值）
+        model: 模型名稱（可選，使用環境變數或預設值；只套用在指定的 provider）
         fallback_to_rule: 如果 LLM 失敗，是否回退到規則式判斷
+        raise_on_overload: 所有 provider 都沒有結果且上游回報過載（429/503/逾時）時，
+            拋出該錯誤而不回退，讓外層的准入控制記錄過載後再自行回退
         
     Returns:
         加上語氣標籤的文字
     """
-    # 嘗試使用 LLM
+    provider = (provider or "openai").lower()
+    if provider not in _PROVIDERS:
+        print(f"⚠️  不支援的 provider: {provider}")
+
+    # 依序嘗試各 provider；每個 provider 有獨立熔斷器，熔斷中直接跳過（未設定金鑰的不會連網，也跳過）
     result = None
-    
-    if provider.lower() == "openai":
-        model = model or OPENAI_MODEL  # 使用環境變數或提供的模型
-        result = llm_emotion_route_openai(text, model)
-    elif provider.lower() == "anthropic":
-        model = model or "claude-3-haiku-20240307"
-        result = llm_emotion_route_anthropic(text, model)
-    else:
-        print(f"⚠️  不支援的 provider: {provider}，使用規則式判斷")
+    overload: Optional[Exception] = None
+    for name in _provider_order(provider):
+        if not _provider_configured(name):
+            print(f"⚠️  未設定 {name} 的 API 金鑰，略過")
+            continue
+        try:
+            with get_circuit_breaker(f"llm_{name}").attempt() as attempt:
+                result = _PROVIDERS[name](text, (model if name == provider and model else _default_model(name)))
+                if result:
+                    attempt.succeeded()
+        except CircuitOpen:
+            continue
+        except Exception as error:
+            if not is_overload_error(error):
+                raise
+            print(f"⚠️  {name} 上游過載：{error}")
+            overload = error
+            continue
+        if result:
+            break
+
+    if not result and overload is not None and raise_on_overload:
+        raise overload
     
     # 如果 LLM 失敗且允許回退，使用規則式判斷
     if not result and fallback_to_rule:
@@ -197,6 +348,57 @@ def llm_emotion_route(
     return result or text
 
 
+async def _llm_route_async(text: str, provider: str, model: Optional[str]) -> Optional[str]:
+    for name in _provider_order(provider):
+        if not _provider_configured(name):
+            continue
+        # 預算逾時會取消這裡的 await；attempt() 把取消也記為失敗，半開狀態的試探名額才會歸還
+        try:
+            with get_circuit_breaker(f"llm_{name}").attempt() as attempt:
+                result = await _ASYNC_PROVIDERS[name](
+                    text, (model if name == provider and model else _default_model(name))
+                )
+                if result:
+                    attempt.succeeded()
+        except CircuitOpen:
+            continue
+        except Exception as error:
+            if not is_overload_error(error):
+                raise
+            print(f"⚠️  {name} 上游過載：{error}")
+            continue
+        if result:
+            return result
+    return None
+
+
+async def llm_emotion_route_async(
+    text: str,
+    provider: str = "openai",
+    model: Optional[str] = None,
+    fallback_to_rule: bool = True,
+    budget_ms: Optional[float] = None
+) -> str:
+    """
+    llm_emotion_route 的非同步版本（provider 順序與熔斷邏輯相同）
+
+    整個 LLM 判斷（含備援 provider）受 budget_ms（預設 EMOTION_LLM_BUDGET_MS）限制，
+    逾時視同 LLM 失敗，回退到規則式判斷。
+    """
+    provider = (provider or "openai").lower()
+    if provider not in _PROVIDERS:
+        print(f"⚠️  不支援的 provider: {provider}")
+
+    result = await within_budget(_llm_route_async(text, provider, model), budget_ms)
+
+    if not result and fallback_to_rule:
+        from emotion_tag_engine import insert_emotion_tags
+        result = insert_emotion_tags(text)
+        print("📌 使用規則式語氣判斷")
+
+    return result or text
+
+
 # 測試函數
 if __name__ == "__main__":
     test_texts = [
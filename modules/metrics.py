@@ -0,0 +1,369 @@
+from __future__ import annotations
+
+import bisect
+import logging
+import math
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from modules.quantile_sketch import DEFAULT_RELATIVE_ACCURACY, DDSketch
+
+logger = logging.getLogger("metrics")
+
+# Seconds; covers sub-ms decode work up to multi-second upstream calls.
+DEFAULT_LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+LabelValues = Tuple[str, ...]
+SampleFunction = Callable[[], Dict[LabelValues, float]]
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape_label(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    return repr(float(value))
+
+
+class _Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names: Tuple[str, ...] = tuple(label_names)
+        self._lock = threading.Lock()
+        self._children: Dict[LabelValues, object] = {}
+
+    def labels(self, *values: str):
+        """Return (and cache) the child for a label combination; reuse the child on hot paths."""
+        key = tuple(str(v) for v in values)
+        if len(key) != len(self.label_names):
+            raise ValueError(f"{self.name}: expected labels {self.label_names}, got {key}")
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._new_child()
+                    self._children[key] = child
+        return child
+
+    def _default_child(self):
+        return self.labels()
+
+    @abstractmethod
+    def _new_child(self):
+        ...
+
+    @abstractmethod
+    def render(self) -> List[str]:
+        ...
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self) -> None:
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default_child().inc(amount)
+
+    def value(self, *values: str) -> float:
+        return self.labels(*values).value
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for key, child in sorted(self._children.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(child.value)}")
+        return lines
+
+
+class _GaugeChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self) -> None:
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value: float) -> None:
+        self.value = float(value)
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value -= amount
+
+
+class Gauge(_Metric):
+    """Gauge with optional callback; callbacks are evaluated only at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, label_names)
+        self._function: Optional[SampleFunction] = None
+
+    def _new_child(self) -> _GaugeChild:
+        return _GaugeChild()
+
+    def set(self, value: float) -> None:
+        self._default_child().set(value)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default_child().inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._default_child().dec(amount)
+
+    def set_function(self, function: SampleFunction) -> None:
+        self._function = function
+
+    def samples(self) -> Dict[LabelValues, float]:
+        if self._function is not None:
+            try:
+                return {tuple(str(v) for v in k): float(v) for k, v in self._function().items()}
+            except Exception:  # noqa: BLE001
+                logger.exception("gauge callback failed: %s", self.name)
+                return {}
+        return {key: child.value for key, child in self._children.items()}
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for key, value in sorted(self.samples().items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class _HistogramChild:
+    __slots__ = ("upper_bounds", "bucket_counts", "sum", "count", "_lock")
+
+    def __init__(self, upper_bounds: Tuple[float, ...]) -> None:
+        self.upper_bounds = upper_bounds
+        self.bucket_counts = [0] * (len(upper_bounds) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.upper_bounds, value)
+        with self._lock:
+            self.bucket_counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram: one bisect and three integer updates per observation."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Iterable[float] = DEFAULT_LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, label_names)
+        bounds = tuple(sorted(float(b) for b in buckets if not math.isinf(b)))
+        if not bounds:
+            raise ValueError(f"{name}: histogram needs at least one finite bucket")
+        self.upper_bounds = bounds
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.upper_bounds)
+
+    def observe(self, value: float) -> None:
+        self._default_child().observe(value)
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for key, child in sorted(self._children.items()):
+            cumulative = 0
+            bounds = list(child.upper_bounds) + [math.inf]
+            for bound, bucket_count in zip(bounds, child.bucket_counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class _SummaryChild:
+    __slots__ = ("sketch", "_lock")
+
+    def __init__(self, relative_accuracy: float) -> None:
+        self.sketch = DDSketch(relative_accuracy)
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.sketch.add(value)
+
+    def merge(self, sketch: DDSketch) -> None:
+        with self._lock:
+            self.sketch.merge(sketch)
+
+    def snapshot(self, quantiles: Sequence[float]) -> Tuple[Dict[float, Optional[float]], float, int]:
+        with self._lock:
+            return self.sketch.quantiles(quantiles), self.sketch.sum, self.sketch.count
+
+
+class Summary(_Metric):
+    """
+    Summary backed by a mergeable DDSketch per label set.
+
+    Unlike a Prometheus client summary the quantiles are cumulative (no sliding
+    window) and whole session sketches can be folded in with `merge()`.
+    """
+
+    kind = "summary"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        quantiles: Iterable[float] = (0.5, 0.9, 0.95, 0.99),
+        relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY,
+    ) -> None:
+        super().__init__(name, documentation, label_names)
+        self.quantiles = tuple(quantiles)
+        self.relative_accuracy = relative_accuracy
+
+    def _new_child(self) -> _SummaryChild:
+        return _SummaryChild(self.relative_accuracy)
+
+    def observe(self, value: float) -> None:
+        self._default_child().observe(value)
+
+    def snapshot(self) -> Dict[LabelValues, Dict[str, object]]:
+        """Per label set `{"count", "sum", "p50", ...}`; handy for JSON views and tests."""
+        result: Dict[LabelValues, Dict[str, object]] = {}
+        for key, child in sorted(self._children.items()):
+            values, total, count = child.snapshot(self.quantiles)
+            entry: Dict[str, object] = {"count": count, "sum": total}
+            entry.update({f"p{q * 100:g}": v for q, v in values.items()})
+            result[key] = entry
+        return result
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for key, child in sorted(self._children.items()):
+            values, total, count = child.snapshot(self.quantiles)
+            if not count:
+                continue
+            for q, value in values.items():
+                labels = _format_labels(self.label_names, key, ("quantile", repr(q)))
+                lines.append(f"{self.name}{labels} {_format_value(value)}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    In-process registry of counters, gauges, histograms and sketch-backed summaries.
+
+    - Metrics are get-or-create by name so modules can declare them at import time.
+    - `render()` produces the Prometheus text exposition format (version 0.0.4).
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _get_or_create(self, cls, name: str, documentation: str, label_names: Sequence[str], **kwargs):
+        with self._lock:
+            existing = self._metrics.get(name)
+            if existing is not None:
+                if not isinstance(existing, cls) or existing.label_names != tuple(label_names):
+                    raise ValueError(f"metric {name} already registered with a different type or labels")
+                return existing
+            metric = cls(name, documentation, label_names, **kwargs)
+            self._metrics[name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, label_names)
+
+    def gauge(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, label_names)
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Iterable[float] = DEFAULT_LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, label_names, buckets=buckets)
+
+    def summary(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        quantiles: Iterable[float] = (0.5, 0.9, 0.95, 0.99),
+    ) -> Summary:
+        return self._get_or_create(Summary, name, documentation, label_names, quantiles=quantiles)
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in sorted(metrics, key=lambda m: m.name):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_metrics_registry: Optional[MetricsRegistry] = None
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    global _metrics_registry
+    if _metrics_registry is None:
+        _metrics_registry = MetricsRegistry()
+    return _metrics_registry
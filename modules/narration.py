@@ -0,0 +1,520 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from xml.etree import ElementTree
+
+from modules import voice_cache_engine
+from modules.admission import PRIORITY_BATCH, AdmissionController, is_overload_error
+from modules.phrase_bank import phrase_key, rule_tags, strip_tags, tagged_text
+from modules.speech_tag_mapper import extract_tags_from_text
+from modules.tts_prefetch import split_sentences
+
+logger = logging.getLogger("narration")
+
+NARRATION_OUTPUT_DIR = Path(os.getenv("NARRATION_OUTPUT_DIR", str(voice_cache_engine.AUDIO_CACHE_DIR / "narration")))
+# ElevenLabs bills per character; set this to the plan's rate (USD per 1000 characters).
+NARRATION_TTS_COST_PER_1K_CHARS = float(os.getenv("NARRATION_TTS_COST_PER_1K_CHARS", "0.30"))
+NARRATION_LLM_COST_PER_CALL = float(os.getenv("NARRATION_LLM_COST_PER_CALL", "0.0002"))
+
+TAGGING_RULE = "rule"
+TAGGING_LLM = "llm"
+TAGGING_NONE = "none"
+
+TEXT_SUFFIXES = (".md", ".txt")
+DOCX_SUFFIX = ".docx"
+_WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_MARKDOWN_NOISE = [
+    (re.compile(r"<!--.*?-->", re.S), ""),
+    (re.compile(r"!\[[^\]]*\]\([^)]*\)"), ""),  # images
+    (re.compile(r"\[([^\]]+)\]\([^)]*\)"), r"\1"),  # links keep their text
+    (re.compile(r"^\s{0,3}(?:#{1,6}|>|[-*+●•]|\d+[.)])\s*", re.M), ""),  # headings, quotes, bullets
+    (re.compile(r"[*_`]{1,3}"), ""),
+    (re.compile(r"[●•]"), "\n"),  # inline bullets ("● 看見框架 ● 鬆動框架")
+]
+
+SynthesizeFn = Callable[["NarrationSegment"], bytes]
+
+
+@dataclass
+class Fragment:
+    fragment_id: str
+    source: str
+    text: str
+
+
+@dataclass
+class NarrationSegment:
+    fragment_id: str
+    index: int
+    text: str
+    tags: Tuple[str, ...]
+    voice_id: str
+
+    @property
+    def key(self) -> str:
+        """Audio-cache key; the same text/voice/tags from the gateway or the phrase bank hit the same file."""
+        return phrase_key(self.text, self.voice_id, self.tags)
+
+    @property
+    def tagged_text(self) -> str:
+        return tagged_text(self.text, self.tags)
+
+
+# --- Fragments -------------------------------------------------------------------
+
+
+def markdown_to_text(markdown: str) -> str:
+    text = markdown.lstrip("﻿")
+    for pattern, replacement in _MARKDOWN_NOISE:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def docx_to_text(path: Path) -> str:
+    """Paragraph text of a .docx (no python-docx needed: it is a zip of WordprocessingML)."""
+    with zipfile.ZipFile(path) as archive:
+        root = ElementTree.fromstring(archive.read("word/document.xml"))
+    paragraphs = []
+    for paragraph in root.iter(f"{_WORD_NS}p"):
+        text = "".join(node.text or "" for node in paragraph.iter(f"{_WORD_NS}t")).strip()
+        if text:
+            paragraphs.append(text)
+    return "\n".join(paragraphs)
+
+
+def fragment_id_for(path: Path) -> str:
+    return re.sub(r"\s+", "_", path.stem.strip()) or "fragment"
+
+
+def load_fragment(path: Path) -> Optional[Fragment]:
+    """A fragment for a text-bearing file (.md/.txt/.docx), or None for anything else (PDF, images, sheets)."""
+    suffix = path.suffix.lower()
+    if suffix in TEXT_SUFFIXES:
+        text = markdown_to_text(path.read_text(encoding="utf-8", errors="replace"))
+    elif suffix == DOCX_SUFFIX:
+        text = docx_to_text(path)
+    else:
+        return None
+    text = text.strip()
+    return Fragment(fragment_id_for(path), str(path), text) if text else None
+
+
+def discover_fragments(sources: Iterable[Path]) -> Tuple[List[Fragment], List[str]]:
+    """Fragments from files and directories (one level deep, sorted); also returns skipped paths."""
+    fragments: List[Fragment] = []
+    skipped: List[str] = []
+    seen: Dict[str, int] = {}
+    for source in sources:
+        source = Path(source)
+        paths = sorted(p for p in source.iterdir() if p.is_file()) if source.is_dir() else [source]
+        for path in paths:
+            try:
+                fragment = load_fragment(path)
+            except (OSError, KeyError, zipfile.BadZipFile, ElementTree.ParseError):
+                logger.warning("fragment unreadable: %s", path, exc_info=True)
+                fragment = None
+            if fragment is None:
+                skipped.append(str(path))
+                continue
+            count = seen.get(fragment.fragment_id, 0)
+            seen[fragment.fragment_id] = count + 1
+            if count:
+                fragment.fragment_id = f"{fragment.fragment_id}_{count + 1}"
+            fragments.append(fragment)
+    return fragments, skipped
+
+
+def segment_fragment(fragment: Fragment, min_chars: int = 12, max_chars: int = 220) -> List[str]:
+    """Sentence-sized synthesis units (same splitter the live TTS prefetch uses)."""
+    return [strip_tags(sentence) for sentence in split_sentences(fragment.text, min_chars, max_chars)]
+
+
+# --- Checkpoint ------------------------------------------------------------------
+
+
+def write_json_atomic(path: Path, payload: dict) -> None:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp.replace(path)
+
+
+class NarrationCheckpoint:
+    """
+    Resumable progress for a narration run (`<output>/checkpoint.json`).
+
+    - `tags`: tags per (tagging mode, text), so a resumed run picks the same tags (and
+      therefore the same cache keys) without calling the LLM again.
+    - `segments`: cache key -> {"bytes", "duration_ms"} for every segment already on disk.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.tags: Dict[str, List[str]] = {}
+        self.segments: Dict[str, dict] = {}
+        if self.path.exists():
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+                self.tags = dict(data.get("tags", {}))
+                self.segments = dict(data.get("segments", {}))
+            except (OSError, ValueError):
+                logger.warning("narration checkpoint unreadable, starting over: %s", self.path, exc_info=True)
+
+    @staticmethod
+    def tag_key(mode: str, text: str) -> str:
+        return hashlib.sha1(f"{mode}|{text}".encode("utf-8")).hexdigest()
+
+    def save(self) -> None:
+        write_json_atomic(self.path, {"version": 1, "saved_at": time.time(), "tags": self.tags, "segments": self.segments})
+
+
+class SegmentTagger:
+    """Emotion tags per segment: the rule engine, a (checkpoint-cached) LLM, or none."""
+
+    def __init__(
+        self,
+        mode: str = TAGGING_RULE,
+        checkpoint: Optional[NarrationCheckpoint] = None,
+        provider: str = "openai",
+        concurrency: int = 4,
+    ) -> None:
+        if mode not in {TAGGING_RULE, TAGGING_LLM, TAGGING_NONE}:
+            raise ValueError(f"unknown tagging mode: {mode}")
+        self.mode = mode
+        self.checkpoint = checkpoint
+        self.provider = provider
+        self.concurrency = max(1, concurrency)
+        self.llm_calls = 0
+
+    async def _tag_one(self, text: str) -> Tuple[str, ...]:
+        if self.mode == TAGGING_NONE:
+            return ()
+        if self.mode == TAGGING_RULE:
+            return rule_tags(text)
+        from modules.llm_emotion_router import llm_emotion_route_async
+
+        self.llm_calls += 1
+        # No latency budget for batch work; failures fall back to the rule engine.
+        return tuple(extract_tags_from_text(await llm_emotion_route_async(text, self.provider, budget_ms=0)))
+
+    async def tag_all(self, texts: Sequence[str]) -> List[Tuple[str, ...]]:
+        cache = self.checkpoint.tags if self.checkpoint is not None else {}
+        results: List[Optional[Tuple[str, ...]]] = [None] * len(texts)
+        missing: Dict[str, List[int]] = {}
+        for i, text in enumerate(texts):
+            cached = cache.get(NarrationCheckpoint.tag_key(self.mode, text))
+            if cached is not None:
+                results[i] = tuple(cached)
+            else:
+                missing.setdefault(text, []).append(i)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def tag(text: str) -> None:
+            async with semaphore:
+                tags = await self._tag_one(text)
+            cache[NarrationCheckpoint.tag_key(self.mode, text)] = list(tags)
+            for i in missing[text]:
+                results[i] = tags
+
+        await asyncio.gather(*(tag(text) for text in missing))
+        return [tags or () for tags in results]
+
+
+# --- MP3 timing ------------------------------------------------------------------
+
+_MP3_BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+def strip_id3(data: bytes) -> bytes:
+    """MP3 frames only (ID3v2 header and ID3v1 trailer removed), so segments can be concatenated."""
+    start = 0
+    if data[:3] == b"ID3" and len(data) >= 10:
+        size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F)
+        start = 10 + size + (10 if data[5] & 0x10 else 0)
+    end = len(data) - 128 if len(data) - start >= 128 and data[-128:-125] == b"TAG" else len(data)
+    return data[start:end]
+
+
+def mp3_duration_ms(data: bytes) -> int:
+    """Duration of MPEG Layer III audio from its frame headers (exact for CBR and VBR)."""
+    data = strip_id3(data)
+    samples = 0.0
+    offset = 0
+    limit = len(data) - 4
+    while offset <= limit:
+        if data[offset] != 0xFF or (data[offset + 1] & 0xE0) != 0xE0:
+            offset += 1
+            continue
+        version = (data[offset + 1] >> 3) & 0x03  # 3 = MPEG1, 2 = MPEG2, 0 = MPEG2.5
+        layer = (data[offset + 1] >> 1) & 0x03  # 1 = Layer III
+        bitrate_index = data[offset + 2] >> 4
+        rate_index = (data[offset + 2] >> 2) & 0x03
+        if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+            offset += 1
+            continue
+        bitrate = _MP3_BITRATES[1 if version == 3 else 2][bitrate_index] * 1000
+        sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+        padding = (data[offset + 2] >> 1) & 0x01
+        per_frame = 1152 if version == 3 else 576
+        frame_length = per_frame // 8 * bitrate // sample_rate + padding
+        samples += per_frame / sample_rate
+        offset += max(frame_length, 1)
+    return int(round(samples * 1000))
+
+
+# --- Runner ----------------------------------------------------------------------
+
+
+class NarrationRunner:
+    """
+    Batch narration of book fragments into per-fragment audio plus a timing manifest.
+
+    - Segments are sentence-sized; each one is a file in the shared audio cache under
+      its cache key, so segments that already exist (from an earlier run, the gateway
+      or the phrase bank) are reused instead of synthesized.
+    - Synthesis runs through an `AdmissionController`: at most `concurrency` calls in
+      flight, shrinking on 429/503/timeouts and growing back on success. Overloaded
+      calls are retried with backoff; `requests_per_minute` adds a hard pacing cap.
+    - Progress is checkpointed every `checkpoint_every` segments (and on interruption),
+      so a re-run only does what is missing.
+    - `<output>/<fragment>.mp3` is written once every segment of the fragment exists;
+      `<output>/manifest.json` lists each segment's start/end offset in that file.
+    """
+
+    def __init__(
+        self,
+        synthesize: SynthesizeFn,
+        voice_id: str,
+        output_dir: Optional[Path] = None,
+        cache_dir: Optional[Path] = None,
+        tagging: str = TAGGING_RULE,
+        llm_provider: str = "openai",
+        concurrency: int = 4,
+        requests_per_minute: Optional[float] = None,
+        max_retries: int = 3,
+        retry_backoff: float = 2.0,
+        checkpoint_every: int = 10,
+        min_chars: int = 12,
+        max_chars: int = 220,
+        model_id: str = "",
+        cost_per_1k_chars: float = NARRATION_TTS_COST_PER_1K_CHARS,
+        llm_cost_per_call: float = NARRATION_LLM_COST_PER_CALL,
+    ) -> None:
+        self.synthesize = synthesize
+        self.voice_id = voice_id
+        self.output_dir = Path(output_dir) if output_dir else NARRATION_OUTPUT_DIR
+        self.cache_dir = Path(cache_dir) if cache_dir else voice_cache_engine.AUDIO_CACHE_DIR
+        self.checkpoint = NarrationCheckpoint(self.output_dir / "checkpoint.json")
+        self.tagger = SegmentTagger(tagging, self.checkpoint, provider=llm_provider, concurrency=concurrency)
+        self.concurrency = max(1, concurrency)
+        self.requests_per_minute = requests_per_minute
+        self.max_retries = max(0, max_retries)
+        self.retry_backoff = retry_backoff
+        self.checkpoint_every = max(1, checkpoint_every)
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.model_id = model_id
+        self.cost_per_1k_chars = cost_per_1k_chars
+        self.llm_cost_per_call = llm_cost_per_call
+        self._next_start = 0.0
+        self._pace_lock: Optional[asyncio.Lock] = None
+
+    def segment_path(self, segment: NarrationSegment) -> Path:
+        return self.cache_dir / f"{segment.key}.mp3"  # same name as `get_cached_audio_path(key)`
+
+    async def plan(self, fragments: Sequence[Fragment]) -> Dict[str, List[NarrationSegment]]:
+        """Segments per fragment, tagged (tags come from the checkpoint when available)."""
+        texts: List[Tuple[str, int, str]] = []
+        for fragment in fragments:
+            for index, text in enumerate(segment_fragment(fragment, self.min_chars, self.max_chars)):
+                if text:
+                    texts.append((fragment.fragment_id, index, text))
+        tags = await self.tagger.tag_all([text for _, _, text in texts])
+        planned: Dict[str, List[NarrationSegment]] = {fragment.fragment_id: [] for fragment in fragments}
+        for (fragment_id, index, text), segment_tags in zip(texts, tags):
+            planned[fragment_id].append(NarrationSegment(fragment_id, index, text, segment_tags, self.voice_id))
+        return planned
+
+    async def _pace(self) -> None:
+        if not self.requests_per_minute:
+            return
+        if self._pace_lock is None:
+            self._pace_lock = asyncio.Lock()
+        async with self._pace_lock:
+            now = time.monotonic()
+            wait = self._next_start - now
+            self._next_start = max(now, self._next_start) + 60.0 / self.requests_per_minute
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def _render(self, segment: NarrationSegment, admission: AdmissionController) -> bytes:
+        attempt = 0
+        while True:
+            await self._pace()
+            try:
+                async with admission.admit(PRIORITY_BATCH):
+                    return await asyncio.to_thread(self.synthesize, segment)
+            except Exception as exc:  # noqa: BLE001
+                if attempt >= self.max_retries or not is_overload_error(exc):
+                    raise
+                delay = self.retry_backoff * (2 ** attempt)
+                attempt += 1
+                logger.info("narration throttled, retrying in %.1fs", delay, extra={"key": segment.key})
+                await asyncio.sleep(delay)
+
+    async def run(self, fragments: Sequence[Fragment]) -> dict:
+        started = time.perf_counter()
+        planned = await self.plan(fragments)
+        segments = [segment for items in planned.values() for segment in items]
+        # Repeated sentences share one cache key: render each key once and let every
+        # fragment that uses it pick it up from the cache (and bill it once).
+        unique: Dict[str, NarrationSegment] = {}
+        uses: Dict[str, int] = {}
+        for segment in segments:
+            unique.setdefault(segment.key, segment)
+            uses[segment.key] = uses.get(segment.key, 0) + 1
+        stats = {
+            "started_at": time.time(),
+            "fragments": len(fragments),
+            "segments": len(segments),
+            "unique_segments": len(unique),
+            "synthesized": 0,
+            "reused": 0,
+            "failed": 0,
+            "characters": sum(len(segment.text) for segment in segments),
+            "billed_characters": 0,
+            "llm_calls": self.tagger.llm_calls,
+        }
+        admission = AdmissionController(
+            "narration",
+            initial_limit=self.concurrency,
+            max_limit=self.concurrency,
+            queue_timeouts={PRIORITY_BATCH: 24 * 3600.0},
+            max_queue=max(64, len(unique)),
+        )
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        done = self.checkpoint.segments
+        since_save = 0
+
+        async def process(segment: NarrationSegment) -> None:
+            nonlocal since_save
+            path = self.segment_path(segment)
+            count = uses[segment.key]
+            if path.exists() and path.stat().st_size > 0:
+                if segment.key not in done or done[segment.key].get("bytes") != path.stat().st_size:
+                    audio = path.read_bytes()
+                    done[segment.key] = {"bytes": len(audio), "duration_ms": mp3_duration_ms(audio)}
+                stats["reused"] += count
+                return
+            try:
+                audio = await self._render(segment, admission)
+            except Exception:  # noqa: BLE001
+                logger.warning("narration segment failed", extra={"key": segment.key, "text": segment.text[:40]}, exc_info=True)
+                stats["failed"] += count
+                return
+            tmp = path.with_suffix(".mp3.tmp")
+            tmp.write_bytes(audio)
+            tmp.replace(path)
+            done[segment.key] = {"bytes": len(audio), "duration_ms": mp3_duration_ms(audio)}
+            stats["synthesized"] += 1
+            stats["reused"] += count - 1
+            stats["billed_characters"] += len(segment.tagged_text)
+            since_save += 1
+            if since_save >= self.checkpoint_every:
+                since_save = 0
+                self.checkpoint.save()
+
+        try:
+            await asyncio.gather(*(process(segment) for segment in unique.values()))
+        finally:
+            self.checkpoint.save()
+
+        manifest = self.write_outputs(fragments, planned)
+        elapsed = time.perf_counter() - started
+        completed = stats["synthesized"] + stats["reused"]
+        stats.update(
+            elapsed_seconds=round(elapsed, 2),
+            segments_per_min=round(completed / elapsed * 60, 1) if elapsed > 0 else 0.0,
+            synthesized_per_min=round(stats["synthesized"] / elapsed * 60, 1) if elapsed > 0 else 0.0,
+            llm_calls=self.tagger.llm_calls,
+            complete_fragments=sum(1 for entry in manifest["fragments"].values() if entry["complete"]),
+            estimated_cost_usd=round(
+                stats["billed_characters"] / 1000 * self.cost_per_1k_chars + self.tagger.llm_calls * self.llm_cost_per_call,
+                4,
+            ),
+        )
+        manifest["runs"] = (manifest.get("runs", []) + [stats])[-20:]
+        write_json_atomic(self.output_dir / "manifest.json", manifest)
+        return stats
+
+    def write_outputs(self, fragments: Sequence[Fragment], planned: Dict[str, List[NarrationSegment]]) -> dict:
+        """Assemble complete fragments and build the manifest (runs history is kept)."""
+        manifest_path = self.output_dir / "manifest.json"
+        previous: dict = {}
+        if manifest_path.exists():
+            try:
+                previous = json.loads(manifest_path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                previous = {}
+        entries = dict(previous.get("fragments", {}))
+        done = self.checkpoint.segments
+        for fragment in fragments:
+            segments = planned.get(fragment.fragment_id, [])
+            complete = bool(segments) and all(self.segment_path(s).exists() and s.key in done for s in segments)
+            rows = []
+            offset = 0
+            for segment in segments:
+                duration = done.get(segment.key, {}).get("duration_ms", 0)
+                rows.append(
+                    {
+                        "index": segment.index,
+                        "text": segment.text,
+                        "tags": list(segment.tags),
+                        "key": segment.key,
+                        "cache_file": f"{segment.key}.mp3",
+                        "start_ms": offset,
+                        "end_ms": offset + duration,
+                    }
+                )
+                offset += duration
+            file_name = None
+            if complete:
+                file_name = f"{fragment.fragment_id}.mp3"
+                target = self.output_dir / file_name
+                tmp = target.with_suffix(".mp3.tmp")
+                with tmp.open("wb") as handle:
+                    for segment in segments:
+                        handle.write(strip_id3(self.segment_path(segment).read_bytes()))
+                tmp.replace(target)
+            entries[fragment.fragment_id] = {
+                "source": fragment.source,
+                "file": file_name,
+                "complete": complete,
+                "duration_ms": offset,
+                "characters": sum(len(segment.text) for segment in segments),
+                "segments": rows,
+            }
+        return {
+            "version": 1,
+            "generated_at": time.time(),
+            "voice_id": self.voice_id,
+            "model_id": self.model_id,
+            "fragments": entries,
+            "runs": previous.get("runs", []),
+        }
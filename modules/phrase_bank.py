@@ -0,0 +1,317 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from modules import voice_cache_engine
+from modules.metrics import get_metrics_registry
+from modules.speech_tag_mapper import extract_tags_from_text
+
+logger = logging.getLogger("phrase_bank")
+
+_metrics = get_metrics_registry()
+METRIC_PHRASE_BANK_LOOKUPS = _metrics.counter(
+    "phrase_bank_lookups_total", "Phrase-bank lookups before live TTS", ["result"]
+)
+
+_TAG_PATTERN = re.compile(r"\[[^\]]+\]\s*")
+
+# Short replies that are worth pre-rendering next to the soft-ling openings.
+COMMON_REPLIES = [
+    "我在呢～想聊聊什麼呀？",
+    "當然可以呀～我正在聽著，你想知道什麼呢？",
+    "嗯嗯，我明白了～",
+    "好呀～",
+    "謝謝你跟我說這些～",
+    "等我一下下喔～",
+    "抱歉，我剛剛沒聽清楚，可以再說一次嗎？",
+    "晚安～做個好夢喔～",
+]
+
+# Tag sets the runtime mappers emit for short phrases: untagged, SoftLingAgent's
+# choices, and whatever the rule engine picks for the phrase itself (added per phrase).
+DEFAULT_TAG_SETS: List[Tuple[str, ...]] = [
+    (),
+    ("playful",),
+    ("softly", "playful"),
+    ("happy", "playful"),
+    ("softly", "sighs"),
+    ("whispering",),
+]
+
+
+def strip_tags(text: str) -> str:
+    return _TAG_PATTERN.sub("", text).strip()
+
+
+def phrase_key(text: str, voice_id: str, tags: Optional[Sequence[str]] = None) -> str:
+    """Same key the audio cache uses for plain text + tags, so banked files also serve cache lookups."""
+    if tags is None:
+        tags = extract_tags_from_text(text)
+    return voice_cache_engine.generate_audio_key(strip_tags(text), voice_id, list(tags))
+
+
+def tagged_text(text: str, tags: Sequence[str]) -> str:
+    prefix = "".join(f"[{tag}]" for tag in tags)
+    return f"{prefix} {text}" if prefix else text
+
+
+@dataclass
+class PhraseEntry:
+    key: str
+    text: str
+    tags: List[str]
+    voice_id: str
+    file: str
+    role_ids: List[str] = field(default_factory=list)
+    bytes: int = 0
+    model_id: str = ""
+    created_at: float = 0.0
+
+
+@dataclass
+class PhraseSpec:
+    """One rendering job for the builder."""
+
+    text: str
+    tags: Tuple[str, ...]
+    voice_id: str
+    role_ids: List[str]
+
+    @property
+    def key(self) -> str:
+        return phrase_key(self.text, self.voice_id, self.tags)
+
+
+def default_phrases() -> List[str]:
+    from modules.soft_ling import OPENING_PHRASES
+
+    return list(dict.fromkeys([*OPENING_PHRASES, *COMMON_REPLIES]))
+
+
+def load_phrase_config(path: Optional[Path]) -> Tuple[List[str], List[Tuple[str, ...]]]:
+    """
+    Phrases and tag sets from a JSON file (`{"phrases": [...], "tag_sets": [[...], ...]}`),
+    falling back to the built-in openings/replies and `DEFAULT_TAG_SETS`.
+    """
+    phrases, tag_sets = default_phrases(), list(DEFAULT_TAG_SETS)
+    if path is None:
+        return phrases, tag_sets
+    data = json.loads(Path(path).read_text(encoding="utf-8"))
+    if data.get("phrases"):
+        phrases = [str(item) for item in data["phrases"]]
+        if data.get("include_defaults"):
+            phrases = list(dict.fromkeys([*default_phrases(), *phrases]))
+    if data.get("tag_sets"):
+        tag_sets = [tuple(tags) for tags in data["tag_sets"]]
+    return phrases, tag_sets
+
+
+def rule_tags(text: str) -> Tuple[str, ...]:
+    """Tags the rule engine (the LLM fallback) would attach to this phrase."""
+    try:
+        from emotion_tag_engine import insert_emotion_tags
+    except ImportError:  # pragma: no cover - only missing when run outside the project root
+        return ()
+    return tuple(extract_tags_from_text(insert_emotion_tags(text)))
+
+
+def plan_phrases(
+    phrases: Iterable[str],
+    voices: Dict[str, List[str]],
+    tag_sets: Iterable[Sequence[str]] = DEFAULT_TAG_SETS,
+    include_rule_tags: bool = True,
+) -> List[PhraseSpec]:
+    """
+    Every (phrase, tag set, voice) combination, de-duplicated by cache key.
+
+    `voices` maps voice_id -> role ids using it, so roles that share a voice share files.
+    """
+    tag_sets = [tuple(tags) for tags in tag_sets]
+    specs: Dict[str, PhraseSpec] = {}
+    for phrase in phrases:
+        text = strip_tags(phrase)
+        if not text:
+            continue
+        combos = list(tag_sets)
+        if include_rule_tags:
+            combos.append(rule_tags(text))
+        for tags in combos:
+            for voice_id, role_ids in voices.items():
+                spec = PhraseSpec(text=text, tags=tuple(tags), voice_id=voice_id, role_ids=list(role_ids))
+                specs.setdefault(spec.key, spec)
+    return list(specs.values())
+
+
+class PhraseBank:
+    """
+    Read side of the pre-rendered phrase bank.
+
+    - The manifest (`public/audio/phrase_bank.json`) maps cache keys to files written by
+      `scripts/build_phrase_bank.py`; those files are pinned against cache expiry.
+    - `lookup()` is a dict probe; the manifest is re-read at most every
+      `reload_seconds` and only when its mtime changed.
+    """
+
+    def __init__(self, manifest_path: Optional[Path] = None, reload_seconds: float = 5.0) -> None:
+        self.manifest_path = Path(manifest_path) if manifest_path else voice_cache_engine.PHRASE_BANK_MANIFEST
+        self.reload_seconds = reload_seconds
+        self._lock = threading.Lock()
+        self._entries: Dict[str, PhraseEntry] = {}
+        self._mtime = -1.0
+        self._checked_at = -float("inf")
+
+    def __len__(self) -> int:
+        self._maybe_reload()
+        return len(self._entries)
+
+    @property
+    def directory(self) -> Path:
+        return self.manifest_path.parent
+
+    def lookup(self, text: str, voice_id: str, tags: Optional[Sequence[str]] = None) -> Optional[Path]:
+        """Path of the banked rendering for this text/voice/tags, or None (caller synthesizes live)."""
+        self._maybe_reload()
+        entry = self._entries.get(phrase_key(text, voice_id, tags)) if self._entries else None
+        path = self.directory / entry.file if entry else None
+        if path is None or not path.exists():
+            METRIC_PHRASE_BANK_LOOKUPS.labels("miss").inc()
+            return None
+        METRIC_PHRASE_BANK_LOOKUPS.labels("hit").inc()
+        return path
+
+    def entries(self) -> Dict[str, PhraseEntry]:
+        self._maybe_reload()
+        return dict(self._entries)
+
+    def reload(self) -> None:
+        with self._lock:
+            self._checked_at = -float("inf")
+            self._mtime = -1.0
+        self._maybe_reload()
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_seconds:
+            return
+        with self._lock:
+            self._checked_at = now
+            try:
+                mtime = self.manifest_path.stat().st_mtime
+            except OSError:
+                self._entries, self._mtime = {}, -1.0
+                return
+            if mtime == self._mtime:
+                return
+            self._entries = read_manifest(self.manifest_path)
+            self._mtime = mtime
+            logger.info("phrase bank loaded", extra={"entries": len(self._entries)})
+
+
+def read_manifest(path: Path) -> Dict[str, PhraseEntry]:
+    try:
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        logger.warning("phrase bank manifest unreadable: %s", path, exc_info=True)
+        return {}
+    return {key: PhraseEntry(**entry) for key, entry in data.get("entries", {}).items()}
+
+
+def write_manifest(path: Path, entries: Dict[str, PhraseEntry]) -> None:
+    """Atomic replace, so readers never see a half-written manifest."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = {
+        "version": 1,
+        "generated_at": time.time(),
+        "entries": {key: asdict(entry) for key, entry in sorted(entries.items())},
+    }
+    tmp = path.with_suffix(path.suffix + f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp.replace(path)
+
+
+def build_phrase_bank(
+    specs: Sequence[PhraseSpec],
+    synthesize: Callable[[PhraseSpec], bytes],
+    manifest_path: Optional[Path] = None,
+    force: bool = False,
+    concurrency: int = 4,
+    model_id: str = "",
+) -> Dict[str, int]:
+    """
+    Render every spec not already banked and merge the results into the manifest.
+
+    Files go into the audio cache under their cache key; existing renderings are
+    reused unless `force`. The manifest is rewritten once at the end, atomically.
+    """
+    manifest_path = Path(manifest_path) if manifest_path else voice_cache_engine.PHRASE_BANK_MANIFEST
+    directory = manifest_path.parent
+    directory.mkdir(parents=True, exist_ok=True)
+    entries = read_manifest(manifest_path) if manifest_path.exists() else {}
+    stats = {"planned": len(specs), "rendered": 0, "reused": 0, "failed": 0}
+
+    def entry_for(spec: PhraseSpec, path: Path) -> PhraseEntry:
+        previous = entries.get(spec.key)
+        return PhraseEntry(
+            key=spec.key,
+            text=spec.text,
+            tags=list(spec.tags),
+            voice_id=spec.voice_id,
+            file=path.name,
+            role_ids=sorted(set(spec.role_ids) | set(previous.role_ids if previous else [])),
+            bytes=path.stat().st_size,
+            model_id=model_id or (previous.model_id if previous else ""),
+            created_at=previous.created_at if previous and not force else time.time(),
+        )
+
+    pending: List[PhraseSpec] = []
+    for spec in specs:
+        path = directory / f"{spec.key}.mp3"  # same name as `get_cached_audio_path(key)`
+        if not force and path.exists() and path.stat().st_size > 0:
+            entries[spec.key] = entry_for(spec, path)
+            stats["reused"] += 1
+        else:
+            pending.append(spec)
+
+    def render(spec: PhraseSpec) -> Tuple[PhraseSpec, Optional[Path]]:
+        path = directory / f"{spec.key}.mp3"
+        try:
+            audio = synthesize(spec)
+        except Exception:  # noqa: BLE001
+            logger.warning("phrase render failed", extra={"key": spec.key, "text": spec.text[:40]}, exc_info=True)
+            return spec, None
+        tmp = path.with_suffix(".mp3.tmp")
+        tmp.write_bytes(audio)
+        tmp.replace(path)
+        return spec, path
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        for spec, path in pool.map(render, pending):
+            if path is None:
+                stats["failed"] += 1
+                continue
+            entries[spec.key] = entry_for(spec, path)
+            stats["rendered"] += 1
+
+    write_manifest(manifest_path, entries)
+    stats["entries"] = len(entries)
+    return stats
+
+
+_phrase_bank: Optional[PhraseBank] = None
+
+
+def get_phrase_bank() -> PhraseBank:
+    global _phrase_bank
+    if _phrase_bank is None:
+        _phrase_bank = PhraseBank()
+    return _phrase_bank
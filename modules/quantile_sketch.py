@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import math
+from typing import Any, Dict, Iterable, Optional
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+DEFAULT_MAX_BINS = 2048
+# Values at or below this are counted in the zero bucket (latencies are never negative).
+_MIN_INDEXABLE = 1e-9
+
+
+class DDSketch:
+    """
+    Mergeable quantile sketch with relative-error guarantees (DDSketch, Masson et al. 2019).
+
+    - `add()` is one `log()` plus a dict increment; memory is bounded by `max_bins`
+      (lowest bins are collapsed first, so high quantiles stay accurate).
+    - Any quantile is within `relative_accuracy` of the true value for non-negative
+      inputs, independent of the number of samples.
+    - Sketches built with the same accuracy merge exactly, so per-session sketches can
+      be folded into per-role or fleet-wide aggregates without keeping raw samples.
+    """
+
+    __slots__ = ("relative_accuracy", "max_bins", "_gamma", "_log_gamma", "bins", "zero_count", "count", "sum", "min", "max")
+
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY, max_bins: int = DEFAULT_MAX_BINS) -> None:
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be in (0, 1)")
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max(16, max_bins)
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def __len__(self) -> int:
+        return self.count
+
+    def add(self, value: float, weight: int = 1) -> None:
+        value = float(value)
+        if value <= _MIN_INDEXABLE:
+            self.zero_count += weight
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[index] = self.bins.get(index, 0) + weight
+            if len(self.bins) > self.max_bins:
+                self._collapse()
+        self.count += weight
+        self.sum += value * weight
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def extend(self, values: Iterable[float]) -> None:
+        for value in values:
+            self.add(value)
+
+    def merge(self, other: "DDSketch") -> None:
+        if other.count == 0:
+            return
+        if not math.isclose(other._gamma, self._gamma):
+            raise ValueError("cannot merge sketches with different relative accuracy")
+        for index, bin_count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + bin_count
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        if not 0 <= q <= 1:
+            raise ValueError("quantile must be in [0, 1]")
+        # Nearest-rank definition: the smallest value with at least q * count samples at or below it.
+        rank = max(1, math.ceil(q * self.count - 1e-9))
+        seen = self.zero_count
+        if rank <= seen:
+            return max(self.min, 0.0)
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen >= rank:
+                value = 2 * self._gamma ** index / (self._gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def quantiles(self, qs: Iterable[float]) -> Dict[float, Optional[float]]:
+        return {q: self.quantile(q) for q in qs}
+
+    def summary(self, qs: Iterable[float] = (0.5, 0.95, 0.99), ndigits: int = 1) -> Optional[Dict[str, Any]]:
+        """`{"count", "p50", "p95", "p99", "max"}` for session summaries; None when empty."""
+        if self.count == 0:
+            return None
+        result: Dict[str, Any] = {"count": self.count}
+        for q in qs:
+            result[f"p{q * 100:g}"] = round(self.quantile(q), ndigits)
+        result["max"] = round(self.max, ndigits)
+        return result
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-safe form, e.g. for shipping sketches to a fleet-level aggregator."""
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "bins": {str(k): v for k, v in self.bins.items()},
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "DDSketch":
+        sketch = cls(relative_accuracy=float(data["relative_accuracy"]))
+        sketch.bins = {int(k): int(v) for k, v in data.get("bins", {}).items()}
+        sketch.zero_count = int(data.get("zero_count", 0))
+        sketch.count = int(data.get("count", 0))
+        sketch.sum = float(data.get("sum", 0.0))
+        if sketch.count:
+            sketch.min = float(data["min"])
+            sketch.max = float(data["max"])
+        return sketch
+
+    def _collapse(self) -> None:
+        indices = sorted(self.bins)
+        excess = len(indices) - self.max_bins
+        target = indices[excess]
+        folded = 0
+        for index in indices[:excess]:
+            folded += self.bins.pop(index)
+        self.bins[target] += folded
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import math
+import os
+from dataclasses import dataclass
+from typing import Dict, Mapping, Optional
+
+from modules.metrics import get_metrics_registry
+from modules.shared_state import LimitDecision, SharedStateBackend
+
+logger = logging.getLogger("rate_limit")
+
+_metrics = get_metrics_registry()
+METRIC_RATE_LIMITED = _metrics.counter(
+    "rate_limit_rejections_total", "Requests rejected by the token-bucket limiter", ["route_class"]
+)
+
+# Route classes: expensive upstream work gets its own, smaller budget.
+ROUTE_DEFAULT = "default"
+ROUTE_LLM = "llm"
+ROUTE_TTS = "tts"
+ROUTE_GATEWAY = "gateway"
+
+
+@dataclass(frozen=True)
+class BucketPolicy:
+    per_minute: float
+    burst: float
+
+    @property
+    def enabled(self) -> bool:
+        return self.per_minute > 0 and self.burst > 0
+
+    @property
+    def refill_per_second(self) -> float:
+        return self.per_minute / 60.0
+
+
+def _policy_from_env(name: str, per_minute_default: float, burst_default: Optional[float] = None) -> BucketPolicy:
+    prefix = f"RATE_LIMIT_{name.upper()}"
+    per_minute = float(os.getenv(f"{prefix}_PER_MIN", str(per_minute_default)))
+    burst = float(os.getenv(f"{prefix}_BURST", str(burst_default if burst_default is not None else per_minute)))
+    return BucketPolicy(per_minute=per_minute, burst=burst)
+
+
+def default_policies() -> Dict[str, BucketPolicy]:
+    """
+    `SERVICE_RATE_LIMIT_PER_MIN` stays the general budget; LLM and TTS routes get
+    tighter buckets (`RATE_LIMIT_LLM_PER_MIN`, `RATE_LIMIT_TTS_PER_MIN`, `*_BURST`).
+    """
+    general = float(os.getenv("SERVICE_RATE_LIMIT_PER_MIN", "60"))
+    return {
+        ROUTE_DEFAULT: _policy_from_env(ROUTE_DEFAULT, general),
+        ROUTE_LLM: _policy_from_env(ROUTE_LLM, min(general, 30), min(general, 10)),
+        ROUTE_TTS: _policy_from_env(ROUTE_TTS, min(general, 20), min(general, 5)),
+        ROUTE_GATEWAY: _policy_from_env(ROUTE_GATEWAY, general, min(general, 10)),
+    }
+
+
+def client_identity(api_key: Optional[str], token: Optional[str], host: Optional[str]) -> str:
+    """Stable, non-reversible identity: API keys and tokens are hashed before they become state keys."""
+    raw = api_key or token
+    if raw:
+        return "k:" + hashlib.sha256(raw.encode("utf-8")).hexdigest()[:24]
+    return "ip:" + (host or "anonymous")
+
+
+class RateLimiter:
+    """
+    Token buckets per (identity, route class).
+
+    - Bucket state lives in the shared-state backend: an LRU-bounded in-process table
+      by default, or Redis (one Lua script per check) when `SHARED_STATE_URL` is set.
+    - The in-process path never awaits between read and write, so there is no lock.
+    - If the backend fails the request is allowed (fail open) and a warning is logged.
+    """
+
+    def __init__(self, backend: SharedStateBackend, policies: Optional[Mapping[str, BucketPolicy]] = None) -> None:
+        self.backend = backend
+        self.policies: Dict[str, BucketPolicy] = dict(policies or default_policies())
+
+    def policy(self, route_class: str) -> BucketPolicy:
+        return self.policies.get(route_class) or self.policies[ROUTE_DEFAULT]
+
+    async def check(self, identity: str, route_class: str = ROUTE_DEFAULT, cost: float = 1.0) -> Optional[LimitDecision]:
+        """Take `cost` tokens; returns None when the route class is not limited."""
+        policy = self.policy(route_class)
+        if not policy.enabled:
+            return None
+        try:
+            decision = await self.backend.take_token(
+                f"{route_class}:{identity}", policy.burst, policy.refill_per_second, cost
+            )
+        except Exception:  # noqa: BLE001
+            logger.warning("rate limit backend unavailable; allowing request", exc_info=True)
+            return None
+        if not decision.allowed:
+            METRIC_RATE_LIMITED.labels(route_class).inc()
+        return decision
+
+
+def rate_limit_headers(decision: Optional[LimitDecision]) -> Dict[str, str]:
+    if decision is None:
+        return {}
+    headers = {
+        "X-RateLimit-Limit": str(decision.limit),
+        "X-RateLimit-Remaining": str(max(0, decision.remaining)),
+    }
+    if not decision.allowed:
+        headers["Retry-After"] = str(max(1, math.ceil(decision.retry_after)))
+    return headers
+
+
+class RateLimitHeadersMiddleware:
+    """
+    ASGI middleware that copies the request's limiter decision (`scope["state"]["rate_limit"]`,
+    set by the route dependency) onto the response as `X-RateLimit-*` headers.
+
+    Works for streaming and file responses too, which a dependency-injected `Response`
+    cannot reach.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_headers(message) -> None:
+            if message["type"] == "http.response.start":
+                decision = scope.get("state", {}).get("rate_limit")
+                if decision is not None:
+                    headers = list(message.get("headers", []))
+                    existing = {name.lower() for name, _ in headers}
+                    for name, value in rate_limit_headers(decision).items():
+                        if name.lower().encode("latin-1") not in existing:
+                            headers.append((name.lower().encode("latin-1"), value.encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
@@ -0,0 +1,333 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Deque, Dict, Iterator, List, Optional, TypeVar
+
+from modules.metrics import get_metrics_registry
+from modules.quantile_sketch import DDSketch
+
+logger = logging.getLogger("resilience")
+
+T = TypeVar("T")
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+_STATE_VALUES = {STATE_CLOSED: 0, STATE_HALF_OPEN: 1, STATE_OPEN: 2}
+
+
+class CircuitOpen(Exception):
+    """The upstream's breaker is open; callers should degrade immediately instead of retrying."""
+
+    def __init__(self, upstream: str, retry_after: float) -> None:
+        super().__init__(f"{upstream} circuit open")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class BreakerAttempt:
+    """Outcome of one call made under `CircuitBreaker.attempt()`."""
+
+    __slots__ = ("ok",)
+
+    def __init__(self) -> None:
+        self.ok = False
+
+    def succeeded(self) -> None:
+        self.ok = True
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open breaker driven by a failure-rate window.
+
+    - Outcomes are counted in one-second buckets over `window_seconds`; once at least
+      `min_calls` were seen and the failure rate reaches `failure_rate`, the breaker opens.
+    - While open, `before_call()` raises `CircuitOpen` without touching the network.
+    - After `open_seconds` it lets `half_open_calls` trial calls through: a success closes
+      it (with a fresh window), a failure re-opens it.
+    - Thread-safe: ElevenLabs/LLM calls run in worker threads.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = 0.5,
+        min_calls: int = 10,
+        window_seconds: float = 30.0,
+        open_seconds: float = 15.0,
+        half_open_calls: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = max(1, min_calls)
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_calls = max(1, half_open_calls)
+        self.clock = clock
+        self.state = STATE_CLOSED
+        self._lock = threading.Lock()
+        self._buckets: Deque[List[float]] = deque()  # [second, successes, failures]
+        self._opened_at = 0.0
+        self._trials = 0
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self.state == STATE_OPEN:
+                remaining = self._opened_at + self.open_seconds - self.clock()
+                if remaining > 0:
+                    raise CircuitOpen(self.name, remaining)
+                self._transition(STATE_HALF_OPEN)
+                self._trials = 0
+            if self.state == STATE_HALF_OPEN:
+                if self._trials >= self.half_open_calls:
+                    raise CircuitOpen(self.name, self.open_seconds)
+                self._trials += 1
+
+    def is_open(self) -> bool:
+        """True while calls are rejected outright; unlike `allow()` it never uses up a half-open trial."""
+        with self._lock:
+            return self.state == STATE_OPEN and self._opened_at + self.open_seconds > self.clock()
+
+    def allow(self) -> bool:
+        try:
+            self.before_call()
+        except CircuitOpen:
+            return False
+        return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state == STATE_HALF_OPEN:
+                self._buckets.clear()
+                self._transition(STATE_CLOSED)
+                return
+            self._bucket()[1] += 1
+
+    def record_failure(self) -> None:
+        with self._lock:
+            if self.state == STATE_HALF_OPEN:
+                self._open()
+                return
+            self._bucket()[2] += 1
+            calls = failures = 0.0
+            for _, ok, failed in self._buckets:
+                calls += ok + failed
+                failures += failed
+            if self.state == STATE_CLOSED and calls >= self.min_calls and failures / calls >= self.failure_rate:
+                self._open()
+
+    @contextmanager
+    def attempt(self) -> Iterator[BreakerAttempt]:
+        """
+        `before_call()` plus the outcome of the guarded block. The call counts as a
+        success only if the block calls `attempt.succeeded()`; any other exit (an
+        exception, a cancelled await, a falsy result) records a failure, so a half-open
+        trial is never left unanswered.
+        """
+        self.before_call()
+        attempt = BreakerAttempt()
+        try:
+            yield attempt
+        except BaseException:
+            self.record_failure()
+            raise
+        if attempt.ok:
+            self.record_success()
+        else:
+            self.record_failure()
+
+    def call(self, function: Callable[..., T], *args, **kwargs) -> T:
+        """Run `function` through the breaker; any exception counts as a failure."""
+        self.before_call()
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            calls = sum(ok + failed for _, ok, failed in self._buckets)
+            failures = sum(failed for _, _, failed in self._buckets)
+        return {"state": self.state, "calls": int(calls), "failures": int(failures)}
+
+    def _bucket(self) -> List[float]:
+        second = int(self.clock())
+        horizon = second - self.window_seconds
+        while self._buckets and self._buckets[0][0] <= horizon:
+            self._buckets.popleft()
+        if not self._buckets or self._buckets[-1][0] != second:
+            self._buckets.append([second, 0, 0])
+        return self._buckets[-1]
+
+    def _open(self) -> None:
+        self._opened_at = self.clock()
+        self._transition(STATE_OPEN)
+
+    def _transition(self, state: str) -> None:
+        if state == self.state:
+            return
+        logger.warning("circuit %s: %s -> %s", self.name, self.state, state)
+        self.state = state
+        METRIC_BREAKER_TRANSITIONS.labels(self.name, state).inc()
+
+
+class HedgePolicy:
+    """
+    Hedge delay from the upstream's own time-to-first-byte distribution.
+
+    Latencies go into a DDSketch that is rotated every `window_samples` observations
+    (the previous generation is kept, so the estimate never starts from empty). No
+    hedge is sent until `min_samples` were seen, and at most `budget` of calls hedge.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        quantile: float = 0.95,
+        min_samples: int = 20,
+        window_samples: int = 1000,
+        min_delay: float = 0.05,
+        max_delay: float = 5.0,
+        budget: float = 0.1,
+    ) -> None:
+        self.name = name
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.window_samples = window_samples
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._current = DDSketch()
+        self._previous = DDSketch()
+        self.calls = 0
+        self.hedges = 0
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._current.add(seconds)
+            if self._current.count >= self.window_samples:
+                self._previous, self._current = self._current, DDSketch()
+
+    def delay(self) -> Optional[float]:
+        with self._lock:
+            merged = DDSketch()
+            merged.merge(self._previous)
+            merged.merge(self._current)
+        if merged.count < self.min_samples:
+            return None
+        return min(self.max_delay, max(self.min_delay, merged.quantile(self.quantile)))
+
+    def count_call(self) -> None:
+        with self._lock:
+            self.calls += 1
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > self.budget * max(1, self.calls):
+                return False
+            self.hedges += 1
+            return True
+
+
+_hedge_pool = ThreadPoolExecutor(max_workers=int(os.getenv("HEDGE_MAX_WORKERS", "16")), thread_name_prefix="hedge")
+
+
+def hedged_call(
+    function: Callable[[], T],
+    policy: HedgePolicy,
+    discard: Optional[Callable[[T], None]] = None,
+) -> T:
+    """
+    Run `function`; if it has not returned after `policy.delay()`, start one more copy
+    and return whichever succeeds first. The losing result is passed to `discard`
+    (e.g. to close a streaming response). Blocking; call it from a worker thread.
+    """
+    policy.count_call()
+    start = time.perf_counter()
+    delay = policy.delay()
+    if delay is None:  # not enough history yet: plain call
+        result = function()
+        policy.observe(time.perf_counter() - start)
+        return result
+    primary = _hedge_pool.submit(function)
+    pending = {primary}
+    done, _ = wait(pending, timeout=delay)
+    if not done and policy.try_spend():
+        METRIC_HEDGES.labels(policy.name).inc()
+        pending.add(_hedge_pool.submit(function))
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            exc = future.exception()
+            if exc is not None:
+                error = error or exc
+                continue
+            policy.observe(time.perf_counter() - start)
+            for loser in pending:
+                loser.add_done_callback(lambda f: _discard(f, discard))
+            return future.result()
+    assert error is not None
+    raise error
+
+
+def _discard(future: Future, discard: Optional[Callable]) -> None:
+    if discard is None or future.cancelled() or future.exception() is not None:
+        return
+    try:
+        discard(future.result())
+    except Exception:  # noqa: BLE001
+        logger.debug("failed to discard hedged result", exc_info=True)
+
+
+def hedge_policy_from_env(name: str) -> Optional[HedgePolicy]:
+    """`HEDGE_<NAME>=1` enables hedging for one upstream; `HEDGE_QUANTILE` / `HEDGE_BUDGET` tune it."""
+    if os.getenv(f"HEDGE_{name.upper()}", "0").lower() not in {"1", "true", "on", "yes"}:
+        return None
+    return HedgePolicy(
+        name,
+        quantile=float(os.getenv("HEDGE_QUANTILE", "0.95")),
+        budget=float(os.getenv("HEDGE_BUDGET", "0.1")),
+    )
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """`CIRCUIT_<NAME>_FAILURE_RATE` / `_MIN_CALLS` / `_WINDOW_SECONDS` / `_OPEN_SECONDS` tune one upstream."""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            prefix = f"CIRCUIT_{name.upper()}"
+            breaker = _breakers[name] = CircuitBreaker(
+                name,
+                failure_rate=float(os.getenv(f"{prefix}_FAILURE_RATE", "0.5")),
+                min_calls=int(os.getenv(f"{prefix}_MIN_CALLS", "10")),
+                window_seconds=float(os.getenv(f"{prefix}_WINDOW_SECONDS", "30")),
+                open_seconds=float(os.getenv(f"{prefix}_OPEN_SECONDS", "15")),
+            )
+        return breaker
+
+
+_metrics = get_metrics_registry()
+METRIC_BREAKER_TRANSITIONS = _metrics.counter(
+    "circuit_breaker_transitions_total", "Circuit breaker state changes", ["upstream", "state"]
+)
+METRIC_HEDGES = _metrics.counter("hedged_requests_total", "Second requests sent after the hedge delay", ["upstream"])
+_metrics.gauge("circuit_breaker_state", "0 = closed, 1 = half-open, 2 = open", ["upstream"]).set_function(
+    lambda: {(name,): float(_STATE_VALUES[breaker.state]) for name, breaker in list(_breakers.items())}
+)
@@ -7,6 +7,8 @@ import threading
 from dataclasses import dataclass, field
 from typing import Dict, Optional, Set
 
+from modules.shared_state import SharedStateBackend
+
 logger = logging.getLogger("role_registry")
 
 
@@ -35,12 +37,20 @@ class RoleRegistry:
     - Loads configuration from environment variable `GATEWAY_ROLES` (JSON array)
       or falls back to built-in defaults (huangrong, xiaoruan, pipi).
     - Tracks which sessions are using each role to enforce concurrency limits.
+    - With a `shared_state` backend the `*_async` methods also hold a cluster-wide
+      seat per session (TTL `ROLE_SEAT_TTL_SECONDS`, kept alive by `heartbeat_role`),
+      so `max_sessions` holds across workers and replicas. If the backend is
+      unreachable they fall back to the per-process limit.
     """
 
-    def __init__(self) -> None:
+    _UNBOUNDED = 1 << 30
+
+    def __init__(self, shared_state: Optional[SharedStateBackend] = None) -> None:
         self._lock = threading.RLock()
         self._roles: Dict[str, RoleChannelState] = {}
         self._default_role: str = "huangrong"
+        self.shared_state = shared_state
+        self.seat_ttl = float(os.getenv("ROLE_SEAT_TTL_SECONDS", "30"))
         self._load_roles()
 
     def _load_roles(self) -> None:
@@ -173,6 +183,69 @@ class RoleRegistry:
             return target_state.config
 
 
+    # ---- cluster-wide seats -------------------------------------------------
+
+    @staticmethod
+    def _seat_pool(role_id: str) -> str:
+        return f"role:{role_id}"
+
+    def _config(self, role_id: str) -> RoleChannelConfig:
+        with self._lock:
+            state = self._roles.get(role_id)
+            if not state:
+                raise ValueError(f"role_not_found:{role_id}")
+            return state.config
+
+    async def _shared_seat_op(self, operation: str, *args) -> bool:
+        try:
+            return await getattr(self.shared_state, operation)(*args)
+        except Exception:  # noqa: BLE001
+            logger.warning("Shared seat backend unavailable (%s); using per-process limits", operation, exc_info=True)
+            return True
+
+    async def acquire_role_async(self, role_id: Optional[str], session_id: str) -> RoleChannelConfig:
+        target_role = role_id or self._default_role
+        config = self._config(target_role)
+        if self.shared_state is None:
+            return self.acquire_role(target_role, session_id)
+        pool = self._seat_pool(target_role)
+        if not await self._shared_seat_op("acquire_seat", pool, session_id, config.max_sessions, self.seat_ttl):
+            raise RuntimeError(f"role_capacity_exceeded:{target_role}")
+        try:
+            return self.acquire_role(target_role, session_id)
+        except Exception:
+            await self._shared_seat_op("release_seat", pool, session_id)
+            raise
+
+    async def switch_role_async(self, current_role: str, new_role: str, session_id: str) -> RoleChannelConfig:
+        if self.shared_state is None or current_role == new_role:
+            return self.switch_role(current_role, new_role, session_id)
+        config = self._config(new_role)
+        source, target = self._seat_pool(current_role), self._seat_pool(new_role)
+        if not await self._shared_seat_op("move_seat", source, target, session_id, config.max_sessions, self.seat_ttl):
+            raise RuntimeError(f"role_capacity_exceeded:{new_role}")
+        try:
+            return self.switch_role(current_role, new_role, session_id)
+        except Exception:
+            # Hand the seat back; the session still holds its previous role locally.
+            await self._shared_seat_op("move_seat", target, source, session_id, self._UNBOUNDED, self.seat_ttl)
+            raise
+
+    async def release_role_async(self, role_id: str, session_id: str) -> None:
+        self.release_role(role_id, session_id)
+        if self.shared_state is not None:
+            await self._shared_seat_op("release_seat", self._seat_pool(role_id), session_id)
+
+    async def heartbeat_role(self, role_id: str, session_id: str) -> bool:
+        """Refresh the session's seat TTL; re-acquires it if it already expired."""
+        if self.shared_state is None:
+            return True
+        pool = self._seat_pool(role_id)
+        if await self._shared_seat_op("heartbeat_seat", pool, session_id, self.seat_ttl):
+            return True
+        return await self._shared_seat_op("acquire_seat", pool, session_id, self._config(role_id).max_sessions, self.seat_ttl)
+
+
 def VOICE_ID_DEFAULT(name: str) -> str:
     """Helper to provide deterministic fallback voice IDs for defaults."""
     defaults = {
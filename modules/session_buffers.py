@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+from array import array
+
+OVERFLOW_TRIM = "trim"
+OVERFLOW_REJECT = "reject"
+
+
+class ChunkArena:
+    """
+    Byte-capped store for one utterance's audio chunks.
+
+    - Chunks are copied into a single growable `bytearray`; an `array('Q')` of end
+      offsets indexes them, so per-chunk overhead is 8 bytes instead of a `bytes`
+      object header.
+    - When a new chunk would exceed `max_bytes`, the `trim` policy evicts the oldest
+      chunks *after* the first `keep_head` ones (WebM/Ogg carry the container header
+      in the first chunk) until at least `trim_fraction` of the budget is free; the
+      `reject` policy refuses the chunk instead.
+    """
+
+    __slots__ = (
+        "max_bytes",
+        "policy",
+        "keep_head",
+        "trim_fraction",
+        "_data",
+        "_ends",
+        "trimmed_bytes",
+        "trimmed_chunks",
+        "rejected_bytes",
+        "rejected_chunks",
+        "peak_bytes",
+    )
+
+    def __init__(
+        self,
+        max_bytes: int,
+        policy: str = OVERFLOW_TRIM,
+        keep_head: int = 1,
+        trim_fraction: float = 0.25,
+    ) -> None:
+        if policy not in {OVERFLOW_TRIM, OVERFLOW_REJECT}:
+            raise ValueError(f"unknown overflow policy: {policy}")
+        self.max_bytes = max(1, max_bytes)
+        self.policy = policy
+        self.keep_head = max(0, keep_head)
+        self.trim_fraction = min(1.0, max(0.0, trim_fraction))
+        self._data = bytearray()
+        self._ends = array("Q")
+        self.trimmed_bytes = 0
+        self.trimmed_chunks = 0
+        self.rejected_bytes = 0
+        self.rejected_chunks = 0
+        self.peak_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._ends)
+
+    def __bool__(self) -> bool:
+        return bool(self._ends)
+
+    @property
+    def nbytes(self) -> int:
+        """Payload bytes currently held."""
+        return len(self._data)
+
+    @property
+    def footprint(self) -> int:
+        """Payload plus index bytes (what the session is charged for)."""
+        return len(self._data) + self._ends.itemsize * len(self._ends)
+
+    def append(self, chunk: bytes) -> bool:
+        """Store a chunk; returns False when it was rejected for being over budget."""
+        size = len(chunk)
+        if size > self.max_bytes or (
+            len(self._data) + size > self.max_bytes
+            and (self.policy == OVERFLOW_REJECT or not self._trim(size))
+        ):
+            self.rejected_bytes += size
+            self.rejected_chunks += 1
+            return False
+        self._data += chunk
+        self._ends.append(len(self._data))
+        if len(self._data) > self.peak_bytes:
+            self.peak_bytes = len(self._data)
+        return True
+
+    def chunk(self, index: int) -> bytes:
+        start = self._ends[index - 1] if index > 0 else 0
+        return bytes(self._data[start:self._ends[index]])
+
+    def to_bytes(self) -> bytes:
+        """One contiguous copy of every held chunk (safe to hand to another task/thread)."""
+        return bytes(self._data)
+
+    def clear(self) -> None:
+        self._data = bytearray()
+        self._ends = array("Q")
+
+    def _trim(self, incoming: int) -> bool:
+        target = self.max_bytes - max(incoming, int(self.max_bytes * self.trim_fraction))
+        count = len(self._ends)
+        head = min(self.keep_head, count)
+        if head >= count:
+            return False
+        head_end = self._ends[head - 1] if head else 0
+        last = head
+        while last < count - 1 and len(self._data) - (self._ends[last] - head_end) > target:
+            last += 1
+        cut_end = self._ends[last]
+        removed = cut_end - head_end
+        del self._data[head_end:cut_end]
+        self._ends = self._ends[:head] + array("Q", (end - removed for end in self._ends[last + 1:]))
+        self.trimmed_bytes += removed
+        self.trimmed_chunks += last - head + 1
+        return len(self._data) + incoming <= self.max_bytes
+
@@ -0,0 +1,309 @@
+from __future__ import annotations
+
+import logging
+import math
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+try:
+    import redis.asyncio as redis_async
+except ImportError:  # pragma: no cover - optional dependency
+    redis_async = None  # type: ignore
+
+logger = logging.getLogger("shared_state")
+
+
+@dataclass(frozen=True)
+class LimitDecision:
+    allowed: bool
+    limit: int
+    remaining: int
+    retry_after: float  # seconds until the next request would be allowed (0 when allowed)
+
+
+def _token_bucket(
+    tokens: float, updated_ms: int, now_ms: int, capacity: float, refill_per_ms: float, cost: float
+) -> Tuple[bool, float, int]:
+    """Refill then try to take `cost` tokens. Returns (allowed, tokens_left, retry_after_ms)."""
+    tokens = min(capacity, tokens + max(0, now_ms - updated_ms) * refill_per_ms)
+    if tokens >= cost:
+        return True, tokens - cost, 0
+    if refill_per_ms <= 0:
+        return False, tokens, 60_000
+    return False, tokens, max(1, math.ceil((cost - tokens) / refill_per_ms))
+
+
+class SharedStateBackend(ABC):
+    """
+    State that must agree across uvicorn workers and replicas.
+
+    - `take_token`: token bucket (`capacity` burst, `refill_per_second` sustained rate).
+    - Seats: capacity-limited membership pools (one per role) whose members expire
+      unless refreshed with `heartbeat_seat`, so a crashed worker cannot leak seats.
+    """
+
+    distributed = False
+
+    @abstractmethod
+    async def take_token(self, key: str, capacity: float, refill_per_second: float, cost: float = 1.0) -> LimitDecision:
+        ...
+
+    @abstractmethod
+    async def acquire_seat(self, pool: str, member: str, capacity: int, ttl_seconds: float) -> bool:
+        ...
+
+    @abstractmethod
+    async def move_seat(self, source: str, target: str, member: str, capacity: int, ttl_seconds: float) -> bool:
+        ...
+
+    @abstractmethod
+    async def heartbeat_seat(self, pool: str, member: str, ttl_seconds: float) -> bool:
+        ...
+
+    @abstractmethod
+    async def release_seat(self, pool: str, member: str) -> None:
+        ...
+
+    @abstractmethod
+    async def seat_count(self, pool: str) -> int:
+        ...
+
+    async def close(self) -> None:
+        return None
+
+
+class InMemoryStateBackend(SharedStateBackend):
+    """
+    Single-process implementation with the same semantics as the Redis backend.
+
+    No locks are needed: every method runs to completion on the event loop without
+    awaiting. Token buckets live in an LRU table capped at `max_buckets` (an evicted
+    client simply starts again with a full bucket).
+    """
+
+    def __init__(
+        self,
+        clock: Callable[[], float] = time.time,
+        max_buckets: Optional[int] = None,
+    ) -> None:
+        self._clock = clock
+        self._buckets: "OrderedDict[str, Tuple[float, int]]" = OrderedDict()  # key -> (tokens, updated ms)
+        self.max_buckets = max_buckets or int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "10000"))
+        self._seats: Dict[str, Dict[str, float]] = {}
+
+    def _now_ms(self) -> int:
+        return int(self._clock() * 1000)
+
+    async def take_token(self, key: str, capacity: float, refill_per_second: float, cost: float = 1.0) -> LimitDecision:
+        now_ms = self._now_ms()
+        tokens, updated_ms = self._buckets.get(key, (capacity, now_ms))
+        allowed, tokens, retry_ms = _token_bucket(tokens, updated_ms, now_ms, capacity, refill_per_second / 1000.0, cost)
+        self._buckets[key] = (tokens, now_ms)
+        self._buckets.move_to_end(key)
+        if len(self._buckets) > self.max_buckets:
+            self._buckets.popitem(last=False)
+        return LimitDecision(allowed, int(capacity), int(tokens), retry_ms / 1000.0)
+
+    def _live_pool(self, pool: str) -> Dict[str, float]:
+        members = self._seats.setdefault(pool, {})
+        now = self._clock()
+        for member in [m for m, expiry in members.items() if expiry <= now]:
+            del members[member]
+        return members
+
+    async def acquire_seat(self, pool: str, member: str, capacity: int, ttl_seconds: float) -> bool:
+        members = self._live_pool(pool)
+        if member not in members and len(members) >= capacity:
+            return False
+        members[member] = self._clock() + ttl_seconds
+        return True
+
+    async def move_seat(self, source: str, target: str, member: str, capacity: int, ttl_seconds: float) -> bool:
+        if source == target:
+            return await self.acquire_seat(target, member, capacity, ttl_seconds)
+        members = self._live_pool(target)
+        if member not in members and len(members) >= capacity:
+            return False
+        self._live_pool(source).pop(member, None)
+        members[member] = self._clock() + ttl_seconds
+        return True
+
+    async def heartbeat_seat(self, pool: str, member: str, ttl_seconds: float) -> bool:
+        members = self._live_pool(pool)
+        if member not in members:
+            return False
+        members[member] = self._clock() + ttl_seconds
+        return True
+
+    async def release_seat(self, pool: str, member: str) -> None:
+        self._seats.get(pool, {}).pop(member, None)
+
+    async def seat_count(self, pool: str) -> int:
+        return len(self._live_pool(pool))
+
+
+# Times come from the Redis server (TIME) so replicas with skewed clocks agree.
+_LUA_NOW_MS = "local t = redis.call('TIME'); local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)\n"
+
+_LUA_TOKEN_BUCKET = _LUA_NOW_MS + """
+local capacity = tonumber(ARGV[1])
+local refill_per_ms = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * refill_per_ms)
+local allowed = 0
+local retry = 0
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+elseif refill_per_ms > 0 then
+  retry = math.max(1, math.ceil((cost - tokens) / refill_per_ms))
+else
+  retry = 60000
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+-- A bucket untouched for one full refill is indistinguishable from a new one.
+local idle_ms = 60000
+if refill_per_ms > 0 then idle_ms = math.ceil(capacity / refill_per_ms) + 1000 end
+redis.call('PEXPIRE', KEYS[1], idle_ms)
+return {allowed, math.floor(tokens), retry}
+"""
+
+_LUA_ACQUIRE_SEAT = _LUA_NOW_MS + """
+local capacity = tonumber(ARGV[2])
+local ttl = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if not redis.call('ZSCORE', KEYS[1], ARGV[1]) and redis.call('ZCARD', KEYS[1]) >= capacity then
+  return 0
+end
+redis.call('ZADD', KEYS[1], now + ttl, ARGV[1])
+redis.call('PEXPIRE', KEYS[1], ttl * 2)
+return 1
+"""
+
+_LUA_MOVE_SEAT = _LUA_NOW_MS + """
+local capacity = tonumber(ARGV[2])
+local ttl = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+if not redis.call('ZSCORE', KEYS[2], ARGV[1]) and redis.call('ZCARD', KEYS[2]) >= capacity then
+  return 0
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('ZADD', KEYS[2], now + ttl, ARGV[1])
+redis.call('PEXPIRE', KEYS[2], ttl * 2)
+return 1
+"""
+
+_LUA_HEARTBEAT_SEAT = _LUA_NOW_MS + """
+local ttl = tonumber(ARGV[2])
+local expiry = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not expiry or tonumber(expiry) <= now then
+  redis.call('ZREM', KEYS[1], ARGV[1])
+  return 0
+end
+redis.call('ZADD', KEYS[1], now + ttl, ARGV[1])
+redis.call('PEXPIRE', KEYS[1], ttl * 2)
+return 1
+"""
+
+_LUA_SEAT_COUNT = _LUA_NOW_MS + """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+return redis.call('ZCARD', KEYS[1])
+"""
+
+
+class RedisStateBackend(SharedStateBackend):
+    """
+    Redis implementation; every operation is a single Lua script, so checks and
+    updates are atomic across workers. Seats are sorted sets scored by expiry time.
+    """
+
+    distributed = True
+
+    def __init__(self, client, prefix: str = "lingya:") -> None:
+        self.client = client
+        self.prefix = prefix
+        self._token_bucket = client.register_script(_LUA_TOKEN_BUCKET)
+        self._acquire = client.register_script(_LUA_ACQUIRE_SEAT)
+        self._move = client.register_script(_LUA_MOVE_SEAT)
+        self._heartbeat = client.register_script(_LUA_HEARTBEAT_SEAT)
+        self._count = client.register_script(_LUA_SEAT_COUNT)
+
+    @classmethod
+    def from_url(cls, url: str, prefix: str = "lingya:") -> "RedisStateBackend":
+        if redis_async is None:
+            raise RuntimeError("redis package is required for SHARED_STATE_URL")
+        return cls(redis_async.from_url(url), prefix=prefix)
+
+    def _seat_key(self, pool: str) -> str:
+        return f"{self.prefix}seats:{pool}"
+
+    async def take_token(self, key: str, capacity: float, refill_per_second: float, cost: float = 1.0) -> LimitDecision:
+        allowed, remaining, retry_ms = await self._token_bucket(
+            keys=[f"{self.prefix}tb:{key}"], args=[capacity, refill_per_second / 1000.0, cost]
+        )
+        return LimitDecision(bool(allowed), int(capacity), int(remaining), int(retry_ms) / 1000.0)
+
+    async def acquire_seat(self, pool: str, member: str, capacity: int, ttl_seconds: float) -> bool:
+        result = await self._acquire(keys=[self._seat_key(pool)], args=[member, capacity, int(ttl_seconds * 1000)])
+        return bool(result)
+
+    async def move_seat(self, source: str, target: str, member: str, capacity: int, ttl_seconds: float) -> bool:
+        result = await self._move(
+            keys=[self._seat_key(source), self._seat_key(target)],
+            args=[member, capacity, int(ttl_seconds * 1000)],
+        )
+        return bool(result)
+
+    async def heartbeat_seat(self, pool: str, member: str, ttl_seconds: float) -> bool:
+        result = await self._heartbeat(keys=[self._seat_key(pool)], args=[member, int(ttl_seconds * 1000)])
+        return bool(result)
+
+    async def release_seat(self, pool: str, member: str) -> None:
+        await self.client.zrem(self._seat_key(pool), member)
+
+    async def seat_count(self, pool: str) -> int:
+        return int(await self._count(keys=[self._seat_key(pool)], args=[]))
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+_shared_state: Optional[SharedStateBackend] = None
+
+
+def create_shared_state() -> SharedStateBackend:
+    """Redis when `SHARED_STATE_URL` (or `REDIS_URL`) is set and the client is installed, else in-memory."""
+    url = os.getenv("SHARED_STATE_URL") or os.getenv("REDIS_URL")
+    if url:
+        try:
+            backend = RedisStateBackend.from_url(url, prefix=os.getenv("SHARED_STATE_PREFIX", "lingya:"))
+            logger.info("Shared state backend: redis")
+            return backend
+        except RuntimeError as exc:
+            logger.warning("%s; falling back to in-memory shared state", exc)
+    return InMemoryStateBackend()
+
+
+def get_shared_state() -> SharedStateBackend:
+    global _shared_state
+    if _shared_state is None:
+        _shared_state = create_shared_state()
+    return _shared_state
+
+
+async def close_shared_state() -> None:
+    global _shared_state
+    if _shared_state is not None:
+        try:
+            await _shared_state.close()
+        except Exception:  # noqa: BLE001
+            logger.debug("shared state close failed", exc_info=True)
+        _shared_state = None
+
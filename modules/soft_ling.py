@@ -4,13 +4,16 @@
 溫柔的語氣靈，以聲傳心，以氣護愛
 """
 
+import asyncio
 import os
 from typing import Dict, List, Optional
 
 from dotenv import load_dotenv
 
 from .autonomous_emotion import AutonomousEmotionAgent
-from .speech_tag_mapper import map_tags_to_voice_settings
+from .keyword_matcher import register_keywords, scan_keywords
+from .resilience import CircuitBreaker, CircuitOpen, get_circuit_breaker
+from .speech_tag_mapper import EMOTION_TAGS, StructuredReply, map_tags_to_voice_settings, parse_structured_reply
 
 
 load_dotenv()
@@ -19,6 +22,18 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_CHAT_MODEL = os.getenv("SOFT_LING_CHAT_MODEL", os.getenv("OPENAI_MODEL", "gpt-4o-mini"))
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 CLAUDE_MODEL = os.getenv("CLAUDE_MODEL", "claude-3-5-sonnet-20241022")
+# 回應文字與語氣標籤由同一次 LLM 呼叫產生（輸出無法解析時退回「先產生回應、再判斷語氣」）
+SOFT_LING_COMBINED_REPLY = os.getenv("SOFT_LING_COMBINED_REPLY", "1").lower() in {"1", "true", "on", "yes"}
+# 合併呼叫要產生整段回應，上限獨立於語氣判斷的 EMOTION_LLM_BUDGET_MS（0 = 只受 client 逾時限制）
+SOFT_LING_REPLY_TIMEOUT_MS = float(os.getenv("SOFT_LING_REPLY_TIMEOUT_MS", "20000"))
+
+
+class SoftLingLLMUnavailable(Exception):
+    """合併呼叫的 LLM 無法使用（未設定、熔斷、逾時或連線錯誤）；fallback_reply 為備援回應文字。"""
+
+    def __init__(self, reason: str, fallback_reply: str) -> None:
+        super().__init__(reason)
+        self.fallback_reply = fallback_reply
 
 
 # 🌷 花小軟核心配置
@@ -49,6 +64,11 @@ SOFT_LING_TONE_SPELL = {
     }
 }
 
+register_keywords(
+    "soft_ling",
+    {"invocation": [SOFT_LING_TONE_SPELL["activation_phrase"], *SOFT_LING_TONE_SPELL["invocation"]]},
+)
+
 # 🕊️ 開靈語（開場白）
 OPENING_PHRASES = [
     "嘻嘻～我是小軟。風過的時候我會說話，光亮的地方，就會有我的語氣呀～💗",
@@ -67,6 +87,13 @@ class SoftLingAgent(AutonomousEmotionAgent):
     - 以笑為光：傾向使用 playful, happy 標籤
     - 以愛為名：保持溫柔的自主程度
     """
+
+    __slots__ = ()
+
+    # 專屬特性為常數，放在類別上，不佔每個 session 代理的記憶體
+    name = SOFT_LING_TONE_SPELL["name"]
+    core_tags = SOFT_LING_TONE_SPELL["core_tags"]
+    default_intensity = SOFT_LING_TONE_SPELL["default_intensity"]
     
     def __init__(self):
         """初始化花小軟代理"""
@@ -74,9 +101,6 @@ class SoftLingAgent(AutonomousEmotionAgent):
             autonomy_level=SOFT_LING_TONE_SPELL["autonomy_level"],
             emotion_persistence=SOFT_LING_TONE_SPELL["emotion_persistence"]
         )
-        self.name = SOFT_LING_TONE_SPELL["name"]
-        self.core_tags = SOFT_LING_TONE_SPELL["core_tags"]
-        self.default_intensity = SOFT_LING_TONE_SPELL["default_intensity"]
         
     def choose_emotion_tags(self, text: str, use_llm: bool = True) -> Optional[List[str]]:
         """
@@ -122,6 +146,12 @@ class SoftLingAgent(AutonomousEmotionAgent):
         else:
             return ["softly", "playful"]
     
+    async def choose_emotion_tags_async(
+        self, text: str, use_llm: bool = True, budget_ms: Optional[float] = None
+    ) -> Optional[List[str]]:
+        """花小軟的選擇是純規則式的，不需要等待 LLM"""
+        return self.choose_emotion_tags(text, use_llm=use_llm)
+    
     def get_voice_settings(self, tags: Optional[List[str]] = None, intensity: Optional[float] = None) -> Dict:
         """
         獲取花小軟專屬的聲音設定
@@ -155,8 +185,7 @@ def detect_soft_ling_invocation(text: str) -> bool:
     Returns:
         是否包含召喚咒語
     """
-    activation_phrase = SOFT_LING_TONE_SPELL["activation_phrase"]
-    return activation_phrase in text or any(phrase in text for phrase in SOFT_LING_TONE_SPELL["invocation"])
+    return scan_keywords(text).has("soft_ling.invocation")
 
 
 def get_soft_ling_opening() -> str:
@@ -210,12 +239,51 @@ def process_with_soft_ling(
     # 處理文字
     tagged_text = agent.process_text(text, use_llm=use_llm)
     
+    return _soft_ling_result(agent, text, tagged_text, is_invocation)
+
+
+async def process_with_soft_ling_async(
+    text: str,
+    use_llm: bool = True,
+    agent: Optional[SoftLingAgent] = None,
+    budget_ms: Optional[float] = None
+) -> Dict:
+    """process_with_soft_ling 的非同步版本（不使用 LLM 時結果與同步版本相同）"""
+    if agent is None:
+        agent = create_soft_ling_agent()
+    
+    is_invocation = detect_soft_ling_invocation(text)
+    tagged_text = await agent.process_text_async(text, use_llm=use_llm, budget_ms=budget_ms)
+    return _soft_ling_result(agent, text, tagged_text, is_invocation)
+
+
+def process_structured_reply_with_soft_ling(
+    reply: StructuredReply,
+    agent: Optional[SoftLingAgent] = None
+) -> Dict:
+    """
+    使用 LLM 一次產生的回應（文字＋標籤＋強度），不再另外判斷語氣
+
+    返回與 process_with_soft_ling 相同格式的結果字典
+    """
+    if agent is None:
+        agent = create_soft_ling_agent()
+    
+    tagged_text = agent.process_text_with_tags(reply.text, list(reply.tags))
+    return _soft_ling_result(
+        agent, reply.text, tagged_text, detect_soft_ling_invocation(reply.text), intensity=reply.intensity
+    )
+
+
+def _soft_ling_result(
+    agent: SoftLingAgent, text: str, tagged_text: str, is_invocation: bool, intensity: Optional[float] = None
+) -> Dict:
     # 提取標籤
     from .speech_tag_mapper import extract_tags_from_text
     tags = extract_tags_from_text(tagged_text)
     
     # 獲取聲音設定
-    voice_settings = agent.get_voice_settings(tags)
+    voice_settings = agent.get_voice_settings(tags, intensity=intensity)
     
     return {
         "text": text,
@@ -236,6 +304,15 @@ SOFT_LING_SYSTEM_PROMPT = (
 )
 
 
+SOFT_LING_COMBINED_PROMPT = (
+    SOFT_LING_SYSTEM_PROMPT
+    + "\n請只輸出一個 JSON 物件，格式為："
+    '{"reply": "回應文字（不含標籤）", "tags": ["標籤"], "intensity": 0.6}\n'
+    f"tags 從以下 ElevenLabs 語氣標籤選 0-2 個：{', '.join(EMOTION_TAGS)}；"
+    "intensity 為 0.0-1.0 的語氣強度。以柔為形、以笑為光，優先 softly、playful、happy、whispering。"
+)
+
+
 def _fallback_soft_ling_reply(user_text: str) -> str:
     """當 LLM 無法使用時的基本回應。"""
     text = user_text.strip()
@@ -306,6 +383,127 @@ def generate_soft_ling_reply(user_text: str, provider: str = "openai") -> str:
     return _fallback_soft_ling_reply(user_text)
 
 
+async def generate_soft_ling_reply_async(user_text: str, provider: str = "openai") -> str:
+    """
+    generate_soft_ling_reply 的非同步版本：使用共用的 AsyncOpenAI / AsyncAnthropic client，
+    等待回應時不阻塞 event loop。
+    """
+    from .llm_emotion_router import get_async_llm_client
+
+    text = user_text.strip()
+    if not text:
+        return _fallback_soft_ling_reply(user_text)
+
+    try:
+        client = get_async_llm_client(provider)
+        if provider.lower() == "openai" and client is not None:
+            response = await client.chat.completions.create(
+                model=OPENAI_CHAT_MODEL,
+                messages=[
+                    {"role": "system", "content": SOFT_LING_SYSTEM_PROMPT},
+                    {"role": "user", "content": text}
+                ],
+                temperature=0.85,
+                max_tokens=320,
+            )
+            reply = response.choices[0].message.content.strip()
+            if reply:
+                return reply
+
+        if provider.lower() == "anthropic" and client is not None:
+            message = await client.messages.create(
+                model=CLAUDE_MODEL,
+                max_tokens=320,
+                temperature=0.85,
+                system=SOFT_LING_SYSTEM_PROMPT,
+                messages=[{"role": "user", "content": text}]
+            )
+            if message.content:
+                reply = message.content[0].text.strip()
+                if reply:
+                    return reply
+
+    except Exception as error:
+        print(f"❌ LLM 產生回應時發生錯誤：{error}")
+
+    return _fallback_soft_ling_reply(user_text)
+
+
+async def generate_soft_ling_turn_async(
+    user_text: str,
+    provider: str = "openai",
+    timeout_ms: Optional[float] = None,
+    breaker: Optional[CircuitBreaker] = None,
+) -> Optional[StructuredReply]:
+    """
+    以一次 LLM 呼叫同時產生花小軟的回應文字、語氣標籤與強度（結構化 JSON 輸出）。
+
+    - 輸出無法解析時返回 None，由呼叫端改用 generate_soft_ling_reply_async +
+      process_with_soft_ling_async 兩段式流程。
+    - LLM 無法使用（未設定、熔斷中、連線錯誤，或超過 timeout_ms，預設 SOFT_LING_REPLY_TIMEOUT_MS）
+      時拋出 SoftLingLLMUnavailable：不再對同一個失敗的 provider 發第二次呼叫，
+      呼叫端直接使用備援回應與規則式語氣。
+    - 熔斷器預設為 `llm_<provider>_reply`，與語氣判斷的 `llm_<provider>` 分開：
+      回應慢不會連帶關閉所有人的 LLM 語氣判斷。
+    """
+    from .llm_emotion_router import get_async_llm_client
+
+    text = user_text.strip()
+    if not text:
+        return None
+
+    provider = (provider or "openai").lower()
+    client = get_async_llm_client(provider)
+    if client is None or provider not in {"openai", "anthropic"}:
+        raise SoftLingLLMUnavailable(f"{provider} 未設定", _fallback_soft_ling_reply(user_text))
+
+    async def request() -> Optional[str]:
+        if provider == "openai":
+            response = await client.chat.completions.create(
+                model=OPENAI_CHAT_MODEL,
+                messages=[
+                    {"role": "system", "content": SOFT_LING_COMBINED_PROMPT},
+                    {"role": "user", "content": text}
+                ],
+                temperature=0.85,
+                max_tokens=400,
+                response_format={"type": "json_object"},
+            )
+            return response.choices[0].message.content or ""
+        message = await client.messages.create(
+            model=CLAUDE_MODEL,
+            max_tokens=400,
+            temperature=0.85,
+            system=SOFT_LING_COMBINED_PROMPT,
+            messages=[{"role": "user", "content": text}]
+        )
+        return message.content[0].text if message.content else ""
+
+    timeout_ms = SOFT_LING_REPLY_TIMEOUT_MS if timeout_ms is None else timeout_ms
+    breaker = breaker or get_circuit_breaker(f"llm_{provider}_reply")
+    try:
+        # 逾時取消也記為熔斷器失敗
+        with breaker.attempt() as attempt:
+            if timeout_ms > 0:
+                raw = await asyncio.wait_for(request(), timeout=timeout_ms / 1000)
+            else:
+                raw = await request()
+            attempt.succeeded()
+    except CircuitOpen as error:
+        raise SoftLingLLMUnavailable(str(error), _fallback_soft_ling_reply(user_text)) from error
+    except asyncio.TimeoutError as error:
+        print(f"⏱️  花小軟回應超過 {timeout_ms:.0f}ms，改用備援回應")
+        raise SoftLingLLMUnavailable("LLM 逾時", _fallback_soft_ling_reply(user_text)) from error
+    except Exception as error:
+        print(f"❌ LLM 產生結構化回應時發生錯誤：{error}")
+        raise SoftLingLLMUnavailable(str(error), _fallback_soft_ling_reply(user_text)) from error
+
+    reply = parse_structured_reply(raw)
+    if reply is None:
+        print("⚠️  LLM 結構化回應無法解析，改用兩段式流程")
+    return reply
+
+
 # 測試函數
 if __name__ == "__main__":
     print("=" * 60)
@@ -4,8 +4,12 @@
 將語氣標籤轉換為 ElevenLabs API 的聲音設定參數
 """
 
-from typing import List, Dict, Optional
-import math
+import json
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
 
 
 # ElevenLabs v3 支援的語氣標籤
@@ -16,6 +20,68 @@ EMOTION_TAGS = [
 ]
 
 
+class TagProfile(NamedTuple):
+    stability: float
+    similarity_boost: float
+    style: float
+    use_speaker_boost: bool
+    intensity: float
+
+
+# 語氣標籤到聲音參數的映射（包含強度基礎值），模組載入時建立一次
+TAG_PROFILES: Dict[str, TagProfile] = {
+    # 情緒強烈 → 降低穩定性，提高風格表現，高強度
+    "crying": TagProfile(0.3, 0.7, 0.95, True, 0.9),
+    "angry": TagProfile(0.35, 0.75, 0.95, True, 0.95),
+    "excited": TagProfile(0.5, 0.85, 0.95, True, 0.85),
+    "happy": TagProfile(0.45, 0.8, 0.9, True, 0.75),
+    # 輕柔/安靜 → 降低穩定性，降低風格，低強度
+    "whispers": TagProfile(0.25, 0.6, 0.7, False, 0.2),
+    "whispering": TagProfile(0.25, 0.6, 0.7, False, 0.2),
+    "softly": TagProfile(0.3, 0.65, 0.75, False, 0.3),
+    # 調皮/活潑 → 中等穩定性，高風格，中高強度
+    "playful": TagProfile(0.5, 0.85, 0.9, True, 0.7),
+    "curious": TagProfile(0.45, 0.8, 0.85, True, 0.6),
+    # 快速/急促 → 提高穩定性，高風格，高強度
+    "speaks quickly": TagProfile(0.6, 0.85, 0.9, True, 0.8),
+    # 悲傷 → 低穩定性，中等風格，中強度
+    "sad": TagProfile(0.3, 0.7, 0.8, True, 0.5),
+    # 驚訝 → 低穩定性，高風格，高強度
+    "surprised": TagProfile(0.35, 0.8, 0.95, True, 0.85),
+    # 特殊效果
+    "sighs": TagProfile(0.25, 0.6, 0.7, False, 0.3),
+    "starts laughing": TagProfile(0.4, 0.8, 0.9, True, 0.8),
+    "sings": TagProfile(0.5, 0.75, 0.85, True, 0.7),
+    "sarcastic": TagProfile(0.45, 0.8, 0.85, True, 0.65),
+    "echoes": TagProfile(0.4, 0.7, 0.8, False, 0.4),
+}
+
+# 多標籤加權：情緒強烈的標籤權重更高
+STRONG_EMOTIONS = frozenset({"crying", "angry", "excited", "surprised"})
+
+# 以標籤 id 索引的唯讀數值表：欄位為 stability, similarity_boost, style, intensity
+TAG_IDS: Dict[str, int] = {tag: index for index, tag in enumerate(TAG_PROFILES)}
+EMOTION_TAGS_BY_ID: Tuple[str, ...] = tuple(TAG_PROFILES)
+_NUMERIC = np.array(
+    [(p.stability, p.similarity_boost, p.style, p.intensity) for p in TAG_PROFILES.values()], dtype=np.float64
+)
+_SPEAKER_BOOST = np.array([p.use_speaker_boost for p in TAG_PROFILES.values()], dtype=bool)
+_WEIGHTS = np.array([1.5 if tag in STRONG_EMOTIONS else 1.0 for tag in TAG_PROFILES], dtype=np.float64)
+for _array in (_NUMERIC, _SPEAKER_BOOST, _WEIGHTS):
+    _array.setflags(write=False)
+
+# 單次掃描的標籤解析：[tag] → 正規標籤（大小寫、去空白變體皆可）
+_TAG_PATTERN = re.compile(r"\[([^\]]+)\]")
+_TAG_STRIP_PATTERN = re.compile(r"\[([^\]]+)\]\s*")
+_TAG_LOOKUP: Dict[str, str] = {}
+for _tag in EMOTION_TAGS:
+    _TAG_LOOKUP.setdefault(_tag.lower().replace(" ", ""), _tag)
+    _TAG_LOOKUP.setdefault(_tag.lower(), _tag)
+    _TAG_LOOKUP[_tag] = _tag
+
+MAPPER_CACHE_SIZE = 1024
+
+
 def map_tags_to_voice_settings(
     tags: List[str],
     base_stability: float = 0.4,
@@ -25,262 +91,87 @@ def map_tags_to_voice_settings(
 ) -> Dict[str, float]:
     """
     將語氣標籤轉換為 ElevenLabs voice_settings 參數
-    
+
+    結果依（排序後的標籤 id、基礎值、intensity）做 LRU 快取，每次回傳新的 dict，
+    呼叫端可放心修改。
+
     Args:
         tags: 語氣標籤列表，例如 ["crying", "curious"]
         base_stability: 基礎穩定性（0.0-1.0）
         base_similarity_boost: 基礎相似度提升（0.0-1.0）
         base_style: 基礎風格（0.0-1.0）
         intensity: 語氣強度（0.0-1.0），如果為 None 則根據標籤自動計算
-        
+
     Returns:
         voice_settings 字典，包含 stability, similarity_boost, style, use_speaker_boost, intensity
     """
-    if not tags:
-        return {
-            "stability": base_stability,
-            "similarity_boost": base_similarity_boost,
-            "style": base_style,
-            "use_speaker_boost": True,
-            "intensity": intensity if intensity is not None else 0.5
-        }
-    
-    # 語氣標籤到聲音參數的映射（包含強度基礎值）
-    tag_mappings = {
-        # 情緒強烈 → 降低穩定性，提高風格表現，高強度
-        "crying": {
-            "stability": 0.3,
-            "similarity_boost": 0.7,
-            "style": 0.95,
-            "use_speaker_boost": True,
-            "intensity": 0.9  # 高強度
-        },
-        "angry": {
-            "stability": 0.35,
-            "similarity_boost": 0.75,
-            "style": 0.95,
-            "use_speaker_boost": True,
-            "intensity": 0.95  # 極高強度
-        },
-        "excited": {
-            "stability": 0.5,
-            "similarity_boost": 0.85,
-            "style": 0.95,
-            "use_speaker_boost": True,
-            "intensity": 0.85  # 高強度
-        },
-        "happy": {
-            "stability": 0.45,
-            "similarity_boost": 0.8,
-            "style": 0.9,
-            "use_speaker_boost": True,
-            "intensity": 0.75  # 中高強度
-        },
-        
-        # 輕柔/安靜 → 降低穩定性，降低風格，低強度
-        "whispers": {
-            "stability": 0.25,
-            "similarity_boost": 0.6,
-            "style": 0.7,
-            "use_speaker_boost": False,
-            "intensity": 0.2  # 低強度
-        },
-        "whispering": {
-            "stability": 0.25,
-            "similarity_boost": 0.6,
-            "style": 0.7,
-            "use_speaker_boost": False,
-            "intensity": 0.2  # 低強度
-        },
-        "softly": {
-            "stability": 0.3,
-            "similarity_boost": 0.65,
-            "style": 0.75,
-            "use_speaker_boost": False,
-            "intensity": 0.3  # 低強度
-        },
-        
-        # 調皮/活潑 → 中等穩定性，高風格，中高強度
-        "playful": {
-            "stability": 0.5,
-            "similarity_boost": 0.85,
-            "style": 0.9,
-            "use_speaker_boost": True,
-            "intensity": 0.7  # 中高強度
-        },
-        "curious": {
-            "stability": 0.45,
-            "similarity_boost": 0.8,
-            "style": 0.85,
-            "use_speaker_boost": True,
-            "intensity": 0.6  # 中等強度
-        },
-        
-        # 快速/急促 → 提高穩定性，高風格，高強度
-        "speaks quickly": {
-            "stability": 0.6,
-            "similarity_boost": 0.85,
-            "style": 0.9,
-            "use_speaker_boost": True,
-            "intensity": 0.8  # 高強度
-        },
-        
-        # 悲傷 → 低穩定性，中等風格，中強度
-        "sad": {
-            "stability": 0.3,
-            "similarity_boost": 0.7,
-            "style": 0.8,
-            "use_speaker_boost": True,
-            "intensity": 0.5  # 中等強度
-        },
-        
-        # 驚訝 → 低穩定性，高風格，高強度
-        "surprised": {
-            "stability": 0.35,
-            "similarity_boost": 0.8,
-            "style": 0.95,
-            "use_speaker_boost": True,
-            "intensity": 0.85  # 高強度
-        },
-        
-        # 特殊效果
-        "sighs": {
-            "stability": 0.25,
-            "similarity_boost": 0.6,
-            "style": 0.7,
-            "use_speaker_boost": False,
-            "intensity": 0.3  # 低強度
-        },
-        "starts laughing": {
-            "stability": 0.4,
-            "similarity_boost": 0.8,
-            "style": 0.9,
-            "use_speaker_boost": True,
-            "intensity": 0.8  # 高強度
-        },
-        "sings": {
-            "stability": 0.5,
-            "similarity_boost": 0.75,
-            "style": 0.85,
-            "use_speaker_boost": True,
-            "intensity": 0.7  # 中高強度
-        },
-        "sarcastic": {
-            "stability": 0.45,
-            "similarity_boost": 0.8,
-            "style": 0.85,
-            "use_speaker_boost": True,
-            "intensity": 0.65  # 中高強度
-        },
-        "echoes": {
-            "stability": 0.4,
-            "similarity_boost": 0.7,
-            "style": 0.8,
-            "use_speaker_boost": False,
-            "intensity": 0.4  # 低中強度
-        },
-    }
-    
-    # 初始化結果
-    result = {
-        "stability": base_stability,
-        "similarity_boost": base_similarity_boost,
-        "style": base_style,
-        "use_speaker_boost": True,
-        "intensity": intensity if intensity is not None else 0.5
-    }
-    
-    # 處理多個標籤：計算加權平均
-    valid_tags = [tag for tag in tags if tag in tag_mappings]
-    
-    if not valid_tags:
-        return result
-    
-    # 如果只有一個標籤，直接使用
-    if len(valid_tags) == 1:
-        result.update(tag_mappings[valid_tags[0]])
-        # 如果提供了 intensity，覆蓋標籤的預設值
-        if intensity is not None:
-            result["intensity"] = intensity
-        return result
-    
-    # 多個標籤：計算平均值（加權）
-    # 情緒強烈的標籤權重更高
-    strong_emotions = ["crying", "angry", "excited", "surprised"]
-    
-    weights = []
-    settings_list = []
-    
-    for tag in valid_tags:
-        weight = 1.5 if tag in strong_emotions else 1.0
-        weights.append(weight)
-        settings_list.append(tag_mappings[tag])
-    
-    total_weight = sum(weights)
-    
-    # 計算加權平均
-    result["stability"] = sum(
-        s["stability"] * w for s, w in zip(settings_list, weights)
-    ) / total_weight
-    
-    result["similarity_boost"] = sum(
-        s["similarity_boost"] * w for s, w in zip(settings_list, weights)
-    ) / total_weight
-    
-    result["style"] = sum(
-        s["style"] * w for s, w in zip(settings_list, weights)
-    ) / total_weight
-    
-    # intensity: 計算加權平均，但如果提供了 intensity 參數則使用它
-    if intensity is None:
-        result["intensity"] = sum(
-            s["intensity"] * w for s, w in zip(settings_list, weights)
-        ) / total_weight
-    else:
-        result["intensity"] = intensity
-    
-    # use_speaker_boost: 如果任何標籤需要，就啟用
-    result["use_speaker_boost"] = any(
-        s["use_speaker_boost"] for s in settings_list
+    # 排序後的 tuple 是標準鍵：順序無關，但保留重複標籤（重複會加重權重）
+    tag_ids = tuple(sorted([TAG_IDS[tag] for tag in tags if tag in TAG_IDS])) if tags else ()
+    return dict(_voice_settings_for(tag_ids, base_stability, base_similarity_boost, base_style, intensity))
+
+
+@lru_cache(maxsize=MAPPER_CACHE_SIZE)
+def _voice_settings_for(
+    tag_ids: Tuple[int, ...],
+    base_stability: float,
+    base_similarity_boost: float,
+    base_style: float,
+    intensity: Optional[float],
+) -> Tuple[Tuple[str, float], ...]:
+    if not tag_ids:
+        return (
+            ("stability", base_stability),
+            ("similarity_boost", base_similarity_boost),
+            ("style", base_style),
+            ("use_speaker_boost", True),
+            ("intensity", intensity if intensity is not None else 0.5),
+        )
+
+    # 只有一個標籤：直接使用（提供 intensity 時覆蓋標籤預設值）
+    if len(tag_ids) == 1:
+        profile = TAG_PROFILES[EMOTION_TAGS_BY_ID[tag_ids[0]]]
+        return (
+            ("stability", profile.stability),
+            ("similarity_boost", profile.similarity_boost),
+            ("style", profile.style),
+            ("use_speaker_boost", profile.use_speaker_boost),
+            ("intensity", profile.intensity if intensity is None else intensity),
+        )
+
+    # 多個標籤：加權平均後夾在 0-1 之間
+    index = np.asarray(tag_ids)
+    weights = _WEIGHTS[index]
+    averaged = np.clip(weights @ _NUMERIC[index] / weights.sum(), 0.0, 1.0)
+    stability, similarity_boost, style, tag_intensity = (float(value) for value in averaged)
+    return (
+        ("stability", stability),
+        ("similarity_boost", similarity_boost),
+        ("style", style),
+        # use_speaker_boost: 如果任何標籤需要，就啟用
+        ("use_speaker_boost", bool(_SPEAKER_BOOST[index].any())),
+        ("intensity", tag_intensity if intensity is None else max(0.0, min(1.0, intensity))),
     )
-    
-    # 確保數值在有效範圍內
-    result["stability"] = max(0.0, min(1.0, result["stability"]))
-    result["similarity_boost"] = max(0.0, min(1.0, result["similarity_boost"]))
-    result["style"] = max(0.0, min(1.0, result["style"]))
-    result["intensity"] = max(0.0, min(1.0, result["intensity"]))
-    
-    return result
 
 
 def extract_tags_from_text(text: str) -> List[str]:
     """
     從文字中提取語氣標籤
-    
+
     Args:
         text: 可能包含標籤的文字，例如 "[crying][curious] 你知道嗎？"
-        
+
     Returns:
         標籤列表，例如 ["crying", "curious"]
     """
-    import re
+    if "[" not in text:
+        return []
     tags = []
-    pattern = r'\[([^\]]+)\]'
-    matches = re.findall(pattern, text)
-    
-    for match in matches:
-        # 處理多詞標籤（如 "speaks quickly"）
-        if match in EMOTION_TAGS:
-            tags.append(match)
-        # 嘗試匹配部分標籤
-        else:
-            # 檢查是否是已知標籤的變體
-            match_lower = match.lower()
-            for tag in EMOTION_TAGS:
-                if tag.lower() == match_lower or tag.lower().replace(" ", "") == match_lower:
-                    tags.append(tag)
-                    break
-    
+    for match in _TAG_PATTERN.finditer(text):
+        raw = match.group(1)
+        # 處理多詞標籤（如 "speaks quickly"）與大小寫／去空白的變體
+        tag = _TAG_LOOKUP.get(raw) or _TAG_LOOKUP.get(raw.lower())
+        if tag is not None:
+            tags.append(tag)
     return tags
 
 
@@ -304,8 +195,7 @@ def process_text_with_voice_settings(
     if tags is None:
         tags = extract_tags_from_text(text)
         # 移除文字中的標籤
-        import re
-        clean_text = re.sub(r'\[([^\]]+)\]\s*', '', text).strip()
+        clean_text = _TAG_STRIP_PATTERN.sub('', text).strip()
     else:
         clean_text = text
     
@@ -315,6 +205,65 @@ def process_text_with_voice_settings(
     return clean_text, voice_settings
 
 
+class StructuredReply(NamedTuple):
+    """LLM 一次產生的回應：純文字、語氣標籤與強度（見 parse_structured_reply）"""
+    text: str
+    tags: Tuple[str, ...]
+    intensity: Optional[float]
+
+    @property
+    def tagged_text(self) -> str:
+        tag_string = "".join(f"[{tag}]" for tag in self.tags)
+        return f"{tag_string} {self.text}" if tag_string else self.text
+
+
+_JSON_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+MAX_STRUCTURED_TAGS = 2
+
+
+def parse_structured_reply(raw: Union[str, Mapping[str, Any]]) -> Optional[StructuredReply]:
+    """
+    解析 LLM 的結構化輸出 {"reply": "...", "tags": [...], "intensity": 0.6}
+
+    - 只保留已知的標籤（大小寫／空白變體會正規化），去重後最多 MAX_STRUCTURED_TAGS 個
+    - intensity 限制在 0.0-1.0 並取到 0.05（map_tags_to_voice_settings 以它為快取鍵）
+    - 格式不符或沒有回應文字時返回 None，由呼叫端改走原本的流程
+    """
+    data = raw
+    if isinstance(raw, str):
+        try:
+            data = json.loads(_JSON_FENCE.sub("", raw.strip()))
+        except ValueError:
+            return None
+    if not isinstance(data, Mapping):
+        return None
+    reply = data.get("reply")
+    if not isinstance(reply, str) or not reply.strip():
+        return None
+    # 回應文字裡若夾帶標籤，與 tags 欄位合併
+    tags = extract_tags_from_text(reply)
+    text = _TAG_STRIP_PATTERN.sub("", reply).strip() if tags else reply.strip()
+    raw_tags = data.get("tags") or []
+    if isinstance(raw_tags, str):
+        raw_tags = [raw_tags]
+    for raw_tag in raw_tags if isinstance(raw_tags, list) else []:
+        if isinstance(raw_tag, str):
+            tag = _TAG_LOOKUP.get(raw_tag.strip("[] ")) or _TAG_LOOKUP.get(raw_tag.strip("[] ").lower())
+            if tag is not None:
+                tags.append(tag)
+    intensity = data.get("intensity")
+    if isinstance(intensity, (int, float)) and not isinstance(intensity, bool):
+        intensity = round(max(0.0, min(1.0, float(intensity))) * 20) / 20
+    else:
+        intensity = None
+    return StructuredReply(text, tuple(dict.fromkeys(tags))[:MAX_STRUCTURED_TAGS], intensity)
+
+
+def map_structured_reply(reply: StructuredReply) -> Dict[str, float]:
+    """結構化回應直接映射為聲音設定（不需再從文字中提取標籤）"""
+    return map_tags_to_voice_settings(list(reply.tags), intensity=reply.intensity)
+
+
 # 測試函數
 if __name__ == "__main__":
     print("=" * 60)
@@ -0,0 +1,463 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+from modules.audio_decode import PCM16_DTYPE, decode_to_pcm16, is_pcm16_mime, pcm16_to_float32, wav_header
+from modules.metrics import get_metrics_registry
+from modules.resilience import CircuitOpen, get_circuit_breaker
+from modules.session_buffers import ChunkArena
+
+try:
+    from faster_whisper import WhisperModel  # type: ignore
+except Exception:  # pragma: no cover - optional dependency
+    WhisperModel = None  # type: ignore
+
+logger = logging.getLogger("stt_engines")
+
+ENGINE_FASTER_WHISPER = "faster-whisper"
+ENGINE_OPENAI = "openai"
+ENGINE_REPLAY = "replay"
+
+# Engine tried first when a role names none, then the failover order.
+STT_DEFAULT_ENGINE = os.getenv("STT_DEFAULT_ENGINE", "").strip().lower()
+STT_ENGINE_ORDER = [
+    name.strip().lower()
+    for name in os.getenv("STT_ENGINE_ORDER", f"{ENGINE_FASTER_WHISPER},{ENGINE_OPENAI}").split(",")
+    if name.strip()
+]
+STT_FIXTURE_PATH = os.getenv("STT_FIXTURE_PATH", "")
+REALTIME_WHISPER_MODEL = os.getenv("REALTIME_WHISPER_MODEL", "tiny")
+REALTIME_WHISPER_DEVICE = os.getenv("REALTIME_WHISPER_DEVICE", "cpu")
+REALTIME_WHISPER_COMPUTE = os.getenv("REALTIME_WHISPER_COMPUTE", "int8")
+STT_TRANSCRIPT_SEGMENTS = int(os.getenv("GATEWAY_TRANSCRIPT_SEGMENTS", "512"))
+
+_metrics = get_metrics_registry()
+METRIC_STT_CALLS = _metrics.counter("stt_engine_calls_total", "STT engine calls by outcome", ["engine", "result"])
+METRIC_STT_FAILOVERS = _metrics.counter(
+    "stt_engine_failovers_total", "Utterances moved to another STT engine mid-stream", ["from_engine", "to_engine"]
+)
+
+
+@dataclass(frozen=True)
+class STTCapabilities:
+    incremental: bool  # feed() transcribes each chunk; partials are free
+    local: bool  # runs in-process (no upstream, no per-minute cost)
+    compressed_input: bool  # accepts WebM/Ogg directly (no decode step); raw PCM is wrapped as WAV
+
+
+@dataclass(frozen=True)
+class STTProfile:
+    """Expected cost of one engine: paces partial requests and is reported in stats."""
+
+    partial_latency_ms: float
+    final_latency_ms_per_audio_second: float
+    cost_per_audio_minute_usd: float
+
+
+class STTEngine(ABC):
+    """
+    Speech-to-text backend.
+
+    Subclasses implement `transcribe()` (one-shot, whole utterance) and may override
+    `open_stream()` for engines that transcribe chunk by chunk. Health is tracked by a
+    circuit breaker per engine (`stt_<name>`), plus an EWMA of observed latency.
+    """
+
+    name = "base"
+    capabilities = STTCapabilities(incremental=False, local=False, compressed_input=True)
+    profile = STTProfile(0.0, 0.0, 0.0)
+
+    def __init__(self, model: Optional[str] = None) -> None:
+        self.model = model
+        self.breaker = get_circuit_breaker(f"stt_{self.name.replace('-', '_')}")
+        self.latency_ewma_ms: Optional[float] = None
+
+    def available(self) -> bool:
+        return True
+
+    def healthy(self) -> bool:
+        return self.available() and not self.breaker.is_open()
+
+    @abstractmethod
+    async def transcribe(self, audio: bytes, mime_type: str) -> str:
+        ...
+
+    def open_stream(self, audio: ChunkArena, mime_type: str, catch_up: bool = False) -> "STTStream":
+        return STTStream(self, audio, mime_type)
+
+    def record(self, ok: bool, latency_ms: float) -> None:
+        """Metrics and latency EWMA; the breaker already saw the outcome in `STTStream._transcribe`."""
+        METRIC_STT_CALLS.labels(self.name, "ok" if ok else "error").inc()
+        if ok:
+            previous = self.latency_ewma_ms
+            self.latency_ewma_ms = latency_ms if previous is None else 0.8 * previous + 0.2 * latency_ms
+
+    def stats(self) -> dict:
+        return {
+            "engine": self.name,
+            "model": self.model,
+            "available": self.available(),
+            "breaker": self.breaker.stats(),
+            "latency_ewma_ms": round(self.latency_ewma_ms, 1) if self.latency_ewma_ms is not None else None,
+            "cost_per_audio_minute_usd": self.profile.cost_per_audio_minute_usd,
+        }
+
+
+class STTStream:
+    """
+    One utterance on one engine. The gateway's `ChunkArena` is the single audio buffer;
+    `feed()` is told about each new chunk after it was stored there.
+
+    Batch engines (the default): `feed()` does nothing, `partial()`/`final()` transcribe
+    everything buffered so far.
+    """
+
+    def __init__(self, engine: STTEngine, audio: ChunkArena, mime_type: str) -> None:
+        self.engine = engine
+        self.audio = audio
+        self.mime_type = mime_type
+        self.engine_calls = 0
+
+    async def _transcribe(self, audio: bytes) -> str:
+        """
+        Every engine call goes through the breaker (raises CircuitOpen while it is open).
+        A call that raises or is cancelled (e.g. a superseded partial) counts as a failure.
+        """
+        with self.engine.breaker.attempt() as attempt:
+            self.engine_calls += 1
+            text = await self.engine.transcribe(audio, self.mime_type)
+            attempt.succeeded()
+        return text
+
+    async def feed(self, chunk: bytes) -> Optional[str]:
+        """New transcript text produced by this chunk, if the engine is incremental."""
+        return None
+
+    async def partial(self) -> str:
+        return await self._transcribe(self.audio.to_bytes())
+
+    async def final(self) -> str:
+        return await self._transcribe(self.audio.to_bytes())
+
+
+class SegmentStream(STTStream):
+    """Incremental engines: every chunk is transcribed on arrival and its segments kept."""
+
+    def __init__(self, engine: STTEngine, audio: ChunkArena, mime_type: str, catch_up: bool = False) -> None:
+        super().__init__(engine, audio, mime_type)
+        self.segments: Deque[str] = deque(maxlen=STT_TRANSCRIPT_SEGMENTS)
+        # Opened mid-utterance (failover): earlier chunks were never fed, so the final
+        # transcript is taken from the whole buffer instead of the segments.
+        self.catch_up = catch_up
+
+    def text(self) -> str:
+        return " ".join(self.segments).strip()
+
+    async def feed(self, chunk: bytes) -> Optional[str]:
+        text = (await self._transcribe(chunk)).strip()
+        if not text:
+            return None
+        self.segments.append(text)
+        return self.text()
+
+    async def partial(self) -> str:
+        return self.text()
+
+    async def final(self) -> str:
+        if self.catch_up and self.audio:
+            return await self._transcribe(self.audio.to_bytes())
+        return self.text()
+
+
+class FasterWhisperEngine(STTEngine):
+    """In-process faster-whisper; the model is loaded once and shared by every session."""
+
+    name = ENGINE_FASTER_WHISPER
+    capabilities = STTCapabilities(incremental=True, local=True, compressed_input=False)
+    profile = STTProfile(partial_latency_ms=300.0, final_latency_ms_per_audio_second=120.0, cost_per_audio_minute_usd=0.0)
+
+    _models: Dict[tuple, object] = {}
+    _models_lock = threading.Lock()
+
+    def available(self) -> bool:
+        return WhisperModel is not None
+
+    def _model(self):
+        key = (self.model or REALTIME_WHISPER_MODEL, REALTIME_WHISPER_DEVICE, REALTIME_WHISPER_COMPUTE)
+        with self._models_lock:
+            model = self._models.get(key)
+            if model is None:
+                model = self._models[key] = WhisperModel(key[0], device=key[1], compute_type=key[2])
+        return model
+
+    def _transcribe_blocking(self, audio: bytes, mime_type: str) -> str:
+        if is_pcm16_mime(mime_type):
+            pcm = np.frombuffer(audio, dtype=PCM16_DTYPE, count=len(audio) // 2)
+        else:
+            pcm = decode_to_pcm16(audio)
+        segments, _ = self._model().transcribe(pcm16_to_float32(pcm), vad_filter=True)
+        return " ".join(s.text.strip() for s in segments if getattr(s, "text", "").strip())
+
+    async def transcribe(self, audio: bytes, mime_type: str) -> str:
+        if WhisperModel is None:
+            raise RuntimeError("faster-whisper is not installed")
+        return await asyncio.to_thread(self._transcribe_blocking, audio, mime_type)
+
+    def open_stream(self, audio: ChunkArena, mime_type: str, catch_up: bool = False) -> STTStream:
+        return SegmentStream(self, audio, mime_type, catch_up=catch_up)
+
+
+class OpenAIWhisperEngine(STTEngine):
+    """Hosted Whisper through the shared async client (modules/whisper_client.py)."""
+
+    name = ENGINE_OPENAI
+    capabilities = STTCapabilities(incremental=False, local=False, compressed_input=True)
+    profile = STTProfile(partial_latency_ms=700.0, final_latency_ms_per_audio_second=60.0, cost_per_audio_minute_usd=0.006)
+
+    def available(self) -> bool:
+        from modules.whisper_client import get_whisper_client
+
+        return get_whisper_client() is not None
+
+    async def transcribe(self, audio: bytes, mime_type: str) -> str:
+        from modules.whisper_client import get_whisper_client
+
+        client = get_whisper_client()
+        if client is None:
+            raise RuntimeError("OPENAI_API_KEY is not configured")
+        if is_pcm16_mime(mime_type):
+            return await client.transcribe([wav_header(len(audio)), audio], "audio/wav")
+        return await client.transcribe([audio], mime_type)
+
+
+class FixtureReplayEngine(STTEngine):
+    """
+    Deterministic engine for tests and load runs: replays recorded transcripts.
+
+    Fixture: a list of utterances, each a string or {"final": ..., "partials": [...],
+    "sha256": <hex digest of the utterance audio>}. Audio whose digest is listed gets its
+    transcript; anything else takes the next utterance in order (wrapping around).
+    Partial i is returned after the i-th fed chunk.
+    """
+
+    name = ENGINE_REPLAY
+    capabilities = STTCapabilities(incremental=True, local=True, compressed_input=True)
+    profile = STTProfile(partial_latency_ms=0.0, final_latency_ms_per_audio_second=0.0, cost_per_audio_minute_usd=0.0)
+
+    def __init__(self, utterances: Optional[Sequence[Union[str, dict]]] = None, fixture_path: Optional[str] = None) -> None:
+        super().__init__(model=fixture_path or None)
+        if utterances is None:
+            utterances = self.load_fixture(fixture_path) if fixture_path else []
+        self.utterances = [{"final": u, "partials": []} if isinstance(u, str) else dict(u) for u in utterances]
+        self._by_digest = {u["sha256"]: u for u in self.utterances if u.get("sha256")}
+        self._next = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def load_fixture(path: str) -> List[Union[str, dict]]:
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        return data.get("utterances", []) if isinstance(data, dict) else data
+
+    def available(self) -> bool:
+        return bool(self.utterances)
+
+    def take(self) -> dict:
+        with self._lock:
+            utterance = self.utterances[self._next % len(self.utterances)]
+            self._next += 1
+        return utterance
+
+    def lookup(self, audio: bytes) -> Optional[dict]:
+        return self._by_digest.get(hashlib.sha256(audio).hexdigest()) if self._by_digest else None
+
+    async def transcribe(self, audio: bytes, mime_type: str) -> str:
+        return (self.lookup(audio) or self.take())["final"]
+
+    def open_stream(self, audio: ChunkArena, mime_type: str, catch_up: bool = False) -> STTStream:
+        return ReplayStream(self, audio, mime_type)
+
+
+class ReplayStream(STTStream):
+    engine: FixtureReplayEngine
+
+    def __init__(self, engine: FixtureReplayEngine, audio: ChunkArena, mime_type: str) -> None:
+        super().__init__(engine, audio, mime_type)
+        self.utterance: Optional[dict] = None
+        self.fed = 0
+
+    def _utterance(self) -> dict:
+        if self.utterance is None:
+            self.utterance = self.engine.take()
+        return self.utterance
+
+    async def feed(self, chunk: bytes) -> Optional[str]:
+        self.fed += 1
+        partials = self._utterance().get("partials") or []
+        if self.fed <= len(partials):
+            return partials[self.fed - 1]
+        return None
+
+    async def partial(self) -> str:
+        partials = self._utterance().get("partials") or []
+        return partials[min(self.fed, len(partials)) - 1] if partials and self.fed else ""
+
+    async def final(self) -> str:
+        matched = self.engine.lookup(self.audio.to_bytes())
+        return (matched or self._utterance())["final"]
+
+
+ENGINE_CLASSES = {
+    ENGINE_FASTER_WHISPER: FasterWhisperEngine,
+    ENGINE_OPENAI: OpenAIWhisperEngine,
+    ENGINE_REPLAY: FixtureReplayEngine,
+}
+
+
+class STTRouter:
+    """
+    Picks engines per role and fails over between them.
+
+    A role's `stt_model` is `engine` or `engine:model` (e.g. `faster-whisper:small`);
+    candidates are that engine first, then `STT_ENGINE_ORDER`, skipping engines that
+    are unavailable or whose breaker is open.
+    """
+
+    def __init__(self, order: Optional[Sequence[str]] = None, default: Optional[str] = None) -> None:
+        self.order = list(order if order is not None else STT_ENGINE_ORDER)
+        self.default = default if default is not None else STT_DEFAULT_ENGINE
+        self._engines: Dict[str, STTEngine] = {}
+        self._lock = threading.Lock()
+
+    def register(self, spec: str, engine: STTEngine) -> None:
+        with self._lock:
+            self._engines[spec] = engine
+
+    def engine(self, spec: str) -> Optional[STTEngine]:
+        spec = spec.strip().lower()
+        with self._lock:
+            engine = self._engines.get(spec)
+            if engine is None:
+                name, _, model = spec.partition(":")
+                engine_class = ENGINE_CLASSES.get(name)
+                if engine_class is None:
+                    logger.warning("unknown stt engine", extra={"engine": spec})
+                    return None
+                if engine_class is FixtureReplayEngine:
+                    engine = FixtureReplayEngine(fixture_path=model or STT_FIXTURE_PATH or None)
+                else:
+                    engine = engine_class(model=model or None)
+                self._engines[spec] = engine
+        return engine
+
+    def candidates(self, preferred: Optional[str] = None) -> List[STTEngine]:
+        specs = [spec for spec in (preferred, self.default, *self.order) if spec]
+        engines: List[STTEngine] = []
+        for spec in dict.fromkeys(s.strip().lower() for s in specs):
+            engine = self.engine(spec)
+            if engine is not None and engine not in engines and engine.healthy():
+                engines.append(engine)
+        return engines
+
+    def open(self, audio: ChunkArena, mime_type: str, preferred: Optional[str] = None) -> "RoutedSTTStream":
+        return RoutedSTTStream(self.candidates(preferred), audio, mime_type)
+
+    def stats(self) -> List[dict]:
+        with self._lock:
+            engines = list(self._engines.values())
+        return [engine.stats() for engine in engines]
+
+
+class STTUnavailable(RuntimeError):
+    """No STT engine is configured and healthy."""
+
+
+class RoutedSTTStream:
+    """
+    `feed()`/`partial()`/`final()` on the first healthy engine; when a call fails the
+    failure is recorded against that engine and the utterance moves to the next one
+    (which catches up from the shared buffer). Only when every engine failed does the
+    error reach the caller.
+    """
+
+    def __init__(self, engines: List[STTEngine], audio: ChunkArena, mime_type: str) -> None:
+        self._engines = engines
+        self.audio = audio
+        self.mime_type = mime_type
+        self._index = 0
+        self.stream: Optional[STTStream] = (
+            engines[0].open_stream(audio, mime_type) if engines else None
+        )
+
+    @property
+    def engine(self) -> Optional[STTEngine]:
+        return self.stream.engine if self.stream is not None else None
+
+    @property
+    def incremental(self) -> bool:
+        return self.stream is not None and self.stream.engine.capabilities.incremental
+
+    def _failover(self, exc: Exception) -> None:
+        failed = self.stream.engine
+        logger.warning("stt engine failed", extra={"engine": failed.name, "error": str(exc)})
+        self._index += 1
+        while self._index < len(self._engines) and not self._engines[self._index].healthy():
+            self._index += 1
+        if self._index >= len(self._engines):
+            self.stream = None
+            raise exc
+        engine = self._engines[self._index]
+        METRIC_STT_FAILOVERS.labels(failed.name, engine.name).inc()
+        self.stream = engine.open_stream(self.audio, self.mime_type, catch_up=True)
+
+    async def _call(self, method: str, *args) -> Optional[str]:
+        while True:
+            if self.stream is None:
+                raise STTUnavailable("no healthy stt engine")
+            stream = self.stream
+            calls = stream.engine_calls
+            start = time.perf_counter()
+            try:
+                result = await getattr(stream, method)(*args)
+            except CircuitOpen as exc:
+                self._failover(exc)
+                continue
+            except Exception as exc:  # noqa: BLE001
+                if stream.engine_calls > calls:
+                    stream.engine.record(False, (time.perf_counter() - start) * 1000)
+                self._failover(exc)
+                continue
+            if stream.engine_calls > calls:
+                stream.engine.record(True, (time.perf_counter() - start) * 1000)
+            return result
+
+    async def feed(self, chunk: bytes) -> Optional[str]:
+        return await self._call("feed", chunk)
+
+    async def partial(self) -> str:
+        return (await self._call("partial")) or ""
+
+    async def final(self) -> str:
+        return (await self._call("final")) or ""
+
+
+_router: Optional[STTRouter] = None
+
+
+def get_stt_router() -> STTRouter:
+    global _router
+    if _router is None:
+        _router = STTRouter()
+    return _router
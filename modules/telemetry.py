@@ -3,34 +3,88 @@ import json
 import logging
 import os
 import time
-from typing import Any, Dict, List, Optional
+from pathlib import Path
+from typing import IO, Any, Dict, List, Optional
 
 try:
     import httpx
 except ImportError:  # pragma: no cover - optional dependency
     httpx = None  # type: ignore
 
+from modules.metrics import get_metrics_registry
+from modules.telemetry_sink import LocalColumnarSink
+
 logger = logging.getLogger("telemetry")
 
+_KINDS = ("metric", "session", "role_switch", "cache")
+_RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+_metrics = get_metrics_registry()
+METRIC_TELEMETRY_DROPPED = _metrics.counter(
+    "telemetry_dropped_total", "Telemetry events dropped before delivery", ["kind", "reason"]
+)
+METRIC_TELEMETRY_SPOOLED = _metrics.counter(
+    "telemetry_spooled_total", "Telemetry events written to the on-disk spool", ["kind"]
+)
+METRIC_TELEMETRY_DELIVERED = _metrics.counter(
+    "telemetry_delivered_total", "Telemetry events accepted by Supabase", ["kind"]
+)
+
 
 class TelemetryClient:
-    def __init__(self) -> None:
+    """
+    Bounded, loss-aware telemetry pipeline to Supabase REST.
+
+    - `record_*` never block: when the in-memory queue (`OBS_QUEUE_MAX`) is full the
+      event is dropped and counted instead of growing memory without limit.
+    - One pooled `httpx.AsyncClient` is kept for the lifetime of the worker; each
+      batch is split per table and the bulk inserts run concurrently.
+    - Rows that fail with a retryable error are appended to an on-disk JSONL spool
+      (`OBS_SPOOL_PATH`, capped by `OBS_SPOOL_MAX_BYTES`) and replayed after the next
+      successful flush.
+    - When a local columnar sink is active (`OBS_LOCAL_SINK`, on by default when
+      Supabase is not configured) every batch is also written to rotating Parquet /
+      Arrow files for offline analysis (`scripts/telemetry_report.py`).
+    - `cache` events have no Supabase table and only reach the local sink; without one
+      they are counted as dropped (`no_destination`) instead of being queued.
+    """
+
+    def __init__(self, transport: Optional[Any] = None) -> None:
         self.supabase_url = os.getenv("OBS_SUPABASE_URL")
         self.supabase_service_key = os.getenv("OBS_SUPABASE_SERVICE_KEY")
         self.metrics_table = os.getenv("OBS_METRICS_TABLE", "voice_metrics")
         self.sessions_table = os.getenv("OBS_SESSIONS_TABLE", "voice_sessions")
         self.role_switch_table = os.getenv("OBS_ROLE_SWITCH_TABLE", "voice_role_switches")
         self.enabled = bool(self.supabase_url and self.supabase_service_key and httpx is not None)
-        self.queue: asyncio.Queue[Dict[str, Any]] = asyncio.Queue()
+        self.queue_max = int(os.getenv("OBS_QUEUE_MAX", "5000"))
+        self.queue: asyncio.Queue[Dict[str, Any]] = asyncio.Queue(maxsize=self.queue_max)
         self.worker_task: Optional[asyncio.Task] = None
         self.batch_size = int(os.getenv("OBS_BATCH_SIZE", "25"))
         self.batch_interval = float(os.getenv("OBS_BATCH_INTERVAL", "2.0"))
+        self.request_timeout = float(os.getenv("OBS_HTTP_TIMEOUT", "10.0"))
+        spool_path = os.getenv("OBS_SPOOL_PATH", "var/telemetry/spool.jsonl")
+        self.spool_path: Optional[Path] = Path(spool_path) if spool_path else None
+        self.spool_max_bytes = int(os.getenv("OBS_SPOOL_MAX_BYTES", str(50 * 1024 * 1024)))
+        self.dropped: Dict[str, int] = {kind: 0 for kind in _KINDS}
+        self.spooled = 0
+        self.delivered = 0
+        self._transport = transport
+        self._client: Optional[Any] = None
+        self._replay_lock = asyncio.Lock()
         self._last_flush = time.monotonic()
+        self._tables = {
+            "metric": self.metrics_table,
+            "session": self.sessions_table,
+            "role_switch": self.role_switch_table,
+        }
+        self.local_sink: Optional[LocalColumnarSink] = LocalColumnarSink.from_env(self.enabled)
 
     async def start(self) -> None:
         if self.worker_task is None:
             self.worker_task = asyncio.create_task(self._worker(), name="telemetry-worker")
             logger.info("Telemetry client started (enabled=%s)", self.enabled)
+            if self.enabled:
+                asyncio.create_task(self.replay_spool(), name="telemetry-spool-replay")
 
     async def stop(self) -> None:
         if self.worker_task:
@@ -41,19 +95,54 @@ class TelemetryClient:
                 pass
             self.worker_task = None
         await self._drain_queue()
+        if self.local_sink is not None:
+            await asyncio.to_thread(self.local_sink.close)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
     async def record_metric(self, payload: Dict[str, Any]) -> None:
-        await self.queue.put({"kind": "metric", "payload": payload})
+        self._enqueue("metric", payload)
 
     async def record_session(self, payload: Dict[str, Any]) -> None:
-        await self.queue.put({"kind": "session", "payload": payload})
+        self._enqueue("session", payload)
 
     async def record_role_switch(self, payload: Dict[str, Any]) -> None:
-        await self.queue.put({"kind": "role_switch", "payload": payload})
+        self._enqueue("role_switch", payload)
+
+    async def record_cache_event(self, payload: Dict[str, Any]) -> None:
+        self._enqueue("cache", payload)
 
     async def flush(self) -> None:
         await self._drain_queue()
 
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "queue_depth": self.queue.qsize(),
+            "queue_max": self.queue_max,
+            "dropped": dict(self.dropped),
+            "spooled": self.spooled,
+            "delivered": self.delivered,
+            "local_sink": self.local_sink.stats() if self.local_sink is not None else None,
+        }
+
+    def _enqueue(self, kind: str, payload: Dict[str, Any]) -> None:
+        if kind not in self._tables and self.local_sink is None:
+            self._count_drop(kind, "no_destination", 1)
+            return
+        try:
+            self.queue.put_nowait({"kind": kind, "payload": payload})
+        except asyncio.QueueFull:
+            self._count_drop(kind, "queue_full", 1)
+
+    def _count_drop(self, kind: str, reason: str, count: int) -> None:
+        self.dropped[kind] = self.dropped.get(kind, 0) + count
+        METRIC_TELEMETRY_DROPPED.labels(kind, reason).inc(count)
+        # Log the first drop and then every 100th so an outage does not flood the log.
+        if self.dropped[kind] == count or self.dropped[kind] % 100 < count:
+            logger.warning("Telemetry dropped %d %s event(s) (%s, total=%d)", count, kind, reason, self.dropped[kind])
+
     async def _worker(self) -> None:
         batch: List[Dict[str, Any]] = []
         while True:
@@ -68,55 +157,201 @@ class TelemetryClient:
                     await self._flush_batch(batch)
                     batch = []
             except asyncio.CancelledError:
+                if batch:
+                    await self._flush_batch(batch)
                 raise
             except Exception:  # pragma: no cover - defensive logging
                 logger.exception("Telemetry worker encountered unexpected error")
 
-    async def _flush_batch(self, batch: List[Dict[str, Any]]) -> None:
+    def _get_client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(  # type: ignore[union-attr]
+                timeout=self.request_timeout,
+                limits=httpx.Limits(max_connections=8, max_keepalive_connections=4),  # type: ignore[union-attr]
+                transport=self._transport,
+                headers={
+                    "apikey": self.supabase_service_key or "",
+                    "Authorization": f"Bearer {self.supabase_service_key}",
+                    "Content-Type": "application/json",
+                    "Prefer": "return=minimal",
+                },
+            )
+        return self._client
+
+    @staticmethod
+    def _group(batch: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+        grouped: Dict[str, List[Dict[str, Any]]] = {}
+        for item in batch:
+            grouped.setdefault(item["kind"], []).append(item["payload"])
+        return grouped
+
+    async def _flush_batch(self, batch: List[Dict[str, Any]]) -> bool:
+        """Deliver one batch; returns True when every table insert succeeded."""
         if not batch:
-            return
+            return True
+        self._last_flush = time.monotonic()
+        grouped = self._group(batch)
+        if self.local_sink is not None:
+            try:
+                await asyncio.to_thread(self.local_sink.write_batch, grouped)
+            except Exception:  # noqa: BLE001
+                logger.exception("Telemetry local sink write failed")
         if not self.enabled:
-            for item in batch:
-                logger.debug("Telemetry (noop) %s: %s", item["kind"], item["payload"])
+            if self.local_sink is None:
+                for item in batch:
+                    logger.debug("Telemetry (noop) %s: %s", item["kind"], item["payload"])
+            return True
+        kinds = [kind for kind in grouped if kind in self._tables]
+        results = await asyncio.gather(
+            *(self._post_rows(kind, grouped[kind]) for kind in kinds),
+            return_exceptions=True,
+        )
+        all_ok = True
+        for kind, result in zip(kinds, results):
+            rows = grouped[kind]
+            if result is True:
+                self.delivered += len(rows)
+                METRIC_TELEMETRY_DELIVERED.labels(kind).inc(len(rows))
+                continue
+            all_ok = False
+            if result is False:
+                self._count_drop(kind, "rejected", len(rows))
+            else:
+                logger.warning("Telemetry push to %s failed: %s", self._tables.get(kind), result)
+                await self._spool(kind, rows)
+        if all_ok and not self._replay_lock.locked() and self._spool_has_data():
+            asyncio.create_task(self.replay_spool(), name="telemetry-spool-replay")
+        return all_ok
+
+    async def _post_rows(self, kind: str, rows: List[Dict[str, Any]]) -> bool:
+        """POST rows to the kind's table. False = permanent rejection; raises on retryable failure."""
+        table = self._tables.get(kind)
+        if not table:
+            return False
+        response = await self._get_client().post(
+            f"{self.supabase_url}/rest/v1/{table}",
+            content=json.dumps(rows, ensure_ascii=False, default=str),
+        )
+        if response.status_code < 300:
+            return True
+        if response.status_code in _RETRYABLE_STATUS:
+            raise RuntimeError(f"HTTP {response.status_code}")
+        logger.error("Telemetry rows rejected by %s: HTTP %s %s", table, response.status_code, response.text[:200])
+        return False
+
+    def _spool_has_data(self) -> bool:
+        try:
+            return bool(self.spool_path and self.spool_path.exists() and self.spool_path.stat().st_size > 0)
+        except OSError:
+            return False
+
+    async def _spool(self, kind: str, rows: List[Dict[str, Any]]) -> None:
+        if not self.spool_path:
+            self._count_drop(kind, "no_spool", len(rows))
             return
-        metrics: List[Dict[str, Any]] = []
-        sessions: List[Dict[str, Any]] = []
-        role_switches: List[Dict[str, Any]] = []
-        for item in batch:
-            if item["kind"] == "metric":
-                metrics.append(item["payload"])
-            elif item["kind"] == "session":
-                sessions.append(item["payload"])
-            elif item["kind"] == "role_switch":
-                role_switches.append(item["payload"])
-                if role_switches:
-                    await client.post(
-                        f"{self.supabase_url}/rest/v1/{self.role_switch_table}",
-                        headers=headers,
-                        content=json.dumps(role_switches),
-                    )
-        async with httpx.AsyncClient(timeout=10.0) as client:  # type: ignore[call-arg]
-            headers = {
-                "apikey": self.supabase_service_key,
-                "Authorization": f"Bearer {self.supabase_service_key}",
-                "Content-Type": "application/json",
-                "Prefer": "return=minimal",
-            }
+        lines = "".join(
+            json.dumps({"kind": kind, "payload": row}, ensure_ascii=False, default=str) + "\n" for row in rows
+        )
+        written = await asyncio.to_thread(self._append_spool, lines)
+        if written:
+            self.spooled += len(rows)
+            METRIC_TELEMETRY_SPOOLED.labels(kind).inc(len(rows))
+        else:
+            self._count_drop(kind, "spool_full", len(rows))
+
+    def _append_spool(self, lines: str) -> bool:
+        assert self.spool_path is not None
+        try:
+            self.spool_path.parent.mkdir(parents=True, exist_ok=True)
+            size = self.spool_path.stat().st_size if self.spool_path.exists() else 0
+            if size + len(lines.encode("utf-8")) > self.spool_max_bytes:
+                return False
+            with self.spool_path.open("a", encoding="utf-8") as fh:
+                fh.write(lines)
+            return True
+        except OSError:
+            logger.exception("Telemetry spool write failed")
+            return False
+
+    def _claim_spool(self) -> Optional[Path]:
+        """Atomically move the spool aside so new failures append to a fresh file."""
+        assert self.spool_path is not None
+        claimed = self.spool_path.with_suffix(self.spool_path.suffix + ".replay")
+        try:
+            if claimed.exists():
+                return claimed  # leftover from an interrupted replay
+            if not self.spool_path.exists():
+                return None
+            self.spool_path.replace(claimed)
+            return claimed
+        except OSError:
+            logger.exception("Telemetry spool claim failed")
+            return None
+
+    def _read_spool_batch(self, fh: IO[str], limit: int) -> List[Dict[str, Any]]:
+        """Up to `limit` replayable rows from the claimed spool (blocking; runs in a thread)."""
+        items: List[Dict[str, Any]] = []
+        while len(items) < limit:
+            line = fh.readline()
+            if not line:
+                break
+            line = line.strip()
+            if not line:
+                continue
             try:
-                if sessions:
-                    await client.post(
-                        f"{self.supabase_url}/rest/v1/{self.sessions_table}",
-                        headers=headers,
-                        content=json.dumps(sessions),
-                    )
-                if metrics:
-                    await client.post(
-                        f"{self.supabase_url}/rest/v1/{self.metrics_table}",
-                        headers=headers,
-                        content=json.dumps(metrics),
-                    )
-            except Exception:
-                logger.exception("Telemetry push failed")
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if item.get("kind") in self._tables:
+                items.append(item)
+        return items
+
+    async def replay_spool(self) -> int:
+        """
+        Re-send spooled rows in batches; returns the number of rows replayed.
+
+        The claimed file is read and parsed one batch at a time in a worker thread, so a
+        large spool left by a long outage neither blocks the event loop nor sits in memory.
+        """
+        if not self.enabled or not self.spool_path:
+            return 0
+        async with self._replay_lock:
+            claimed = await asyncio.to_thread(self._claim_spool)
+            if claimed is None:
+                return 0
+            replayed = 0
+            upstream_down = False
+            batch_rows = max(self.batch_size, 100)
+            fh = await asyncio.to_thread(claimed.open, "r", encoding="utf-8")
+            try:
+                while True:
+                    chunk = await asyncio.to_thread(self._read_spool_batch, fh, batch_rows)
+                    if not chunk:
+                        break
+                    for kind, rows in self._group(chunk).items():
+                        if upstream_down:
+                            await self._spool(kind, rows)
+                            continue
+                        try:
+                            ok = await self._post_rows(kind, rows)
+                        except Exception as exc:  # noqa: BLE001
+                            # Still failing: put the rest back and wait for the next successful flush.
+                            logger.warning("Telemetry spool replay paused: %s", exc)
+                            upstream_down = True
+                            await self._spool(kind, rows)
+                            continue
+                        if ok:
+                            replayed += len(rows)
+                            self.delivered += len(rows)
+                            METRIC_TELEMETRY_DELIVERED.labels(kind).inc(len(rows))
+                        else:
+                            self._count_drop(kind, "rejected", len(rows))
+            finally:
+                await asyncio.to_thread(fh.close)
+            claimed.unlink(missing_ok=True)
+            if replayed:
+                logger.info("Telemetry spool replayed %d rows", replayed)
+            return replayed
 
     async def _drain_queue(self) -> None:
         items: List[Dict[str, Any]] = []
@@ -137,4 +372,3 @@ def get_telemetry_client() -> TelemetryClient:
     if _telemetry_client is None:
         _telemetry_client = TelemetryClient()
     return _telemetry_client
-
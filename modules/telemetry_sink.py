@@ -0,0 +1,382 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - optional dependency
+    pa = None  # type: ignore
+    pa_ipc = None  # type: ignore
+    pq = None  # type: ignore
+
+from modules.metrics import get_metrics_registry
+
+logger = logging.getLogger("telemetry_sink")
+
+_metrics = get_metrics_registry()
+METRIC_LOCAL_SINK_ROWS = _metrics.counter(
+    "telemetry_local_rows_total", "Telemetry rows written to the local columnar sink", ["kind"]
+)
+
+FORMAT_SUFFIXES = {"parquet": ".parquet", "arrow": ".arrow"}
+
+# (column, arrow type, dotted source path in the telemetry payload)
+_SCHEMAS: Dict[str, List[Tuple[str, str, str]]] = {
+    "metric": [
+        ("timestamp", "int64", "timestamp"),
+        ("session_id", "string", "session_id"),
+        ("role_id", "string", "role_id"),
+        ("avg_energy", "float64", "avg_energy"),
+        ("peak_energy", "float64", "peak_energy"),
+        ("emotion_estimate", "string", "emotion_estimate"),
+        ("pitch_hz", "float64", "pitch_hz"),
+        ("emotion_confidence", "float64", "emotion_confidence"),
+        ("transcript", "string", "transcript"),
+        ("is_final", "bool", "is_final"),
+        ("latency_ms", "float64", "latency_ms"),
+    ],
+    "session": [
+        ("timestamp", "int64", "timestamp"),
+        ("session_id", "string", "session_id"),
+        ("role_id", "string", "role_id"),
+        ("reason", "string", "reason"),
+        ("duration_ms", "float64", "duration_ms"),
+        ("voice_id", "string", "voice_id"),
+        ("provider", "string", "provider"),
+        ("trace_id", "string", "trace_id"),
+        ("errors", "int64", "errors"),
+        ("error_message", "string", "error_message"),
+        ("stt_latency_p50_ms", "float64", "metrics.stt_latency_ms.p50"),
+        ("stt_latency_p95_ms", "float64", "metrics.stt_latency_ms.p95"),
+        ("stt_latency_p99_ms", "float64", "metrics.stt_latency_ms.p99"),
+        ("tts_first_chunk_ms", "float64", "metrics.tts_first_chunk_ms"),
+        ("avg_energy", "float64", "metrics.avg_energy"),
+        ("peak_energy", "float64", "metrics.peak_energy"),
+        ("emotion_estimate", "string", "metrics.emotion_estimate"),
+        ("pitch_hz", "float64", "metrics.pitch_hz"),
+        ("emotion_confidence", "float64", "metrics.emotion_confidence"),
+        ("buffer_bytes_peak", "int64", "metrics.buffer_bytes_peak"),
+        ("audio_trimmed_bytes", "int64", "metrics.audio_trimmed_bytes"),
+    ],
+    "role_switch": [
+        ("timestamp", "int64", "timestamp"),
+        ("session_id", "string", "session_id"),
+        ("from_role", "string", "from_role"),
+        ("to_role", "string", "to_role"),
+        ("latency_ms", "float64", "latency_ms"),
+        ("success", "bool", "success"),
+        ("error", "string", "error"),
+    ],
+    "cache": [
+        ("timestamp", "int64", "timestamp"),
+        ("route", "string", "route"),
+        ("cache_hit", "bool", "cache_hit"),
+        ("voice_id", "string", "voice_id"),
+        ("text_length", "int64", "text_length"),
+    ],
+}
+SINK_KINDS = tuple(_SCHEMAS)
+
+
+def _to_int(value: Any) -> Optional[int]:
+    return int(value) if value is not None and not isinstance(value, str) else None
+
+
+def _to_float(value: Any) -> Optional[float]:
+    return float(value) if value is not None and not isinstance(value, str) else None
+
+
+def _to_bool(value: Any) -> Optional[bool]:
+    return bool(value) if value is not None else None
+
+
+def _to_str(value: Any) -> Optional[str]:
+    return str(value) if value is not None else None
+
+
+_CONVERTERS: Dict[str, Callable[[Any], Any]] = {
+    "int64": _to_int,
+    "float64": _to_float,
+    "bool": _to_bool,
+    "string": _to_str,
+}
+
+
+def _lookup(payload: Dict[str, Any], path: str) -> Any:
+    value: Any = payload
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def arrow_schema(kind: str):
+    fields = [pa.field(name, pa.type_for_alias(arrow_type)) for name, arrow_type, _ in _SCHEMAS[kind]]
+    fields.append(pa.field("extra", pa.string()))
+    return pa.schema(fields)
+
+
+def rows_to_table(kind: str, rows: List[Dict[str, Any]], received_ms: Optional[int] = None):
+    """
+    Flatten telemetry payloads into a fixed-schema Arrow table.
+
+    Keys that are not part of the schema are kept as a JSON string in `extra`
+    so ad-hoc fields survive without breaking the file schema.
+    """
+    columns = _SCHEMAS[kind]
+    consumed = {path.split(".", 1)[0] for _, _, path in columns}
+    received_ms = received_ms if received_ms is not None else int(time.time() * 1000)
+    data: Dict[str, List[Any]] = {name: [] for name, _, _ in columns}
+    extras: List[Optional[str]] = []
+    for row in rows:
+        for name, arrow_type, path in columns:
+            try:
+                value = _CONVERTERS[arrow_type](_lookup(row, path))
+            except (TypeError, ValueError):
+                value = None
+            data[name].append(value)
+        if data["timestamp"][-1] is None:
+            data["timestamp"][-1] = received_ms
+        leftover = {k: v for k, v in row.items() if k not in consumed and k != "type"}
+        extras.append(json.dumps(leftover, ensure_ascii=False, default=str) if leftover else None)
+    data["extra"] = extras
+    return pa.Table.from_pydict(data, schema=arrow_schema(kind))
+
+
+class _RotatingWriter:
+    """
+    One open columnar file per kind, written under a hidden `_inprogress-` name
+    and renamed into `<kind>/date=YYYY-MM-DD/` once closed, so readers only ever
+    see complete files.
+    """
+
+    def __init__(self, sink: "LocalColumnarSink", kind: str) -> None:
+        self.sink = sink
+        self.kind = kind
+        self.schema = arrow_schema(kind)
+        self.buffer: List[Dict[str, Any]] = []
+        self.buffer_started = 0.0
+        self._writer: Optional[Any] = None
+        self._tmp_path: Optional[Path] = None
+        self._final_path: Optional[Path] = None
+        self._opened_at = 0.0
+        self._opened_day: Optional[date] = None
+        self.rows_in_file = 0
+        self._seq = 0
+
+    def append(self, rows: List[Dict[str, Any]], now: float) -> None:
+        if not self.buffer:
+            self.buffer_started = now
+        self.buffer.extend(rows)
+        if len(self.buffer) >= self.sink.row_group_rows or now - self.buffer_started >= self.sink.flush_seconds:
+            self.flush(now)
+        elif self._writer is not None and self._should_rotate(now):
+            self.flush(now)
+
+    def flush(self, now: float) -> None:
+        if not self.buffer:
+            if self._writer is not None and self._should_rotate(now):
+                self.close()
+            return
+        table = rows_to_table(self.kind, self.buffer)
+        self.buffer = []
+        if self._writer is not None and self._should_rotate(now):
+            self.close()
+        if self._writer is None:
+            self._open(now)
+        self._writer.write_table(table)
+        self.rows_in_file += table.num_rows
+        if self.rows_in_file >= self.sink.rotate_rows:
+            self.close()
+
+    def _should_rotate(self, now: float) -> bool:
+        return (
+            now - self._opened_at >= self.sink.rotate_seconds
+            or self.rows_in_file >= self.sink.rotate_rows
+            or date.fromtimestamp(now) != self._opened_day
+        )
+
+    def _open(self, now: float) -> None:
+        opened = datetime.fromtimestamp(now)
+        directory = self.sink.directory / self.kind / f"date={opened:%Y-%m-%d}"
+        directory.mkdir(parents=True, exist_ok=True)
+        self._seq += 1
+        name = f"{self.kind}-{opened:%H%M%S}-{os.getpid()}-{self._seq}{FORMAT_SUFFIXES[self.sink.fmt]}"
+        self._final_path = directory / name
+        self._tmp_path = directory / f"_inprogress-{name}"
+        if self.sink.fmt == "parquet":
+            self._writer = pq.ParquetWriter(str(self._tmp_path), self.schema, compression=self.sink.compression)
+        else:
+            options = pa_ipc.IpcWriteOptions(compression=self.sink.compression)
+            self._writer = pa_ipc.new_file(str(self._tmp_path), self.schema, options=options)
+        self._opened_at = now
+        self._opened_day = opened.date()
+        self.rows_in_file = 0
+
+    def close(self) -> None:
+        if self._writer is None:
+            return
+        try:
+            self._writer.close()
+            assert self._tmp_path is not None and self._final_path is not None
+            self._tmp_path.replace(self._final_path)
+        finally:
+            self._writer = None
+            self.rows_in_file = 0
+
+
+class LocalColumnarSink:
+    """
+    Writes telemetry rows into rotating, compressed columnar files for offline analysis.
+
+    - Layout: `<dir>/<kind>/date=YYYY-MM-DD/<kind>-HHMMSS-<pid>-<n>.parquet` (or `.arrow`
+      for Arrow IPC), readable with `pyarrow.dataset` or `scripts/telemetry_report.py`.
+    - Rows are buffered per kind and written as one row group per `row_group_rows`
+      (or every `flush_seconds`); files rotate by age, row count and day.
+    - Date partitions older than `retention_days` are removed on rotation.
+
+    Calls are blocking; `TelemetryClient` runs them through `asyncio.to_thread`.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        fmt: str = "parquet",
+        compression: str = "zstd",
+        row_group_rows: int = 1000,
+        flush_seconds: float = 60.0,
+        rotate_seconds: float = 3600.0,
+        rotate_rows: int = 500_000,
+        retention_days: int = 30,
+    ) -> None:
+        if pa is None:
+            raise RuntimeError("pyarrow is required for the local columnar telemetry sink")
+        if fmt not in FORMAT_SUFFIXES:
+            raise ValueError(f"unsupported sink format: {fmt}")
+        self.directory = Path(directory)
+        self.fmt = fmt
+        self.compression = compression
+        self.row_group_rows = max(1, row_group_rows)
+        self.flush_seconds = flush_seconds
+        self.rotate_seconds = rotate_seconds
+        self.rotate_rows = max(self.row_group_rows, rotate_rows)
+        self.retention_days = retention_days
+        self.rows_written: Dict[str, int] = {kind: 0 for kind in SINK_KINDS}
+        self._lock = threading.Lock()
+        self._writers: Dict[str, _RotatingWriter] = {}
+        self._last_prune: Optional[date] = None
+
+    @classmethod
+    def from_env(cls, supabase_enabled: bool) -> Optional["LocalColumnarSink"]:
+        """
+        `OBS_LOCAL_SINK`: `auto` (default, only when Supabase is not configured), `on` or `off`.
+        """
+        mode = os.getenv("OBS_LOCAL_SINK", "auto").strip().lower()
+        if mode in {"off", "0", "false"} or (mode == "auto" and supabase_enabled):
+            return None
+        if pa is None:
+            if mode != "auto":
+                logger.warning("OBS_LOCAL_SINK=%s but pyarrow is not installed; local sink disabled", mode)
+            return None
+        return cls(
+            directory=os.getenv("OBS_LOCAL_SINK_DIR", "var/telemetry/columnar"),
+            fmt=os.getenv("OBS_LOCAL_SINK_FORMAT", "parquet").strip().lower(),
+            compression=os.getenv("OBS_LOCAL_SINK_COMPRESSION", "zstd"),
+            row_group_rows=int(os.getenv("OBS_LOCAL_SINK_ROW_GROUP", "1000")),
+            flush_seconds=float(os.getenv("OBS_LOCAL_SINK_FLUSH_SECONDS", "60")),
+            rotate_seconds=float(os.getenv("OBS_LOCAL_SINK_ROTATE_SECONDS", "3600")),
+            rotate_rows=int(os.getenv("OBS_LOCAL_SINK_ROTATE_ROWS", "500000")),
+            retention_days=int(os.getenv("OBS_LOCAL_SINK_RETENTION_DAYS", "30")),
+        )
+
+    def write_batch(self, grouped: Dict[str, List[Dict[str, Any]]]) -> None:
+        now = time.time()
+        with self._lock:
+            for kind, rows in grouped.items():
+                if kind not in _SCHEMAS or not rows:
+                    continue
+                writer = self._writers.get(kind)
+                if writer is None:
+                    writer = self._writers[kind] = _RotatingWriter(self, kind)
+                writer.append(rows, now)
+                self.rows_written[kind] += len(rows)
+                METRIC_LOCAL_SINK_ROWS.labels(kind).inc(len(rows))
+            self._prune(now)
+
+    def close(self) -> None:
+        """Flush buffered rows and finalize every open file."""
+        now = time.time()
+        with self._lock:
+            for writer in self._writers.values():
+                try:
+                    writer.flush(now)
+                finally:
+                    writer.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"directory": str(self.directory), "format": self.fmt, "rows_written": dict(self.rows_written)}
+
+    def _prune(self, now: float) -> None:
+        today = date.fromtimestamp(now)
+        if self.retention_days <= 0 or self._last_prune == today:
+            return
+        self._last_prune = today
+        cutoff = today - timedelta(days=self.retention_days)
+        for partition in self.directory.glob("*/date=*"):
+            partition_day = _partition_date(partition)
+            if partition_day is not None and partition_day < cutoff:
+                shutil.rmtree(partition, ignore_errors=True)
+
+
+def _partition_date(path: Path) -> Optional[date]:
+    try:
+        return date.fromisoformat(path.name.split("=", 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def sink_files(directory: str, kind: str, since: Optional[date] = None) -> Iterable[Path]:
+    """Completed sink files for a kind, pruned by date partition."""
+    root = Path(directory) / kind
+    if not root.exists():
+        return []
+    files: List[Path] = []
+    for partition in sorted(root.glob("date=*")):
+        partition_day = _partition_date(partition)
+        if since is not None and partition_day is not None and partition_day < since:
+            continue
+        for path in sorted(partition.iterdir()):
+            if path.name.startswith("_") or path.suffix not in FORMAT_SUFFIXES.values():
+                continue
+            files.append(path)
+    return files
+
+
+def read_sink(directory: str, kind: str, since: Optional[date] = None):
+    """Load every completed file for `kind` into one Arrow table (empty table when none)."""
+    if pa is None:
+        raise RuntimeError("pyarrow is required to read the local columnar telemetry sink")
+    tables = []
+    for path in sink_files(directory, kind, since):
+        try:
+            if path.suffix == ".parquet":
+                tables.append(pq.read_table(str(path)))
+            else:
+                with pa_ipc.open_file(str(path)) as reader:
+                    tables.append(reader.read_all())
+        except (OSError, pa.ArrowInvalid):
+            logger.warning("skipping unreadable sink file %s", path)
+    if not tables:
+        return arrow_schema(kind).empty_table()
+    return pa.concat_tables(tables)
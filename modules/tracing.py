@@ -0,0 +1,326 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - optional dependency
+    httpx = None  # type: ignore
+
+logger = logging.getLogger("tracing")
+
+_STATUS_UNSET = 0
+_STATUS_OK = 1
+_STATUS_ERROR = 2
+
+
+def _new_id(nbytes: int) -> str:
+    return random.getrandbits(nbytes * 8).to_bytes(nbytes, "big").hex()
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": k, "value": _otlp_value(v)} for k, v in attributes.items() if v is not None]
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_span_id: Optional[str]
+    start_ns: int
+    end_ns: Optional[int] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    status: int = _STATUS_UNSET
+    status_message: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def record_error(self, exc: BaseException) -> None:
+        self.status = _STATUS_ERROR
+        self.status_message = str(exc)
+
+    def end(self, **attributes: Any) -> None:
+        if self.end_ns is not None:
+            return
+        self.attributes.update(attributes)
+        self.end_ns = time.time_ns()
+        if self.status == _STATUS_UNSET:
+            self.status = _STATUS_OK
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        if self.end_ns is None:
+            return None
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span: Dict[str, Any] = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "status": {"code": self.status},
+        }
+        if self.parent_span_id:
+            span["parentSpanId"] = self.parent_span_id
+        if self.status_message:
+            span["status"]["message"] = self.status_message
+        return span
+
+
+class TurnTrace:
+    """
+    Span tree for one gateway turn (audio in → transcript → reply → TTS out).
+
+    Spans may be ended from worker threads (e.g. TTS first byte); the tree is
+    only exported once `finish()` is called on the event loop side.
+    """
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: Dict[str, Any]) -> None:
+        self._tracer = tracer
+        self._lock = threading.Lock()
+        self.trace_id = _new_id(16)
+        self.root = Span(name, self.trace_id, _new_id(8), None, time.time_ns(), attributes=dict(attributes))
+        self.spans: List[Span] = [self.root]
+        self.dropped_spans = 0
+        self.finished = False
+
+    @property
+    def sampled(self) -> bool:
+        return True
+
+    def start_span(self, name: str, parent: Optional[Span] = None, **attributes: Any) -> Span:
+        parent_span = parent or self.root
+        span = Span(name, self.trace_id, _new_id(8), parent_span.span_id, time.time_ns(), attributes=attributes)
+        with self._lock:
+            if len(self.spans) < self._tracer.max_spans_per_turn:
+                self.spans.append(span)
+            else:
+                self.dropped_spans += 1
+        return span
+
+    @contextmanager
+    def span(self, name: str, parent: Optional[Span] = None, **attributes: Any) -> Iterator[Span]:
+        current = self.start_span(name, parent, **attributes)
+        try:
+            yield current
+        except BaseException as exc:
+            current.record_error(exc)
+            raise
+        finally:
+            current.end()
+
+    def finish(self, **attributes: Any) -> None:
+        if self.finished:
+            return
+        self.finished = True
+        if self.dropped_spans:
+            attributes["dropped_spans"] = self.dropped_spans
+        self.root.end(**attributes)
+        self._tracer.export(self)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = [span.to_otlp() for span in self.spans]
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": _otlp_attributes(self._tracer.resource_attributes)},
+                    "scopeSpans": [{"scope": {"name": "lingya.gateway"}, "spans": spans}],
+                }
+            ]
+        }
+
+
+class _NoopSpan(Span):
+    def __init__(self) -> None:
+        super().__init__("noop", "", "", None, 0)
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        return
+
+    def record_error(self, exc: BaseException) -> None:
+        return
+
+    def end(self, **attributes: Any) -> None:
+        return
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _NoopTurnTrace(TurnTrace):
+    """Returned for unsampled turns; every operation is a constant-time no-op."""
+
+    def __init__(self) -> None:  # noqa: D401 - intentionally skips TurnTrace init
+        self.trace_id = ""
+        self.root = _NOOP_SPAN
+        self.spans = []
+        self.dropped_spans = 0
+        self.finished = False
+
+    @property
+    def sampled(self) -> bool:
+        return False
+
+    def start_span(self, name: str, parent: Optional[Span] = None, **attributes: Any) -> Span:
+        return _NOOP_SPAN
+
+    @contextmanager
+    def span(self, name: str, parent: Optional[Span] = None, **attributes: Any) -> Iterator[Span]:
+        yield _NOOP_SPAN
+
+    def finish(self, **attributes: Any) -> None:
+        return
+
+
+NOOP_TURN = _NoopTurnTrace()
+
+
+class OTLPJsonFileExporter:
+    """Appends one OTLP `ExportTraceServiceRequest` JSON document per line (collector `otlpjsonfile` format)."""
+
+    def __init__(self, path: str) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def export(self, documents: List[Dict[str, Any]]) -> None:
+        with self.path.open("a", encoding="utf-8") as fh:
+            for document in documents:
+                fh.write(json.dumps(document, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+
+class OTLPHttpExporter:
+    """Posts OTLP/HTTP JSON to `<endpoint>/v1/traces` (an OpenTelemetry collector or local stand-in)."""
+
+    def __init__(self, endpoint: str, timeout: float = 5.0) -> None:
+        if httpx is None:
+            raise RuntimeError("httpx is required for OTLP HTTP export")
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.client = httpx.Client(timeout=timeout)
+
+    def export(self, documents: List[Dict[str, Any]]) -> None:
+        for document in documents:
+            self.client.post(self.url, json=document)
+
+
+class Tracer:
+    """
+    Lightweight head-sampled tracer for gateway turns.
+
+    - Sampling decision is made once per turn (`TRACE_SAMPLE_RATE`, defaulting to
+      `SENTRY_TRACES_SAMPLE_RATE`); unsampled turns cost a single random() call.
+    - Finished turns are exported off the event loop by a daemon thread to either
+      an OTLP JSON-lines file (`TRACE_EXPORT_FILE`) or an OTLP/HTTP endpoint
+      (`TRACE_OTLP_ENDPOINT`).
+    """
+
+    def __init__(
+        self,
+        sample_rate: Optional[float] = None,
+        exporter: Optional[Any] = None,
+        max_spans_per_turn: Optional[int] = None,
+        max_pending: Optional[int] = None,
+    ) -> None:
+        if sample_rate is None:
+            sample_rate = float(os.getenv("TRACE_SAMPLE_RATE", os.getenv("SENTRY_TRACES_SAMPLE_RATE", "0")))
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+        self.max_spans_per_turn = max_spans_per_turn or int(os.getenv("TRACE_MAX_SPANS_PER_TURN", "512"))
+        self.resource_attributes = {"service.name": os.getenv("TRACE_SERVICE_NAME", "lingya-gateway")}
+        self.exporter = exporter if exporter is not None else self._exporter_from_env()
+        self._pending: "queue.Queue[TurnTrace]" = queue.Queue(maxsize=max_pending or int(os.getenv("TRACE_MAX_PENDING", "256")))
+        self._thread: Optional[threading.Thread] = None
+        self.dropped_turns = 0
+
+    @staticmethod
+    def _exporter_from_env() -> Optional[Any]:
+        endpoint = os.getenv("TRACE_OTLP_ENDPOINT")
+        if endpoint:
+            try:
+                return OTLPHttpExporter(endpoint)
+            except RuntimeError:
+                logger.warning("TRACE_OTLP_ENDPOINT set but httpx missing; tracing export disabled")
+                return None
+        path = os.getenv("TRACE_EXPORT_FILE")
+        if path:
+            return OTLPJsonFileExporter(path)
+        return None
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 and self.exporter is not None
+
+    def start_turn(self, name: str = "gateway.turn", **attributes: Any) -> TurnTrace:
+        if not self.enabled or random.random() >= self.sample_rate:
+            return NOOP_TURN
+        return TurnTrace(self, name, attributes)
+
+    def export(self, turn: TurnTrace) -> None:
+        if not turn.sampled or self.exporter is None:
+            return
+        try:
+            self._pending.put_nowait(turn)
+        except queue.Full:
+            self.dropped_turns += 1
+            return
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._export_loop, name="trace-exporter", daemon=True)
+            self._thread.start()
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """Block until queued turns are exported (used at shutdown and in tests)."""
+        deadline = time.monotonic() + timeout
+        while self._pending.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def _export_loop(self) -> None:
+        while True:
+            turn = self._pending.get()
+            batch = [turn]
+            while len(batch) < 32:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.exporter.export([t.to_otlp() for t in batch])
+            except Exception:  # noqa: BLE001
+                logger.exception("trace export failed (%d turns dropped)", len(batch))
+            finally:
+                for _ in batch:
+                    self._pending.task_done()
+
+
+_tracer: Optional[Tracer] = None
+
+
+def get_tracer() -> Tracer:
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger("tts_prefetch")
+
+# Sentence ends: CJK and ASCII terminators (with trailing closing quotes/brackets), or newlines.
+_SENTENCE_END = re.compile(r"[^。！？!?；;…\n]+(?:[。！？!?；;…]+[」』”’）)]*|\n+|$)")
+_LEADING_TAGS = re.compile(r"^\s*((?:\[[^\]]+\]\s*)+)")
+
+
+def split_sentences(text: str, min_chars: int = 12, max_chars: int = 220) -> List[str]:
+    """
+    Split a reply into synthesis units.
+
+    - Fragments shorter than `min_chars` are merged into the following sentence, so
+      "嗯！好呀～" does not cost two upstream requests.
+    - Runs longer than `max_chars` without punctuation are cut on commas/spaces.
+    - Emotion tags at the start of a sentence carry over to following untagged
+      sentences, since each unit is synthesized on its own.
+    """
+    pieces: List[str] = []
+    for match in _SENTENCE_END.finditer(text):
+        piece = match.group(0).strip()
+        if not piece:
+            continue
+        while len(piece) > max_chars:
+            cut = max(piece.rfind(sep, 0, max_chars) for sep in ("，", ",", "、", " "))
+            cut = cut + 1 if cut > 0 else max_chars
+            pieces.append(piece[:cut].strip())
+            piece = piece[cut:].strip()
+        if piece:
+            pieces.append(piece)
+
+    merged: List[str] = []
+    pending = ""
+    for piece in pieces:
+        pending = f"{pending}{piece}" if pending else piece
+        if len(_LEADING_TAGS.sub("", pending)) >= min_chars:
+            merged.append(pending)
+            pending = ""
+    if pending:
+        if merged and len(_LEADING_TAGS.sub("", pending)) < min_chars:
+            merged[-1] = f"{merged[-1]}{pending}"
+        else:
+            merged.append(pending)
+
+    sentences: List[str] = []
+    tags = ""
+    for sentence in merged:
+        leading = _LEADING_TAGS.match(sentence)
+        if leading:
+            tags = leading.group(1).strip()
+        elif tags:
+            sentence = f"{tags} {sentence}"
+        sentences.append(sentence)
+    return sentences
+
+
+class SentencePrefetcher:
+    """
+    Ordered audio for a multi-sentence reply with bounded look-ahead.
+
+    - Sentence 0 is streamed chunk by chunk through `stream` as soon as iteration starts.
+    - Sentences 1..n are fetched whole through `fetch`, at most `lookahead` ahead of the
+      sentence being played, at most `concurrency` at a time, and only while the
+      not-yet-played prefetched text stays within `max_ahead_chars` (the cost budget:
+      text that is cancelled before playback was still billed).
+    - Audio is yielded strictly in sentence order; `cancel()` (or closing the iterator)
+      cancels every outstanding fetch.
+    """
+
+    def __init__(
+        self,
+        sentences: List[str],
+        stream: Callable[[str], AsyncIterator[bytes]],
+        fetch: Callable[[str], Awaitable[bytes]],
+        lookahead: int = 2,
+        concurrency: int = 2,
+        max_ahead_chars: int = 400,
+        chunk_bytes: int = 48 * 1024,
+    ) -> None:
+        self.sentences = sentences
+        self._stream = stream
+        self._fetch = fetch
+        self.lookahead = max(0, lookahead)
+        self.max_ahead_chars = max_ahead_chars
+        self.chunk_bytes = max(1, chunk_bytes)
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._next_to_schedule = 1
+        self._playing = 0
+        self.cancelled = False
+        self.prefetched = 0
+        self._iterator: Optional[AsyncIterator[bytes]] = None
+
+    def __aiter__(self) -> AsyncIterator[bytes]:
+        if self._iterator is None:
+            self._iterator = self._iterate()
+        return self._iterator
+
+    async def aclose(self) -> None:
+        """Cancel outstanding fetches and close the running stream (releasing its upstream slot)."""
+        self.cancel()
+        if self._iterator is not None:
+            await self._iterator.aclose()
+
+    def cancel(self) -> None:
+        self.cancelled = True
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+
+    @property
+    def pending(self) -> int:
+        """Sentences being synthesized ahead of playback."""
+        return len(self._tasks)
+
+    def _ahead_chars(self) -> int:
+        return sum(len(self.sentences[i]) for i in self._tasks)
+
+    def _schedule(self) -> None:
+        while (
+            not self.cancelled
+            and self._next_to_schedule < len(self.sentences)
+            and self._next_to_schedule <= self._playing + self.lookahead
+        ):
+            index = self._next_to_schedule
+            if self._tasks and self._ahead_chars() + len(self.sentences[index]) > self.max_ahead_chars:
+                break
+            self._tasks[index] = asyncio.create_task(self._bounded_fetch(self.sentences[index]))
+            self._next_to_schedule += 1
+            self.prefetched += 1
+
+    async def _bounded_fetch(self, sentence: str) -> bytes:
+        async with self._semaphore:
+            return await self._fetch(sentence)
+
+    async def _iterate(self) -> AsyncIterator[bytes]:
+        if not self.sentences:
+            return
+        try:
+            self._schedule()
+            stream = self._stream(self.sentences[0])
+            try:
+                async for chunk in stream:
+                    if self.cancelled:
+                        return
+                    yield chunk
+            finally:
+                await stream.aclose()
+            for index in range(1, len(self.sentences)):
+                self._playing = index
+                self._schedule()
+                task = self._tasks.get(index)
+                if task is None:  # outside the budget so far: fetch it now
+                    task = self._tasks[index] = asyncio.create_task(self._bounded_fetch(self.sentences[index]))
+                    self._next_to_schedule = max(self._next_to_schedule, index + 1)
+                # wait() rather than awaiting the task: cancel() cancels it, and that must
+                # end the iteration, not the task consuming it.
+                await asyncio.wait({task})
+                if self.cancelled:
+                    return
+                audio = task.result()
+                self._tasks.pop(index, None)
+                self._schedule()
+                for offset in range(0, len(audio), self.chunk_bytes):
+                    if self.cancelled:
+                        return
+                    yield audio[offset:offset + self.chunk_bytes]
+        finally:
+            self.cancel()
+
+
+async def iterate_blocking(iterator, stop: Optional[Callable[[], None]] = None) -> AsyncIterator[bytes]:
+    """Drive a blocking byte iterator (e.g. `requests` `iter_content`) from the event loop."""
+    try:
+        while True:
+            chunk = await asyncio.to_thread(next, iterator, None)
+            if chunk is None:
+                return
+            if chunk:
+                yield chunk
+    finally:
+        if stop is not None:
+            stop()
@@ -3,14 +3,21 @@
 # 🧠 Context: Part of Voice Agent v2.0 upgrade under OpenSpec task: audio-cache
 
 import hashlib
+import json
 import os
 import time
 from pathlib import Path
-from typing import Iterable
+from typing import FrozenSet, Iterable, Tuple
 
 
 AUDIO_CACHE_DIR = Path("public/audio")
 CACHE_TTL_SECONDS = int(os.getenv("AUDIO_CACHE_TTL", 60 * 60 * 6))  # default 6 hours
+# Phrase-bank manifest: files listed here are pinned (never expire, never cleaned)
+PHRASE_BANK_MANIFEST = AUDIO_CACHE_DIR / "phrase_bank.json"
+# MP3 originals plus transcoded variants (modules/audio_formats.py)
+CACHE_SUFFIXES = (".mp3", ".ogg", ".pcm")
+
+_pinned_cache: Tuple[float, FrozenSet[str]] = (-1.0, frozenset())
 
 
 def ensure_cache_dir() -> None:
@@ -29,10 +36,30 @@ def get_cached_audio_path(audio_key: str) -> Path:
     return AUDIO_CACHE_DIR / f"{audio_key}.mp3"
 
 
+def pinned_files() -> FrozenSet[str]:
+    """File names pinned by the phrase-bank manifest (re-read only when it changes)."""
+    global _pinned_cache
+    try:
+        mtime = PHRASE_BANK_MANIFEST.stat().st_mtime
+    except OSError:
+        return frozenset()
+    if mtime != _pinned_cache[0]:
+        try:
+            entries = json.loads(PHRASE_BANK_MANIFEST.read_text(encoding="utf-8")).get("entries", {})
+            names = frozenset(entry["file"] for entry in entries.values())
+        except (OSError, ValueError, KeyError, AttributeError) as exc:
+            print(f"Failed to read phrase bank manifest: {exc}")
+            names = frozenset()
+        _pinned_cache = (mtime, names)
+    return _pinned_cache[1]
+
+
 def is_cache_valid(path: Path) -> bool:
-    """Check if cached file exists and is still within TTL."""
+    """Check if cached file exists and is still within TTL (pinned phrase-bank files never expire)."""
     if not path.exists():
         return False
+    if path.name in pinned_files():
+        return True
     age = time.time() - path.stat().st_mtime
     return age < CACHE_TTL_SECONDS
 
@@ -41,7 +68,10 @@ def clean_expired_cache(now: float | None = None) -> None:
     """Delete expired audio cache files from disk."""
     ensure_cache_dir()
     current = now or time.time()
-    for file in AUDIO_CACHE_DIR.glob("*.mp3"):
+    pinned = pinned_files()
+    for file in AUDIO_CACHE_DIR.iterdir():
+        if file.suffix not in CACHE_SUFFIXES or file.name in pinned:
+            continue
         age = current - file.stat().st_mtime
         if age > CACHE_TTL_SECONDS:
             try:
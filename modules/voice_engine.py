@@ -6,6 +6,7 @@
 """
 
 from modules.autonomous_emotion import autonomous_emotion_route, get_global_agent
+from modules.keyword_matcher import register_keywords, scan_keywords
 from modules.speech_tag_mapper import extract_tags_from_text, map_tags_to_voice_settings
 from eleven_tts import generate_speech
 from typing import Optional
@@ -32,6 +33,12 @@ LANGUAGE_KEYWORDS = {
     }
 }
 
+register_keywords("language", {code: info["keywords"] for code, info in LANGUAGE_KEYWORDS.items()})
+
+_CJK_PATTERN = re.compile(r'[\u4e00-\u9fff]')
+_KANA_PATTERN = re.compile(r'[\u3040-\u309f\u30a0-\u30ff]')
+_HANGUL_PATTERN = re.compile(r'[\uac00-\ud7a3]')
+
 
 def detect_language(text: str) -> str:
     """
@@ -43,28 +50,20 @@ def detect_language(text: str) -> str:
     Returns:
         語言代碼：zh, en, ja, ko，預設返回 "zh"
     """
-    text_lower = text.lower()
-    
-    # 計算各語言的匹配分數
-    scores = {}
-    for lang_code, lang_info in LANGUAGE_KEYWORDS.items():
-        score = sum(1 for keyword in lang_info["keywords"] if keyword.lower() in text_lower)
-        scores[lang_code] = score
+    # 計算各語言的匹配分數（命中的不同關鍵字數，一次掃描）
+    hits = scan_keywords(text)
+    scores = {lang_code: len(hits.keywords(f"language.{lang_code}")) for lang_code in LANGUAGE_KEYWORDS}
     
     # 檢查中文字符（CJK 統一漢字範圍）
-    cjk_pattern = re.compile(r'[\u4e00-\u9fff]')
-    if cjk_pattern.search(text):
+    if _CJK_PATTERN.search(text):
         scores["zh"] = scores.get("zh", 0) + 10  # 大幅提高中文分數
     
     # 檢查日文假名
-    hiragana_pattern = re.compile(r'[\u3040-\u309f]')
-    katakana_pattern = re.compile(r'[\u30a0-\u30ff]')
-    if hiragana_pattern.search(text) or katakana_pattern.search(text):
+    if _KANA_PATTERN.search(text):
         scores["ja"] = scores.get("ja", 0) + 10
     
     # 檢查韓文
-    korean_pattern = re.compile(r'[\uac00-\ud7a3]')
-    if korean_pattern.search(text):
+    if _HANGUL_PATTERN.search(text):
         scores["ko"] = scores.get("ko", 0) + 10
     
     # 返回分數最高的語言
@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import io
+import logging
+import os
+from bisect import bisect_right
+from typing import Iterable, List, Optional, Union
+
+import httpx
+
+try:
+    from openai import AsyncOpenAI
+except ImportError:  # pragma: no cover - optional dependency
+    AsyncOpenAI = None  # type: ignore
+
+from modules.metrics import get_metrics_registry
+
+logger = logging.getLogger("whisper_client")
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "whisper-1")
+# OpenAI-compatible endpoint for transcription (a local stand-in server, a proxy, ...).
+WHISPER_BASE_URL = os.getenv("WHISPER_BASE_URL") or None
+WHISPER_API_KEY = os.getenv("WHISPER_API_KEY") or OPENAI_API_KEY
+WHISPER_MAX_CONNECTIONS = int(os.getenv("WHISPER_MAX_CONNECTIONS", "16"))
+WHISPER_MAX_RETRIES = int(os.getenv("WHISPER_MAX_RETRIES", "1"))
+# Request timeout = base + per_audio_second * estimated duration, capped at max.
+WHISPER_TIMEOUT_BASE_SECONDS = float(os.getenv("WHISPER_TIMEOUT_BASE_SECONDS", "5"))
+WHISPER_TIMEOUT_PER_AUDIO_SECOND = float(os.getenv("WHISPER_TIMEOUT_PER_AUDIO_SECOND", "0.5"))
+WHISPER_TIMEOUT_MAX_SECONDS = float(os.getenv("WHISPER_TIMEOUT_MAX_SECONDS", "120"))
+# Duration of compressed uploads is estimated from size; a low bitrate errs towards a longer timeout.
+WHISPER_ASSUMED_KBPS = float(os.getenv("WHISPER_ASSUMED_KBPS", "24"))
+PCM16_BYTES_PER_SECOND = 16000 * 2
+
+DEFAULT_MIME_TYPE = "audio/webm"
+MIME_SUFFIX_MAP = {
+    "audio/webm": ".webm",
+    "audio/webm;codecs=opus": ".webm",
+    "audio/ogg": ".ogg",
+    "audio/ogg;codecs=opus": ".ogg",
+    "audio/mp4": ".m4a",
+    "audio/mp4;codecs=opus": ".m4a",
+    "audio/mpeg": ".mp3",
+    "audio/mp3": ".mp3",
+    "audio/wav": ".wav",
+}
+_PCM_MIME_TYPES = {"audio/wav", "audio/x-wav", "audio/l16", "audio/pcm"}
+
+_metrics = get_metrics_registry()
+METRIC_WHISPER_UPLOAD_BYTES = _metrics.histogram(
+    "whisper_upload_bytes",
+    "Audio bytes per Whisper transcription request",
+    buckets=(8_000, 32_000, 128_000, 512_000, 2_000_000, 8_000_000),
+)
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+
+class ChunkStream(io.RawIOBase):
+    """
+    Seekable, read-only file object over a list of byte chunks.
+
+    The chunks are exposed through memoryviews and read straight into the caller's
+    buffer, so uploading them needs neither a temp file nor a concatenated copy.
+    The chunks must not be mutated while the stream is in use.
+    """
+
+    def __init__(self, chunks: Iterable[BytesLike], name: str = "audio.webm") -> None:
+        super().__init__()
+        self._views: List[memoryview] = [memoryview(chunk).cast("B") for chunk in chunks if len(chunk)]
+        self._starts: List[int] = []
+        total = 0
+        for view in self._views:
+            self._starts.append(total)
+            total += len(view)
+        self.size = total
+        self.name = name
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self._pos = offset
+        return offset
+
+    def readinto(self, buffer) -> int:
+        target = memoryview(buffer).cast("B")
+        written = 0
+        index = bisect_right(self._starts, self._pos) - 1
+        while written < len(target) and 0 <= index < len(self._views) and self._pos < self.size:
+            view = self._views[index]
+            offset = self._pos - self._starts[index]
+            count = min(len(view) - offset, len(target) - written)
+            target[written:written + count] = view[offset:offset + count]
+            written += count
+            self._pos += count
+            index += 1
+        return written
+
+
+def estimate_duration_seconds(nbytes: int, mime_type: str) -> float:
+    """Audio length from its size: exact for 16 kHz PCM16, a bitrate estimate for compressed formats."""
+    base = (mime_type or DEFAULT_MIME_TYPE).split(";")[0].strip().lower()
+    if base in _PCM_MIME_TYPES:
+        return nbytes / PCM16_BYTES_PER_SECOND
+    return nbytes * 8 / (WHISPER_ASSUMED_KBPS * 1000)
+
+
+def transcription_timeout(duration_seconds: float) -> float:
+    return min(
+        WHISPER_TIMEOUT_MAX_SECONDS,
+        WHISPER_TIMEOUT_BASE_SECONDS + WHISPER_TIMEOUT_PER_AUDIO_SECOND * max(0.0, duration_seconds),
+    )
+
+
+class WhisperClient:
+    """
+    Async Whisper transcription over one pooled connection.
+
+    - One `AsyncOpenAI` client (and its `httpx.AsyncClient` pool) is shared by every
+      session, so requests reuse keep-alive connections instead of reconnecting.
+    - Chunks are uploaded from a `ChunkStream`: no disk I/O and no blocking call on
+      the event loop.
+    - The request timeout scales with the audio duration.
+    - `base_url` points at any OpenAI-compatible server (e.g. a local stand-in in tests).
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        model: str = WHISPER_MODEL,
+        http_client: Optional[httpx.AsyncClient] = None,
+        max_retries: int = WHISPER_MAX_RETRIES,
+    ) -> None:
+        if AsyncOpenAI is None:
+            raise RuntimeError("openai package is not installed")
+        if http_client is None:
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=WHISPER_MAX_CONNECTIONS,
+                    max_keepalive_connections=WHISPER_MAX_CONNECTIONS,
+                ),
+                timeout=httpx.Timeout(WHISPER_TIMEOUT_MAX_SECONDS, connect=5.0),
+            )
+        self.model = model
+        self.base_url = base_url
+        # A local server may not check keys, but the SDK insists on one.
+        self._client = AsyncOpenAI(
+            api_key=api_key or "unused",
+            base_url=base_url,
+            http_client=http_client,
+            max_retries=max_retries,
+        )
+
+    async def transcribe(self, chunks: Iterable[BytesLike], mime_type: str = DEFAULT_MIME_TYPE) -> str:
+        base = (mime_type or DEFAULT_MIME_TYPE).split(";")[0].strip().lower()
+        suffix = MIME_SUFFIX_MAP.get(mime_type, MIME_SUFFIX_MAP.get(base, ".webm"))
+        stream = ChunkStream(chunks, name=f"audio{suffix}")
+        if not stream.size:
+            return ""
+        timeout = transcription_timeout(estimate_duration_seconds(stream.size, mime_type))
+        METRIC_WHISPER_UPLOAD_BYTES.observe(stream.size)
+        response = await self._client.audio.transcriptions.create(
+            model=self.model,
+            file=(stream.name, stream, base),
+            timeout=timeout,
+        )
+        return response.text or ""
+
+    async def aclose(self) -> None:
+        await self._client.close()
+
+
+_client: Optional[WhisperClient] = None
+
+
+def get_whisper_client() -> Optional[WhisperClient]:
+    """Shared client, or None when neither an API key nor a WHISPER_BASE_URL is configured."""
+    global _client
+    if _client is None and (WHISPER_API_KEY or WHISPER_BASE_URL) and AsyncOpenAI is not None:
+        _client = WhisperClient(api_key=WHISPER_API_KEY, base_url=WHISPER_BASE_URL)
+        logger.info("whisper client ready", extra={"base_url": WHISPER_BASE_URL or "openai", "model": WHISPER_MODEL})
+    return _client
+
+
+async def close_whisper_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
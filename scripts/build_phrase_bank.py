@@ -0,0 +1,111 @@
+"""
+Pre-render openings and frequent short replies into the audio cache (the phrase bank).
+
+    python scripts/build_phrase_bank.py --dry-run
+    python scripts/build_phrase_bank.py --config config/phrase_bank.json --concurrency 4
+
+Renders every phrase x tag set for every voice in `RoleRegistry` (plus the default
+`ELEVEN_HUANGRONG_ID` voice) and records the files in `public/audio/phrase_bank.json`.
+Banked files are pinned against cache expiry; the gateway and `/api/chat` serve them
+without calling ElevenLabs. Re-running only renders what is missing (use `--force` to
+re-render everything, e.g. after a voice or model change).
+"""
+
+import argparse
+import json
+import os
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import requests  # noqa: E402
+
+from eleven_tts import API_KEY, VOICE_ID  # noqa: E402
+from modules.phrase_bank import (  # noqa: E402
+    PhraseSpec,
+    build_phrase_bank,
+    load_phrase_config,
+    plan_phrases,
+    tagged_text,
+)
+from modules.role_registry import RoleRegistry  # noqa: E402
+from modules.speech_tag_mapper import map_tags_to_voice_settings  # noqa: E402
+from modules.voice_cache_engine import PHRASE_BANK_MANIFEST  # noqa: E402
+
+MODEL_ID = os.getenv("PHRASE_BANK_MODEL_ID", "eleven_turbo_v2_5")
+
+
+def collect_voices(roles: Optional[List[str]], extra_voices: List[str]) -> Dict[str, List[str]]:
+    voices: Dict[str, List[str]] = defaultdict(list)
+    for role_id, info in RoleRegistry().list_roles().items():
+        if roles and role_id not in roles:
+            continue
+        if info.get("voice_id"):
+            voices[info["voice_id"]].append(role_id)
+    for voice_id in extra_voices:
+        voices.setdefault(voice_id, [])
+    return dict(voices)
+
+
+def synthesize(spec: PhraseSpec) -> bytes:
+    response = requests.post(
+        f"https://api.elevenlabs.io/v1/text-to-speech/{spec.voice_id}",
+        headers={"xi-api-key": API_KEY, "Content-Type": "application/json"},
+        json={
+            "model_id": MODEL_ID,
+            "text": tagged_text(spec.text, spec.tags),
+            "voice_settings": map_tags_to_voice_settings(list(spec.tags)),
+        },
+        timeout=60,
+    )
+    if response.status_code != 200:
+        raise RuntimeError(f"ElevenLabs {response.status_code}: {response.text[:200]}")
+    return response.content
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Pre-render the phrase audio bank")
+    parser.add_argument("--config", type=Path, default=os.getenv("PHRASE_BANK_CONFIG") or None,
+                        help='JSON with {"phrases": [...], "tag_sets": [[...]]}; defaults to openings + common replies')
+    parser.add_argument("--manifest", type=Path, default=PHRASE_BANK_MANIFEST)
+    parser.add_argument("--role", action="append", dest="roles", help="Only these role ids (repeatable)")
+    parser.add_argument("--voice", action="append", dest="voices", default=[], help="Extra voice ids (repeatable)")
+    parser.add_argument("--no-rule-tags", action="store_true", help="Skip the rule-engine tags per phrase")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--force", action="store_true", help="Re-render phrases that are already banked")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the plan")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    phrases, tag_sets = load_phrase_config(args.config)
+    extra = list(args.voices)
+    if VOICE_ID and not args.roles:
+        extra.append(VOICE_ID)
+    voices = collect_voices(args.roles, extra)
+    specs = plan_phrases(phrases, voices, tag_sets, include_rule_tags=not args.no_rule_tags)
+    print(f"{len(phrases)} phrases x {len(tag_sets)}+ tag sets x {len(voices)} voices -> {len(specs)} renderings")
+
+    if args.dry_run:
+        for spec in specs:
+            print(json.dumps({"key": spec.key, "voice_id": spec.voice_id, "text": tagged_text(spec.text, spec.tags)},
+                             ensure_ascii=False))
+        return 0
+    if not API_KEY:
+        print("ELEVEN_API_KEY is not set", file=sys.stderr)
+        return 1
+
+    stats = build_phrase_bank(
+        specs, synthesize, manifest_path=args.manifest, force=args.force, concurrency=args.concurrency, model_id=MODEL_ID
+    )
+    print(json.dumps(stats))
+    return 0 if stats["failed"] == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
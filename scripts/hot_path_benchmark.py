@@ -0,0 +1,89 @@
+"""
+Record and compare hot-path micro-benchmarks (benchmarks/bench_hot_paths.py).
+
+    python scripts/hot_path_benchmark.py record --name baseline
+    python scripts/hot_path_benchmark.py compare --max-regression 10
+
+Baselines are pytest-benchmark JSON files stored under `benchmarks/baselines/`.
+`compare` exits non-zero when any benchmark's statistic regressed by more than
+the configured percentage against the chosen baseline (default: latest saved).
+Requires `pip install pytest-benchmark`.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import List
+
+ROOT = Path(__file__).resolve().parents[1]
+BENCH_FILE = ROOT / "benchmarks" / "bench_hot_paths.py"
+BASELINE_DIR = ROOT / "benchmarks" / "baselines"
+
+
+def _pytest_cmd(extra: List[str]) -> List[str]:
+    return [
+        sys.executable,
+        "-m",
+        "pytest",
+        str(BENCH_FILE),
+        "-q",
+        "--benchmark-only",
+        f"--benchmark-storage=file://{BASELINE_DIR}",
+        "--benchmark-sort=name",
+        *extra,
+    ]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Hot-path micro-benchmark baselines")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    record = sub.add_parser("record", help="Run benchmarks and save a JSON baseline")
+    record.add_argument("--name", default=os.getenv("BENCH_BASELINE_NAME", "baseline"), help="Baseline label")
+
+    compare = sub.add_parser("compare", help="Run benchmarks and fail on regressions")
+    compare.add_argument(
+        "--baseline",
+        default=os.getenv("BENCH_BASELINE_ID", ""),
+        help="Saved run id/prefix (e.g. 0001); defaults to the latest baseline",
+    )
+    compare.add_argument(
+        "--max-regression",
+        type=float,
+        default=float(os.getenv("BENCH_MAX_REGRESSION_PCT", "10")),
+        help="Allowed slowdown in percent before failing",
+    )
+    compare.add_argument(
+        "--stat",
+        default=os.getenv("BENCH_COMPARE_STAT", "median"),
+        choices=["min", "max", "mean", "median"],
+        help="Statistic used for the regression check",
+    )
+    compare.add_argument("--save", action="store_true", help="Also save this run as a new baseline")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    BASELINE_DIR.mkdir(parents=True, exist_ok=True)
+
+    if args.command == "record":
+        cmd = _pytest_cmd([f"--benchmark-save={args.name}"])
+    else:
+        compare_flag = f"--benchmark-compare={args.baseline}" if args.baseline else "--benchmark-compare"
+        extra = [compare_flag, f"--benchmark-compare-fail={args.stat}:{args.max_regression:g}%"]
+        if args.save:
+            extra.append("--benchmark-autosave")
+        cmd = _pytest_cmd(extra)
+
+    print("[cmd]", " ".join(cmd))
+    result = subprocess.run(cmd, cwd=ROOT)
+    if args.command == "compare" and result.returncode != 0:
+        print(f"Hot-path regression above {args.max_regression:g}% ({args.stat}) or benchmark failure")
+    sys.exit(result.returncode)
+
+
+if __name__ == "__main__":
+    main()
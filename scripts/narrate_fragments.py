@@ -0,0 +1,120 @@
+"""
+Narrate the e-book fragments (every text file in `換框/` plus `Tracy_converted.md`).
+
+    python scripts/narrate_fragments.py --dry-run
+    python scripts/narrate_fragments.py --tagging llm --concurrency 4 --rpm 120
+
+Each fragment is split into sentence-sized segments, tagged (rule engine by default,
+or a checkpoint-cached LLM), and synthesized into the shared audio cache. The output
+directory (`NARRATION_OUTPUT_DIR`, default `public/audio/narration/`) gets one MP3 per
+fragment and `manifest.json` with each segment's start/end time. Interrupted runs
+resume from `checkpoint.json`; segments already in the cache are never re-billed.
+PDF, image and spreadsheet files are listed as skipped (convert them to .md first).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import requests  # noqa: E402
+
+from eleven_tts import API_KEY, VOICE_ID  # noqa: E402
+from modules.narration import (  # noqa: E402
+    NARRATION_OUTPUT_DIR,
+    NARRATION_TTS_COST_PER_1K_CHARS,
+    TAGGING_LLM,
+    TAGGING_NONE,
+    TAGGING_RULE,
+    NarrationRunner,
+    NarrationSegment,
+    discover_fragments,
+)
+from modules.speech_tag_mapper import map_tags_to_voice_settings  # noqa: E402
+
+MODEL_ID = os.getenv("NARRATION_MODEL_ID", "eleven_turbo_v2_5")
+DEFAULT_SOURCES = [ROOT / "換框", ROOT / "Tracy_converted.md"]
+
+
+def synthesize(segment: NarrationSegment) -> bytes:
+    response = requests.post(
+        f"https://api.elevenlabs.io/v1/text-to-speech/{segment.voice_id}",
+        headers={"xi-api-key": API_KEY, "Content-Type": "application/json"},
+        json={
+            "model_id": MODEL_ID,
+            "text": segment.tagged_text,
+            "voice_settings": map_tags_to_voice_settings(list(segment.tags)),
+        },
+        timeout=60,
+    )
+    # HTTPError keeps the response, so 429/503 are recognised as overload and retried.
+    response.raise_for_status()
+    return response.content
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Batch-narrate book fragments")
+    parser.add_argument("--source", action="append", dest="sources", type=Path,
+                        help="Fragment file or directory (repeatable); defaults to 換框/ and Tracy_converted.md")
+    parser.add_argument("--output-dir", type=Path, default=NARRATION_OUTPUT_DIR)
+    parser.add_argument("--voice", default=VOICE_ID, help="Voice id (default ELEVEN_HUANGRONG_ID)")
+    parser.add_argument("--tagging", choices=[TAGGING_RULE, TAGGING_LLM, TAGGING_NONE], default=TAGGING_RULE)
+    parser.add_argument("--llm-provider", default=os.getenv("NARRATION_LLM_PROVIDER", "openai"))
+    parser.add_argument("--concurrency", type=int, default=4, help="Max synthesis calls in flight")
+    parser.add_argument("--rpm", type=float, default=None, help="Cap on synthesis requests per minute")
+    parser.add_argument("--min-chars", type=int, default=12)
+    parser.add_argument("--max-chars", type=int, default=220)
+    parser.add_argument("--dry-run", action="store_true", help="Only print the plan and the cost estimate")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    fragments, skipped = discover_fragments(args.sources or DEFAULT_SOURCES)
+    for path in skipped:
+        print(f"skipped (no text): {path}", file=sys.stderr)
+    if not args.voice:
+        print("ELEVEN_HUANGRONG_ID is not set (or pass --voice)", file=sys.stderr)
+        return 1
+
+    runner = NarrationRunner(
+        synthesize,
+        voice_id=args.voice,
+        output_dir=args.output_dir,
+        tagging=TAGGING_RULE if args.dry_run and args.tagging == TAGGING_LLM else args.tagging,
+        llm_provider=args.llm_provider,
+        concurrency=args.concurrency,
+        requests_per_minute=args.rpm,
+        min_chars=args.min_chars,
+        max_chars=args.max_chars,
+        model_id=MODEL_ID,
+    )
+    if args.dry_run:
+        planned = asyncio.run(runner.plan(fragments))
+        billed = {}  # repeated sentences are rendered (and billed) once
+        for fragment_id, segments in planned.items():
+            pending = [s for s in segments if not runner.segment_path(s).exists()]
+            billed.update((s.key, len(s.tagged_text)) for s in pending)
+            print(json.dumps({"fragment": fragment_id, "segments": len(segments), "to_synthesize": len(pending)},
+                             ensure_ascii=False))
+        characters = sum(billed.values())
+        print(json.dumps({"fragments": len(planned), "billable_characters": characters,
+                          "estimated_cost_usd": round(characters / 1000 * NARRATION_TTS_COST_PER_1K_CHARS, 4)}))
+        return 0
+    if not API_KEY:
+        print("ELEVEN_API_KEY is not set", file=sys.stderr)
+        return 1
+
+    stats = asyncio.run(runner.run(fragments))
+    print(json.dumps(stats, ensure_ascii=False))
+    return 0 if stats["failed"] == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""
+Latency percentiles and cache / role statistics over the local columnar telemetry sink.
+
+    python scripts/telemetry_report.py --days 7
+    python scripts/telemetry_report.py --dir var/telemetry/columnar --since 2026-10-01 --json
+
+Reads the Parquet / Arrow IPC files written by `modules.telemetry_sink.LocalColumnarSink`
+(`OBS_LOCAL_SINK_DIR`); no hosted database is involved. Requires `pip install pyarrow`.
+"""
+
+import argparse
+import json
+import os
+import sys
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import pyarrow as pa  # noqa: E402
+import pyarrow.compute as pc  # noqa: E402
+
+from modules.telemetry_sink import read_sink  # noqa: E402
+
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+
+def percentiles(values: "pa.ChunkedArray") -> Optional[Dict[str, Any]]:
+    values = pc.drop_null(values)
+    if len(values) == 0:
+        return None
+    result: Dict[str, Any] = {"count": len(values)}
+    for q, v in zip(QUANTILES, pc.quantile(values, q=list(QUANTILES)).to_pylist()):
+        result[f"p{int(q * 100)}"] = round(v, 1)
+    result["max"] = round(pc.max(values).as_py(), 1)
+    return result
+
+
+def by_group(table: "pa.Table", key: str, column: str) -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    for group in sorted(v for v in pc.unique(table[key]).to_pylist() if v is not None):
+        stats = percentiles(table.filter(pc.equal(table[key], group))[column])
+        if stats:
+            out[group] = stats
+    return out
+
+
+def _since_filter(table: "pa.Table", since: date) -> "pa.Table":
+    cutoff_ms = int(datetime.combine(since, datetime.min.time()).timestamp() * 1000)
+    return table.filter(pc.greater_equal(table["timestamp"], cutoff_ms))
+
+
+def build_report(directory: str, since: date) -> Dict[str, Any]:
+    metrics = _since_filter(read_sink(directory, "metric", since), since)
+    sessions = _since_filter(read_sink(directory, "session", since), since)
+    switches = _since_filter(read_sink(directory, "role_switch", since), since)
+    cache = _since_filter(read_sink(directory, "cache", since), since)
+
+    stt = metrics.filter(pc.is_valid(metrics["latency_ms"]))
+    stt_final = stt.filter(pc.equal(stt["is_final"], True))
+    stt_partial = stt.filter(pc.invert(pc.equal(stt["is_final"], True)))
+
+    report: Dict[str, Any] = {
+        "directory": directory,
+        "since": since.isoformat(),
+        "stt_latency_ms": {
+            "final": percentiles(stt_final["latency_ms"]),
+            "partial": percentiles(stt_partial["latency_ms"]),
+            "final_by_role": by_group(stt_final, "role_id", "latency_ms"),
+        },
+        "sessions": {
+            "count": sessions.num_rows,
+            "with_errors": pc.sum(pc.greater(sessions["errors"], 0)).as_py() or 0,
+            "duration_ms": percentiles(sessions["duration_ms"]),
+            "tts_first_chunk_ms": percentiles(sessions["tts_first_chunk_ms"]),
+            "tts_first_chunk_ms_by_role": by_group(sessions, "role_id", "tts_first_chunk_ms"),
+            "by_role": dict(
+                zip(*[col.to_pylist() for col in pc.value_counts(sessions["role_id"]).flatten()])
+            ),
+        },
+        "role_switches": {"count": switches.num_rows},
+        "cache": {"requests": cache.num_rows},
+    }
+
+    if switches.num_rows:
+        ok = switches.filter(pc.equal(switches["success"], True))
+        transitions: Dict[str, int] = {}
+        for src, dst in zip(switches["from_role"].to_pylist(), switches["to_role"].to_pylist()):
+            name = f"{src or '-'}->{dst or '-'}"
+            transitions[name] = transitions.get(name, 0) + 1
+        report["role_switches"].update(
+            {
+                "success_rate": round(ok.num_rows / switches.num_rows, 4),
+                "latency_ms": percentiles(ok["latency_ms"]),
+                "top_transitions": dict(sorted(transitions.items(), key=lambda kv: -kv[1])[:10]),
+            }
+        )
+
+    if cache.num_rows:
+        per_route: Dict[str, Dict[str, Any]] = {}
+        for route, hit in zip(cache["route"].to_pylist(), cache["cache_hit"].to_pylist()):
+            entry = per_route.setdefault(route or "-", {"requests": 0, "hits": 0})
+            entry["requests"] += 1
+            entry["hits"] += int(bool(hit))
+        for entry in per_route.values():
+            entry["hit_ratio"] = round(entry["hits"] / entry["requests"], 4)
+        hits = sum(entry["hits"] for entry in per_route.values())
+        report["cache"].update({"hits": hits, "hit_ratio": round(hits / cache.num_rows, 4), "by_route": per_route})
+
+    return report
+
+
+def _format_stats(stats: Optional[Dict[str, Any]]) -> str:
+    if not stats:
+        return "n/a"
+    return "  ".join(f"{k}={v}" for k, v in stats.items())
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"Telemetry report: {report['directory']} (since {report['since']})")
+    stt = report["stt_latency_ms"]
+    print("\nSTT latency (ms)")
+    print(f"  final    {_format_stats(stt['final'])}")
+    print(f"  partial  {_format_stats(stt['partial'])}")
+    for role, stats in stt["final_by_role"].items():
+        print(f"  final[{role}]  {_format_stats(stats)}")
+
+    sessions = report["sessions"]
+    print(f"\nSessions: {sessions['count']} ({sessions['with_errors']} with errors)")
+    print(f"  duration_ms         {_format_stats(sessions['duration_ms'])}")
+    print(f"  tts_first_chunk_ms  {_format_stats(sessions['tts_first_chunk_ms'])}")
+    for role, stats in sessions["tts_first_chunk_ms_by_role"].items():
+        print(f"  tts_first_chunk_ms[{role}]  {_format_stats(stats)}")
+    for role, count in sessions["by_role"].items():
+        print(f"  role {role}: {count} sessions")
+
+    switches = report["role_switches"]
+    print(f"\nRole switches: {switches['count']}")
+    if switches["count"]:
+        print(f"  success_rate  {switches['success_rate']}")
+        print(f"  latency_ms    {_format_stats(switches['latency_ms'])}")
+        for transition, count in switches["top_transitions"].items():
+            print(f"  {transition}: {count}")
+
+    cache = report["cache"]
+    print(f"\nVoice cache requests: {cache['requests']}")
+    if cache["requests"]:
+        print(f"  hit_ratio  {cache['hit_ratio']}")
+        for route, entry in cache["by_route"].items():
+            print(f"  {route}: {entry['hits']}/{entry['requests']} hits ({entry['hit_ratio']})")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline telemetry report from the local columnar sink")
+    parser.add_argument("--dir", default=os.getenv("OBS_LOCAL_SINK_DIR", "var/telemetry/columnar"))
+    window = parser.add_mutually_exclusive_group()
+    window.add_argument("--days", type=int, default=7, help="Look back N days (default 7)")
+    window.add_argument("--since", type=date.fromisoformat, help="Start date (YYYY-MM-DD)")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    since = args.since or (date.today() - timedelta(days=max(args.days - 1, 0)))
+    report = build_report(args.dir, since)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,16 @@
+import pytest
+
+
+class FakeClock:
+    """Stand-in for `time.monotonic`; tests move time with `clock.now += seconds`."""
+
+    def __init__(self, now: float = 1_000_000.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture()
+def clock() -> FakeClock:
+    return FakeClock()
@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+from modules.admission import (
+    OUTCOME_OK,
+    OUTCOME_OVERLOAD,
+    PRIORITY_BATCH,
+    PRIORITY_LIVE,
+    AdmissionController,
+    AdmissionRejected,
+)
+
+
+def _controller(**kwargs) -> AdmissionController:
+    options = dict(initial_limit=1, max_limit=4, queue_timeouts={PRIORITY_LIVE: 1.0, PRIORITY_BATCH: 1.0})
+    options.update(kwargs)
+    return AdmissionController("test", **options)
+
+
+@pytest.mark.asyncio
+async def test_live_waiters_are_admitted_before_batch() -> None:
+    controller = _controller()
+    held = await controller.acquire(PRIORITY_BATCH)
+    order = []
+
+    async def call(name: str, priority: int) -> None:
+        async with controller.admit(priority):
+            order.append(name)
+
+    batch = asyncio.create_task(call("batch", PRIORITY_BATCH))
+    await asyncio.sleep(0)
+    live = asyncio.create_task(call("live", PRIORITY_LIVE))
+    await asyncio.sleep(0)
+    assert controller.queued == 2
+    controller.release(held)
+    await asyncio.gather(batch, live)
+    assert order == ["live", "batch"]
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_queue_timeout_and_shedding() -> None:
+    controller = _controller(queue_timeouts={PRIORITY_LIVE: 0.01, PRIORITY_BATCH: 0.0})
+    await controller.acquire(PRIORITY_LIVE)
+    with pytest.raises(AdmissionRejected) as shed:
+        await controller.acquire(PRIORITY_BATCH)
+    assert shed.value.reason == "shed" and shed.value.retry_after >= 1
+    with pytest.raises(AdmissionRejected) as timed_out:
+        await controller.acquire(PRIORITY_LIVE)
+    assert timed_out.value.reason == "queue_timeout"
+    assert controller.queued == 0 and controller.in_flight == 1
+
+
+def test_aimd_window(clock) -> None:
+    controller = _controller(initial_limit=4, max_limit=8, cooldown=1.0, latency_target_ms=500, clock=clock)
+    for _ in range(8):
+        controller.in_flight += 1
+        controller.release(clock(), OUTCOME_OK)
+    assert 5.0 < controller.limit < 6.5  # roughly +1 per window of successful calls
+
+    before = controller.limit
+    controller.in_flight += 1
+    controller.release(clock(), OUTCOME_OVERLOAD)
+    assert controller.limit == pytest.approx(before * 0.7)
+    controller.in_flight += 1
+    controller.release(clock(), OUTCOME_OVERLOAD)  # inside the cooldown: no second cut
+    assert controller.limit == pytest.approx(before * 0.7)
+
+    clock.now += 2.0
+    started = clock()
+    clock.now += 1.0  # slower than the latency target counts as congestion
+    controller.in_flight += 1
+    controller.release(started, OUTCOME_OK)
+    assert controller.limit == pytest.approx(before * 0.49)
+
+
+@pytest.mark.asyncio
+async def test_upstream_429_shrinks_window() -> None:
+    class Throttled(Exception):
+        status_code = 429
+
+    controller = _controller(initial_limit=4)
+    with pytest.raises(Throttled):
+        async with controller.admit(PRIORITY_BATCH):
+            raise Throttled()
+    assert controller.limit == pytest.approx(2.8)
+
+
+@pytest.mark.asyncio
+async def test_llm_window_shrinks_when_the_provider_is_throttled(monkeypatch, clock) -> None:
+    from api import main
+    from modules import llm_emotion_router, resilience
+
+    class Throttled(Exception):
+        status_code = 429
+
+    calls = []
+
+    def throttled_provider(text, model):
+        calls.append(text)
+        raise Throttled()
+
+    controller = _controller(initial_limit=8, max_limit=8, cooldown=1.0, clock=clock)
+    monkeypatch.setattr(main, "llm_admission", controller)
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setattr(llm_emotion_router, "OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(llm_emotion_router, "LLM_FAILOVER", False)
+    monkeypatch.setitem(llm_emotion_router._PROVIDERS, "openai", throttled_provider)
+
+    for _ in range(2):
+        reply = await main._route_emotion("太好了！我們成功了！", "openai", PRIORITY_LIVE)
+        assert reply == main.insert_emotion_tags("太好了！我們成功了！")
+        clock.now += 1.0
+    assert len(calls) == 2
+    assert controller.limit == pytest.approx(8 * controller.backoff ** 2)
+    assert controller.in_flight == 0
@@ -0,0 +1,77 @@
+import asyncio
+import json
+import random
+
+import pytest
+
+from modules.agent_store import AgentStore
+from modules.autonomous_emotion import AutonomousEmotionAgent
+from modules.soft_ling import SoftLingAgent
+
+
+def _talk(agent, texts) -> None:
+    random.seed(7)
+    for text in texts:
+        agent.process_text(text, use_llm=False)
+
+
+@pytest.mark.asyncio
+async def test_sessions_are_isolated_and_lru_evicted() -> None:
+    store = AgentStore(max_sessions=2, ttl_seconds=0)
+    async with store.use("alice") as alice:
+        _talk(alice, ["我好難過", "真的好想哭"])
+    assert store.get("bob").get_autonomy_stats()["total_messages"] == 0
+    assert store.get("alice") is alice
+    assert isinstance(store.get("alice", "soft_ling"), SoftLingAgent)  # evicts bob (least recent)
+    assert len(store) == 2
+    assert store.get("bob").get_autonomy_stats()["total_messages"] == 0
+    assert store.get("alice", autonomy_level=0.3).autonomy_level == 0.3
+
+
+def test_ttl_expiry(monkeypatch) -> None:
+    clock = [1000.0]
+    monkeypatch.setattr("modules.agent_store.time.monotonic", lambda: clock[0])
+    store = AgentStore(max_sessions=10, ttl_seconds=60)
+    first = store.get("carol")
+    clock[0] += 30
+    assert store.get("carol") is first
+    clock[0] += 61
+    assert store.evict_expired() == 1
+    assert store.get("carol") is not first
+
+
+@pytest.mark.asyncio
+async def test_snapshot_round_trip(tmp_path) -> None:
+    store = AgentStore(snapshot_path=tmp_path / "agents.json")
+    async with store.use("dave") as agent:
+        _talk(agent, ["這是個秘密", "哈哈太好笑了", "我真的好感動"] * 3)
+    expected = agent.get_autonomy_stats()
+    store.save()
+    assert json.loads((tmp_path / "agents.json").read_text(encoding="utf-8"))["sessions"]
+
+    restored = AgentStore(snapshot_path=tmp_path / "agents.json")
+    assert restored.load() == 1
+    assert restored.get("dave").get_autonomy_stats() == expected
+
+
+@pytest.mark.asyncio
+async def test_turns_of_one_session_are_serialized() -> None:
+    store = AgentStore()
+    events = []
+
+    async def turn(session_id: str, name: str) -> None:
+        async with store.use(session_id):
+            events.append(f"{name}:start")
+            await asyncio.sleep(0.01)  # the LLM call between reading and updating state
+            events.append(f"{name}:end")
+
+    await asyncio.gather(turn("erin", "a"), turn("erin", "b"), turn("frank", "c"))
+    erin = [event for event in events if not event.startswith("c")]
+    assert erin == ["a:start", "a:end", "b:start", "b:end"]
+    assert events.index("c:start") < events.index("a:end")  # other sessions are not held up
+
+
+def test_agent_state_is_compact() -> None:
+    agent = AutonomousEmotionAgent()
+    assert not hasattr(agent, "__dict__")
+    assert not hasattr(SoftLingAgent(), "__dict__")
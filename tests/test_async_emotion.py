@@ -0,0 +1,129 @@
+import asyncio
+import random
+import time
+
+import pytest
+
+from modules import llm_emotion_router
+from modules.autonomous_emotion import AutonomousEmotionAgent
+from modules.resilience import STATE_CLOSED, STATE_OPEN, CircuitBreaker
+from modules.soft_ling import (
+    SoftLingAgent,
+    SoftLingLLMUnavailable,
+    generate_soft_ling_turn_async,
+    process_structured_reply_with_soft_ling,
+    process_with_soft_ling,
+    process_with_soft_ling_async,
+)
+
+TEXTS = ["你好", "這是個秘密", "我真的好感動", "哈哈太好笑了", "你知道嗎？", "我好難過", "太好了！"] * 3
+
+
+@pytest.mark.asyncio
+async def test_async_paths_match_sync_without_llm() -> None:
+    for agent_class in (AutonomousEmotionAgent, SoftLingAgent):
+        sync_agent, async_agent = agent_class(), agent_class()
+        random.seed(11)
+        expected = [sync_agent.process_text(text, use_llm=False) for text in TEXTS]
+        random.seed(11)
+        actual = [await async_agent.process_text_async(text, use_llm=False) for text in TEXTS]
+        assert actual == expected
+        assert async_agent.get_autonomy_stats() == sync_agent.get_autonomy_stats()
+
+    random.seed(3)
+    expected = process_with_soft_ling("我好開心！", use_llm=False)
+    random.seed(3)
+    assert await process_with_soft_ling_async("我好開心！", use_llm=False) == expected
+
+
+@pytest.mark.asyncio
+async def test_rule_path_wins_when_llm_exceeds_budget(monkeypatch) -> None:
+    async def slow_llm(text, model="gpt-4o-mini"):
+        await asyncio.sleep(5)
+        return f"[whispers] {text}"
+
+    monkeypatch.setattr(llm_emotion_router, "llm_emotion_route_openai_async", slow_llm)
+    agent = AutonomousEmotionAgent(autonomy_level=1.0)
+    started = time.perf_counter()
+    tags = await agent.choose_emotion_tags_async("氣死我了！太過分了！", budget_ms=20)
+    assert time.perf_counter() - started < 1
+    assert tags and "whispers" not in tags
+
+    async def fast_llm(text, model="gpt-4o-mini"):
+        return f"[whispers] {text}"
+
+    monkeypatch.setattr(llm_emotion_router, "llm_emotion_route_openai_async", fast_llm)
+    assert await agent.choose_emotion_tags_async("氣死我了！太過分了！", budget_ms=500) == ["whispers"]
+
+
+class _FakeCompletions:
+    def __init__(self, content, delay: float = 0.0):
+        self.content = content
+        self.delay = delay
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        message = type("Message", (), {"content": self.content})()
+        choice = type("Choice", (), {"message": message})()
+        return type("Response", (), {"choices": [choice]})()
+
+
+def _fake_client(monkeypatch, completions) -> None:
+    client = type("Client", (), {"chat": type("Chat", (), {"completions": completions})()})()
+    monkeypatch.setattr(llm_emotion_router, "get_async_llm_client", lambda provider: client)
+
+
+def _breaker() -> CircuitBreaker:
+    # A private breaker, so these tests never write into the process-wide `llm_*` ones.
+    return CircuitBreaker("soft_ling_test", min_calls=1, open_seconds=60)
+
+
+@pytest.mark.asyncio
+async def test_combined_turn_feeds_agent_and_voice_settings(monkeypatch) -> None:
+    completions = _FakeCompletions('{"reply": "好呀～我們一起去！", "tags": ["excited"], "intensity": 0.9}')
+    _fake_client(monkeypatch, completions)
+
+    reply = await generate_soft_ling_turn_async("要不要出去玩？", breaker=_breaker())
+    assert completions.calls == 1
+    agent = SoftLingAgent()
+    result = process_structured_reply_with_soft_ling(reply, agent=agent)
+    assert result["tagged_text"] == "[excited] 好呀～我們一起去！"
+    assert result["voice_settings"]["intensity"] == 0.9
+    assert agent.current_emotion_state == "excited"
+
+    completions.content = "抱歉，我不會輸出 JSON"
+    assert await generate_soft_ling_turn_async("要不要出去玩？", breaker=_breaker()) is None
+
+
+@pytest.mark.asyncio
+async def test_slow_combined_reply_is_not_cut_by_the_emotion_budget(monkeypatch) -> None:
+    assert llm_emotion_router.EMOTION_LLM_BUDGET_MS <= 1500
+    completions = _FakeCompletions('{"reply": "慢慢想，好好說～", "tags": ["softly"], "intensity": 0.5}', delay=1.6)
+    _fake_client(monkeypatch, completions)
+    breaker = _breaker()
+    reply = await generate_soft_ling_turn_async("你覺得呢？", breaker=breaker)
+    assert reply is not None and reply.text == "慢慢想，好好說～"
+    assert breaker.state == STATE_CLOSED and breaker.stats()["failures"] == 0
+
+
+@pytest.mark.asyncio
+async def test_combined_turn_fails_fast_when_llm_is_down(monkeypatch) -> None:
+    completions = _FakeCompletions(None, delay=5)
+    _fake_client(monkeypatch, completions)
+    breaker = _breaker()
+    started = time.perf_counter()
+    with pytest.raises(SoftLingLLMUnavailable) as exc:
+        await generate_soft_ling_turn_async("要不要出去玩？", timeout_ms=20, breaker=breaker)
+    assert time.perf_counter() - started < 1 and completions.calls == 1
+    assert exc.value.fallback_reply
+    assert breaker.state == STATE_OPEN
+
+    with pytest.raises(SoftLingLLMUnavailable):  # breaker open: no second call to the provider
+        await generate_soft_ling_turn_async("要不要出去玩？", breaker=breaker)
+    assert completions.calls == 1
+
+    monkeypatch.setattr(llm_emotion_router, "get_async_llm_client", lambda provider: None)
+    with pytest.raises(SoftLingLLMUnavailable):
+        await generate_soft_ling_turn_async("要不要出去玩？", breaker=_breaker())
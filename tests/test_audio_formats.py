@@ -0,0 +1,44 @@
+import pytest
+
+from modules import audio_formats, voice_cache_engine
+from modules.audio_formats import (
+    FORMATS,
+    TranscodeUnavailable,
+    eleven_output_format,
+    ensure_variant,
+    negotiate_format,
+    variant_path,
+)
+from modules.audio_serving import AUDIO_NAME_PATTERN
+
+
+def test_negotiation_prefers_explicit_then_accept() -> None:
+    assert negotiate_format("ogg").name == "opus"
+    assert negotiate_format(None, "audio/mpeg;q=0.5, audio/ogg;codecs=opus;q=0.9").name == "opus"
+    assert negotiate_format(None, "audio/ogg;q=0, audio/L16").name == "pcm16"
+    assert negotiate_format(None, "application/json").name == audio_formats.DEFAULT_AUDIO_FORMAT
+    with pytest.raises(ValueError):
+        negotiate_format("flac")
+    assert eleven_output_format(FORMATS["opus"]) == f"opus_48000_{FORMATS['opus'].bitrate_kbps}"
+    assert eleven_output_format(FORMATS["pcm16"]) == "pcm_16000"
+
+
+def test_variants_are_cached_per_format_and_bitrate(monkeypatch, tmp_path) -> None:
+    monkeypatch.setattr(voice_cache_engine, "AUDIO_CACHE_DIR", tmp_path)
+    source = tmp_path / "abc123.mp3"
+    source.write_bytes(b"ID3mp3")
+    calls = []
+    monkeypatch.setattr(audio_formats, "transcode", lambda data, fmt: calls.append(fmt.name) or b"OggS" + data)
+
+    opus = ensure_variant(source, FORMATS["opus"])
+    assert opus == variant_path("abc123", FORMATS["opus"])
+    assert opus.name == f"abc123_opus{FORMATS['opus'].bitrate_kbps}.ogg" and AUDIO_NAME_PATTERN.match(opus.name)
+    assert ensure_variant(source, FORMATS["opus"]) == opus
+    assert ensure_variant(source, FORMATS["mp3"]) == source
+    assert calls == ["opus"]
+
+
+def test_missing_ffmpeg_raises_transcode_unavailable(monkeypatch) -> None:
+    monkeypatch.setattr(audio_formats, "FFMPEG_BIN", "definitely-not-ffmpeg")
+    with pytest.raises(TranscodeUnavailable):
+        audio_formats.transcode(b"ID3", FORMATS["opus"])
@@ -0,0 +1,75 @@
+import fractions
+import io
+
+import numpy as np
+import pytest
+
+from modules.audio_decode import PCMStreamDecoder, wav_header, wav_to_pcm16
+from modules.audio_input import INPUT_OPUS_FRAMES, INPUT_PCM16, PCM16Input, negotiate_input
+from modules.emotion_ai import EmotionAIWorker
+
+
+def test_wav_header_round_trip() -> None:
+    pcm = np.arange(-800, 800, dtype="<i2").tobytes()
+    wav = wav_header(len(pcm)) + pcm
+    assert len(wav) == 44 + len(pcm)
+    assert wav_to_pcm16(wav) == pcm
+    # Extra chunks before `data` (e.g. ffmpeg's LIST) are skipped.
+    listed = wav[:36] + b"LIST" + (4).to_bytes(4, "little") + b"INFO" + wav[36:]
+    assert wav_to_pcm16(listed) == pcm
+
+
+def test_pcm_input_passes_frames_through_sample_aligned() -> None:
+    decoder = negotiate_input(INPUT_PCM16)
+    assert isinstance(decoder, PCM16Input) and decoder.buffers_pcm
+    assert decoder.decode(b"\x01\x02\x03").tobytes() == b"\x01\x02"
+    assert decoder.decode(b"\x04\x05").tobytes() == b"\x03\x04"
+    frame = decoder.decode(b"\x06")
+    assert frame.dtype == np.int16 and frame.tolist() == [0x0605]
+    with pytest.raises(ValueError):
+        negotiate_input("flac")
+
+
+TONE = (np.sin(2 * np.pi * 220 * np.arange(48000) / 48000) * 8000).astype(np.int16)
+
+
+def _tone_frames(av):
+    for start in range(0, len(TONE), 960):
+        frame = av.AudioFrame.from_ndarray(TONE[start:start + 960].reshape(1, -1), format="s16", layout="mono")
+        frame.sample_rate, frame.pts = 48000, start
+        yield frame
+
+
+def test_opus_frames_decode_to_16k_pcm() -> None:
+    av = pytest.importorskip("av")
+    encoder = av.CodecContext.create("libopus", "w")
+    encoder.sample_rate, encoder.layout, encoder.format = 48000, "mono", "s16"
+    encoder.time_base = fractions.Fraction(1, 48000)
+    packets = [bytes(packet) for frame in _tone_frames(av) for packet in encoder.encode(frame)]
+
+    decoder = negotiate_input(INPUT_OPUS_FRAMES)
+    samples = np.concatenate([decoder.decode(packet) for packet in packets])
+    assert samples.dtype == np.int16
+    assert abs(len(samples) - 16000) < 480  # one second at 16 kHz, minus codec delay
+    assert np.abs(samples).max() > 4000
+    worker = EmotionAIWorker()
+    wav = wav_header(samples.nbytes) + samples.tobytes()
+    assert worker.analyze_pcm(samples, 40.0, 60.0) == worker.analyze(wav, 40.0, 60.0)
+
+
+def test_stream_decoder_yields_frames_from_a_container() -> None:
+    av = pytest.importorskip("av")
+    buffer = io.BytesIO()
+    with av.open(buffer, "w", format="ogg") as container:
+        stream = container.add_stream("libopus", rate=48000, layout="mono")
+        for frame in _tone_frames(av):
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+
+    decoder = PCMStreamDecoder()
+    frames = list(decoder.frames(buffer.getvalue()))
+    assert len(frames) > 1 and all(frame.dtype == np.int16 and frame.ndim == 1 for frame in frames)
+    total = sum(frame.size for frame in frames) + decoder.flush().size
+    assert abs(total - 16000) < 480
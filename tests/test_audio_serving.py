@@ -0,0 +1,58 @@
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from modules.audio_serving import RangeNotSatisfiable, audio_response, parse_range
+
+
+def _client(tmp_path) -> TestClient:
+    app = FastAPI()
+
+    @app.get("/audio/{filename}")
+    async def serve(filename: str, request: Request):
+        return audio_response(request, tmp_path, filename)
+
+    return TestClient(app)
+
+
+def test_parse_range_forms() -> None:
+    assert parse_range("bytes=0-9", 100) == (0, 9)
+    assert parse_range("bytes=90-", 100) == (90, 99)
+    assert parse_range("bytes=-10", 100) == (90, 99)
+    assert parse_range("bytes=95-200", 100) == (95, 99)
+    assert parse_range("bytes=0-1,5-6", 100) is None
+    assert parse_range("items=0-1", 100) is None
+    for header, size in (("bytes=-5", 0), ("bytes=0-", 0), ("bytes=100-", 100), ("bytes=-0", 100)):
+        with pytest.raises(RangeNotSatisfiable):
+            parse_range(header, size)
+
+
+def test_etag_conditional_get_and_range(tmp_path) -> None:
+    (tmp_path / "abc123.mp3").write_bytes(bytes(range(200)))
+    client = _client(tmp_path)
+
+    full = client.get("/audio/abc123.mp3")
+    assert full.status_code == 200 and len(full.content) == 200
+    assert "immutable" in full.headers["cache-control"]
+    etag = full.headers["etag"]
+    assert etag.startswith('"abc123-')
+
+    assert client.get("/audio/abc123.mp3", headers={"If-None-Match": etag}).status_code == 304
+
+    partial = client.get("/audio/abc123.mp3", headers={"Range": "bytes=10-19"})
+    assert partial.status_code == 206
+    assert partial.content == bytes(range(10, 20))
+    assert partial.headers["content-range"] == "bytes 10-19/200"
+
+    stale = client.get("/audio/abc123.mp3", headers={"Range": "bytes=10-19", "If-Range": '"other"'})
+    assert stale.status_code == 200 and len(stale.content) == 200
+
+    unsatisfiable = client.get("/audio/abc123.mp3", headers={"Range": "bytes=500-"})
+    assert unsatisfiable.status_code == 416 and unsatisfiable.headers["content-range"] == "bytes */200"
+
+
+def test_rejects_unsafe_names(tmp_path) -> None:
+    (tmp_path.parent / "secret.mp3").write_bytes(b"x")
+    client = _client(tmp_path)
+    for name in ("..%2Fsecret.mp3", ".hidden.mp3", "notes.txt", "missing.mp3"):
+        assert client.get(f"/audio/{name}").status_code == 404
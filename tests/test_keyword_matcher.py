@@ -0,0 +1,21 @@
+from modules.keyword_matcher import AhoCorasick, KeywordLexicon
+
+
+def test_automaton_finds_overlapping_hits_with_positions() -> None:
+    automaton = AhoCorasick([("你知道", "curious"), ("你知道嗎", "curious"), ("知道", "other"), ("he", "en"), ("she", "en")])
+    hits = {(m.keyword, m.category, m.start) for m in automaton.iter_matches("你知道嗎 she")}
+    assert hits == {("你知道", "curious", 0), ("知道", "other", 1), ("你知道嗎", "curious", 0), ("she", "en", 5), ("he", "en", 6)}
+
+
+def test_lexicon_groups_categories_and_is_case_insensitive() -> None:
+    lexicon = KeywordLexicon()
+    lexicon.register("rules", {"excited": ["Hello", "太好了"], "curious": ["什麼"]})
+    lexicon.register("language", {"en": ["hello", "what"]})
+    hits = lexicon.scan("HELLO！太好了，what 什麼")
+    assert hits.has("rules.excited") and hits.has("rules.curious")
+    assert hits.keywords("language.en") == {"hello", "what"}
+    assert sorted(hits.categories("rules")) == ["rules.curious", "rules.excited"]
+    assert lexicon.scan("HELLO！太好了，what 什麼") is hits  # shared by every detector
+
+    lexicon.register("rules", {"curious": ["為什麼"]})  # re-registering recompiles
+    assert not lexicon.scan("什麼").has("rules.curious")
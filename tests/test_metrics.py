@@ -0,0 +1,52 @@
+import pytest
+
+from modules.metrics import MetricsRegistry
+
+
+@pytest.fixture()
+def registry() -> MetricsRegistry:
+    return MetricsRegistry()
+
+
+def test_histogram_buckets_are_cumulative(registry: MetricsRegistry) -> None:
+    hist = registry.histogram("decode_seconds", "decode", ["stage"], buckets=(0.01, 0.1, 1.0))
+    child = hist.labels("energy")
+    for value in (0.005, 0.01, 0.05, 2.0):
+        child.observe(value)
+    text = registry.render()
+    assert 'decode_seconds_bucket{stage="energy",le="0.01"} 2' in text
+    assert 'decode_seconds_bucket{stage="energy",le="0.1"} 3' in text
+    assert 'decode_seconds_bucket{stage="energy",le="+Inf"} 4' in text
+    assert 'decode_seconds_count{stage="energy"} 4' in text
+    assert "# TYPE decode_seconds histogram" in text
+
+
+def test_counter_and_gauge_function(registry: MetricsRegistry) -> None:
+    counter = registry.counter("cache_requests_total", "cache", ["result"])
+    counter.labels("hit").inc()
+    counter.labels("hit").inc(2)
+    assert counter.value("hit") == 3
+    gauge = registry.gauge("active_sessions", "sessions", ["role_id"])
+    gauge.set_function(lambda: {("huangrong",): 2})
+    text = registry.render()
+    assert 'cache_requests_total{result="hit"} 3.0' in text
+    assert 'active_sessions{role_id="huangrong"} 2.0' in text
+
+
+def test_registry_rejects_conflicting_redefinition(registry: MetricsRegistry) -> None:
+    registry.counter("dup_total", "dup")
+    assert registry.counter("dup_total", "dup") is registry.get("dup_total")
+    with pytest.raises(ValueError):
+        registry.gauge("dup_total", "dup")
+
+
+def test_metrics_endpoint_exposes_gateway_metrics() -> None:
+    from fastapi.testclient import TestClient
+
+    from api.main import app
+
+    response = TestClient(app).get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "gateway_active_sessions" in response.text
+    assert "# TYPE gateway_tts_first_chunk_seconds histogram" in response.text
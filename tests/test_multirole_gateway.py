@@ -49,3 +49,76 @@ async def test_registry_safe_across_tasks(registry: RoleRegistry) -> None:
     await asyncio.gather(*(acquire_release("pipi", f"session-{i}") for i in range(3)))
     assert registry.list_roles()["pipi"]["active_sessions"] == 0
 
+
+
+class _FakeSocket:
+    def __init__(self) -> None:
+        self.sent = []
+
+    async def send_json(self, payload: dict) -> None:
+        self.sent.append(payload)
+
+    def types(self) -> list:
+        return [payload["type"] for payload in self.sent]
+
+
+class _FakeSTT:
+    engine = None
+
+    async def final(self) -> str:
+        return "給我講個故事吧"
+
+
+@pytest.mark.asyncio
+async def test_role_switch_cancels_remaining_sentences(monkeypatch, registry: RoleRegistry) -> None:
+    from api import main
+
+    sentences = ["第一句話先串流出來給你聽。", "第二句話還在背景預先合成。", "第三句話也還在背景預先合成。"]
+    fetch_started = asyncio.Event()
+    cancelled = []
+
+    async def route(text, provider, priority):
+        return "".join(sentences)
+
+    async def stream(self, text, voice_id):
+        yield b"first"
+
+    async def fetch(self, text, voice_id):
+        fetch_started.set()
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.append(text)
+            raise
+        return b"late"
+
+    monkeypatch.setattr(main, "_route_emotion", route)
+    monkeypatch.setattr(main.LingyaGatewayMultiRole, "_tts_sentence_stream", stream)
+    monkeypatch.setattr(main.LingyaGatewayMultiRole, "_tts_sentence_audio", fetch)
+    monkeypatch.setattr(main, "TTS_SPLIT_MIN_CHARS", 4)
+
+    ws = _FakeSocket()
+    session = main.LingyaGatewayMultiRole(ws, default_voice_id="voice", registry=registry, emotion_worker=None)
+    config = await registry.acquire_role_async("huangrong", session.session_id)
+    session.role_id, session.role_config = config.role_id, config
+    session.started_at, session.phase = 1.0, "listen"
+    session.stt_stream = _FakeSTT()
+
+    # voice.end returns while the reply is still synthesizing, so the loop can take the switch.
+    await session.handle_text_message('{"type": "voice.end"}')
+    await asyncio.wait_for(fetch_started.wait(), timeout=5)
+    prefetcher = session.tts_prefetch
+    assert prefetcher is not None and prefetcher.pending
+
+    await session.handle_text_message('{"type": "voice.switch", "role_id": "xiaoruan"}')
+    assert prefetcher.cancelled and prefetcher.pending == 0
+    await asyncio.wait_for(session.reply_task, timeout=5)
+
+    assert sorted(cancelled) == sorted(sentences[1:3])
+    assert [p["sequence"] for p in ws.sent if p["type"] == "tts.stream"] == [0]
+    assert "tts.stream.completed" not in ws.types()
+    statuses = [p["message"] for p in ws.sent if p["type"] == "voice.role_status"]
+    assert "role_switch_success" in statuses
+    assert ws.types()[-1] == "session.closed" and ws.sent[-1]["role_id"] == "xiaoruan"
+    assert all(role["active_sessions"] == 0 for role in registry.list_roles().values())
+    await session.close()
@@ -0,0 +1,129 @@
+import json
+import zipfile
+
+import pytest
+
+from modules.narration import (
+    TAGGING_NONE,
+    NarrationRunner,
+    discover_fragments,
+    mp3_duration_ms,
+    strip_id3,
+)
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz: 417-byte frames of 1152 samples.
+_FRAME = b"\xff\xfb\x90\x64" + bytes(413)
+
+
+def _mp3(frames: int) -> bytes:
+    return b"ID3\x03\x00\x00\x00\x00\x00\x05" + bytes(5) + _FRAME * frames
+
+
+def test_mp3_duration_from_frame_headers() -> None:
+    audio = _mp3(100)
+    assert mp3_duration_ms(audio) == round(100 * 1152 / 44100 * 1000)
+    assert strip_id3(audio) == _FRAME * 100
+    assert mp3_duration_ms(b"not audio") == 0
+
+
+def _sources(tmp_path):
+    book = tmp_path / "book"
+    book.mkdir()
+    (book / "序.md").write_text("# 序\n\n這是第一段很長的句子，用來測試。這是第二段很長的句子，也用來測試！", encoding="utf-8")
+    document = (
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+        "<w:p><w:r><w:t>時間換框</w:t></w:r></w:p>"
+        "<w:p><w:r><w:t>時間包括過去、現在與未來，</w:t></w:r><w:r><w:t>從過去淬煉出學習。</w:t></w:r></w:p>"
+        "</w:body></w:document>"
+    )
+    with zipfile.ZipFile(book / "八法.docx", "w") as archive:
+        archive.writestr("word/document.xml", document)
+    (book / "cover.png").write_bytes(b"\x89PNG")
+    return book
+
+
+class _Synth:
+    def __init__(self, fail_on=()):
+        self.calls = []
+        self.fail_on = set(fail_on)
+
+    def __call__(self, segment):
+        self.calls.append(segment.text)
+        if segment.text in self.fail_on:
+            raise RuntimeError("upstream error")
+        return _mp3(len(segment.text))
+
+
+def _runner(tmp_path, synth):
+    return NarrationRunner(
+        synth, "voice-1", output_dir=tmp_path / "out", cache_dir=tmp_path / "cache", tagging=TAGGING_NONE, min_chars=4
+    )
+
+
+@pytest.mark.asyncio
+async def test_run_writes_fragments_manifest_and_resumes(tmp_path) -> None:
+    fragments, skipped = discover_fragments([_sources(tmp_path)])
+    assert [f.fragment_id for f in fragments] == ["八法", "序"]
+    assert skipped and skipped[0].endswith("cover.png")
+
+    first = _Synth(fail_on={"時間包括過去、現在與未來，從過去淬煉出學習。"})
+    stats = await _runner(tmp_path, first).run(fragments)
+    assert stats["failed"] == 1 and stats["synthesized"] == stats["segments"] - 1
+    assert stats["estimated_cost_usd"] > 0 and stats["segments_per_min"] > 0
+
+    manifest = json.loads((tmp_path / "out" / "manifest.json").read_text(encoding="utf-8"))
+    assert not manifest["fragments"]["八法"]["complete"]
+    preface = manifest["fragments"]["序"]
+    assert preface["complete"] and (tmp_path / "out" / preface["file"]).exists()
+    ends = [0] + [row["end_ms"] for row in preface["segments"]]
+    assert [row["start_ms"] for row in preface["segments"]] == ends[:-1]
+    assert preface["duration_ms"] == ends[-1] > 0
+
+    second = _Synth()
+    stats = await _runner(tmp_path, second).run(fragments)
+    assert second.calls == ["時間包括過去、現在與未來，從過去淬煉出學習。"]
+    assert stats["failed"] == 0 and stats["reused"] == stats["segments"] - 1
+    manifest = json.loads((tmp_path / "out" / "manifest.json").read_text(encoding="utf-8"))
+    assert manifest["fragments"]["八法"]["complete"] and len(manifest["runs"]) == 2
+    audio = (tmp_path / "out" / "八法.mp3").read_bytes()
+    assert mp3_duration_ms(audio) == manifest["fragments"]["八法"]["duration_ms"]
+
+
+@pytest.mark.asyncio
+async def test_overloaded_calls_are_retried(tmp_path) -> None:
+    fragments, _ = discover_fragments([_sources(tmp_path) / "序.md"])
+    attempts = []
+
+    class Throttled(Exception):
+        status_code = 429
+
+    def synth(segment):
+        attempts.append(segment.text)
+        if len(attempts) == 1:
+            raise Throttled()
+        return _mp3(3)
+
+    runner = _runner(tmp_path, synth)
+    runner.retry_backoff = 0.01
+    stats = await runner.run(fragments)
+    assert stats["failed"] == 0 and stats["synthesized"] == stats["segments"]
+    assert len(attempts) == stats["segments"] + 1
+
+
+@pytest.mark.asyncio
+async def test_repeated_sentences_are_synthesized_once(tmp_path) -> None:
+    book = tmp_path / "book"
+    book.mkdir()
+    refrain = "換個框架，世界就不一樣了。"
+    (book / "一.md").write_text(f"第一章的開頭在這裡。{refrain}", encoding="utf-8")
+    (book / "二.md").write_text(f"{refrain}第二章的結尾在這裡。", encoding="utf-8")
+    fragments, _ = discover_fragments([book])
+
+    synth = _Synth()
+    stats = await _runner(tmp_path, synth).run(fragments)
+    assert sorted(synth.calls) == sorted(["第一章的開頭在這裡。", refrain, "第二章的結尾在這裡。"])
+    assert stats["segments"] == 4 and stats["unique_segments"] == 3
+    assert stats["synthesized"] == 3 and stats["reused"] == 1
+    assert stats["billed_characters"] == sum(len(text) for text in synth.calls)
+    manifest = json.loads((tmp_path / "out" / "manifest.json").read_text(encoding="utf-8"))
+    assert all(entry["complete"] for entry in manifest["fragments"].values())
@@ -0,0 +1,54 @@
+import os
+import time
+
+from modules import voice_cache_engine
+from modules.phrase_bank import PhraseBank, build_phrase_bank, phrase_key, plan_phrases
+
+
+def _use_cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(voice_cache_engine, "AUDIO_CACHE_DIR", tmp_path)
+    monkeypatch.setattr(voice_cache_engine, "PHRASE_BANK_MANIFEST", tmp_path / "phrase_bank.json")
+    return tmp_path / "phrase_bank.json"
+
+
+def test_plan_covers_tag_sets_and_dedupes_shared_voices() -> None:
+    specs = plan_phrases(
+        ["你好呀～", "[happy] 你好呀～"],
+        {"voice-a": ["huangrong", "xiaoruan"], "voice-b": ["pipi"]},
+        tag_sets=[(), ("playful",)],
+        include_rule_tags=False,
+    )
+    assert len(specs) == 4  # tagged duplicate collapses; 2 tag sets x 2 voices
+    assert {spec.voice_id for spec in specs} == {"voice-a", "voice-b"}
+    assert next(s for s in specs if s.voice_id == "voice-a").role_ids == ["huangrong", "xiaoruan"]
+
+
+def test_build_then_lookup_and_pinning(monkeypatch, tmp_path) -> None:
+    manifest = _use_cache_dir(monkeypatch, tmp_path)
+    specs = plan_phrases(["好呀～"], {"voice-a": ["huangrong"]}, tag_sets=[(), ("playful",)], include_rule_tags=False)
+    rendered = []
+
+    def synthesize(spec):
+        rendered.append(spec.key)
+        return b"ID3" + spec.key.encode()
+
+    stats = build_phrase_bank(specs, synthesize, manifest_path=manifest)
+    assert stats["rendered"] == 2 and stats["failed"] == 0
+    assert build_phrase_bank(specs, synthesize, manifest_path=manifest)["reused"] == 2
+    assert len(rendered) == 2
+
+    bank = PhraseBank(manifest, reload_seconds=0)
+    hit = bank.lookup("[playful] 好呀～", "voice-a")
+    assert hit is not None and hit.name == f"{phrase_key('好呀～', 'voice-a', ['playful'])}.mp3"
+    assert bank.lookup("好呀～", "voice-b") is None
+    assert bank.lookup("[sad] 好呀～", "voice-a") is None
+
+    # Banked files never expire; ordinary cache files still do.
+    stale = tmp_path / "stale.mp3"
+    stale.write_bytes(b"x")
+    old = time.time() - voice_cache_engine.CACHE_TTL_SECONDS - 10
+    for path in (hit, stale):
+        os.utime(path, (old, old))
+    assert voice_cache_engine.is_cache_valid(hit)
+    voice_cache_engine.clean_expired_cache()
+    assert hit.exists() and not stale.exists()
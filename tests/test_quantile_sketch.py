@@ -0,0 +1,58 @@
+import math
+import random
+
+import pytest
+
+from modules.metrics import MetricsRegistry
+from modules.quantile_sketch import DDSketch
+
+
+def _exact(values, q):
+    ordered = sorted(values)
+    return ordered[math.ceil(q * len(ordered)) - 1]
+
+
+def test_quantiles_within_relative_accuracy() -> None:
+    rng = random.Random(7)
+    values = [rng.lognormvariate(5, 1) for _ in range(20000)]
+    sketch = DDSketch(relative_accuracy=0.01)
+    sketch.extend(values)
+    for q in (0.5, 0.95, 0.99):
+        assert sketch.quantile(q) == pytest.approx(_exact(values, q), rel=0.02)
+    assert sketch.count == 20000
+    assert sketch.max == max(values)
+
+
+def test_merge_matches_single_sketch_and_round_trips() -> None:
+    left, right, combined = DDSketch(), DDSketch(), DDSketch()
+    for value in range(1, 501):
+        (left if value % 2 else right).add(value)
+        combined.add(value)
+    left.merge(right)
+    assert left.quantiles((0.5, 0.99)) == combined.quantiles((0.5, 0.99))
+    restored = DDSketch.from_dict(left.to_dict())
+    assert restored.summary() == combined.summary()
+    assert DDSketch().summary() is None
+
+
+def test_small_samples_p95_is_not_off_by_one() -> None:
+    sketch = DDSketch()
+    sketch.extend([100, 200])
+    # The old sort-based reducer returned the minimum here.
+    assert sketch.quantile(0.95) == pytest.approx(200, rel=0.01)
+    zeros = DDSketch()
+    zeros.extend([0, 0, 5])
+    assert zeros.quantile(0.5) == 0
+
+
+def test_summary_metric_renders_merged_role_quantiles() -> None:
+    registry = MetricsRegistry()
+    summary = registry.summary("role_latency_ms", "latency", ["role_id"], quantiles=(0.5,))
+    session = DDSketch()
+    session.extend([100, 100, 100])
+    summary.labels("pipi").merge(session)
+    summary.labels("pipi").observe(100)
+    text = registry.render()
+    assert "# TYPE role_latency_ms summary" in text
+    assert 'role_latency_ms_count{role_id="pipi"} 4' in text
+    assert summary.snapshot()[("pipi",)]["p50"] == pytest.approx(100, rel=0.01)
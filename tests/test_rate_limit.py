@@ -0,0 +1,65 @@
+import pytest
+
+from modules.rate_limit import (
+    ROUTE_DEFAULT,
+    ROUTE_TTS,
+    BucketPolicy,
+    RateLimiter,
+    client_identity,
+    rate_limit_headers,
+)
+from modules.shared_state import InMemoryStateBackend, RedisStateBackend
+
+
+POLICIES = {ROUTE_DEFAULT: BucketPolicy(per_minute=60, burst=3), ROUTE_TTS: BucketPolicy(per_minute=6, burst=1)}
+
+
+@pytest.mark.asyncio
+async def test_bucket_allows_burst_then_refills(clock) -> None:
+    limiter = RateLimiter(InMemoryStateBackend(clock=clock), POLICIES)
+    decisions = [await limiter.check("ip:1.2.3.4") for _ in range(4)]
+    assert [d.allowed for d in decisions] == [True, True, True, False]
+    assert decisions[-1].retry_after == pytest.approx(1.0)
+    headers = rate_limit_headers(decisions[-1])
+    assert headers == {"X-RateLimit-Limit": "3", "X-RateLimit-Remaining": "0", "Retry-After": "1"}
+    clock.now += 1.0
+    assert (await limiter.check("ip:1.2.3.4")).allowed
+
+
+@pytest.mark.asyncio
+async def test_route_classes_have_separate_budgets(clock) -> None:
+    limiter = RateLimiter(InMemoryStateBackend(clock=clock), POLICIES)
+    assert (await limiter.check("ip:a", ROUTE_TTS)).allowed
+    denied = await limiter.check("ip:a", ROUTE_TTS)
+    assert not denied.allowed and denied.retry_after == pytest.approx(10.0)
+    assert (await limiter.check("ip:a", ROUTE_DEFAULT)).allowed
+    assert await RateLimiter(InMemoryStateBackend(), {ROUTE_DEFAULT: BucketPolicy(0, 0)}).check("ip:a") is None
+
+
+@pytest.mark.asyncio
+async def test_bucket_table_is_lru_bounded(clock) -> None:
+    backend = InMemoryStateBackend(clock=clock, max_buckets=3)
+    limiter = RateLimiter(backend, POLICIES)
+    for i in range(10):
+        await limiter.check(f"ip:10.0.0.{i}")
+    assert len(backend._buckets) == 3
+    assert list(backend._buckets) == [f"default:ip:10.0.0.{i}" for i in (7, 8, 9)]
+
+
+def test_client_identity_hashes_secrets() -> None:
+    identity = client_identity("secret-key", None, "1.2.3.4")
+    assert identity.startswith("k:") and "secret" not in identity
+    assert client_identity(None, None, "1.2.3.4") == "ip:1.2.3.4"
+
+
+@pytest.mark.asyncio
+async def test_redis_token_bucket_is_shared() -> None:
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    worker_a = RedisStateBackend(fakeredis.FakeAsyncRedis(server=server))
+    worker_b = RedisStateBackend(fakeredis.FakeAsyncRedis(server=server))
+    decisions = [await (worker_a if i % 2 else worker_b).take_token("ip", 3, 0.01) for i in range(4)]
+    assert [d.allowed for d in decisions] == [True, True, True, False]
+    assert decisions[-1].retry_after > 0
+    await worker_a.close()
+    await worker_b.close()
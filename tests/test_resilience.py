@@ -0,0 +1,108 @@
+import asyncio
+import threading
+
+import pytest
+
+from modules import llm_emotion_router, resilience
+from modules.resilience import (
+    STATE_CLOSED,
+    STATE_HALF_OPEN,
+    STATE_OPEN,
+    CircuitBreaker,
+    CircuitOpen,
+    HedgePolicy,
+    hedged_call,
+)
+
+
+def test_breaker_opens_on_failure_rate_and_recovers(clock) -> None:
+    breaker = CircuitBreaker("test", failure_rate=0.5, min_calls=4, window_seconds=10, open_seconds=5, clock=clock)
+    for ok in (True, False, True):
+        breaker.record_success() if ok else breaker.record_failure()
+    assert breaker.state == STATE_CLOSED  # below min_calls
+    breaker.record_failure()
+    assert breaker.state == STATE_OPEN
+    with pytest.raises(CircuitOpen) as exc:
+        breaker.before_call()
+    assert exc.value.retry_after == pytest.approx(5)
+
+    clock.now += 5
+    breaker.before_call()  # the single half-open trial
+    assert breaker.state == STATE_HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == STATE_OPEN
+
+    clock.now += 5
+    assert breaker.call(lambda: "ok") == "ok"
+    assert breaker.state == STATE_CLOSED and breaker.stats()["calls"] == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_half_open_trial_reopens_the_breaker(clock) -> None:
+    breaker = CircuitBreaker("test", min_calls=1, open_seconds=5, clock=clock)
+    breaker.record_failure()
+    clock.now += 5
+
+    async def slow_call() -> None:
+        with breaker.attempt() as attempt:
+            await asyncio.sleep(1)
+            attempt.succeeded()
+
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(slow_call(), 0.01)
+    assert breaker.state == STATE_OPEN  # not stuck half-open with its trial used up
+    clock.now += 5
+    with breaker.attempt() as attempt:
+        attempt.succeeded()
+    assert breaker.state == STATE_CLOSED
+
+
+def test_old_failures_leave_the_window(clock) -> None:
+    breaker = CircuitBreaker("test", failure_rate=0.5, min_calls=4, window_seconds=10, clock=clock)
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 11
+    for _ in range(3):
+        breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == STATE_CLOSED
+
+
+def test_hedged_call_takes_the_faster_copy() -> None:
+    policy = HedgePolicy("test", min_samples=5, budget=1.0)
+    for _ in range(10):
+        policy.observe(0.01)
+    release_first = threading.Event()
+    calls = []
+    discarded = []
+
+    def request():
+        calls.append(len(calls))
+        if len(calls) == 1:
+            release_first.wait(2)  # the primary stalls past the p95 delay
+            return "slow"
+        return "fast"
+
+    assert hedged_call(request, policy, discard=discarded.append) == "fast"
+    release_first.set()
+    assert len(calls) == 2 and policy.hedges == 1
+    for _ in range(50):
+        if discarded:
+            break
+        threading.Event().wait(0.01)
+    assert discarded == ["slow"]
+
+
+def test_llm_route_fails_over_between_providers(monkeypatch) -> None:
+    monkeypatch.setattr(llm_emotion_router, "OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(llm_emotion_router, "ANTHROPIC_API_KEY", "ak-test")
+    monkeypatch.setattr(llm_emotion_router, "LLM_FAILOVER", True)
+    monkeypatch.setattr(resilience, "_breakers", {})  # fresh breakers; the process-wide ones stay untouched
+    seen = []
+    monkeypatch.setitem(llm_emotion_router._PROVIDERS, "openai", lambda text, model: seen.append("openai"))
+    monkeypatch.setitem(
+        llm_emotion_router._PROVIDERS, "anthropic", lambda text, model: seen.append("anthropic") or f"[happy] {text}"
+    )
+    assert llm_emotion_router.llm_emotion_route("太好了", provider="openai") == "[happy] 太好了"
+    assert seen == ["openai", "anthropic"]
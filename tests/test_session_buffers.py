@@ -0,0 +1,42 @@
+import pytest
+
+from modules.session_buffers import OVERFLOW_REJECT, ChunkArena
+
+
+def test_arena_trims_oldest_chunks_but_keeps_header() -> None:
+    arena = ChunkArena(max_bytes=100, trim_fraction=0.3)
+    arena.append(b"H" * 10)
+    for i in range(9):
+        assert arena.append(bytes([ord("a") + i]) * 10)
+    assert arena.nbytes == 100
+    assert arena.append(b"z" * 10)
+    # At least 30 bytes were freed from the oldest non-header chunks.
+    assert arena.chunk(0) == b"H" * 10
+    assert arena.to_bytes().endswith(b"z" * 10)
+    assert arena.trimmed_chunks == 3 and arena.trimmed_bytes == 30
+    assert arena.nbytes == 80
+    assert arena.to_bytes() == b"H" * 10 + b"".join(bytes([c]) * 10 for c in b"defghi") + b"z" * 10
+
+
+def test_arena_reject_policy_and_oversized_chunks() -> None:
+    arena = ChunkArena(max_bytes=20, policy=OVERFLOW_REJECT)
+    assert arena.append(b"x" * 15)
+    assert not arena.append(b"y" * 10)
+    assert not arena.append(b"z" * 25)
+    assert arena.rejected_chunks == 2 and arena.rejected_bytes == 35
+    assert arena.to_bytes() == b"x" * 15
+    arena.clear()
+    assert not arena and arena.peak_bytes == 15
+
+
+def test_gateway_session_is_bounded() -> None:
+    from api.main import LingyaGatewayMultiRole, role_registry
+
+    session = LingyaGatewayMultiRole(None, default_voice_id="voice", registry=role_registry, emotion_worker=None)
+    with pytest.raises(AttributeError):
+        session.metrics_samples = []
+    session.audio_chunks.append(b"\x00" * 1024)
+    for latency in range(1000):
+        session._observe_latency("stt", latency)
+    assert len(session.latency_sketches[("stt", "unknown")].bins) < 1000
+    assert session.memory_bytes() >= 1024
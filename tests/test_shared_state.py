@@ -0,0 +1,57 @@
+import pytest
+
+from modules.role_registry import RoleRegistry
+from modules.shared_state import InMemoryStateBackend, RedisStateBackend
+
+
+@pytest.mark.asyncio
+async def test_seats_expire_without_heartbeat(clock) -> None:
+    backend = InMemoryStateBackend(clock=clock)
+    assert await backend.acquire_seat("role:pipi", "a", 1, ttl_seconds=30)
+    assert not await backend.acquire_seat("role:pipi", "b", 1, ttl_seconds=30)
+    clock.now += 20
+    assert await backend.heartbeat_seat("role:pipi", "a", 30)
+    clock.now += 20
+    assert not await backend.acquire_seat("role:pipi", "b", 1, ttl_seconds=30)
+    clock.now += 31
+    assert await backend.acquire_seat("role:pipi", "b", 1, ttl_seconds=30)
+    assert not await backend.heartbeat_seat("role:pipi", "a", 30)
+
+
+@pytest.mark.asyncio
+async def test_role_capacity_is_shared_between_registries() -> None:
+    backend = InMemoryStateBackend()
+    worker_a, worker_b = RoleRegistry(shared_state=backend), RoleRegistry(shared_state=backend)
+    capacity = worker_a.list_roles()["pipi"]["max_sessions"]
+    for i in range(capacity):
+        await (worker_a if i % 2 else worker_b).acquire_role_async("pipi", f"s{i}")
+    with pytest.raises(RuntimeError):
+        await worker_a.acquire_role_async("pipi", "overflow")
+    await worker_b.switch_role_async("pipi", "huangrong", "s0")
+    assert await backend.seat_count("role:pipi") == capacity - 1
+    await worker_a.acquire_role_async("pipi", "late")
+    await worker_b.release_role_async("huangrong", "s0")
+    assert await backend.seat_count("role:huangrong") == 0
+
+
+@pytest.mark.asyncio
+async def test_redis_backend_scripts() -> None:
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    worker_a = RedisStateBackend(fakeredis.FakeAsyncRedis(server=server))
+    worker_b = RedisStateBackend(fakeredis.FakeAsyncRedis(server=server))
+
+    assert await worker_a.acquire_seat("role:pipi", "a", 2, 30)
+    assert await worker_b.acquire_seat("role:pipi", "b", 2, 30)
+    assert not await worker_a.acquire_seat("role:pipi", "c", 2, 30)
+    assert await worker_b.heartbeat_seat("role:pipi", "b", 30)
+    assert await worker_a.move_seat("role:pipi", "role:huangrong", "a", 1, 30)
+    assert await worker_b.seat_count("role:pipi") == 1
+    await worker_b.release_seat("role:huangrong", "a")
+    assert await worker_a.seat_count("role:huangrong") == 0
+
+    decisions = [await (worker_a if i % 2 else worker_b).take_token("ip", 3, 0.1) for i in range(4)]
+    assert [d.allowed for d in decisions] == [True, True, True, False]
+    assert decisions[-1].retry_after > 0
+    await worker_a.close()
+    await worker_b.close()
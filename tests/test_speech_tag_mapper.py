@@ -0,0 +1,50 @@
+import pytest
+
+from modules.speech_tag_mapper import (
+    StructuredReply,
+    extract_tags_from_text,
+    map_structured_reply,
+    map_tags_to_voice_settings,
+    parse_structured_reply,
+)
+
+
+def test_multi_tag_average_is_order_independent_and_weighted() -> None:
+    settings = map_tags_to_voice_settings(["crying", "curious"])
+    assert settings == map_tags_to_voice_settings(["curious", "crying", "unknown"])
+    # crying weighs 1.5 (strong emotion), curious 1.0
+    assert settings["stability"] == pytest.approx((0.3 * 1.5 + 0.45) / 2.5)
+    assert settings["use_speaker_boost"] is True
+    assert map_tags_to_voice_settings(["curious", "curious", "crying"])["stability"] == pytest.approx(
+        (0.3 * 1.5 + 0.45 * 2) / 3.5
+    )
+    assert map_tags_to_voice_settings(["whispers", "sighs"], intensity=1.4)["intensity"] == 1.0
+
+
+def test_single_and_empty_tags() -> None:
+    assert map_tags_to_voice_settings(["excited"], intensity=0.3)["intensity"] == 0.3
+    assert map_tags_to_voice_settings(["whispers"])["use_speaker_boost"] is False
+    empty = map_tags_to_voice_settings([], base_stability=0.2)
+    assert empty["stability"] == 0.2 and empty["intensity"] == 0.5
+
+
+def test_memoized_results_are_copies() -> None:
+    first = map_tags_to_voice_settings(["happy"])
+    first["stability"] = 0.0
+    assert map_tags_to_voice_settings(["happy"])["stability"] == 0.45
+
+
+def test_extract_tags_accepts_case_and_space_variants() -> None:
+    text = "[Crying][speaksquickly][Speaks Quickly][not-a-tag] 你知道嗎？"
+    assert extract_tags_from_text(text) == ["crying", "speaks quickly", "speaks quickly"]
+    assert extract_tags_from_text("沒有標籤") == []
+
+
+def test_parse_structured_reply() -> None:
+    reply = parse_structured_reply('```json\n{"reply": "[Happy] 好呀～", "tags": ["playful", "unknown", "happy", "softly"], "intensity": 0.63}\n```')
+    assert reply == StructuredReply("好呀～", ("happy", "playful"), 0.65)
+    assert reply.tagged_text == "[happy][playful] 好呀～"
+    assert map_structured_reply(reply) == map_tags_to_voice_settings(["happy", "playful"], intensity=0.65)
+    assert parse_structured_reply({"reply": "嗯", "tags": "whispers", "intensity": True}) == StructuredReply("嗯", ("whispers",), None)
+    assert parse_structured_reply("not json") is None
+    assert parse_structured_reply('{"tags": ["happy"]}') is None
@@ -0,0 +1,77 @@
+import hashlib
+
+import pytest
+
+from modules.resilience import CircuitBreaker
+from modules.session_buffers import ChunkArena
+from modules.stt_engines import FixtureReplayEngine, STTEngine, STTRouter, STTUnavailable
+
+UTTERANCES = [
+    {"final": "你好嗎", "partials": ["你", "你好"]},
+    {"final": "今天天氣很好", "partials": ["今天"]},
+]
+
+
+class _FailingEngine(STTEngine):
+    name = "failing"
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.breaker = CircuitBreaker("stt_failing_test", min_calls=1, open_seconds=60)
+        self.calls = 0
+
+    async def transcribe(self, audio: bytes, mime_type: str) -> str:
+        self.calls += 1
+        raise RuntimeError("upstream down")
+
+
+def _arena(*chunks: bytes) -> ChunkArena:
+    arena = ChunkArena(1 << 20)
+    for chunk in chunks:
+        arena.append(chunk)
+    return arena
+
+
+@pytest.mark.asyncio
+async def test_replay_is_deterministic() -> None:
+    for _ in range(2):
+        engine = FixtureReplayEngine(UTTERANCES)
+        arena = _arena()
+        stream = engine.open_stream(arena, "audio/webm")
+        seen = []
+        for chunk in (b"a", b"b", b"c"):
+            arena.append(chunk)
+            seen.append(await stream.feed(chunk))
+        assert seen == ["你", "你好", None]
+        assert await stream.partial() == "你好"
+        assert await stream.final() == "你好嗎"
+        assert await engine.open_stream(_arena(b"x"), "audio/webm").final() == "今天天氣很好"
+
+
+@pytest.mark.asyncio
+async def test_replay_matches_audio_digest() -> None:
+    audio = b"recorded utterance"
+    engine = FixtureReplayEngine(UTTERANCES + [{"final": "指定的句子", "sha256": hashlib.sha256(audio).hexdigest()}])
+    assert await engine.transcribe(audio, "audio/webm") == "指定的句子"
+    assert await engine.open_stream(_arena(b"recorded ", b"utterance"), "audio/webm").final() == "指定的句子"
+
+
+@pytest.mark.asyncio
+async def test_failover_catches_up_and_open_breaker_is_skipped() -> None:
+    failing, replay = _FailingEngine(), FixtureReplayEngine(UTTERANCES)
+    router = STTRouter(order=["replay"], default="")
+    router.register("failing", failing)
+    router.register("replay", replay)
+
+    stream = router.open(_arena(b"a", b"b"), "audio/webm", preferred="failing")
+    assert stream.engine is failing and not stream.incremental
+    assert await stream.final() == "你好嗎"
+    assert stream.engine is replay and failing.calls == 1
+    assert failing.breaker.is_open()
+
+    stream = router.open(_arena(b"a"), "audio/webm", preferred="failing")
+    assert stream.engine is replay and failing.calls == 1
+
+    empty = STTRouter(order=[], default="")
+    with pytest.raises(STTUnavailable):
+        await empty.open(_arena(b"a"), "audio/webm").final()
@@ -0,0 +1,97 @@
+import json
+from pathlib import Path
+from typing import List
+
+import httpx
+import pytest
+
+from modules.telemetry import TelemetryClient
+
+
+@pytest.fixture()
+def supabase_env(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> Path:
+    spool = tmp_path / "spool.jsonl"
+    monkeypatch.setenv("OBS_SUPABASE_URL", "https://obs.example")
+    monkeypatch.setenv("OBS_SUPABASE_SERVICE_KEY", "service-key")
+    monkeypatch.setenv("OBS_SPOOL_PATH", str(spool))
+    monkeypatch.setenv("OBS_QUEUE_MAX", "3")
+    return spool
+
+
+def _recording_transport(calls: List[httpx.Request], status: List[int]) -> httpx.MockTransport:
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        return httpx.Response(status[0])
+
+    return httpx.MockTransport(handler)
+
+
+@pytest.mark.asyncio
+async def test_batch_posts_each_table_including_role_switches(supabase_env: Path) -> None:
+    calls: List[httpx.Request] = []
+    client = TelemetryClient(transport=_recording_transport(calls, [201]))
+    await client.record_metric({"session_id": "s", "avg_energy": 12})
+    await client.record_session({"session_id": "s"})
+    await client.record_role_switch({"session_id": "s", "to_role": "pipi"})
+    await client.flush()
+    await client.stop()
+
+    paths = sorted(request.url.path for request in calls)
+    assert paths == ["/rest/v1/voice_metrics", "/rest/v1/voice_role_switches", "/rest/v1/voice_sessions"]
+    switch_request = next(r for r in calls if r.url.path.endswith("voice_role_switches"))
+    assert switch_request.headers["apikey"] == "service-key"
+    assert json.loads(switch_request.content) == [{"session_id": "s", "to_role": "pipi"}]
+    assert client.delivered == 3
+
+
+@pytest.mark.asyncio
+async def test_queue_is_bounded_and_counts_drops(supabase_env: Path) -> None:
+    client = TelemetryClient(transport=_recording_transport([], [201]))
+    for i in range(5):
+        await client.record_metric({"i": i})
+    assert client.queue.qsize() == 3
+    assert client.stats()["dropped"]["metric"] == 2
+    await client.stop()
+
+
+@pytest.mark.asyncio
+async def test_cache_events_without_local_sink_are_counted_not_queued(supabase_env: Path) -> None:
+    client = TelemetryClient(transport=_recording_transport([], [201]))
+    assert client.local_sink is None
+    await client.record_cache_event({"hit": True})
+    assert client.queue.qsize() == 0
+    assert client.stats()["dropped"]["cache"] == 1
+    await client.stop()
+
+
+@pytest.mark.asyncio
+async def test_outage_spools_rows_and_replays_after_recovery(supabase_env: Path) -> None:
+    calls: List[httpx.Request] = []
+    status = [503]
+    client = TelemetryClient(transport=_recording_transport(calls, status))
+
+    await client.record_metric({"seq": 1})
+    await client.record_metric({"seq": 2})
+    await client.flush()
+    assert client.spooled == 2
+    assert len(supabase_env.read_text(encoding="utf-8").splitlines()) == 2
+
+    status[0] = 201
+    replayed = await client.replay_spool()
+    assert replayed == 2
+    assert not supabase_env.exists() or supabase_env.stat().st_size == 0
+    assert json.loads(calls[-1].content) == [{"seq": 1}, {"seq": 2}]
+    await client.stop()
+
+
+@pytest.mark.asyncio
+async def test_large_spool_is_replayed_in_bounded_batches(supabase_env: Path) -> None:
+    rows = [json.dumps({"kind": "metric", "payload": {"seq": i}}) for i in range(250)]
+    supabase_env.write_text("\n".join(rows + ["not json"]) + "\n", encoding="utf-8")
+    calls: List[httpx.Request] = []
+    client = TelemetryClient(transport=_recording_transport(calls, [201]))
+
+    assert await client.replay_spool() == 250
+    assert [len(json.loads(request.content)) for request in calls] == [100, 100, 50]
+    assert json.loads(calls[-1].content)[-1] == {"seq": 249}
+    await client.stop()
@@ -0,0 +1,63 @@
+import importlib.util
+from datetime import date
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from modules.telemetry import TelemetryClient  # noqa: E402
+from modules.telemetry_sink import LocalColumnarSink, read_sink, sink_files  # noqa: E402
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def _load_report_script():
+    spec = importlib.util.spec_from_file_location("telemetry_report", ROOT / "scripts" / "telemetry_report.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_sink_rotates_and_round_trips_rows(tmp_path: Path, fmt: str) -> None:
+    sink = LocalColumnarSink(str(tmp_path), fmt=fmt, row_group_rows=2, rotate_rows=4)
+    rows = [{"session_id": "s", "role_id": "huangrong", "latency_ms": i, "custom": "x"} for i in range(5)]
+    sink.write_batch({"metric": rows})
+    # Two full row groups landed in one rotated file; the fifth row is still buffered.
+    assert len(list(sink_files(str(tmp_path), "metric"))) == 1
+    sink.write_batch(
+        {"session": [{"session_id": "s", "metrics": {"stt_latency_ms": {"p50": 120, "p95": 300}, "tts_first_chunk_ms": 410}}]}
+    )
+    sink.close()
+
+    metrics = read_sink(str(tmp_path), "metric")
+    assert metrics.num_rows == 5
+    assert metrics["latency_ms"].to_pylist() == [0.0, 1.0, 2.0, 3.0, 4.0]
+    assert metrics["extra"][0].as_py() == '{"custom": "x"}'
+    sessions = read_sink(str(tmp_path), "session")
+    assert sessions["stt_latency_p95_ms"].to_pylist() == [300.0]
+    assert sessions["tts_first_chunk_ms"].to_pylist() == [410.0]
+    assert not list(tmp_path.rglob("_inprogress-*"))
+
+
+@pytest.mark.asyncio
+async def test_client_without_supabase_writes_local_sink_and_report(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    monkeypatch.delenv("OBS_SUPABASE_URL", raising=False)
+    monkeypatch.setenv("OBS_LOCAL_SINK_DIR", str(tmp_path))
+    client = TelemetryClient()
+    assert client.local_sink is not None
+    for latency in (100, 200, 300, 400):
+        await client.record_metric({"session_id": "s", "role_id": "pipi", "latency_ms": latency, "is_final": True})
+    await client.record_role_switch({"session_id": "s", "from_role": "pipi", "to_role": "huangrong", "latency_ms": 12, "success": True})
+    await client.record_cache_event({"route": "/api/voice/huangrong", "cache_hit": True})
+    await client.record_cache_event({"route": "/api/voice/huangrong", "cache_hit": False})
+    await client.stop()
+
+    report = _load_report_script().build_report(str(tmp_path), date.today())
+    assert report["stt_latency_ms"]["final"]["count"] == 4
+    assert report["stt_latency_ms"]["final_by_role"]["pipi"]["p50"] == 250.0
+    assert report["role_switches"]["success_rate"] == 1.0
+    assert report["cache"]["hit_ratio"] == 0.5
@@ -0,0 +1,49 @@
+import json
+from pathlib import Path
+
+from modules.tracing import NOOP_TURN, OTLPJsonFileExporter, Tracer
+
+
+def test_turn_exports_otlp_span_tree(tmp_path: Path) -> None:
+    export_path = tmp_path / "traces.jsonl"
+    tracer = Tracer(sample_rate=1.0, exporter=OTLPJsonFileExporter(str(export_path)))
+
+    turn = tracer.start_turn("gateway.turn", session_id="s-1", role_id="huangrong")
+    with turn.span("transcribe", mode="remote", final=True):
+        pass
+    tts = turn.start_span("tts_request", chars=12)
+    turn.start_span("first_byte", parent=tts).end()
+    tts.end()
+    turn.finish(outcome="replied")
+    tracer.flush()
+
+    document = json.loads(export_path.read_text(encoding="utf-8").splitlines()[0])
+    spans = document["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    by_name = {span["name"]: span for span in spans}
+    assert set(by_name) == {"gateway.turn", "transcribe", "tts_request", "first_byte"}
+    root_id = by_name["gateway.turn"]["spanId"]
+    assert "parentSpanId" not in by_name["gateway.turn"]
+    assert by_name["transcribe"]["parentSpanId"] == root_id
+    assert by_name["first_byte"]["parentSpanId"] == by_name["tts_request"]["spanId"]
+    assert {span["traceId"] for span in spans} == {turn.trace_id}
+    attrs = {a["key"]: a["value"] for a in by_name["transcribe"]["attributes"]}
+    assert attrs["final"] == {"boolValue": True}
+
+
+def test_unsampled_turn_is_noop(tmp_path: Path) -> None:
+    tracer = Tracer(sample_rate=0.0, exporter=OTLPJsonFileExporter(str(tmp_path / "t.jsonl")))
+    turn = tracer.start_turn()
+    assert turn is NOOP_TURN
+    with turn.span("decode"):
+        pass
+    turn.finish()
+    assert not (tmp_path / "t.jsonl").exists()
+
+
+def test_span_cap_counts_dropped(tmp_path: Path) -> None:
+    tracer = Tracer(sample_rate=1.0, exporter=OTLPJsonFileExporter(str(tmp_path / "t.jsonl")), max_spans_per_turn=3)
+    turn = tracer.start_turn()
+    for _ in range(5):
+        turn.start_span("ws_send").end()
+    assert len(turn.spans) == 3
+    assert turn.dropped_spans == 3
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from modules.tts_prefetch import SentencePrefetcher, split_sentences
+
+
+def test_split_merges_short_fragments_and_carries_tags() -> None:
+    sentences = split_sentences("[happy] 嗯！今天天氣真的很好呢。我們一起去公園散步吧！好嗎？", min_chars=8)
+    assert sentences == ["[happy] 嗯！今天天氣真的很好呢。", "[happy] 我們一起去公園散步吧！好嗎？"]
+    assert split_sentences("短句。") == ["短句。"]
+    long = "，".join(["一二三四五"] * 10)
+    assert all(len(piece) <= 20 for piece in split_sentences(long, min_chars=1, max_chars=20))
+
+
+@pytest.mark.asyncio
+async def test_prefetcher_yields_in_order_within_lookahead() -> None:
+    sentences = [f"s{i}" for i in range(5)]
+    started = []
+    gates = {text: asyncio.Event() for text in sentences}
+
+    async def stream(text):
+        yield f"{text}-a".encode()
+        yield f"{text}-b".encode()
+
+    async def fetch(text):
+        started.append(text)
+        await gates[text].wait()
+        return text.encode()
+
+    prefetcher = SentencePrefetcher(sentences, stream, fetch, lookahead=2, concurrency=2)
+    iterator = aiter(prefetcher)
+    assert await anext(iterator) == b"s0-a"
+    await asyncio.sleep(0)
+    assert started == ["s1", "s2"]  # look-ahead bound, nothing beyond
+
+    for text in reversed(sentences[1:]):  # finish out of order
+        gates[text].set()
+    rest = [chunk async for chunk in iterator]
+    assert rest == [b"s0-b", b"s1", b"s2", b"s3", b"s4"]
+
+
+@pytest.mark.asyncio
+async def test_cancel_stops_outstanding_fetches() -> None:
+    cancelled = []
+
+    async def stream(text):
+        yield b"first"
+
+    async def fetch(text):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(text)
+            raise
+        return b""
+
+    prefetcher = SentencePrefetcher(["a", "b", "c"], stream, fetch, lookahead=2)
+    iterator = aiter(prefetcher)
+    assert await anext(iterator) == b"first"
+    await asyncio.sleep(0)
+    await prefetcher.aclose()
+    await asyncio.sleep(0)
+    assert sorted(cancelled) == ["b", "c"] and prefetcher.pending == 0
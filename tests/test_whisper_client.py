@@ -0,0 +1,63 @@
+import io
+import json
+
+import httpx
+import pytest
+
+from modules.whisper_client import ChunkStream, WhisperClient, estimate_duration_seconds, transcription_timeout
+
+
+def test_chunk_stream_reads_and_seeks_like_the_concatenation() -> None:
+    chunks = [b"abc", b"", bytearray(b"defgh"), memoryview(b"ijklmnop")]
+    reference = io.BytesIO(b"abcdefghijklmnop")
+    stream = ChunkStream(chunks)
+    assert stream.size == 16
+    for size in (2, 5, 1, 100):
+        assert stream.read(size) == reference.read(size)
+    for offset, whence in ((4, io.SEEK_SET), (-3, io.SEEK_END), (-2, io.SEEK_CUR)):
+        assert stream.seek(offset, whence) == reference.seek(offset, whence)
+        assert stream.read(4) == reference.read(4)
+    stream.seek(0)
+    assert stream.read() == b"abcdefghijklmnop"
+
+
+def test_timeout_scales_with_duration() -> None:
+    assert estimate_duration_seconds(32000 * 3, "audio/wav") == 3
+    assert transcription_timeout(60) > transcription_timeout(2)
+    assert transcription_timeout(10**6) == transcription_timeout(10**7)
+
+
+def _stand_in_server(received):
+    """Minimal OpenAI-compatible transcription endpoint."""
+
+    async def app(scope, receive, send):
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        received.append((scope["path"], body))
+        payload = json.dumps({"text": f"heard {len(body)} bytes"}).encode()
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": payload})
+
+    return app
+
+
+@pytest.mark.asyncio
+async def test_transcribe_uploads_chunks_from_memory() -> None:
+    received = []
+    http_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=_stand_in_server(received)))
+    client = WhisperClient(base_url="http://stt.local/v1", http_client=http_client, max_retries=0)
+    chunks = [b"\x1aE\xdf\xa3header", b"cluster-1", b"cluster-2"]
+
+    text = await client.transcribe(chunks, "audio/webm;codecs=opus")
+
+    assert text.startswith("heard")
+    path, body = received[0]
+    assert path == "/v1/audio/transcriptions"
+    assert b"".join(chunks) in body
+    assert b'filename="audio.webm"' in body and b"whisper-1" in body
+    assert await client.transcribe([], "audio/webm") == ""
+    await client.aclose()
@@ -4,12 +4,13 @@
 提供語音對話的 Web API 端點
 """
 
+import asyncio
 import os
 import uuid
 import time
 from pathlib import Path
 from typing import Optional, Dict
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -23,14 +24,30 @@ import sys
 project_root = Path(__file__).parent
 sys.path.insert(0, str(project_root))
 
-from modules.llm_emotion_router import llm_emotion_route
-from modules.autonomous_emotion import autonomous_emotion_route, get_global_agent
+from modules.audio_formats import (
+    FORMAT_MP3,
+    FORMATS,
+    AudioFormat,
+    TranscodeUnavailable,
+    eleven_output_format,
+    ensure_variant,
+    get_format,
+)
+from modules.audio_serving import audio_response
+from modules.llm_emotion_router import llm_emotion_route_async
+from modules.agent_store import get_agent_store
+from modules.autonomous_emotion import autonomous_emotion_route_async
 from modules.speech_tag_mapper import extract_tags_from_text, map_tags_to_voice_settings
+from modules.phrase_bank import get_phrase_bank
 from modules.soft_ling import (
-    process_with_soft_ling,
+    SOFT_LING_COMBINED_REPLY,
+    SoftLingLLMUnavailable,
+    process_with_soft_ling_async,
+    process_structured_reply_with_soft_ling,
     detect_soft_ling_invocation,
     get_soft_ling_opening,
-    generate_soft_ling_reply,
+    generate_soft_ling_reply_async,
+    generate_soft_ling_turn_async,
 )
 from eleven_tts import generate_speech, API_KEY, VOICE_ID
 import requests
@@ -56,6 +73,12 @@ AUDIO_DIR.mkdir(parents=True, exist_ok=True)
 STATIC_DIR = Path("web_static")
 STATIC_DIR.mkdir(parents=True, exist_ok=True)
 
+# 預先產生的開靈語／常用短句音訊（scripts/build_phrase_bank.py）
+phrase_bank = get_phrase_bank()
+
+# 每個 session 各自的語氣代理（情緒動量不再在使用者之間共用）
+agent_store = get_agent_store()
+
 # 掛載靜態檔案
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
@@ -68,6 +91,8 @@ class ChatRequest(BaseModel):
     autonomy_mode: bool = True  # 是否使用自主模式
     autonomy_level: float = 0.7  # 自主程度（0.0-1.0）
     use_soft_ling: bool = True  # 是否使用花小軟模式
+    audio_format: Optional[str] = None  # mp3 / opus / pcm16（預設 AUDIO_DEFAULT_FORMAT）
+    session_id: Optional[str] = None  # 對話 session（未提供時共用 "default"）
 
 
 class ChatResponse(BaseModel):
@@ -81,6 +106,18 @@ class ChatResponse(BaseModel):
     is_invocation: bool = False  # 是否為召喚咒語
     agent_name: str = "黃蓉"  # 代理名稱
     opening: Optional[str] = None  # 開靈語（可選）
+    opening_audio_url: Optional[str] = None  # 開靈語音訊（語音庫有預先產生時）
+    audio_format: str = "mp3"  # audio_url 的實際格式
+
+
+@app.on_event("startup")
+async def load_agent_sessions() -> None:
+    agent_store.load()
+
+
+@app.on_event("shutdown")
+async def save_agent_sessions() -> None:
+    agent_store.save()
 
 
 @app.get("/")
@@ -101,34 +138,53 @@ async def chat(request: ChatRequest):
         is_invocation = detect_soft_ling_invocation(request.text) if request.use_soft_ling else False
 
         # 產生回應文字（花小軟模式時才啟用 LLM）
+        # 合併模式：回應文字與語氣標籤由同一次 LLM 呼叫產生；輸出無法解析時退回兩段式流程，
+        # LLM 無法使用時直接用備援回應＋規則式語氣（不再對失敗的 provider 呼叫第二次）
         reply_text = request.text
+        structured_reply = None
+        use_llm_tags = request.use_llm
         if request.use_soft_ling and request.use_llm:
-            reply_text = generate_soft_ling_reply(request.text, provider=request.provider)
+            try:
+                if SOFT_LING_COMBINED_REPLY:
+                    structured_reply = await generate_soft_ling_turn_async(request.text, provider=request.provider)
+                if structured_reply is not None:
+                    reply_text = structured_reply.text
+                else:
+                    reply_text = await generate_soft_ling_reply_async(request.text, provider=request.provider)
+            except SoftLingLLMUnavailable as exc:
+                reply_text = exc.fallback_reply
+                use_llm_tags = False
 
         # 1. 語氣判斷（花小軟模式優先）
         if request.use_soft_ling:
             # 使用花小軟模式
-            soft_ling_result = process_with_soft_ling(
-                reply_text,
-                use_llm=request.use_llm
-            )
+            # 代理先讀狀態、await LLM、再更新狀態；同一 session 的並行請求（重複送出、重試）依序執行
+            async with agent_store.use(request.session_id, "soft_ling") as agent:
+                if structured_reply is not None:
+                    soft_ling_result = process_structured_reply_with_soft_ling(structured_reply, agent=agent)
+                else:
+                    soft_ling_result = await process_with_soft_ling_async(
+                        reply_text,
+                        use_llm=use_llm_tags,
+                        agent=agent
+                    )
             tagged_text = soft_ling_result["tagged_text"]
             voice_settings = soft_ling_result["voice_settings"]
         elif request.autonomy_mode:
             # 使用自主模式：小軟自己決定是否使用語氣
-            agent = get_global_agent(autonomy_level=request.autonomy_level)
-            tagged_text = autonomous_emotion_route(
-                reply_text,
-                autonomy_level=request.autonomy_level,
-                use_llm=request.use_llm,
-                agent=agent
-            )
+            async with agent_store.use(request.session_id, autonomy_level=request.autonomy_level) as agent:
+                tagged_text = await autonomous_emotion_route_async(
+                    reply_text,
+                    autonomy_level=request.autonomy_level,
+                    use_llm=request.use_llm,
+                    agent=agent
+                )
             # 提取標籤並映射到聲音參數
             tags = extract_tags_from_text(tagged_text)
             voice_settings = map_tags_to_voice_settings(tags)
         elif request.use_llm:
             # 傳統模式：使用 LLM 判斷
-            tagged_text = llm_emotion_route(
+            tagged_text = await llm_emotion_route_async(
                 reply_text,
                 provider=request.provider,
                 fallback_to_rule=True
@@ -142,45 +198,62 @@ async def chat(request: ChatRequest):
             tags = extract_tags_from_text(tagged_text)
             voice_settings = map_tags_to_voice_settings(tags)
         
-        # 2. 產生語音
-        filename = f"chat_{uuid.uuid4().hex[:8]}.mp3"
-        filepath = AUDIO_DIR / filename
-        
+        # 2. 產生語音（語音庫命中時直接使用預先產生的檔案）
         voice_id = VOICE_ID
         if not voice_id:
             raise HTTPException(status_code=500, detail="未設定 Voice ID")
         
-        url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}/stream"
-        headers = {
-            "xi-api-key": API_KEY,
-            "Content-Type": "application/json"
-        }
-        payload = {
-            "model_id": "eleven_turbo_v2_5",
-            "text": tagged_text,  # 保持標籤在文字中
-            "voice_settings": voice_settings  # 使用映射的聲音參數
-        }
-        
-        response = requests.post(url, headers=headers, json=payload, timeout=30)
-        
-        if response.status_code != 200:
-            raise HTTPException(
-                status_code=response.status_code,
-                detail=f"ElevenLabs API 錯誤：{response.text}"
-            )
-        
-        # 3. 儲存音訊檔案
-        with open(filepath, "wb") as f:
-            f.write(response.content)
+        try:
+            audio_format = get_format(request.audio_format)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+
+        banked = phrase_bank.lookup(tagged_text, voice_id)
+        if banked is not None:
+            banked, audio_format = await asyncio.to_thread(_banked_variant, banked, audio_format)
+            audio_url = f"/audio/{banked.name}"
+        else:
+            # ElevenLabs 能直接輸出的格式就不轉檔；否則以 MP3 回傳
+            output_format = eleven_output_format(audio_format)
+            if output_format is None:
+                audio_format = FORMATS[FORMAT_MP3]
+                output_format = eleven_output_format(audio_format)
+            filename = f"chat_{uuid.uuid4().hex[:8]}.{audio_format.extension}"
+            filepath = AUDIO_DIR / filename
+            
+            url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}/stream"
+            if output_format:
+                url = f"{url}?output_format={output_format}"
+            headers = {
+                "xi-api-key": API_KEY,
+                "Content-Type": "application/json"
+            }
+            payload = {
+                "model_id": "eleven_turbo_v2_5",
+                "text": tagged_text,  # 保持標籤在文字中
+                "voice_settings": voice_settings  # 使用映射的聲音參數
+            }
+            
+            response = await asyncio.to_thread(requests.post, url, headers=headers, json=payload, timeout=30)
+            
+            if response.status_code != 200:
+                raise HTTPException(
+                    status_code=response.status_code,
+                    detail=f"ElevenLabs API 錯誤：{response.text}"
+                )
+            
+            # 3. 儲存音訊檔案
+            await asyncio.to_thread(filepath.write_bytes, response.content)
+            
+            audio_url = f"/audio/{filename}"
         
         # 4. 回傳結果
-        audio_url = f"/audio/{filename}"
         
         # 獲取自主決策統計（如果使用自主模式且非花小軟模式）
         autonomy_stats = None
         if request.autonomy_mode and not request.use_soft_ling:
-            agent = get_global_agent(autonomy_level=request.autonomy_level)
-            autonomy_stats = agent.get_autonomy_stats()
+            async with agent_store.use(request.session_id) as agent:
+                autonomy_stats = agent.get_autonomy_stats()
         
         # 如果是召喚咒語，添加開靈語標記
         response_data = {
@@ -191,14 +264,22 @@ async def chat(request: ChatRequest):
             "message": "語音產生成功",
             "autonomy_stats": autonomy_stats,
             "is_invocation": is_invocation,
-            "agent_name": "花小軟" if request.use_soft_ling else "黃蓉"
+            "agent_name": "花小軟" if request.use_soft_ling else "黃蓉",
+            "audio_format": audio_format.name,
         }
         
         if is_invocation and request.use_soft_ling:
-            response_data["opening"] = get_soft_ling_opening()
+            opening = get_soft_ling_opening()
+            response_data["opening"] = opening
+            opening_audio = phrase_bank.lookup(opening, voice_id)
+            if opening_audio is not None:
+                opening_audio, _ = await asyncio.to_thread(_banked_variant, opening_audio, audio_format)
+                response_data["opening_audio_url"] = f"/audio/{opening_audio.name}"
         
         return ChatResponse(**response_data)
         
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         error_detail = traceback.format_exc()
@@ -206,21 +287,29 @@ async def chat(request: ChatRequest):
         raise HTTPException(status_code=500, detail=f"發生錯誤：{str(e)}")
 
 
+def _banked_variant(path: Path, audio_format: AudioFormat):
+    """語音庫檔案（MP3）轉成要求的格式；無法轉檔時沿用 MP3。"""
+    try:
+        return ensure_variant(path, audio_format), audio_format
+    except TranscodeUnavailable:
+        return path, FORMATS[FORMAT_MP3]
+
+
 @app.post("/api/chat/stream")
 async def chat_stream(request: ChatRequest):
     """直接返回音訊流"""
     try:
         # 語氣判斷（自主模式或傳統模式）
         if request.autonomy_mode:
-            agent = get_global_agent(autonomy_level=request.autonomy_level)
-            tagged_text = autonomous_emotion_route(
-                request.text,
-                autonomy_level=request.autonomy_level,
-                use_llm=request.use_llm,
-                agent=agent
-            )
+            async with agent_store.use(request.session_id, autonomy_level=request.autonomy_level) as agent:
+                tagged_text = await autonomous_emotion_route_async(
+                    request.text,
+                    autonomy_level=request.autonomy_level,
+                    use_llm=request.use_llm,
+                    agent=agent
+                )
         elif request.use_llm:
-            tagged_text = llm_emotion_route(
+            tagged_text = await llm_emotion_route_async(
                 request.text,
                 provider=request.provider,
                 fallback_to_rule=True
@@ -274,13 +363,9 @@ async def chat_stream(request: ChatRequest):
 
 
 @app.get("/audio/{filename}")
-async def serve_audio(filename: str):
-    """提供音訊檔案下載"""
-    filepath = AUDIO_DIR / filename
-    if not filepath.exists():
-        raise HTTPException(status_code=404, detail="檔案不存在")
-    
-    return FileResponse(filepath, media_type="audio/mpeg")
+async def serve_audio(filename: str, request: Request):
+    """提供音訊檔案下載（ETag / 304 / Range）"""
+    return audio_response(request, AUDIO_DIR, filename)
 
 
 @app.get("/health")